@@ -0,0 +1,403 @@
+"""Колоночная копия videos и snapshots в памяти процесса бота
+
+Данные помещаются в память (сотни тысяч видео, десятки миллионов снапшотов),
+поэтому агрегаты по ним можно считать векторно в NumPy, без обращения к БД:
+
+- video_id и creator_id закодированы словарем в int32, время хранится в int64
+  (микросекунды от 2000-01-01, как в двоичном протоколе PostgreSQL);
+- snapshots упорядочены по created_at: условия на время превращаются в
+  бинарный поиск по отсортированному столбцу;
+- снапшоты читаются двоичным COPY с фиксированной шириной строк и разбираются
+  np.frombuffer порциями, без создания Python-объектов на каждую строку;
+- после загрузки (новая версия данных) копия обновляется инкрементально:
+  читаются только строки, записанные транзакциями после прошлого обновления
+  (по системному столбцу xmin). Если число строк в БД не сошлось с копией
+  (удаления, очистка таблиц) или счетчик транзакций прошел по кругу,
+  копия перечитывается целиком;
+- пока копия не загружена или отстает от версии данных, fetch_one возвращает
+  None, и запрос выполняет Postgres.
+
+Подмножество SQL и семантика вычислений — в analytics.evaluator.
+"""
+import asyncio
+import logging
+import struct
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.analytics.evaluator import (
+    COUNTERS, DELTAS, NULL_TIME, Column, Dataset, Plan, Table, UnsupportedQuery, compile_plan, to_pg_time,
+)
+from src.db.data_version import GET_VERSION_SQL
+from src.db.database import async_engine
+from src.db.sql_parser import SQLParameterizer, SQLValidationError
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_INTS = COUNTERS + DELTAS
+
+# Строка двоичного COPY: число полей, затем длина и значение каждого поля (big-endian).
+# NULL сделали бы ширину переменной, поэтому они заменены в запросе: время —
+# на -infinity (в двоичном виде это минимальный int64), числа — на 0 с битом в nulls
+_SNAPSHOT_FIELDS = [('id', '>i8'), ('video', '>i4')] + [(c, '>i4') for c in SNAPSHOT_INTS] + [
+    ('created_at', '>i8'), ('updated_at', '>i8'), ('nulls', '>i4'),
+]
+SNAPSHOT_ROW = np.dtype([('fields', '>i2')] + [
+    item for name, fmt in _SNAPSHOT_FIELDS for item in ((f'{name}_len', '>i4'), (name, fmt))
+])
+
+_NULL_BITS = ' | '.join(f"((s.{c} IS NULL)::int << {i})" for i, c in enumerate(SNAPSHOT_INTS))
+SNAPSHOTS_COPY_SQL = (
+    "SELECT s.id::int8, v.id, "
+    + ', '.join(f'COALESCE(s.{c}, 0)' for c in SNAPSHOT_INTS)
+    + ", COALESCE(s.created_at, '-infinity'), COALESCE(s.updated_at, '-infinity'), "
+    + f"{_NULL_BITS} FROM snapshots s JOIN videos v ON v.video_id = s.video_id"
+)
+VIDEOS_SQL = (
+    "SELECT id, video_id, creator_id, video_created_at, "
+    + ', '.join(COUNTERS) + ", created_at, updated_at FROM videos"
+)
+CHANGED_SINCE = " WHERE {alias}.xmin::text::int8 >= {watermark}"
+# Транзакции с номером не меньше xmin снимка могли еще не завершиться: их строки
+# будут прочитаны при следующем обновлении
+WATERMARK_SQL = "SELECT txid_snapshot_xmin(txid_current_snapshot()) % 4294967296"
+
+_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00'
+
+
+class _BinaryRows:
+    """Приемник двоичного COPY: разбирает поступающие порции целыми строками"""
+
+    def __init__(self, dtype: np.dtype):
+        self.dtype = dtype
+        self.buffer = b''
+        self.header_done = False
+        self.parts: List[np.ndarray] = []
+
+    async def __call__(self, chunk: bytes):
+        self.buffer += chunk
+        if not self.header_done:
+            if len(self.buffer) < 19:
+                return
+            if not self.buffer.startswith(_COPY_HEADER):
+                raise ValueError("неожиданный заголовок двоичного COPY")
+            extension = struct.unpack('>i', self.buffer[15:19])[0]
+            self.buffer = self.buffer[19 + extension:]
+            self.header_done = True
+        whole = len(self.buffer) // self.dtype.itemsize * self.dtype.itemsize
+        if whole:
+            # Строка из 2 байт (-1) — конец данных — короче строки и остается в буфере
+            self.parts.append(np.frombuffer(self.buffer[:whole], dtype=self.dtype))
+            self.buffer = self.buffer[whole:]
+
+    def rows(self) -> np.ndarray:
+        if self.buffer not in (b'', b'\xff\xff'):
+            raise ValueError(f"неразобранный остаток двоичного COPY: {len(self.buffer)} байт")
+        return np.concatenate(self.parts) if self.parts else np.empty(0, dtype=self.dtype)
+
+
+def _time(value) -> int:
+    return NULL_TIME if value is None else to_pg_time(value)
+
+
+def _time_column(values: np.ndarray) -> Column:
+    null = values == NULL_TIME
+    return Column(values, ~null if null.any() else None)
+
+
+class _Snapshots:
+    """Столбцы снапшотов как массивы (в порядке created_at) и идентификаторы строк"""
+
+    def __init__(self, ids: np.ndarray, video: np.ndarray, ints: Dict[str, np.ndarray],
+                 nulls: np.ndarray, created_at: np.ndarray, updated_at: np.ndarray):
+        self.ids = ids
+        self.video = video
+        self.ints = ints
+        self.nulls = nulls
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+    @classmethod
+    def from_rows(cls, rows: np.ndarray, video_lookup: np.ndarray) -> '_Snapshots':
+        return cls(
+            ids=rows['id'].astype(np.int64),
+            video=video_lookup[rows['video'].astype(np.int64)],
+            ints={c: rows[c].astype(np.int32) for c in SNAPSHOT_INTS},
+            nulls=rows['nulls'].astype(np.int32),
+            created_at=rows['created_at'].astype(np.int64),
+            updated_at=rows['updated_at'].astype(np.int64),
+        )
+
+    def take(self, index) -> '_Snapshots':
+        return _Snapshots(self.ids[index], self.video[index], {c: v[index] for c, v in self.ints.items()},
+                          self.nulls[index], self.created_at[index], self.updated_at[index])
+
+    @staticmethod
+    def concat(parts: List['_Snapshots']) -> '_Snapshots':
+        return _Snapshots(
+            np.concatenate([p.ids for p in parts]), np.concatenate([p.video for p in parts]),
+            {c: np.concatenate([p.ints[c] for p in parts]) for c in SNAPSHOT_INTS},
+            np.concatenate([p.nulls for p in parts]),
+            np.concatenate([p.created_at for p in parts]), np.concatenate([p.updated_at for p in parts]),
+        )
+
+    def sorted(self) -> '_Snapshots':
+        return self.take(np.argsort(self.created_at, kind='stable'))
+
+    def table(self) -> Table:
+        columns = {'video_id': Column(self.video), 'created_at': _time_column(self.created_at),
+                   'updated_at': _time_column(self.updated_at)}
+        any_nulls = bool(self.nulls.any())
+        for bit, name in enumerate(SNAPSHOT_INTS):
+            null = (self.nulls & (1 << bit)) != 0 if any_nulls else None
+            columns[name] = Column(self.ints[name], ~null if null is not None and null.any() else None)
+        return Table(columns, len(self.ids), int(np.count_nonzero(self.created_at == NULL_TIME)))
+
+
+class _Videos:
+    """Видео по коду (номер строки = код video_id)"""
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.creator_codes: Dict[str, int] = {}
+        self.pg_ids: List[int] = []
+        self.creators: List[int] = []
+        self.ints: Dict[str, List[Optional[int]]] = {c: [] for c in COUNTERS}
+        self.times: Dict[str, List[int]] = {c: [] for c in ('video_created_at', 'created_at', 'updated_at')}
+
+    def copy(self) -> '_Videos':
+        other = _Videos()
+        other.codes = dict(self.codes)
+        other.creator_codes = dict(self.creator_codes)
+        other.pg_ids = list(self.pg_ids)
+        other.creators = list(self.creators)
+        other.ints = {c: list(v) for c, v in self.ints.items()}
+        other.times = {c: list(v) for c, v in self.times.items()}
+        return other
+
+    def apply(self, records):
+        for r in records:
+            code = self.codes.get(r['video_id'])
+            if code is None:
+                code = self.codes[r['video_id']] = len(self.pg_ids)
+                self.pg_ids.append(0)
+                self.creators.append(0)
+                for values in (*self.ints.values(), *self.times.values()):
+                    values.append(None)
+            creator = self.creator_codes.setdefault(r['creator_id'], len(self.creator_codes))
+            self.pg_ids[code] = r['id']
+            self.creators[code] = creator
+            for c in COUNTERS:
+                self.ints[c][code] = r[c]
+            for c in self.times:
+                self.times[c][code] = _time(r[c])
+
+    def lookup(self) -> np.ndarray:
+        """videos.id → код видео (для снапшотов, которые читаются с videos.id)"""
+        pg_ids = np.asarray(self.pg_ids, dtype=np.int64)
+        lookup = np.full(int(pg_ids.max()) + 1 if len(pg_ids) else 1, -1, dtype=np.int32)
+        lookup[pg_ids] = np.arange(len(pg_ids), dtype=np.int32)
+        return lookup
+
+    def table(self) -> Table:
+        columns = {
+            'video_id': Column(np.arange(len(self.pg_ids), dtype=np.int32)),
+            'creator_id': Column(np.asarray(self.creators, dtype=np.int32)),
+        }
+        for c, values in self.ints.items():
+            null = np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+            array = np.fromiter((0 if v is None else v for v in values), dtype=np.int64, count=len(values))
+            columns[c] = Column(array, ~null if null.any() else None)
+        for c, values in self.times.items():
+            columns[c] = _time_column(np.asarray(values, dtype=np.int64))
+        return Table(columns, len(self.pg_ids))
+
+
+class ColumnarMirror:
+    """Ответы на агрегатные запросы из колоночной копии данных
+
+    fetch_one(sql) возвращает строку результата или None, если запрос нужно
+    выполнить в Postgres: он вне поддерживаемого подмножества, копия еще не
+    загружена или данные изменились и копия обновляется.
+    """
+
+    def __init__(self, engine: AsyncEngine = async_engine, version_check_interval: float = 1.0,
+                 max_plans: int = 1024, clock: Callable[[], float] = time.monotonic):
+        self.engine = engine
+        self.version_check_interval = version_check_interval
+        self.max_plans = max_plans
+        self.clock = clock
+        self.parameterizer = SQLParameterizer()
+        self._plans: "OrderedDict[str, Optional[Plan]]" = OrderedDict()
+
+        self.data: Optional[Dataset] = None
+        self._videos: Optional[_Videos] = None
+        self._snapshots: Optional[_Snapshots] = None
+        self._watermark: Optional[int] = None
+        self._db_version: Optional[int] = None
+        self._checked_at = float('-inf')
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+        self.answered = 0
+        self.fallbacks = 0
+        self.full_refreshes = 0
+        self.incremental_refreshes = 0
+        self.last_refresh_seconds = 0.0
+
+    # --- ответы ---
+
+    def execute(self, sql: str) -> tuple:
+        """Вычисление по текущей копии; UnsupportedQuery, если запрос вне подмножества"""
+        if self.data is None:
+            raise UnsupportedQuery("копия еще не загружена")
+        try:
+            parsed = self.parameterizer.parameterize(sql)
+        except SQLValidationError as e:
+            raise UnsupportedQuery(str(e)) from e
+
+        if parsed.fingerprint in self._plans:
+            plan = self._plans[parsed.fingerprint]
+            self._plans.move_to_end(parsed.fingerprint)
+        else:
+            try:
+                plan = compile_plan(parsed.fingerprint)
+            except UnsupportedQuery as e:
+                logger.debug(f"Колоночный движок не поддерживает запрос ({e}): {sql}")
+                plan = None
+            self._plans[parsed.fingerprint] = plan
+            if len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        if plan is None:
+            raise UnsupportedQuery("форма запроса не поддерживается")
+        return plan.execute(self.data, parsed.params)
+
+    async def fetch_one(self, sql: str) -> Optional[tuple]:
+        if not await self._is_fresh():
+            self.fallbacks += 1
+            return None
+        try:
+            row = self.execute(sql)
+        except UnsupportedQuery as e:
+            logger.debug(f"Запрос выполнится в Postgres: {e}")
+            self.fallbacks += 1
+            return None
+        self.answered += 1
+        return row
+
+    async def _is_fresh(self) -> bool:
+        now = self.clock()
+        if self._refresh_task is None and now - self._checked_at >= self.version_check_interval:
+            self._checked_at = now
+            try:
+                async with self.engine.connect() as conn:
+                    self._db_version = (await conn.exec_driver_sql(GET_VERSION_SQL)).scalar() or 0
+            except Exception as e:
+                logger.warning(f"Не удалось проверить версию данных для колоночной копии: {e}")
+                return False
+        if self.data is not None and self.data.version == self._db_version:
+            return True
+        self.schedule_refresh()
+        return False
+
+    # --- обновление ---
+
+    def schedule_refresh(self):
+        """Обновление в фоне (не больше одного одновременно)"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._background_refresh())
+
+    async def _background_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Ошибка обновления колоночной копии: {e}", exc_info=True)
+        finally:
+            self._refresh_task = None
+            self._checked_at = float('-inf')
+
+    async def refresh(self, full: bool = False) -> Dict[str, int]:
+        """Чтение изменений из БД и подмена копии; full=True — перечитать целиком"""
+        async with self._lock:
+            started = time.perf_counter()
+            async with self.engine.connect() as conn:
+                pg_conn = (await conn.get_raw_connection()).driver_connection
+                # Видео и снапшоты читаются из одного снимка данных
+                async with pg_conn.transaction(isolation='repeatable_read', readonly=True):
+                    result = await self._refresh(pg_conn, full)
+            self.last_refresh_seconds = time.perf_counter() - started
+            self._db_version = self.data.version
+            logger.info(f"Колоночная копия {'перечитана' if result['full'] else 'обновлена'} за "
+                        f"{self.last_refresh_seconds:.2f} с: видео {self.data.videos.rows}, "
+                        f"снапшотов {self.data.snapshots.rows} (прочитано видео {result['videos']}, "
+                        f"снапшотов {result['snapshots']}), версия данных {self.data.version}")
+            return result
+
+    async def _refresh(self, pg_conn, full: bool) -> Dict[str, int]:
+        version = await pg_conn.fetchval(GET_VERSION_SQL) or 0
+        watermark = await pg_conn.fetchval(WATERMARK_SQL)
+        full = full or self.data is None or self._watermark is None or watermark < self._watermark
+
+        if not full:
+            videos_count = await pg_conn.fetchval("SELECT count(*) FROM videos")
+            snapshots_count = await pg_conn.fetchval("SELECT count(*) FROM snapshots")
+            videos, snapshots, read = await self._read_changes(pg_conn, self._watermark)
+            if len(videos.pg_ids) != videos_count or len(snapshots.ids) != snapshots_count:
+                logger.info("Число строк в копии не совпало с БД (были удаления), копия перечитывается целиком")
+                full = True
+
+        if full:
+            videos, snapshots, read = await self._read_changes(pg_conn, None)
+            self.full_refreshes += 1
+        else:
+            self.incremental_refreshes += 1
+
+        video_table = videos.table()
+        snapshot_table = await asyncio.to_thread(snapshots.table)
+        self._videos, self._snapshots, self._watermark = videos, snapshots, watermark
+        self.data = Dataset(video_table, snapshot_table, videos.codes, videos.creator_codes, version)
+        return {'full': int(full), **read}
+
+    async def _read_changes(self, pg_conn, watermark: Optional[int]) -> Tuple[_Videos, _Snapshots, Dict[str, int]]:
+        videos_sql, snapshots_sql = VIDEOS_SQL, SNAPSHOTS_COPY_SQL
+        if watermark is not None:
+            videos_sql += CHANGED_SINCE.format(alias='videos', watermark=int(watermark))
+            snapshots_sql += CHANGED_SINCE.format(alias='s', watermark=int(watermark))
+
+        videos = self._videos.copy() if watermark is not None else _Videos()
+        changed_videos = await pg_conn.fetch(videos_sql)
+        videos.apply(changed_videos)
+
+        receiver = _BinaryRows(SNAPSHOT_ROW)
+        await pg_conn.copy_from_query(snapshots_sql, output=receiver, format='binary')
+        rows = receiver.rows()
+        changed = _Snapshots.from_rows(rows, videos.lookup())
+
+        def merge() -> _Snapshots:
+            if watermark is None:
+                return changed.sorted()
+            # Измененные строки заменяют прежние версии, новые добавляются
+            kept = self._snapshots.take(~np.isin(self._snapshots.ids, changed.ids))
+            return _Snapshots.concat([kept, changed]).sorted()
+
+        snapshots = await asyncio.to_thread(merge)
+        return videos, snapshots, {'videos': len(changed_videos), 'snapshots': len(rows)}
+
+    def stats(self) -> dict:
+        total = self.answered + self.fallbacks
+        return {
+            'loaded': self.data is not None,
+            'version': self.data.version if self.data is not None else None,
+            'videos': self.data.videos.rows if self.data is not None else 0,
+            'snapshots': self.data.snapshots.rows if self.data is not None else 0,
+            'answered': self.answered,
+            'fallbacks': self.fallbacks,
+            'answered_rate': round(self.answered / total, 3) if total else 0.0,
+            'full_refreshes': self.full_refreshes,
+            'incremental_refreshes': self.incremental_refreshes,
+            'last_refresh_seconds': round(self.last_refresh_seconds, 3),
+        }
@@ -0,0 +1,497 @@
+"""Вычисление поддерживаемого подмножества SQL над колоночными массивами
+
+Поддерживается один SELECT из videos или snapshots без JOIN/GROUP BY, где в
+списке выборки только агрегаты COUNT(*), COUNT([DISTINCT] col), SUM, AVG, MIN,
+MAX (в том числе внутри COALESCE с литералом), а в WHERE — сравнения столбца с
+литералом, BETWEEN, IN (список), IS [NOT] NULL, AND/OR/NOT и подзапрос
+video_id IN (SELECT video_id FROM videos WHERE ...). Остальное — UnsupportedQuery,
+и запрос выполняет Postgres.
+
+Запрос компилируется один раз на отпечаток (db.sql_parser): литералы сравнений
+приходят параметрами, поэтому вопросы одной формы с разными датами и ID
+используют один план. Логика трехзначная, как в SQL: NULL в сравнении дает
+«неизвестно», и NOT такую строку не выбирает.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from decimal import ROUND_HALF_UP, Decimal, localcontext
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlglot import exp
+
+from src.db.sql_parser import DIALECT, _parse_one
+
+# Время хранится как в двоичном формате PostgreSQL: микросекунды от 2000-01-01
+PG_EPOCH = datetime(2000, 1, 1)
+NULL_TIME = np.iinfo(np.int64).min
+_MICROSECOND = timedelta(microseconds=1)
+
+INT, TIME, CODE = 'int', 'time', 'code'
+
+COUNTERS = ('views_count', 'likes_count', 'comments_count', 'reports_count')
+DELTAS = tuple(f'delta_{c}' for c in COUNTERS)
+
+SCHEMA: Dict[str, Dict[str, str]] = {
+    'videos': {
+        'video_id': CODE, 'creator_id': CODE, 'video_created_at': TIME,
+        **{c: INT for c in COUNTERS}, 'created_at': TIME, 'updated_at': TIME,
+    },
+    'snapshots': {
+        'video_id': CODE, **{c: INT for c in COUNTERS + DELTAS}, 'created_at': TIME, 'updated_at': TIME,
+    },
+}
+
+_COMPARISONS = {exp.EQ: '=', exp.NEQ: '<>', exp.GT: '>', exp.GTE: '>=', exp.LT: '<', exp.LTE: '<='}
+_FLIPPED = {'=': '=', '<>': '<>', '>': '<', '>=': '<=', '<': '>', '<=': '>='}
+_NUMPY_OPS = {'=': np.equal, '<>': np.not_equal, '>': np.greater, '>=': np.greater_equal,
+              '<': np.less, '<=': np.less_equal}
+
+
+class UnsupportedQuery(Exception):
+    """Запрос вне поддерживаемого подмножества: выполнять в Postgres"""
+
+
+def to_pg_time(value: datetime) -> int:
+    return (value - PG_EPOCH) // _MICROSECOND
+
+
+def from_pg_time(value: int) -> datetime:
+    return PG_EPOCH + timedelta(microseconds=int(value))
+
+
+@dataclass
+class Column:
+    values: np.ndarray
+    valid: Optional[np.ndarray] = None      # None — в столбце нет NULL
+
+
+@dataclass
+class Table:
+    columns: Dict[str, Column]
+    rows: int
+    null_times: int = 0     # для snapshots: строк с created_at IS NULL (они в начале порядка)
+
+
+class Dataset:
+    """Снимок данных, по которому считаются запросы (подменяется целиком при обновлении)"""
+
+    def __init__(self, videos: Table, snapshots: Table, video_codes: Dict[str, int],
+                 creator_codes: Dict[str, int], version: int = 0):
+        self.videos = videos
+        self.snapshots = snapshots
+        self.video_codes = video_codes
+        self.creator_codes = creator_codes
+        self.version = version
+
+    def codes(self, column: str) -> Dict[str, int]:
+        return self.creator_codes if column == 'creator_id' else self.video_codes
+
+
+class _Ctx:
+    """Строки таблицы [lo, hi) и значения параметров для одного вычисления"""
+
+    def __init__(self, data: Dataset, table: str, params: Sequence[str], lo: int = 0, hi: int = None):
+        self.data = data
+        self.table_name = table
+        self.table: Table = getattr(data, table)
+        self.params = params
+        self.lo = lo
+        self.hi = self.table.rows if hi is None else hi
+
+    @property
+    def size(self) -> int:
+        return self.hi - self.lo
+
+    def column(self, name: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        col = self.table.columns[name]
+        valid = col.valid[self.lo:self.hi] if col.valid is not None else None
+        return col.values[self.lo:self.hi], valid
+
+
+# Предикат возвращает маску «истина» и маску «неизвестно» (None — таких строк нет)
+Mask = Tuple[np.ndarray, Optional[np.ndarray]]
+Predicate = Callable[[_Ctx], Mask]
+Value = Callable[[Sequence[str]], object]
+
+
+def _value(node: exp.Expression) -> Tuple[Value, Optional[str]]:
+    """Литерал или параметр $n и тип, к которому его явно привели (CAST)"""
+    cast = None
+    if isinstance(node, exp.Cast):
+        if not node.to.is_type(exp.DataType.Type.DATE, exp.DataType.Type.TIMESTAMP):
+            raise UnsupportedQuery(f"приведение к {node.to.sql(dialect=DIALECT)}")
+        cast = 'date' if node.to.is_type(exp.DataType.Type.DATE) else 'timestamp'
+        node = node.this
+    if isinstance(node, exp.Parameter):
+        index = int(node.name) - 1
+        return (lambda params: params[index]), cast
+    if isinstance(node, exp.Literal):
+        literal = node.this
+        return (lambda params: literal), cast
+    if isinstance(node, exp.Neg) and isinstance(node.this, exp.Literal) and not node.this.is_string:
+        literal = '-' + node.this.this
+        return (lambda params: literal), cast
+    raise UnsupportedQuery(f"ожидался литерал, получено {node.sql(dialect=DIALECT)}")
+
+
+def _as_int(raw) -> object:
+    text = str(raw).strip()
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            raise UnsupportedQuery(f"не число: {raw!r}") from None
+
+
+def _as_time(raw, cast: Optional[str]) -> int:
+    try:
+        parsed = datetime.fromisoformat(str(raw).strip())
+    except ValueError:
+        raise UnsupportedQuery(f"не дата: {raw!r}") from None
+    if parsed.tzinfo is not None:
+        raise UnsupportedQuery(f"дата с часовым поясом: {raw!r}")
+    if cast == 'date':
+        parsed = datetime.combine(parsed.date(), datetime.min.time())
+    return to_pg_time(parsed)
+
+
+def _converter(kind: str, cast: Optional[str]) -> Callable[[Dataset, str, object], object]:
+    if kind == TIME:
+        return lambda data, column, raw: _as_time(raw, cast)
+    if cast is not None:
+        raise UnsupportedQuery("дата в сравнении с нечисловым столбцом")
+    if kind == INT:
+        return lambda data, column, raw: _as_int(raw)
+    # Неизвестный ID получает код -1, которого нет ни у одной строки
+    return lambda data, column, raw: data.codes(column).get(str(raw), -1)
+
+
+class _Compiler:
+    def __init__(self, table: str, alias: Optional[str]):
+        self.table = table
+        self.names = {table} | ({alias} if alias else set())
+
+    def column(self, node: exp.Expression) -> Tuple[str, str]:
+        if not isinstance(node, exp.Column):
+            raise UnsupportedQuery(f"ожидался столбец, получено {node.sql(dialect=DIALECT)}")
+        if node.table and node.table not in self.names:
+            raise UnsupportedQuery(f"столбец другой таблицы: {node.sql(dialect=DIALECT)}")
+        kind = SCHEMA[self.table].get(node.name)
+        if kind is None:
+            raise UnsupportedQuery(f"столбец {node.name} не поддерживается")
+        return node.name, kind
+
+    # --- WHERE ---
+
+    def predicate(self, node: exp.Expression) -> Predicate:
+        if isinstance(node, exp.Paren):
+            return self.predicate(node.this)
+        if isinstance(node, exp.And):
+            return _and(self.predicate(node.this), self.predicate(node.expression))
+        if isinstance(node, exp.Or):
+            return _or(self.predicate(node.this), self.predicate(node.expression))
+        if isinstance(node, exp.Not):
+            return _not(self.predicate(node.this))
+        if type(node) in _COMPARISONS:
+            return self.comparison(node)
+        if isinstance(node, exp.Between):
+            low = self.compare(node.this, '>=', node.args['low'])
+            high = self.compare(node.this, '<=', node.args['high'])
+            return _and(low, high)
+        if isinstance(node, exp.In):
+            return self.in_(node)
+        if isinstance(node, exp.Is) and isinstance(node.expression, exp.Null):
+            name, _ = self.column(node.this)
+            negate = bool(node.args.get('negate'))
+
+            def is_null(ctx: _Ctx) -> Mask:
+                _, valid = ctx.column(name)
+                if valid is None:
+                    return np.full(ctx.size, negate), None
+                return (valid if negate else ~valid), None
+            return is_null
+        raise UnsupportedQuery(f"условие {type(node).__name__} не поддерживается")
+
+    def comparison(self, node: exp.Binary) -> Predicate:
+        op = _COMPARISONS[type(node)]
+        left, right = node.this, node.expression
+        if not isinstance(left, exp.Column):
+            left, right, op = right, left, _FLIPPED[op]
+        return self.compare(left, op, right)
+
+    def compare(self, column_node: exp.Expression, op: str, value_node: exp.Expression) -> Predicate:
+        name, kind = self.column(column_node)
+        if kind == CODE and op not in ('=', '<>'):
+            raise UnsupportedQuery(f"сравнение {op} для {name}")
+        value, cast = _value(value_node)
+        convert = _converter(kind, cast)
+        numpy_op = _NUMPY_OPS[op]
+
+        def compare(ctx: _Ctx) -> Mask:
+            values, valid = ctx.column(name)
+            result = numpy_op(values, convert(ctx.data, name, value(ctx.params)))
+            if valid is None:
+                return result, None
+            return result & valid, ~valid
+        compare.bound = (name, op, value, convert)
+        return compare
+
+    def in_(self, node: exp.In) -> Predicate:
+        name, kind = self.column(node.this)
+        query = node.args.get('query')
+        if query is not None:
+            return self.in_subquery(name, query.this if isinstance(query, exp.Subquery) else query)
+        if kind == TIME or not node.expressions:
+            raise UnsupportedQuery(f"IN для {name}")
+        values = [_value(item) for item in node.expressions]
+        converts = [_converter(kind, cast) for _, cast in values]
+
+        def in_list(ctx: _Ctx) -> Mask:
+            column_values, valid = ctx.column(name)
+            wanted = [convert(ctx.data, name, value(ctx.params)) for (value, _), convert in zip(values, converts)]
+            result = np.isin(column_values, np.asarray(wanted))
+            if valid is None:
+                return result, None
+            return result & valid, ~valid
+        return in_list
+
+    def in_subquery(self, name: str, query: exp.Expression) -> Predicate:
+        if name != 'video_id':
+            raise UnsupportedQuery(f"подзапрос для {name}")
+        table, alias, where = _single_table(query)
+        if table != 'videos' or len(query.expressions) != 1:
+            raise UnsupportedQuery("подзапрос поддерживается только как SELECT video_id FROM videos")
+        inner = _Compiler(table, alias)
+        if inner.column(query.expressions[0]) != ('video_id', CODE):
+            raise UnsupportedQuery("подзапрос должен выбирать video_id")
+        inner_predicate = inner.predicate(where.this) if where is not None else None
+
+        def in_subquery(ctx: _Ctx) -> Mask:
+            videos = _Ctx(ctx.data, 'videos', ctx.params)
+            selected = inner_predicate(videos)[0] if inner_predicate else np.ones(videos.size, dtype=bool)
+            codes, _ = ctx.column('video_id')
+            return selected[codes], None
+        return in_subquery
+
+    # --- SELECT ---
+
+    def aggregate(self, node: exp.Expression) -> Callable[[_Ctx, Optional[np.ndarray]], object]:
+        if isinstance(node, exp.Alias):
+            return self.aggregate(node.this)
+        if isinstance(node, exp.Paren):
+            return self.aggregate(node.this)
+        if isinstance(node, exp.Coalesce):
+            if len(node.expressions) != 1:
+                raise UnsupportedQuery("COALESCE поддерживается с одним значением по умолчанию")
+            inner = self.aggregate(node.this)
+            default, _ = _value(node.expressions[0])
+            fallback = _as_int(default(()))
+            return lambda ctx, mask: _coalesce(inner(ctx, mask), fallback)
+        if isinstance(node, exp.Count):
+            return self.count(node)
+        for func, kernel in ((exp.Sum, _sum), (exp.Avg, _avg), (exp.Min, _min), (exp.Max, _max)):
+            if isinstance(node, func):
+                name, kind = self.column(node.this)
+                if kind == CODE or (kind == TIME and func in (exp.Sum, exp.Avg)):
+                    raise UnsupportedQuery(f"{func.__name__.upper()}({name})")
+                return lambda ctx, mask, name=name, kind=kind, kernel=kernel: kernel(*_selected(ctx, name, mask), kind)
+        raise UnsupportedQuery(f"в SELECT поддерживаются только агрегаты, получено {node.sql(dialect=DIALECT)}")
+
+    def count(self, node: exp.Count):
+        target = node.this
+        if isinstance(target, exp.Star):
+            return lambda ctx, mask: ctx.size if mask is None else int(np.count_nonzero(mask))
+        if isinstance(target, exp.Distinct):
+            if len(target.expressions) != 1:
+                raise UnsupportedQuery("COUNT(DISTINCT) по нескольким столбцам")
+            name, kind = self.column(target.expressions[0])
+
+            def count_distinct(ctx: _Ctx, mask):
+                values, _ = _selected(ctx, name, mask)
+                if kind == CODE and len(values) > len(ctx.data.codes(name)) // 16:
+                    # Плотные коды: отметки в массиве по числу ключей дешевле сортировки
+                    seen = np.zeros(len(ctx.data.codes(name)), dtype=bool)
+                    seen[values] = True
+                    return int(np.count_nonzero(seen))
+                return int(len(np.unique(values)))
+            return count_distinct
+        name, _ = self.column(target)
+        return lambda ctx, mask: int(len(_selected(ctx, name, mask)[0]))
+
+
+def _selected(ctx: _Ctx, name: str, mask: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Не-NULL значения столбца в выбранных строках"""
+    values, valid = ctx.column(name)
+    if valid is not None:
+        mask = valid if mask is None else mask & valid
+    return (values if mask is None else values[mask]), mask
+
+
+def _sum(values: np.ndarray, mask, kind: str):
+    return int(values.sum(dtype=np.int64)) if len(values) else None
+
+
+def _base10000(value: int) -> Tuple[int, int]:
+    """Вес и первая цифра числа в представлении numeric (цифры по основанию 10000)"""
+    value = abs(value)
+    weight = 0
+    while value >= 10000 ** (weight + 1):
+        weight += 1
+    return weight, value // 10000 ** weight
+
+
+def numeric_div(total: int, count: int) -> Decimal:
+    """Деление целых как в PostgreSQL для AVG: масштаб по правилу select_div_scale
+
+    Не меньше 16 значащих цифр, округление половины от нуля.
+    """
+    weight1, first1 = _base10000(total)
+    weight2, first2 = _base10000(count)
+    qweight = weight1 - weight2 - (first1 <= first2)
+    scale = min(max(16 - qweight * 4, 0), 1000)
+    with localcontext() as context:
+        context.prec = scale + len(str(abs(total))) + 2
+        quotient = Decimal(total) / Decimal(count)
+        return quotient.quantize(Decimal(1).scaleb(-scale), rounding=ROUND_HALF_UP)
+
+
+def _avg(values: np.ndarray, mask, kind: str):
+    if not len(values):
+        return None
+    return numeric_div(int(values.sum(dtype=np.int64)), len(values))
+
+
+def _min(values: np.ndarray, mask, kind: str):
+    if not len(values):
+        return None
+    return from_pg_time(values.min()) if kind == TIME else int(values.min())
+
+
+def _max(values: np.ndarray, mask, kind: str):
+    if not len(values):
+        return None
+    return from_pg_time(values.max()) if kind == TIME else int(values.max())
+
+
+def _coalesce(value, fallback):
+    return fallback if value is None else value
+
+
+def _and(left: Predicate, right: Predicate) -> Predicate:
+    def both(ctx: _Ctx) -> Mask:
+        (lt, lu), (rt, ru) = left(ctx), right(ctx)
+        if lu is None and ru is None:
+            return lt & rt, None
+        # Неизвестно, если ни одна сторона не ложна и хотя бы одна неизвестна
+        lf = ~lt if lu is None else ~(lt | lu)
+        rf = ~rt if ru is None else ~(rt | ru)
+        unknown = ~(lt & rt) & ~lf & ~rf
+        return lt & rt, unknown
+    return both
+
+
+def _or(left: Predicate, right: Predicate) -> Predicate:
+    def either(ctx: _Ctx) -> Mask:
+        (lt, lu), (rt, ru) = left(ctx), right(ctx)
+        true = lt | rt
+        if lu is None and ru is None:
+            return true, None
+        unknown = ~true & ((lu if lu is not None else False) | (ru if ru is not None else False))
+        return true, unknown
+    return either
+
+
+def _not(inner: Predicate) -> Predicate:
+    def negated(ctx: _Ctx) -> Mask:
+        true, unknown = inner(ctx)
+        if unknown is None:
+            return ~true, None
+        return ~(true | unknown), unknown
+    return negated
+
+
+def _single_table(select: exp.Expression) -> Tuple[str, Optional[str], Optional[exp.Where]]:
+    if not isinstance(select, exp.Select):
+        raise UnsupportedQuery(f"ожидался SELECT, получено {type(select).__name__}")
+    for key in ('joins', 'group', 'having', 'order', 'offset', 'with', 'distinct', 'windows', 'qualify'):
+        if select.args.get(key):
+            raise UnsupportedQuery(f"{key.upper()} не поддерживается")
+    source = select.args.get('from_') or select.args.get('from')
+    if source is None or not isinstance(source.this, exp.Table):
+        raise UnsupportedQuery("ожидалась одна таблица во FROM")
+    table = source.this
+    if table.db or table.name not in SCHEMA:
+        raise UnsupportedQuery(f"таблица {table.sql(dialect=DIALECT)}")
+    return table.name, table.alias or None, select.args.get('where')
+
+
+def _conjuncts(node: exp.Expression) -> List[exp.Expression]:
+    while isinstance(node, exp.Paren):
+        node = node.this
+    if isinstance(node, exp.And):
+        return _conjuncts(node.this) + _conjuncts(node.expression)
+    return [node]
+
+
+@dataclass
+class Plan:
+    table: str
+    range_bounds: List[Tuple[str, Value, Callable]]     # условия на snapshots.created_at для бинарного поиска
+    predicate: Optional[Predicate]
+    aggregates: List[Callable]
+    limit: Optional[int]
+
+    def execute(self, data: Dataset, params: Sequence[str]) -> tuple:
+        ctx = _Ctx(data, self.table, params)
+        if self.range_bounds:
+            ctx.lo, ctx.hi = self._narrow(ctx)
+        mask = None
+        if self.predicate is not None and ctx.size:
+            mask = self.predicate(ctx)[0]
+        if self.limit == 0:
+            return None
+        return tuple(aggregate(ctx, mask) for aggregate in self.aggregates)
+
+    def _narrow(self, ctx: _Ctx) -> Tuple[int, int]:
+        """Диапазон строк по условиям на created_at: snapshots упорядочены по нему"""
+        times = ctx.table.columns['created_at'].values
+        lo, hi = ctx.table.null_times, ctx.table.rows
+        for op, value, convert in self.range_bounds:
+            bound = convert(ctx.data, 'created_at', value(ctx.params))
+            if op in ('>=', '>', '='):
+                lo = max(lo, int(np.searchsorted(times, bound, 'left' if op != '>' else 'right')))
+            if op in ('<', '<=', '='):
+                hi = min(hi, int(np.searchsorted(times, bound, 'left' if op == '<' else 'right')))
+        return lo, max(lo, hi)
+
+
+def compile_plan(fingerprint: str) -> Plan:
+    """План для отпечатка запроса; UnsupportedQuery, если запрос вне подмножества"""
+    select = _parse_one(fingerprint)
+    table, alias, where = _single_table(select)
+    compiler = _Compiler(table, alias)
+    aggregates = [compiler.aggregate(node) for node in select.expressions]
+
+    limit = None
+    if select.args.get('limit') is not None:
+        limit_value = select.args['limit'].expression
+        if not isinstance(limit_value, exp.Literal) or limit_value.is_string:
+            raise UnsupportedQuery("LIMIT не литерал")
+        limit = int(limit_value.this)
+
+    range_bounds, predicates = [], []
+    for node in (_conjuncts(where.this) if where is not None else []):
+        predicate = compiler.predicate(node)
+        bound = getattr(predicate, 'bound', None)
+        if table == 'snapshots' and bound is not None and bound[0] == 'created_at' and bound[1] != '<>':
+            range_bounds.append(bound[1:])
+        else:
+            predicates.append(predicate)
+
+    predicate = None
+    for item in predicates:
+        predicate = item if predicate is None else _and(predicate, item)
+    return Plan(table, range_bounds, predicate, aggregates, limit)
@@ -0,0 +1,81 @@
+"""Пакет вопросов: по одному подряд против конвейера BatchRunner
+
+Вопросы идут через YandexMLGPTQueryService с заглушкой модели
+(stubs.StubModel) и планировщиком LLM, как в боте; выполнение SQL имитируется
+задержкой --db-latency. Доля --duplicates вопросов повторяет уже заданные
+(другой регистр и пунктуация). Для каждого режима — общее время пакета,
+нижняя граница по пропускной способности LLM (вызовы × средняя задержка /
+одновременных вызовов) и число вызовов модели.
+
+Запуск: python -m src.benchmarks.bench_batch --questions 300 --llm-concurrency 4
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from src.benchmarks.stubs import StubModel, StubSDK
+from src.llm_service.llm_service import YandexGPTConfig, YandexMLGPTQueryService
+from src.llm_service.scheduler import LLMRequestScheduler
+from src.services.batch import BatchRunner, summarize
+
+SQL = "SELECT COUNT(*) FROM videos WHERE views_count > {n}"
+
+
+def make_questions(args) -> tuple:
+    rnd = random.Random(args.seed)
+    answers, questions = {}, []
+    for n in range(args.questions):
+        if questions and rnd.random() < args.duplicates:
+            questions.append(rnd.choice(questions).lower().rstrip('?'))
+            continue
+        question = f'Сколько видео набрали больше {n} просмотров?'
+        answers[question] = SQL.format(n=n)
+        questions.append(question)
+    return questions, answers
+
+
+async def run_mode(args, llm_concurrency: int, db_concurrency: int) -> dict:
+    questions, answers = make_questions(args)
+    model = StubModel(answers, latency=args.llm_latency, jitter=0.5, seed=args.seed)
+    service = YandexMLGPTQueryService(YandexGPTConfig(api_key='bench', folder_id='bench', model='stub'),
+                                      sdk=StubSDK({'stub': model}),
+                                      scheduler=LLMRequestScheduler(max_in_flight=args.llm_concurrency))
+    rnd = random.Random(args.seed + 1)
+
+    async def execute(sql: str):
+        await asyncio.sleep(args.db_latency * rnd.uniform(0.5, 1.5))
+        return (1,)
+
+    runner = BatchRunner(lambda question: service.text_to_sql(question, 'batch'), execute,
+                         llm_concurrency=llm_concurrency, db_concurrency=db_concurrency)
+    started = time.perf_counter()
+    items = await runner.run(questions)
+    return {
+        'total_s': time.perf_counter() - started,
+        'llm_bound_s': model.calls * args.llm_latency / llm_concurrency,
+        'calls': model.calls,
+        'outcomes': summarize(items),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', type=int, default=300)
+    parser.add_argument('--duplicates', type=float, default=0.2)
+    parser.add_argument('--llm-latency', type=float, default=0.5)
+    parser.add_argument('--db-latency', type=float, default=0.05)
+    parser.add_argument('--llm-concurrency', type=int, default=4)
+    parser.add_argument('--db-concurrency', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'режим':<12}{'пакет, с':>10}{'граница LLM, с':>16}{'вызовов':>9}  исходы")
+    for name, llm, db in (('по одному', 1, 1), ('конвейер', args.llm_concurrency, args.db_concurrency)):
+        r = await run_mode(args, llm, db)
+        outcomes = ', '.join(f'{k} {v}' for k, v in r['outcomes'].items())
+        print(f"{name:<12}{r['total_s']:>10.1f}{r['llm_bound_s']:>16.1f}{r['calls']:>9}  {outcomes}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
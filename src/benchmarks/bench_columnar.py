@@ -0,0 +1,95 @@
+"""Колоночная копия в памяти против Postgres на типичных агрегатных запросах
+
+Запуск: python -m src.benchmarks.bench_columnar --queries 2000
+Читает рабочие таблицы: копия загружается целиком, затем одни и те же запросы
+(формы как у быстрого пути и LLM, ID и даты из данных) выполняются копией и
+в Postgres через песочницу. Выводятся время загрузки, задержки и доля запросов,
+на которые копия ответила сама.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import time
+
+from sqlalchemy import text
+
+from src.analytics.columnar import ColumnarMirror
+from src.analytics.evaluator import UnsupportedQuery
+from src.db.database import get_async_session
+from src.db.sandbox import ResourceClass, SQLSandbox
+
+SHAPES = [
+    "SELECT COUNT(DISTINCT video_id) FROM snapshots WHERE created_at >= '{day}' AND created_at < '{next_day}' "
+    "AND delta_views_count > 0",
+    "SELECT COALESCE(SUM(delta_views_count), 0) FROM snapshots WHERE created_at >= '{day} 10:00:00' "
+    "AND created_at < '{day} 15:00:00' AND video_id IN (SELECT video_id FROM videos WHERE creator_id = '{creator}')",
+    "SELECT COUNT(*) FROM videos WHERE creator_id = '{creator}' AND views_count > {threshold}",
+    "SELECT AVG(views_count) FROM videos WHERE creator_id = '{creator}'",
+    "SELECT COUNT(DISTINCT video_id) FROM snapshots WHERE views_count > {threshold}",
+    "SELECT COALESCE(SUM(delta_views_count), 0) FROM snapshots",
+]
+
+
+async def _queries(count: int, seed: int = 1):
+    async with get_async_session() as session:
+        creators = [r[0] for r in (await session.execute(text("SELECT DISTINCT creator_id FROM videos"))).all()]
+        days = [r[0] for r in (await session.execute(text(
+            "SELECT DISTINCT created_at::date FROM snapshots WHERE created_at IS NOT NULL"))).all()]
+    rng = random.Random(seed)
+    return [
+        rng.choice(SHAPES).format(
+            day=day, next_day=day.fromordinal(day.toordinal() + 1),
+            creator=rng.choice(creators), threshold=rng.randrange(10000),
+        )
+        for day in (rng.choice(days) for _ in range(count))
+    ]
+
+
+def _row(name: str, timings: list):
+    timings.sort()
+    print(f"{name:<12}{statistics.median(timings) * 1000:>10.3f}{timings[int(len(timings) * 0.95)] * 1000:>10.3f}"
+          f"{timings[-1] * 1000:>10.3f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    queries = await _queries(args.queries)
+
+    mirror = ColumnarMirror()
+    result = await mirror.refresh(full=True)
+    print(f"Загрузка копии: {mirror.last_refresh_seconds:.2f} с, видео {result['videos']}, "
+          f"снапшотов {result['snapshots']}")
+
+    mirror_timings, unsupported = [], 0
+    for sql in queries:
+        started = time.perf_counter()
+        try:
+            mirror.execute(sql)
+        except UnsupportedQuery:
+            unsupported += 1
+            continue
+        mirror_timings.append(time.perf_counter() - started)
+
+    sandbox = SQLSandbox(classes={'interactive': ResourceClass(60000, '64MB', 0)})
+    pg_timings = []
+    for sql in queries:
+        started = time.perf_counter()
+        await sandbox.fetch_one(sql)
+        pg_timings.append(time.perf_counter() - started)
+    await sandbox.close()
+
+    print(f"Ответила копия: {len(mirror_timings)}/{len(queries)}")
+    print(f"{'':<12}{'p50, мс':>10}{'p95, мс':>10}{'max, мс':>10}")
+    if mirror_timings:
+        _row('копия', mirror_timings)
+    _row('postgres', pg_timings)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""Латентность запросов с пулом соединений и без него (NullPool)
+
+Каждый запрос идет через отдельную сессию, как в handle_text_query.
+Запуск: python -m src.benchmarks.bench_db_pool --queries 500 --concurrency 8
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+from src.db.database import create_engine_from_settings, warm_up_pool
+
+QUERIES = [
+    "SELECT COUNT(*) FROM videos WHERE views_count > 10000",
+    "SELECT COUNT(DISTINCT video_id) FROM snapshots WHERE delta_views_count > 0",
+    "SELECT COALESCE(SUM(views_count), 0) FROM videos",
+]
+
+
+def _percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def _bench(pooled: bool, n_queries: int, concurrency: int) -> dict:
+    engine = create_engine_from_settings(pooled=pooled, echo=False)
+    factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    await warm_up_pool(engine, concurrency)
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            async with factory() as session:
+                res = await session.execute(text(QUERIES[i % len(QUERIES)]))
+                res.fetchone()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n_queries)))
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+
+    return {
+        'mode': 'pool' if pooled else 'NullPool',
+        'p50_ms': _percentile(latencies, 50),
+        'p99_ms': _percentile(latencies, 99),
+        'mean_ms': statistics.mean(latencies),
+        'qps': n_queries / elapsed,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"{'режим':>9} {'p50, мс':>9} {'p99, мс':>9} {'среднее':>9} {'запр/с':>9}")
+    for pooled in (False, True):
+        r = await _bench(pooled, args.queries, args.concurrency)
+        print(f"{r['mode']:>9} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['mean_ms']:>9.2f} {r['qps']:>9.0f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
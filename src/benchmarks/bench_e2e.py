@@ -0,0 +1,326 @@
+"""Сквозной нагрузочный тест: синтетические сообщения через router бота
+
+Сообщения пользователей подаются в Dispatcher aiogram (feed_update) с заданной
+частотой, как если бы их присылал Telegram. Внешние сервисы заменены
+заглушками из src.benchmarks.stubs: модель отвечает заранее заданным SQL
+с настраиваемой задержкой, ответы бота никуда не отправляются. Быстрый путь,
+кэши, планировщик LLM, песочница и Postgres работают как в боте, по настройкам
+из .env (кэш вопросов только в памяти, файл не меняется).
+
+Запуск:
+  python -m src.benchmarks.bench_e2e --rate 50 --messages 2000 --output e2e.json
+  python -m src.benchmarks.bench_e2e --seed-videos 20000 --seed-snapshots 20 ...   # очищает таблицы
+  python -m src.benchmarks.bench_e2e ... --output new.json --baseline e2e.json      # сравнение с прошлым прогоном
+
+Отчет (JSON): пропускная способность, p50/p95/p99 по стадиям, исходы ответов и
+доля ошибок. Задержка total отсчитывается от запланированного времени
+прихода сообщения, поэтому отставание генератора тоже попадает в нее.
+Стадии: sql — получение SQL (быстрый путь или LLM), llm — generate_sql
+(кэш вопросов, очередь планировщика и модель), model — вызов модели,
+db — выполнение SQL, send — отправка ответа.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Chat, Message, Update, User
+from sqlalchemy import text
+
+from src.benchmarks.reporting import git_commit, summary
+from src.benchmarks.stubs import StubModel, StubSession
+from src.benchmarks.synthetic import write_videos_json
+from src.bot.handlers import handlers
+from src.config.config import settings
+from src.db.database import async_engine, get_async_session, init_db
+from src.llm_service.model_router import ModelRouter
+from src.llm_service.question_cache import QuestionCache
+from src.services.data_loader.loader_service import clear_existing_data, load_videos_from_json
+
+logger = logging.getLogger(__name__)
+
+MONTHS_GENITIVE = ['января', 'февраля', 'марта', 'апреля', 'мая', 'июня', 'июля', 'августа',
+                   'сентября', 'октября', 'ноября', 'декабря']
+
+# Формулировки вопросов и SQL, который на них "отвечает" модель. Часть
+# формулировок разбирает быстрый путь — до заглушки они не доходят.
+QUESTIONS = [
+    ("Сколько всего видео у креатора {creator}?",
+     "SELECT COUNT(*) FROM videos WHERE creator_id = '{creator}'"),
+    ("Сколько видео у креатора {creator} набрали больше {n} просмотров?",
+     "SELECT COUNT(*) FROM videos WHERE creator_id = '{creator}' AND views_count > {n}"),
+    ("Подскажи, сколько лайков в среднем у видео креатора {creator}",
+     "SELECT AVG(likes_count) FROM videos WHERE creator_id = '{creator}'"),
+    ("На сколько просмотров в сумме выросли все видео {day_text}?",
+     "SELECT COALESCE(SUM(delta_views_count), 0) FROM snapshots "
+     "WHERE created_at >= '{day}' AND created_at < '{next_day}'"),
+    ("Сколько разных видео получали новые просмотры {day_text}?",
+     "SELECT COUNT(DISTINCT video_id) FROM snapshots "
+     "WHERE created_at >= '{day}' AND created_at < '{next_day}' AND delta_views_count > 0"),
+    ("Сколько лайков суммарно получили видео креатора {creator} за {day_text}",
+     "SELECT COALESCE(SUM(delta_likes_count), 0) FROM snapshots WHERE created_at >= '{day}' "
+     "AND created_at < '{next_day}' AND video_id IN (SELECT video_id FROM videos WHERE creator_id = '{creator}')"),
+]
+
+# Начало ответа бота -> исход; число в ответе — успешный ответ
+OUTCOMES = [
+    ('Не удалось понять', 'not_understood'),
+    ('Сейчас слишком много', 'overloaded'),
+    ('Запрос получился слишком тяжелым', 'rejected'),
+    ('Не удалось получить ответ вовремя', 'timeout'),
+    ('Возникла ошибка', 'error'),
+]
+
+_dispatcher: Optional[Dispatcher] = None
+
+
+def _get_dispatcher() -> Dispatcher:
+    # router можно подключить только к одному диспетчеру
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = Dispatcher()
+        _dispatcher.include_router(handlers.router)
+    return _dispatcher
+
+
+async def seed_database(videos: int, snapshots: int):
+    """Очистка таблиц и загрузка синтетической выгрузки заданного размера"""
+    await init_db()
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = write_videos_json(Path(tmp) / 'videos.json', videos, snapshots)
+        await clear_existing_data()
+        stats = await load_videos_from_json(json_path, bulk=True)
+    logger.info(f"БД заполнена: видео {stats['videos']}, снапшотов {stats['snapshots']}")
+
+
+async def build_questions(count: int, seed: int = 42) -> Dict[str, str]:
+    """Набор различных вопросов с ID и датами из БД: вопрос -> SQL для заглушки"""
+    async with get_async_session() as session:
+        creators = [r[0] for r in (await session.execute(text(
+            "SELECT DISTINCT creator_id FROM videos ORDER BY creator_id LIMIT 100"))).all()]
+        days = [r[0] for r in (await session.execute(text(
+            "SELECT DISTINCT created_at::date FROM snapshots WHERE created_at IS NOT NULL "
+            "ORDER BY 1 LIMIT 60"))).all()]
+    if not creators or not days:
+        raise RuntimeError("В БД нет данных: запустите с --seed-videos или загрузите выгрузку")
+
+    rnd = random.Random(seed)
+    answers = {}
+    for _ in range(count * 20):
+        if len(answers) >= count:
+            break
+        question, sql = rnd.choice(QUESTIONS)
+        day = rnd.choice(days)
+        values = {
+            'creator': rnd.choice(creators), 'n': rnd.choice([100, 1000, 5000, 10000]),
+            'day': day, 'next_day': day + timedelta(days=1),
+            'day_text': f"{day.day} {MONTHS_GENITIVE[day.month - 1]} {day.year} года",
+        }
+        answers[question.format(**values)] = sql.format(**values)
+    return answers
+
+
+def _outcome(reply: str) -> str:
+    if reply.lstrip('-').isdigit():
+        return 'ok'
+    for prefix, outcome in OUTCOMES:
+        if reply.startswith(prefix):
+            return outcome
+    return 'other'
+
+
+class _StageTimer:
+    """Задержки и ошибки стадий обработки сообщения"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+
+    def wrap(self, name: str, func):
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                self.errors[name] += 1
+                raise
+            finally:
+                self.samples[name].append(time.perf_counter() - started)
+        return timed
+
+
+@contextmanager
+def _instrumented(timer: _StageTimer, model: StubModel):
+    """Подмена модели и кэша вопросов, замер стадий; после прогона все возвращается"""
+    service = handlers.yc_service
+    saved = (handlers._generate_sql, handlers._execute_sql, service.router, service.cache)
+    handlers._generate_sql = timer.wrap('sql', handlers._generate_sql)
+    handlers._execute_sql = timer.wrap('db', handlers._execute_sql)
+    service.generate_sql = timer.wrap('llm', service.generate_sql)
+    service.router = ModelRouter([('stub', SimpleNamespace(run=timer.wrap('model', model.run)))],
+                                 attempt_timeout=settings.LLM_ATTEMPT_TIMEOUT)
+    if service.cache is not None:
+        service.cache = QuestionCache(max_size=settings.QUESTION_CACHE_SIZE, ttl=settings.QUESTION_CACHE_TTL)
+    try:
+        yield
+    finally:
+        handlers._generate_sql, handlers._execute_sql, service.router, service.cache = saved
+        del service.generate_sql
+
+
+def _update(number: int, user_id: int, question: str) -> Update:
+    user = User(id=user_id, is_bot=False, first_name='bench')
+    return Update(update_id=number, message=Message(
+        message_id=number, date=datetime.now(), chat=Chat(id=user_id, type='private'),
+        from_user=user, text=question,
+    ))
+
+
+async def run_load(answers: Dict[str, str], messages: int, rate: float, model: StubModel,
+                   users: int = 100, send_latency: float = 0.0, seed: int = 42) -> dict:
+    """Подача messages сообщений с частотой rate в секунду (пуассоновский поток)"""
+    rnd = random.Random(seed)
+    questions = list(answers)
+    # Распределение Ципфа: несколько популярных вопросов и длинный хвост
+    weights = [1 / (rank + 1) for rank in range(len(questions))]
+    session = StubSession(latency=send_latency)
+    bot = Bot(token='42:BENCHMARK', session=session)
+    dispatcher = _get_dispatcher()
+    timer = _StageTimer()
+    failures: Counter = Counter()
+
+    async def deliver(update: Update, scheduled: float):
+        try:
+            await dispatcher.feed_update(bot, update)
+        except Exception as e:
+            failures[type(e).__name__] += 1
+        finally:
+            timer.samples['total'].append(time.perf_counter() - scheduled)
+
+    with _instrumented(timer, model):
+        tasks = []
+        started = time.perf_counter()
+        scheduled = started
+        for number in range(1, messages + 1):
+            scheduled += rnd.expovariate(rate)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            update = _update(number, rnd.randrange(users) + 1, rnd.choices(questions, weights)[0])
+            tasks.append(asyncio.create_task(deliver(update, scheduled)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    timer.samples['send'] = session.timings
+    outcomes = Counter(_outcome(reply) for _, reply in session.sent)
+    outcomes['no_reply'] = max(0, messages - len(session.sent))
+    for name, count in failures.items():
+        outcomes[f'exception:{name}'] = count
+
+    return {
+        'messages': messages,
+        'seconds': round(elapsed, 3),
+        'throughput_per_sec': round(messages / elapsed, 2),
+        'error_rate': round(1 - outcomes['ok'] / messages, 4),
+        'outcomes': {k: v for k, v in sorted(outcomes.items()) if v},
+        'stages': {name: dict(summary(values), errors=timer.errors[name])
+                   for name, values in sorted(timer.samples.items())},
+        'llm': {'calls': model.calls, 'errors': model.errors},
+        'sql_paths': {name: stats.stats() for name, stats in handlers.sql_path_stats.items()},
+        'single_flight': {'question': handlers.question_flight.stats(), 'sql': handlers.sql_flight.stats()},
+    }
+
+
+def compare(report: dict, baseline: dict) -> List[str]:
+    """Строки сравнения с прошлым отчетом: пропускная способность, доля ошибок, p95/p99 стадий"""
+    def change(new, old):
+        return f"{(new - old) / old:+.0%}" if old else '—'
+
+    lines = [
+        f"Базовый прогон: {baseline['meta'].get('commit')} от {baseline['meta'].get('started_at')}",
+        f"{'сообщений/с':<14}{baseline['throughput_per_sec']:>12}{report['throughput_per_sec']:>12}"
+        f"{change(report['throughput_per_sec'], baseline['throughput_per_sec']):>10}",
+        f"{'доля ошибок':<14}{baseline['error_rate']:>12}{report['error_rate']:>12}",
+    ]
+    for stage, new in report['stages'].items():
+        old = baseline['stages'].get(stage)
+        if not old or not old['count'] or not new['count']:
+            continue
+        for p in ('p95_ms', 'p99_ms'):
+            lines.append(f"{stage + ' ' + p:<14}{old[p]:>12}{new[p]:>12}{change(new[p], old[p]):>10}")
+    return lines
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=20, help="сообщений в секунду")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--questions', type=int, default=200, help="число различных вопросов")
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="средняя задержка модели, с")
+    parser.add_argument('--llm-jitter', type=float, default=0.3, help="разброс задержки модели, доля")
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--send-latency', type=float, default=0.0, help="задержка ответа Telegram API, с")
+    parser.add_argument('--seed-videos', type=int, default=0, help="заполнить БД синтетикой (очищает таблицы)")
+    parser.add_argument('--seed-snapshots', type=int, default=20, help="снапшотов на видео для --seed-videos")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', type=Path, help="файл для JSON-отчета")
+    parser.add_argument('--baseline', type=Path, help="JSON-отчет прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.seed_videos:
+        await seed_database(args.seed_videos, args.seed_snapshots)
+    if handlers.columnar_mirror is not None:
+        await handlers.columnar_mirror.refresh(full=True)
+
+    answers = await build_questions(args.questions, args.seed)
+    model = StubModel(answers, latency=args.llm_latency, jitter=args.llm_jitter,
+                      error_rate=args.llm_error_rate, seed=args.seed)
+    started_at = datetime.now().isoformat(timespec='seconds')
+    try:
+        report = await run_load(answers, args.messages, args.rate, model, users=args.users,
+                                send_latency=args.send_latency, seed=args.seed)
+    finally:
+        if handlers.sql_sandbox is not None:
+            await handlers.sql_sandbox.close()
+        await async_engine.dispose()
+
+    report['meta'] = {
+        'commit': git_commit(),
+        'started_at': started_at,
+        'args': {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        'settings': {name: getattr(settings, name) for name in (
+            'FAST_PATH_ENABLED', 'QUESTION_CACHE_ENABLED', 'RESULT_CACHE_ENABLED', 'SANDBOX_ENABLED',
+            'QUERY_ROLLUPS_ENABLED', 'COLUMNAR_ENABLED', 'LLM_MAX_IN_FLIGHT', 'LLM_MAX_QUEUE',
+        )},
+    }
+
+    print(f"Сообщений: {report['messages']} за {report['seconds']} с "
+          f"({report['throughput_per_sec']} в секунду), доля ошибок {report['error_rate']:.2%}")
+    print(f"Исходы: {report['outcomes']}")
+    print(f"{'стадия':<8}{'кол-во':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'ошибок':>8}")
+    for name, s in report['stages'].items():
+        if s['count']:
+            print(f"{name:<8}{s['count']:>8}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}{s['errors']:>8}")
+
+    if args.baseline:
+        print()
+        print('\n'.join(compare(report, json.loads(args.baseline.read_text(encoding='utf-8')))))
+    if args.output:
+        args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2, default=str), encoding='utf-8')
+        print(f"Отчет: {args.output}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,174 @@
+"""Память примеров на 100 000+ парах: скорость поиска и точность повторного использования
+
+Синтетические вопросы собираются из частей (начало, объект, автор, условие,
+метрика, период, окончание), у каждой части — свой кусок SQL, поэтому для
+любого вопроса известен правильный SQL. В память добавляется --entries пар,
+затем замеряется lookup на вопросах четырех видов:
+  exact   — та же формулировка с другими ID и числами;
+  typo    — опечатка или слово-паразит в сохраненной формулировке;
+  changed — одна смысловая часть заменена (вопроса с таким смыслом в памяти нет);
+  novel   — формулировка, которой нет в памяти.
+Для каждого вида — доля ответов из памяти, доля верного SQL среди них и
+задержка lookup; отдельно — время построения индекса и загрузки из JSONL.
+
+Запуск: python -m src.benchmarks.bench_few_shot --entries 100000 --queries 2000
+"""
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from src.benchmarks.reporting import summary
+from src.llm_service.few_shot_memory import FewShotMemory
+
+OPENINGS = [('сколько', ''), ('подскажи сколько', ''), ('скажи сколько', ''), ('посчитай сколько', ''),
+            ('какое количество', ''), ('какое число', ''), ('а сколько', ''), ('назови число', '')]
+NOUNS = [('видео', ''), ('роликов', ''), ('публикаций', ''), ('клипов', ''), ('записей', '')]
+OWNERS = [('', ''), ('у креатора {id}', " AND creator_id = '{id}'"), ('у автора {id}', " AND creator_id = '{id}'"),
+          ('у блогера {id}', " AND creator_id = '{id}'"), ('с канала {id}', " AND channel_id = '{id}'"),
+          ('от студии {id}', " AND studio_id = '{id}'")]
+CONDITIONS = [('набрали больше {n}', ' > {n}'), ('имеют больше {n}', ' > {n}'), ('получили меньше {n}', ' < {n}'),
+              ('набрали ровно {n}', ' = {n}'), ('имеют не менее {n}', ' >= {n}'), ('собрали более {n}', ' > {n}'),
+              ('набрали хотя бы {n}', ' >= {n}')]
+METRICS = [('просмотров', 'views_count'), ('лайков', 'likes_count'), ('комментариев', 'comments_count'),
+           ('жалоб', 'reports_count'), ('репостов', 'shares_count')]
+PERIODS = [('', ''), ('за всё время', ''), ('в {month} {year}', ' AND month = {m} AND year = {year}'),
+           ('по итоговой статистике', ''), ('по снапшотам', ' AND source = snapshots'),
+           ('за последнюю неделю', ' AND week = last'), ('в истории', ' AND source = history'),
+           ('после публикации', ' AND after = publish'), ('с момента загрузки', ' AND after = upload')]
+TAILS = [('', ''), ('в сумме', ' AND total'), ('на сегодня', ' AND today'), ('на данный момент', ' AND now'),
+         ('по всем замерам', ' AND all_snapshots'), ('среди опубликованных', ' AND published')]
+PARTS = [OPENINGS, NOUNS, OWNERS, CONDITIONS, METRICS, PERIODS, TAILS]
+MONTHS = ['январе', 'феврале', 'марте', 'апреле', 'мае', 'июне', 'июле', 'августе', 'сентябре', 'октябре',
+          'ноябре', 'декабре']
+FILLERS = ['пожалуйста', 'вообще', 'ну']
+
+Combo = Tuple[int, ...]
+
+
+def render(combo: Combo, rnd: random.Random) -> Tuple[str, str]:
+    """Вопрос и правильный SQL для набора частей со случайными литералами"""
+    month = combo[-1]
+    values = {'id': f'{rnd.getrandbits(128):032x}', 'n': rnd.randrange(100, 10 ** 6),
+              'month': MONTHS[month], 'm': month + 1, 'year': rnd.choice([2023, 2024, 2025])}
+    chosen = [part[index] for part, index in zip(PARTS, combo)]
+    question = ' '.join(text for text, _ in chosen if text).format(**values) + '?'
+    metric = chosen[4][1]
+    sql = (f"SELECT COUNT(*) FROM videos WHERE {metric}{chosen[3][1]}{chosen[2][1]}{chosen[5][1]}{chosen[6][1]}"
+           .format(**values))
+    return question, sql
+
+
+def meaning(combo: Combo) -> tuple:
+    pieces = tuple(part[index][1] for part, index in zip(PARTS, combo))
+    return pieces + ((combo[-1],) if '{m}' in ''.join(pieces) else ())
+
+
+def random_combo(rnd: random.Random) -> Combo:
+    # Последний элемент — месяц: название месяца входит в шаблон вопроса
+    return tuple(rnd.randrange(len(part)) for part in PARTS) + (rnd.randrange(12),)
+
+
+def perturb(question: str, rnd: random.Random) -> str:
+    words = question.rstrip('?').split()
+    if rnd.random() < 0.5:
+        words.insert(rnd.randrange(len(words) + 1), rnd.choice(FILLERS))
+    else:
+        # Опечатка: пропущенная буква в длинном слове без цифр
+        candidates = [i for i, w in enumerate(words) if len(w) >= 7 and w.isalpha()]
+        if candidates:
+            i = rnd.choice(candidates)
+            position = rnd.randrange(1, len(words[i]) - 1)
+            words[i] = words[i][:position] + words[i][position + 1:]
+    return ' '.join(words) + '?'
+
+
+def build(entries: int, rnd: random.Random) -> Tuple[FewShotMemory, List[Combo], float]:
+    memory = FewShotMemory()
+    stored: Dict[Combo, None] = {}
+    started = time.perf_counter()
+    while len(stored) < entries:
+        combo = random_combo(rnd)
+        if combo in stored:
+            continue
+        stored[combo] = None
+        memory.add(*render(combo, rnd))
+    return memory, list(stored), time.perf_counter() - started
+
+
+def make_queries(stored: List[Combo], count: int, rnd: random.Random) -> Dict[str, List[Tuple[str, str]]]:
+    known = set(stored)
+    meanings = {meaning(combo) for combo in stored}
+    queries = {'exact': [], 'typo': [], 'changed': [], 'novel': []}
+    for _ in range(count):
+        combo = rnd.choice(stored)
+        queries['exact'].append(render(combo, rnd))
+        question, sql = render(combo, rnd)
+        queries['typo'].append((perturb(question, rnd), sql))
+
+    while len(queries['changed']) < count or len(queries['novel']) < count:
+        combo = random_combo(rnd)
+        if combo in known:
+            continue
+        if meaning(combo) not in meanings and len(queries['changed']) < count:
+            queries['changed'].append(render(combo, rnd))
+        elif len(queries['novel']) < count:
+            queries['novel'].append(render(combo, rnd))
+    return queries
+
+
+def run_queries(memory: FewShotMemory, queries: List[Tuple[str, str]]) -> dict:
+    latencies, reused, correct, with_examples = [], 0, 0, 0
+    for question, expected in queries:
+        started = time.perf_counter()
+        match = memory.lookup(question)
+        latencies.append(time.perf_counter() - started)
+        if match.sql:
+            reused += 1
+            correct += match.sql == expected
+        with_examples += bool(match.examples)
+    latency = summary(latencies)
+    return {
+        'reused': round(reused / len(queries), 3),
+        'correct': round(correct / reused, 3) if reused else None,
+        'with_examples': round(with_examples / len(queries), 3),
+        **{key: round(latency[f'{key}_ms'] * 1000) for key in ('p50', 'p95', 'p99')},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=100_000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    memory, stored, build_seconds = build(args.entries, rnd)
+    stats = memory.stats()
+    print(f"Пар: {stats['entries']}, шаблонов: {stats['templates']}, построение индекса: {build_seconds:.1f} с")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'memory.jsonl'
+        memory.path = path
+        memory.compact()
+        memory.path = None
+        started = time.perf_counter()
+        loaded = FewShotMemory(path=path)
+        print(f"Загрузка из JSONL ({path.stat().st_size / 2 ** 20:.1f} МБ): "
+              f"{time.perf_counter() - started:.1f} с, пар: {len(loaded)}")
+
+    queries = make_queries(stored, args.queries, rnd)
+    print(f"\n{'вид':<9}{'из памяти':>11}{'верных':>9}{'с примерами':>13}{'p50, мкс':>10}{'p95, мкс':>10}"
+          f"{'p99, мкс':>10}")
+    for kind, items in queries.items():
+        r = run_queries(memory, items)
+        correct = f"{r['correct']:.1%}" if r['correct'] is not None else '-'
+        print(f"{kind:<9}{r['reused']:>11.1%}{correct:>9}{r['with_examples']:>13.1%}"
+              f"{r['p50']:>10}{r['p95']:>10}{r['p99']:>10}")
+
+
+if __name__ == '__main__':
+    main()
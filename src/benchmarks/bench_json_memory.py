@@ -0,0 +1,62 @@
+"""Пиковая память (RSS) при чтении выгрузки: json.load против потокового iter_videos
+
+Каждое измерение идет в отдельном процессе, чтобы ru_maxrss не накапливался.
+Запуск: python -m src.benchmarks.bench_json_memory --sizes 2000 8000 32000
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from src.benchmarks.synthetic import write_videos_json
+
+
+def _child(mode: str, path: str):
+    count = 0
+    if mode == 'json.load':
+        with open(path, 'r', encoding='utf-8') as f:
+            count = len(json.load(f)['videos'])
+    else:
+        from src.services.data_loader.json_stream import iter_videos
+        for _ in iter_videos(Path(path)):
+            count += 1
+    # На Linux ru_maxrss в килобайтах
+    print(json.dumps({'count': count, 'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+
+
+def _measure(mode: str, path: Path) -> dict:
+    out = subprocess.run(
+        [sys.executable, '-m', 'src.benchmarks.bench_json_memory', '--child', mode, str(path)],
+        check=True, capture_output=True, text=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2000, 8000, 32000], help="количество видео")
+    parser.add_argument('--snapshots', type=int, default=20, help="снапшотов на видео")
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(*args.child)
+        return
+
+    print(f"{'видео':>8} {'размер, МБ':>11} {'json.load, МБ':>14} {'iter_videos, МБ':>16}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            path = write_videos_json(Path(tmp) / f'videos_{n}.json', n, args.snapshots)
+            size_mb = path.stat().st_size / 1024 / 1024
+            full = _measure('json.load', path)
+            stream = _measure('stream', path)
+            assert full['count'] == stream['count'] == n
+            print(f"{n:>8} {size_mb:>11.1f} {full['maxrss_kb'] / 1024:>14.1f} {stream['maxrss_kb'] / 1024:>16.1f}")
+            path.unlink()
+
+
+if __name__ == '__main__':
+    main()
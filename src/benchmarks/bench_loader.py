@@ -0,0 +1,101 @@
+"""Сравнение пропускной способности построчной и bulk (COPY) загрузки
+
+Запуск: python -m src.benchmarks.bench_loader --videos 2000 --snapshots 20 [--incremental]
+Внимание: бенчмарк очищает таблицы videos/snapshots в БД из .env.
+
+--incremental дополнительно замеряет инкрементальный режим после полной загрузки:
+первый проход (хеши видео еще не записаны), повтор того же файла и файл,
+в котором изменена доля видео --changed.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+from src.db.database import init_db
+from src.services.data_loader.incremental import load_incremental
+from src.services.data_loader.loader_service import clear_existing_data, load_videos_from_json
+from src.benchmarks.synthetic import generate_videos, write_videos_json
+
+
+async def _run(json_path: Path, bulk: bool, batch_size: int) -> dict:
+    await clear_existing_data()
+    started = time.perf_counter()
+    stats = await load_videos_from_json(json_path, bulk=bulk, batch_size=batch_size)
+    elapsed = time.perf_counter() - started
+    return {
+        'mode': 'bulk' if bulk else 'row',
+        'seconds': round(elapsed, 3),
+        'videos_per_sec': round(stats['videos'] / elapsed, 1),
+        'snapshots_per_sec': round(stats['snapshots'] / elapsed, 1),
+        **stats,
+    }
+
+
+def _write_changed(path: Path, n_videos: int, snapshots: int, share: float) -> Path:
+    """Та же выгрузка, в которой у доли видео выросли просмотры и добавился снапшот"""
+    step = max(1, round(1 / share)) if share else 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"videos": [')
+        for i, video in enumerate(generate_videos(n_videos, snapshots)):
+            if step and i % step == 0:
+                video['views_count'] += 100
+                video['snapshots'].append(dict(video['snapshots'][-1], id=f"extra{i}", delta_views_count=100))
+            f.write((',' if i else '') + json.dumps(video, ensure_ascii=False))
+        f.write(']}')
+    return path
+
+
+async def _run_incremental(json_path: Path, batch_size: int, label: str) -> dict:
+    started = time.perf_counter()
+    stats = await load_incremental(json_path, batch_size=batch_size)
+    elapsed = time.perf_counter() - started
+    return {'mode': label, 'seconds': round(elapsed, 3), **stats}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--videos', type=int, default=1000)
+    parser.add_argument('--snapshots', type=int, default=20, help="снапшотов на видео")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--skip-row', action='store_true', help="не запускать медленный построчный режим")
+    parser.add_argument('--incremental', action='store_true', help="замерить инкрементальный режим")
+    parser.add_argument('--changed', type=float, default=0.01, help="доля измененных видео для --incremental")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    await init_db()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = write_videos_json(Path(tmp) / 'videos.json', args.videos, args.snapshots)
+
+        results = []
+        if not args.skip_row:
+            results.append(await _run(json_path, bulk=False, batch_size=args.batch_size))
+        results.append(await _run(json_path, bulk=True, batch_size=args.batch_size))
+
+        incremental = []
+        if args.incremental:
+            incremental.append(await _run_incremental(json_path, args.batch_size, 'первый проход'))
+            incremental.append(await _run_incremental(json_path, args.batch_size, 'тот же файл'))
+            changed_path = _write_changed(Path(tmp) / 'changed.json', args.videos, args.snapshots, args.changed)
+            incremental.append(await _run_incremental(changed_path, args.batch_size, f'изменено {args.changed:.0%}'))
+
+    for r in results:
+        print(f"{r['mode']:>5}: {r['seconds']:>8} c  {r['videos_per_sec']:>10} видео/с  "
+              f"{r['snapshots_per_sec']:>12} снапшотов/с  ошибок: {r['errors']}")
+    if len(results) == 2:
+        print(f"Ускорение bulk: x{results[0]['seconds'] / results[1]['seconds']:.1f}")
+
+    if incremental:
+        print("\nИнкрементальный режим после полной загрузки:")
+    for r in incremental:
+        print(f"{r['mode']:>16}: {r['seconds']:>8} c  записано видео {r['videos']:>7}, снапшотов {r['snapshots']:>8}; "
+              f"без изменений видео {r['skipped_videos']:>7}, снапшотов {r['skipped_snapshots']:>8}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
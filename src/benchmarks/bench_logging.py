@@ -0,0 +1,124 @@
+"""Задержка логирования в цикле событий: обработчики напрямую против очереди
+
+--tasks корутин обрабатывают по --requests "запросов" с общей частотой
+--rate запросов в секунду; на запрос пишется
+столько же записей, сколько в боте (получен запрос, SQL, ответ), и --echo
+строк эха SQL от sqlalchemy.engine. Логи идут через setup_logging в файл с
+ротацией и в "stdout" — временный файл; --slow-io-ms добавляет задержку к
+каждой записи в stdout (медленный диск или переполненный канал логов
+контейнера). Для каждого режима — время вызова logger.info в цикле событий
+(p50/p99/макс.), задержка цикла событий (насколько опаздывает таймер 1 мс),
+общее время и сколько строк записано.
+
+Запуск: python -m src.benchmarks.bench_logging --tasks 50 --rate 500 --echo 6 --slow-io-ms 0.2
+"""
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+from src.benchmarks.reporting import summary
+from src.config.logs_config import setup_logging, stop_logging
+
+MODES = [
+    ('напрямую', dict(use_queue=False, sampled_loggers=())),
+    ('очередь', dict(use_queue=True, sampled_loggers=())),
+    ('очередь+выборка', dict(use_queue=True, sampled_loggers=('sqlalchemy.engine',))),
+]
+
+
+class SlowStream:
+    """Поток, каждая запись в который занимает delay секунд"""
+
+    def __init__(self, stream, delay: float):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, data: str):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+
+async def run_mode(args, options: dict, directory: Path) -> dict:
+    stdout = open(directory / 'stdout.log', 'w', encoding='utf-8')
+    setup_logging('INFO', str(directory / 'bot.log'), json_format=args.json, sample_rate=args.sample_rate,
+                  stream=SlowStream(stdout, args.slow_io_ms / 1000), **options)
+    app_logger = logging.getLogger('src.bot.handlers.handlers')
+    echo_logger = logging.getLogger('sqlalchemy.engine.Engine')
+    # Как при DB_ECHO=true: SQLAlchemy при импорте ставит своим логгерам WARNING
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
+    calls, lags = [], []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - started - 0.001)
+
+    def log(logger, message, *values):
+        started = time.perf_counter()
+        logger.info(message, *values)
+        calls.append(time.perf_counter() - started)
+
+    async def worker(number: int):
+        interval = args.tasks / args.rate
+        await asyncio.sleep(interval * number / args.tasks)
+        for request in range(args.requests):
+            next_at = time.perf_counter() + interval
+            log(app_logger, 'Получен запрос Сколько видео у креатора %s набрали больше %d просмотров?',
+                f'{number:032x}', request)
+            for line in range(args.echo):
+                log(echo_logger, 'SELECT count(*) FROM videos WHERE creator_id = $%d::VARCHAR', line)
+            await asyncio.sleep(0)
+            log(app_logger, 'Сгенерирован SQL: SELECT COUNT(*) FROM videos WHERE views_count > %d', request)
+            await asyncio.sleep(0)
+            log(app_logger, 'Ответ отправлен: %d', request)
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+    tick = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(args.tasks)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await tick
+
+    stop_logging()
+    stdout.close()
+    written = sum(1 for _ in open(directory / 'bot.log', encoding='utf-8'))
+    for path in directory.iterdir():
+        path.unlink()
+    # Вызовы — в микросекундах: summary округляет миллисекунды до трех знаков
+    return {'seconds': elapsed, 'calls_us': summary([c * 1000 for c in calls]), 'lag': summary(lags),
+            'written': written}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=40)
+    parser.add_argument('--rate', type=float, default=500, help="запросов в секунду всего")
+    parser.add_argument('--echo', type=int, default=6, help="строк эха SQL на запрос")
+    parser.add_argument('--slow-io-ms', type=float, default=0.0)
+    parser.add_argument('--sample-rate', type=float, default=10.0)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    print(f"{'режим':<17}{'вызов p50, мкс':>15}{'p99, мкс':>10}{'макс., мс':>11}{'лаг p99, мс':>13}"
+          f"{'время, с':>10}{'строк':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, options in MODES:
+            r = await run_mode(args, options, Path(tmp))
+            calls = r['calls_us']
+            print(f"{name:<17}{calls['p50_ms']:>15.1f}{calls['p99_ms']:>10.1f}{calls['max_ms'] / 1000:>11.1f}"
+                  f"{r['lag']['p99_ms']:>13.1f}{r['seconds']:>10.2f}{r['written']:>9}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
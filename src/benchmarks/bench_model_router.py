@@ -0,0 +1,77 @@
+"""Хвост задержки LLM: одна модель против ModelRouter с дублирующими запросами
+
+Обе модели — заглушки (stubs.StubModel) с тяжелым хвостом: доля --slow-rate
+вызовов "зависает" на --slow-latency секунд. Запросы идут через
+YandexMLGPTQueryService (очистка и проверка SQL настоящие) без кэшей и
+планировщика, --concurrency одновременно. Для каждого режима — p50/p95/p99
+задержки, доля дублирующих запросов (дополнительная нагрузка на API) и
+ответов без SQL.
+
+Запуск: python -m src.benchmarks.bench_model_router --requests 1000 --slow-rate 0.05
+"""
+import argparse
+import asyncio
+import time
+
+from src.benchmarks.reporting import summary
+from src.benchmarks.stubs import StubModel, StubSDK
+from src.llm_service.llm_service import YandexGPTConfig, YandexMLGPTQueryService
+
+SQL = "SELECT COUNT(*) FROM videos WHERE views_count > {n}"
+
+
+async def run_mode(args, models: str) -> dict:
+    answers = {f'Сколько видео набрали больше {n} просмотров?': SQL.format(n=n) for n in range(args.requests)}
+    stubs = {
+        'lite': StubModel(answers, latency=args.lite_latency, jitter=0.3, slow_rate=args.slow_rate,
+                          slow_latency=args.slow_latency, seed=args.seed),
+        'pro': StubModel(answers, latency=args.pro_latency, jitter=0.3, slow_rate=args.slow_rate,
+                         slow_latency=args.slow_latency, seed=args.seed + 1),
+    }
+    service = YandexMLGPTQueryService(YandexGPTConfig(api_key='bench', folder_id='bench', model=models),
+                                      sdk=StubSDK(stubs))
+    service.router.attempt_timeout = args.attempt_timeout
+    slots = asyncio.Semaphore(args.concurrency)
+    latencies, failures = [], 0
+
+    async def one(question: str):
+        nonlocal failures
+        async with slots:
+            started = time.perf_counter()
+            try:
+                sql = await service.text_to_sql(question)
+            except asyncio.TimeoutError:
+                sql = None
+            latencies.append(time.perf_counter() - started)
+            failures += sql is None
+
+    await asyncio.gather(*(one(question) for question in answers))
+    router = service.router.stats()
+    return {
+        'mode': models, 'failed': failures / args.requests,
+        'hedge_rate': router['hedges'] / args.requests, 'calls': sum(s.calls for s in stubs.values()),
+        **summary(latencies),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--lite-latency', type=float, default=0.05)
+    parser.add_argument('--pro-latency', type=float, default=0.1)
+    parser.add_argument('--slow-rate', type=float, default=0.05)
+    parser.add_argument('--slow-latency', type=float, default=2.0)
+    parser.add_argument('--attempt-timeout', type=float, default=15.0)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'модели':<12}{'вызовов':>9}{'дублей':>8}{'без SQL':>9}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for models in ('lite', 'lite,pro'):
+        r = await run_mode(args, models)
+        print(f"{r['mode']:<12}{r['calls']:>9}{r['hedge_rate']:>8.1%}{r['failed']:>9.1%}"
+              f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
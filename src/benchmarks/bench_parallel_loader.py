@@ -0,0 +1,73 @@
+"""Масштабирование параллельной загрузки по числу процессов и соединений
+
+Запуск: python -m src.benchmarks.bench_parallel_loader --videos 20000 --snapshots 20 --workers 1,2,4 [--ndjson]
+Внимание: бенчмарк очищает таблицы videos/snapshots в БД из .env.
+
+Базовая линия — последовательный bulk-режим (разбор и запись в одном
+процессе, агрегаты по пакетам). Затем для каждого значения из --workers
+выполняется конвейер parallel_loader с тем же числом соединений записи.
+В NDJSON строки декодируются в процессах пула; JSON-документ разбирается
+читающим потоком, а в пул уходит только приведение типов.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from src.db.database import init_db
+from src.services.data_loader.loader_service import clear_existing_data, load_videos_from_json
+from src.services.data_loader.parallel_loader import parallel_load_videos
+from src.benchmarks.synthetic import write_videos_json, write_videos_ndjson
+
+
+async def _run(json_path: Path, batch_size: int, workers: int = 0) -> dict:
+    await clear_existing_data()
+    stats = {'videos': 0, 'snapshots': 0, 'errors': 0}
+    started = time.perf_counter()
+    if workers:
+        await parallel_load_videos(json_path, stats, batch_size=batch_size, workers=workers)
+    else:
+        stats = await load_videos_from_json(json_path, bulk=True, batch_size=batch_size)
+    elapsed = time.perf_counter() - started
+    return {
+        'mode': f'workers={workers}' if workers else 'bulk',
+        'seconds': round(elapsed, 3),
+        'snapshots_per_sec': round(stats['snapshots'] / elapsed, 1),
+        **stats,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--videos', type=int, default=10000)
+    parser.add_argument('--snapshots', type=int, default=20, help="снапшотов на видео")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', default='1,2,4', help="значения через запятую")
+    parser.add_argument('--ndjson', action='store_true', help="выгрузка в NDJSON вместо JSON-документа")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    await init_db()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.ndjson:
+            json_path = write_videos_ndjson(Path(tmp) / 'videos.ndjson', args.videos, args.snapshots)
+        else:
+            json_path = write_videos_json(Path(tmp) / 'videos.json', args.videos, args.snapshots)
+
+        results = [await _run(json_path, args.batch_size)]
+        for workers in (int(w) for w in args.workers.split(',')):
+            results.append(await _run(json_path, args.batch_size, workers))
+
+    print(f"Ядер: {os.cpu_count()}, формат: {'NDJSON' if args.ndjson else 'JSON'}")
+    baseline = results[0]['seconds']
+    for r in results:
+        print(f"{r['mode']:>10}: {r['seconds']:>8} c  {r['snapshots_per_sec']:>12} снапшотов/с  "
+              f"x{baseline / r['seconds']:.2f}  ошибок: {r['errors']}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,174 @@
+"""Секционированная по месяцам таблица снапшотов против одной таблицы
+
+Запуск: python -m src.benchmarks.bench_partitions --rows 5000000 --months 12
+Бенчмарк создает собственные таблицы bench_snapshots_flat/bench_snapshots_part
+и удаляет их в конце; рабочие таблицы не трогаются.
+
+Сравниваются: запросы за день и за месяц (и сколько секций попало в план),
+DATE(created_at) = ... до и после make_sargable, VACUUM после обновления части
+строк последнего месяца и удаление самого старого месяца (DELETE против DETACH + DROP).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+from datetime import date
+
+from src.db.database import async_engine
+from src.db.partitions import next_month
+from src.db.query_router import make_sargable
+
+FLAT = 'bench_snapshots_flat'
+PART = 'bench_snapshots_part'
+
+COLUMNS_DDL = (
+    "id bigint NOT NULL, video_id varchar NOT NULL, delta_views_count integer, "
+    "views_count integer, created_at timestamp NOT NULL"
+)
+
+FILL_SQL = """
+INSERT INTO {table} (id, video_id, delta_views_count, views_count, created_at)
+SELECT i, 'v' || (i % 20000), (random() * 200)::int - 20, (random() * 100000)::int,
+       timestamp '{start}' + ((i - 1)::float / {rows}) * (timestamp '{end}' - timestamp '{start}')
+FROM generate_series(1, {rows}) AS i
+"""
+
+
+def _month(start: date, offset: int) -> date:
+    month = start
+    for _ in range(offset):
+        month = next_month(month)
+    return month
+
+
+async def _setup(pg_conn, rows: int, start: date, months: int):
+    end = _month(start, months)
+    for table in (FLAT, PART):
+        await pg_conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+    await pg_conn.execute(f"CREATE TABLE {FLAT} ({COLUMNS_DDL}, PRIMARY KEY (id, created_at))")
+    await pg_conn.execute(
+        f"CREATE TABLE {PART} ({COLUMNS_DDL}, PRIMARY KEY (id, created_at)) PARTITION BY RANGE (created_at)"
+    )
+    for i in range(months):
+        month = _month(start, i)
+        await pg_conn.execute(
+            f"CREATE TABLE {PART}_{month:%Y%m} PARTITION OF {PART} "
+            f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+        )
+
+    for table in (FLAT, PART):
+        # Индексы на секционированной таблице создаются в каждой секции
+        await pg_conn.execute(f"CREATE INDEX ON {table} (created_at)")
+        await pg_conn.execute(f"CREATE INDEX ON {table} (video_id, created_at)")
+        started = time.perf_counter()
+        await pg_conn.execute(FILL_SQL.format(table=table, rows=rows, start=start, end=end))
+        print(f"{table}: заполнение {time.perf_counter() - started:.1f} c")
+        await pg_conn.execute(f"VACUUM ANALYZE {table}")
+
+
+async def _timed(pg_conn, sql: str, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await pg_conn.fetchval(sql)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def _relations(plan: dict) -> set:
+    found = {plan['Relation Name']} if 'Relation Name' in plan else set()
+    for child in plan.get('Plans', []):
+        found |= _relations(child)
+    return found
+
+
+async def _partitions_scanned(pg_conn, sql: str) -> int:
+    raw = await pg_conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}")
+    plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]['Plan']
+    return len(_relations(plan))
+
+
+async def _compare_queries(pg_conn, start: date, months: int, repeat: int):
+    day = _month(start, months - 1).replace(day=15)
+    month = _month(start, months - 2)
+    queries = [
+        ('день', "SELECT COALESCE(SUM(delta_views_count), 0) FROM {t} "
+                 f"WHERE created_at >= '{day}' AND created_at < '{day.replace(day=16)}'"),
+        ('месяц', "SELECT COALESCE(SUM(delta_views_count), 0) FROM {t} "
+                  f"WHERE created_at >= '{month}' AND created_at < '{next_month(month)}'"),
+        ('DATE() =', "SELECT COUNT(*) FROM {t} WHERE DATE(created_at) = " f"'{day}'"),
+        ('DATE() → диапазон', make_sargable("SELECT COUNT(*) FROM {t} WHERE DATE(created_at) = " f"'{day}'")),
+    ]
+    print(f"\n{'запрос':<20}{'одна таблица, мс':>18}{'секции, мс':>14}{'секций в плане':>17}")
+    for name, template in queries:
+        flat = await _timed(pg_conn, template.format(t=FLAT), repeat)
+        part = await _timed(pg_conn, template.format(t=PART), repeat)
+        scanned = await _partitions_scanned(pg_conn, template.format(t=PART))
+        print(f"{name:<20}{flat * 1000:>18.1f}{part * 1000:>14.1f}{scanned:>11}/{months}")
+
+
+async def _compare_maintenance(pg_conn, start: date, months: int, update_share: float):
+    last = _month(start, months - 1)
+    for table in (FLAT, PART):
+        # Повторная загрузка свежих данных: обновление части строк последнего месяца
+        await pg_conn.execute(
+            f"UPDATE {table} SET views_count = views_count + 1 "
+            f"WHERE created_at >= '{last}' AND random() < {update_share}"
+        )
+
+    started = time.perf_counter()
+    await pg_conn.execute(f"VACUUM {FLAT}")
+    flat_vacuum = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await pg_conn.execute(f"VACUUM {PART}_{last:%Y%m}")
+    part_vacuum = time.perf_counter() - started
+
+    print(f"\nVACUUM после обновления {update_share:.0%} строк последнего месяца:")
+    print(f"  одна таблица целиком:     {flat_vacuum * 1000:>9.1f} мс")
+    print(f"  только секция {last:%Y-%m}:   {part_vacuum * 1000:>9.1f} мс")
+
+    started = time.perf_counter()
+    await pg_conn.execute(f"DELETE FROM {FLAT} WHERE created_at < '{next_month(start)}'")
+    flat_delete = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await pg_conn.execute(f"ALTER TABLE {PART} DETACH PARTITION {PART}_{start:%Y%m}")
+    await pg_conn.execute(f"DROP TABLE {PART}_{start:%Y%m}")
+    part_drop = time.perf_counter() - started
+
+    print(f"Удаление месяца {start:%Y-%m}:")
+    print(f"  DELETE из одной таблицы:  {flat_delete * 1000:>9.1f} мс (плюс последующий VACUUM)")
+    print(f"  DETACH + DROP секции:     {part_drop * 1000:>9.1f} мс")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5_000_000)
+    parser.add_argument('--months', type=int, default=12)
+    parser.add_argument('--start', type=lambda v: date.fromisoformat(v + '-01'), default=date(2025, 1, 1),
+                        help="первый месяц, ГГГГ-ММ")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--update-share', type=float, default=0.2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    async with async_engine.connect() as conn:
+        # Без транзакции: VACUUM нельзя выполнять внутри нее
+        pg_conn = (await conn.get_raw_connection()).driver_connection
+        try:
+            await _setup(pg_conn, args.rows, args.start, args.months)
+            await _compare_queries(pg_conn, args.start, args.months, args.repeat)
+            await _compare_maintenance(pg_conn, args.start, args.months, args.update_share)
+        finally:
+            for table in (FLAT, PART):
+                await pg_conn.execute(f"DROP TABLE IF EXISTS {table}")
+    await async_engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""Подготовленные операторы по отпечатку против литерального SQL
+
+Запуск: python -m src.benchmarks.bench_prepared --queries 2000
+Запросы одной формы с разными датами и порогами (как генерирует LLM)
+выполняются через песочницу с SANDBOX_PREPARED_STATEMENTS и без него,
+с проверкой стоимости по EXPLAIN и без нее. Читает рабочие таблицы.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from src.db.sandbox import ResourceClass, SQLSandbox
+
+SHAPES = [
+    "SELECT COUNT(DISTINCT video_id) FROM snapshots WHERE created_at >= '{day}' AND created_at < '{next_day}' "
+    "AND delta_views_count > {threshold}",
+    "SELECT COUNT(*) FROM videos WHERE views_count > {threshold} AND video_created_at >= '{day}'",
+    "SELECT COALESCE(SUM(delta_views_count), 0) FROM snapshots WHERE created_at >= '{day} 10:00:00' "
+    "AND created_at < '{day} 15:00:00' AND video_id IN (SELECT video_id FROM videos WHERE creator_id = '{creator}')",
+]
+
+
+def _queries(count: int, seed: int = 1):
+    rng = random.Random(seed)
+    start = date(2025, 11, 1)
+    for _ in range(count):
+        day = start + timedelta(days=rng.randrange(60))
+        yield rng.choice(SHAPES).format(
+            day=day, next_day=day + timedelta(days=1),
+            threshold=rng.randrange(10000), creator=f'creator_{rng.randrange(500)}',
+        )
+
+
+async def _run(queries, prepared: bool, max_cost: float, concurrency: int):
+    sandbox = SQLSandbox(classes={'interactive': ResourceClass(10000, '16MB', max_cost)},
+                         prepared_statements=prepared)
+    timings = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(sql):
+        async with semaphore:
+            started = time.perf_counter()
+            await sandbox.fetch_one(sql)
+            timings.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(sql) for sql in queries))
+    elapsed = time.perf_counter() - started
+    stats = sandbox.stats()
+    await sandbox.close()
+    return elapsed, timings, stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--max-cost', type=float, default=1e12,
+                        help="порог стоимости для варианта с EXPLAIN (большой — только сама проверка)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    queries = list(_queries(args.queries))
+
+    print(f"{'вариант':<34}{'запросов/с':>12}{'p50, мс':>10}{'p95, мс':>10}{'с параметрами':>16}"
+          f"{'попадания в кэш':>18}")
+    for prepared in (False, True):
+        for max_cost in (0, args.max_cost):
+            elapsed, timings, stats = await _run(queries, prepared, max_cost, args.concurrency)
+            timings.sort()
+            name = ('подготовленные' if prepared else 'литералы') + (', с EXPLAIN' if max_cost else '')
+            share = f"{stats['parameterized'] / stats['executed']:.1%}" if prepared else '—'
+            hit_rate = f"{stats['plan_cache_hit_rate']:.1%}" if prepared else '—'
+            print(f"{name:<34}{len(queries) / elapsed:>12.0f}{statistics.median(timings) * 1000:>10.2f}"
+                  f"{timings[int(len(timings) * 0.95)] * 1000:>10.2f}{share:>16}{hit_rate:>18}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+"""Размер системного промпта: полный против собранного из фрагментов
+
+На золотом наборе вопросов (golden_questions.json) считается оценка токенов
+системного промпта для полного текста и для PromptBuilder с разными бюджетами,
+а также покрытие — доля вопросов, для которых выбраны все нужные фрагменты
+(поле fragments в наборе). Для этого сеть не нужна.
+
+С --live каждый вопрос отправляется в YandexGPT (ключ из .env) в обоих режимах
+--repeat раз: задержка модели, входные токены из usage и точность — совпадает ли
+результат сгенерированного SQL с результатом эталонного в текущей БД.
+
+Запуск:
+  python -m src.benchmarks.bench_prompt --budgets 1000,1500,2000
+  python -m src.benchmarks.bench_prompt --live --repeat 3
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from pathlib import Path
+from statistics import mean
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from src.benchmarks.reporting import summary
+from src.llm_service.prompt_builder import PromptBuilder, full_prompt_tokens
+
+GOLDEN_PATH = Path(__file__).with_name('golden_questions.json')
+
+
+def load_golden(path: Path = GOLDEN_PATH) -> List[dict]:
+    """Вопросы золотого набора (общего с eval_sql)"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['items']
+
+
+def measure_sizes(golden: List[dict], builder: PromptBuilder) -> dict:
+    tokens, missed = [], []
+    for item in golden:
+        selection = builder.select(item['question'])
+        tokens.append(selection.tokens)
+        absent = set(item['fragments']) - set(selection.fragment_ids)
+        if absent:
+            missed.append({'question': item['question'], 'missing': sorted(absent)})
+    return {
+        'budget': builder.token_budget,
+        'avg_tokens': round(mean(tokens)),
+        'max_tokens': max(tokens),
+        'coverage': round(1 - len(missed) / len(golden), 3),
+        'missed': missed,
+    }
+
+
+async def _run_sql(sql: Optional[str]):
+    from src.db.database import async_engine
+
+    if not sql:
+        return None
+    try:
+        async with async_engine.connect() as conn:
+            return (await conn.execute(text(sql))).first()
+    except Exception as e:
+        return f'ошибка: {e}'
+
+
+async def measure_live(golden: List[dict], builder: PromptBuilder, repeat: int) -> List[dict]:
+    from src.db.database import async_engine
+    from src.llm_service.llm_service import YandexGPTConfig, YandexMLGPTQueryService, llm_tokens
+
+    service = YandexMLGPTQueryService(YandexGPTConfig())
+    results = []
+    try:
+        for mode, prompt_builder in (('full', None), ('retrieval', builder)):
+            service.prompt_builder = prompt_builder
+            latencies, correct, input_tokens = [], 0, []
+            for item in golden:
+                expected = await _run_sql(item['sql'])
+                for _ in range(repeat):
+                    before = llm_tokens.value(kind='input')
+                    started = time.perf_counter()
+                    sql = await service.text_to_sql(item['question'])
+                    latencies.append(time.perf_counter() - started)
+                    input_tokens.append(llm_tokens.value(kind='input') - before)
+                    correct += sql is not None and await _run_sql(sql) == expected
+            results.append({
+                'mode': mode, 'avg_input_tokens': round(mean(input_tokens)),
+                'accuracy': round(correct / (len(golden) * repeat), 3), **summary(latencies),
+            })
+    finally:
+        await async_engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--golden', type=Path, default=GOLDEN_PATH)
+    parser.add_argument('--budgets', default='1000,1500,2000', help="бюджеты токенов через запятую")
+    parser.add_argument('--max-examples', type=int, default=3)
+    parser.add_argument('--live', action='store_true', help="запросы к YandexGPT и БД")
+    parser.add_argument('--live-budget', type=int, default=1500)
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    golden = load_golden(args.golden)
+    full = full_prompt_tokens()
+    print(f"Вопросов: {len(golden)}, полный промпт: ~{full} токенов")
+    print(f"{'бюджет':>8}{'ср. токенов':>13}{'макс.':>8}{'сокращение':>12}{'покрытие':>10}")
+    for budget in (int(b) for b in args.budgets.split(',')):
+        report = measure_sizes(golden, PromptBuilder(token_budget=budget, max_examples=args.max_examples))
+        print(f"{budget:>8}{report['avg_tokens']:>13}{report['max_tokens']:>8}"
+              f"{1 - report['avg_tokens'] / full:>12.0%}{report['coverage']:>10.0%}")
+        for miss in report['missed']:
+            print(f"    не хватает {', '.join(miss['missing'])}: {miss['question']}")
+
+    if args.live:
+        builder = PromptBuilder(token_budget=args.live_budget, max_examples=args.max_examples)
+        print(f"\n{'режим':<11}{'вход. токенов':>15}{'точность':>10}{'p50, мс':>10}{'p95, мс':>10}")
+        for r in asyncio.run(measure_live(golden, builder, args.repeat)):
+            print(f"{r['mode']:<11}{r['avg_input_tokens']:>15}{r['accuracy']:>10.0%}"
+                  f"{r.get('p50_ms', '-'):>10}{r.get('p95_ms', '-'):>10}")
+
+
+if __name__ == '__main__':
+    main()
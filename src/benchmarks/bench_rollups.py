@@ -0,0 +1,102 @@
+"""Сравнение запросов к snapshots и к часовым/суточным агрегатам
+
+Запуск: python -m src.benchmarks.bench_rollups --snapshots 10000000
+Данные генерируются прямо в БД через generate_series.
+Внимание: бенчмарк очищает таблицы videos/snapshots в БД из .env.
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from sqlalchemy import text
+
+from src.db.database import init_db, get_async_session
+from src.db.query_router import route_to_rollups
+from src.db.rollups import rebuild_rollups
+from src.services.data_loader.loader_service import clear_existing_data
+
+GENERATE_VIDEOS_SQL = """
+INSERT INTO videos (video_id, creator_id, video_created_at, views_count, likes_count,
+                    comments_count, reports_count, created_at, updated_at)
+SELECT 'v' || i, 'c' || (i % :creators), timestamp '2025-08-01' + (i % 90) * interval '1 day',
+       0, 0, 0, 0, now(), now()
+FROM generate_series(1, :videos) AS i
+"""
+
+GENERATE_SNAPSHOTS_SQL = """
+INSERT INTO snapshots (snapshot_id, video_id, views_count, likes_count, comments_count, reports_count,
+                       delta_views_count, delta_likes_count, delta_comments_count, delta_reports_count,
+                       created_at, updated_at)
+SELECT 's' || i, 'v' || (1 + i % :videos), 0, 0, 0, 0,
+       (random() * 200)::int - 20, (random() * 20)::int - 2, (random() * 5)::int, (random() * 2)::int,
+       timestamp '2025-11-01' + (i % (:days * 24 * 60)) * interval '1 minute', now()
+FROM generate_series(1, :snapshots) AS i
+"""
+
+QUERIES = [
+    "SELECT COALESCE(SUM(delta_views_count), 0) FROM snapshots WHERE DATE(created_at) = '2025-11-15'",
+    "SELECT SUM(delta_likes_count) FROM snapshots "
+    "WHERE created_at >= '2025-11-10 10:00:00' AND created_at < '2025-11-10 15:00:00'",
+    "SELECT COALESCE(SUM(delta_views_count), 0) FROM snapshots WHERE created_at >= '2025-11-01' "
+    "AND created_at < '2025-11-20' AND video_id IN (SELECT video_id FROM videos WHERE creator_id = 'c7')",
+    "SELECT COUNT(DISTINCT video_id) FROM snapshots WHERE DATE(created_at) = '2025-11-15' AND delta_views_count < 0",
+    "SELECT COUNT(*) FROM snapshots WHERE created_at >= '2025-11-01' AND created_at < '2025-11-08'",
+]
+
+
+async def _generate(videos: int, snapshots: int, creators: int, days: int):
+    await clear_existing_data()
+    async with get_async_session() as session:
+        await session.execute(text(GENERATE_VIDEOS_SQL), {'videos': videos, 'creators': creators})
+        await session.execute(text(GENERATE_SNAPSHOTS_SQL),
+                              {'videos': videos, 'snapshots': snapshots, 'days': days})
+        await session.execute(text("ANALYZE videos"))
+        await session.execute(text("ANALYZE snapshots"))
+
+
+async def _time(sql: str, repeat: int):
+    timings = []
+    value = None
+    for _ in range(repeat):
+        async with get_async_session() as session:
+            started = time.perf_counter()
+            value = (await session.execute(text(sql))).scalar()
+            timings.append(time.perf_counter() - started)
+    return value, statistics.median(timings)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--snapshots', type=int, default=10_000_000)
+    parser.add_argument('--videos', type=int, default=20_000)
+    parser.add_argument('--creators', type=int, default=200)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-generate', action='store_true', help="использовать уже сгенерированные данные")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    await init_db()
+
+    if not args.skip_generate:
+        started = time.perf_counter()
+        await _generate(args.videos, args.snapshots, args.creators, args.days)
+        print(f"Сгенерировано {args.snapshots} снапшотов за {time.perf_counter() - started:.1f} c")
+
+    started = time.perf_counter()
+    await rebuild_rollups()
+    print(f"Полный пересчет агрегатов: {time.perf_counter() - started:.1f} c")
+
+    for sql in QUERIES:
+        routed = route_to_rollups(sql)
+        raw_value, raw_time = await _time(sql, args.repeat)
+        routed_value, routed_time = await _time(routed, args.repeat)
+        status = 'OK' if raw_value == routed_value else f'РАСХОЖДЕНИЕ ({routed_value})'
+        print(f"{raw_time * 1000:>9.1f} мс → {routed_time * 1000:>7.2f} мс  "
+              f"x{raw_time / routed_time:>7.1f}  {status}  {sql[:70]}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
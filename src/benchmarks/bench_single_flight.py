@@ -0,0 +1,77 @@
+"""Нагрузочный тест схлопывания одинаковых вопросов (single-flight)
+
+Имитирует всплеск: сообщения от многих пользователей приходят одновременно,
+популярные вопросы повторяются. LLM и БД заменены заглушками с задержкой,
+поэтому бенчмарк не требует ни YandexGPT, ни Postgres.
+Запуск: python -m src.benchmarks.bench_single_flight --messages 500 --questions 20
+"""
+import argparse
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+from src.bot.handlers import handlers
+from src.llm_service.llm_service import SQL_FROM_LLM
+
+
+class _FakeMessage:
+    def __init__(self, text: str, user_id: int):
+        self.text = text
+        self.from_user = SimpleNamespace(id=user_id)
+        self.answers = []
+
+    async def answer(self, text: str, **kwargs):
+        self.answers.append(text)
+
+
+async def _run_burst(messages: int, questions: int, llm_latency: float, db_latency: float, seed: int) -> dict:
+    counters = {'llm': 0, 'db': 0}
+
+    async def stub_generate_sql(user_query: str, *args, **kwargs):
+        counters['llm'] += 1
+        await asyncio.sleep(llm_latency)
+        return f"SELECT COUNT(*) FROM videos WHERE views_count > {abs(hash(user_query)) % 100000}", SQL_FROM_LLM
+
+    async def stub_fetch(sql_query: str):
+        counters['db'] += 1
+        await asyncio.sleep(db_latency)
+        return (1,)
+
+    handlers.yc_service.generate_sql = stub_generate_sql
+    handlers._fetch_first_row = stub_fetch
+    handlers.result_cache = None
+
+    rnd = random.Random(seed)
+    # Распределение Ципфа: несколько популярных вопросов и длинный хвост
+    weights = [1 / (rank + 1) for rank in range(questions)]
+    texts = [f"Сколько видео набрали больше просмотров, вопрос №{i}?" for i in range(questions)]
+    burst = [_FakeMessage(rnd.choices(texts, weights)[0], user_id) for user_id in range(messages)]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handlers.handle_text_query(m) for m in burst))
+    elapsed = time.perf_counter() - started
+
+    assert all(m.answers for m in burst)
+    return {'messages': messages, 'llm_calls': counters['llm'], 'db_calls': counters['db'], 'seconds': elapsed}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--questions', type=int, default=20, help="число различных вопросов во всплеске")
+    parser.add_argument('--llm-latency', type=float, default=1.0)
+    parser.add_argument('--db-latency', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    r = await _run_burst(args.messages, args.questions, args.llm_latency, args.db_latency, args.seed)
+    saved = r['messages'] - r['llm_calls']
+    print(f"Сообщений: {r['messages']}, время всплеска: {r['seconds']:.2f} с")
+    print(f"Вызовов LLM: {r['llm_calls']} (сэкономлено {saved}, {saved / r['messages']:.0%})")
+    print(f"Запросов к БД: {r['db_calls']}")
+    print(f"Статистика: question={handlers.question_flight.stats()} sql={handlers.sql_flight.stats()}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
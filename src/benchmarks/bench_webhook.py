@@ -0,0 +1,236 @@
+"""Long polling против webhook: пропускная способность и задержка доставки
+
+Бот работает с локальным Bot API (stubs.FakeTelegram). Генератор создает
+обновления с заданной частотой: в режиме polling они ставятся в очередь
+getUpdates, в режиме webhook отправляются POST-запросами в --connections
+соединений, как это делает Telegram (max_connections). Задержка — от появления
+обновления до sendMessage с ответом. Обработка сообщения заменена заглушками
+(--llm-latency, --db-latency), поэтому сравнивается именно транспорт; ни
+YandexGPT, ни Postgres не нужны.
+
+Запуск: python -m src.benchmarks.bench_webhook --messages 3000 --rate 300 --workers 1,2,4
+Webhook с несколькими процессами слушает один порт (SO_REUSEPORT), как WEBHOOK_WORKERS.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import random
+import socket
+import time
+from datetime import datetime
+from typing import Dict, List
+
+import aiohttp
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from src.benchmarks.bench_e2e import _get_dispatcher
+from src.benchmarks.reporting import summary
+from src.benchmarks.stubs import FakeTelegram
+from src.bot.handlers import handlers
+from src.bot.webhook import create_webhook_app, serve_webhook
+
+WEBHOOK_PATH = '/webhook'
+TOKEN = '42:BENCHMARK'
+
+
+def _install_stub_pipeline(llm_latency: float, db_latency: float, seed: int = 0):
+    """Получение SQL и запрос к БД заменяются задержками со случайным разбросом ±50%"""
+    rnd = random.Random(seed)
+
+    async def generate_sql(user_query: str, user_id=None):
+        await asyncio.sleep(llm_latency * rnd.uniform(0.5, 1.5))
+        return "SELECT COUNT(*) FROM videos", False
+
+    async def execute_sql(sql_query: str):
+        await asyncio.sleep(db_latency * rnd.uniform(0.5, 1.5))
+        return (1,)
+
+    handlers._generate_sql = generate_sql
+    handlers._execute_sql = execute_sql
+
+
+def _make_bot(telegram_url: str) -> Bot:
+    return Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(telegram_url)))
+
+
+def _update(number: int) -> dict:
+    # chat_id совпадает с номером обновления: по нему FakeTelegram сопоставляет ответ
+    user = {'id': number, 'is_bot': False, 'first_name': 'bench'}
+    return {'update_id': number, 'message': {
+        'message_id': number, 'date': int(datetime.now().timestamp()),
+        'chat': {'id': number, 'type': 'private'}, 'from': user,
+        'text': f'Сколько видео набрали больше {number % 1000} просмотров?',
+    }}
+
+
+async def _generate(messages: int, rate: float, deliver, seed: int) -> Dict[int, float]:
+    """Обновления с пуассоновскими интервалами; возвращает время появления каждого"""
+    rnd = random.Random(seed)
+    created = {}
+    scheduled = time.perf_counter()
+    for number in range(1, messages + 1):
+        scheduled += rnd.expovariate(rate)
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        created[number] = time.perf_counter()
+        await deliver(_update(number))
+    return created
+
+
+async def _wait_replies(telegram: FakeTelegram, messages: int, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while len(telegram.replies) < messages and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+
+
+def _result(mode: str, workers, telegram: FakeTelegram, created: Dict[int, float], started: float) -> dict:
+    latencies = [telegram.replies[n] - t for n, t in created.items() if n in telegram.replies]
+    finished = max(telegram.replies.values(), default=started)
+    return {
+        'mode': mode, 'workers': workers, 'messages': len(created), 'answered': len(latencies),
+        'seconds': round(finished - started, 3),
+        'throughput_per_sec': round(len(latencies) / (finished - started), 1) if latencies else 0.0,
+        **summary(latencies),
+    }
+
+
+async def run_polling(args) -> dict:
+    telegram = FakeTelegram()
+    await telegram.start()
+    bot = _make_bot(telegram.base_url)
+    dispatcher = _get_dispatcher()
+    polling = asyncio.create_task(dispatcher.start_polling(
+        bot, handle_signals=False, close_bot_session=False, polling_timeout=10,
+        tasks_concurrency_limit=args.concurrency))
+    try:
+        started = time.perf_counter()
+        created = await _generate(args.messages, args.rate, telegram.push, args.seed)
+        await _wait_replies(telegram, args.messages, args.timeout)
+        return _result('polling', 1, telegram, created, started)
+    finally:
+        await dispatcher.stop_polling()
+        await polling
+        await bot.session.close()
+        await telegram.stop()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def _webhook_worker_main(port: int, telegram_url: str, concurrency: int, llm_latency: float,
+                               db_latency: float, seed: int):
+    _install_stub_pipeline(llm_latency, db_latency, seed)
+    bot = _make_bot(telegram_url)
+    try:
+        app = create_webhook_app(_get_dispatcher(), bot, path=WEBHOOK_PATH, max_concurrent=concurrency,
+                                 shutdown_timeout=5)
+        await serve_webhook(app, '127.0.0.1', port, reuse_port=True)
+    finally:
+        await bot.session.close()
+
+
+def _webhook_worker(*args):
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(_webhook_worker_main(*args))
+
+
+async def _wait_ready(url: str, workers: int, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.perf_counter() < deadline:
+            try:
+                async with session.get(url):
+                    return
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"webhook-процессы ({workers}) не запустились за {timeout} с")
+
+
+async def run_webhook(args, workers: int) -> dict:
+    telegram = FakeTelegram()
+    await telegram.start()
+    port = _free_port()
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_webhook_worker, args=(
+        port, telegram.base_url, args.concurrency, args.llm_latency, args.db_latency, args.seed + n))
+        for n in range(workers)]
+    for process in processes:
+        process.start()
+
+    queue: asyncio.Queue = asyncio.Queue()
+    url = f'http://127.0.0.1:{port}{WEBHOOK_PATH}'
+    failures = 0
+
+    async def connection():
+        # Как Telegram: одно обновление на запрос, следующий запрос — после ответа
+        nonlocal failures
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=1, force_close=False)) as session:
+            while True:
+                update = await queue.get()
+                if update is None:
+                    return
+                try:
+                    async with session.post(url, json=update) as response:
+                        await response.read()
+                        failures += response.status != 200
+                except aiohttp.ClientError:
+                    failures += 1
+
+    try:
+        await _wait_ready(f'http://127.0.0.1:{port}/health', workers)
+        senders = [asyncio.create_task(connection()) for _ in range(args.connections)]
+        started = time.perf_counter()
+        created = await _generate(args.messages, args.rate, queue.put, args.seed)
+        for _ in senders:
+            await queue.put(None)
+        await asyncio.gather(*senders)
+        await _wait_replies(telegram, args.messages, args.timeout)
+        result = _result('webhook', workers, telegram, created, started)
+        result['http_failures'] = failures
+        return result
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            await asyncio.to_thread(process.join, 10)
+        await telegram.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=200, help="обновлений в секунду")
+    parser.add_argument('--workers', default='1,2', help="числа webhook-процессов через запятую")
+    parser.add_argument('--connections', type=int, default=40, help="соединений Telegram с webhook")
+    parser.add_argument('--concurrency', type=int, default=100, help="одновременных обновлений в процессе")
+    parser.add_argument('--llm-latency', type=float, default=0.2)
+    parser.add_argument('--db-latency', type=float, default=0.01)
+    parser.add_argument('--timeout', type=float, default=60, help="ожидание последних ответов, с")
+    parser.add_argument('--skip-polling', action='store_true')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    _install_stub_pipeline(args.llm_latency, args.db_latency, args.seed)
+
+    results: List[dict] = []
+    if not args.skip_polling:
+        results.append(await run_polling(args))
+    for workers in (int(w) for w in args.workers.split(',')):
+        results.append(await run_webhook(args, workers))
+
+    print(f"{'режим':<9}{'проц.':>6}{'ответов':>9}{'сообщ./с':>10}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for r in results:
+        print(f"{r['mode']:<9}{r['workers']:>6}{r['answered']:>9}{r['throughput_per_sec']:>10}"
+              f"{r.get('p50_ms', '-'):>10}{r.get('p95_ms', '-'):>10}{r.get('p99_ms', '-'):>10}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,344 @@
+"""Оценка text-to-SQL на золотом наборе: точность ответов, задержки стадий, токены промпта
+
+Вопросы из golden_questions.json с ожидаемыми числами проходят тот же путь, что в
+боте: системный промпт (полный или PromptBuilder), модель, очистка и проверка
+SQL, выполнение в Postgres. Ответ верный, если число совпало с ожидаемым так,
+как его показывает бот (целая часть). В БД должна быть синтетика из поля dataset
+набора: --seed-db очищает таблицы и загружает ее.
+
+Режимы:
+  record — запросы к YandexGPT (ключ из .env), сырые ответы модели с задержкой
+           и токенами записываются в кассету;
+  replay — ответы берутся из кассеты, сеть не нужна. Ключ записи — модель и
+           сообщения целиком, поэтому после изменения промпта вопросы без записи
+           отмечаются как cassette_miss — нужна новая запись.
+Задержка стадии model — записанная задержка модели (в replay не ожидается,
+с --replay-latency — выдерживается), остальные стадии замеряются в прогоне.
+
+Запуск:
+  python -m src.benchmarks.eval_sql record --cassette eval.cassette.json --output eval.json
+  python -m src.benchmarks.eval_sql replay --cassette eval.cassette.json --output new.json --baseline eval.json
+  python -m src.benchmarks.eval_sql replay --cassette eval.cassette.json --refresh-answers   # ответы эталонным SQL
+С --baseline выводится сравнение; если какой-то вопрос перестал решаться, код выхода 1.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from statistics import mean
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from src.benchmarks.reporting import git_commit, summary
+from src.benchmarks.stubs import StubSDK
+from src.config.config import settings
+from src.llm_service.llm_service import YandexGPTConfig, YandexMLGPTQueryService
+from src.llm_service.prompt_builder import PromptBuilder, selection_for
+
+logger = logging.getLogger(__name__)
+
+GOLDEN_PATH = Path(__file__).with_name('golden_questions.json')
+
+
+def load_golden(path: Path = GOLDEN_PATH) -> dict:
+    """Золотой набор: dataset — синтетика для ответов, items — вопрос, эталонный SQL,
+    нужные фрагменты промпта (bench_prompt) и ожидаемый ответ"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_golden(golden: dict, path: Path = GOLDEN_PATH):
+    # Вопрос на строке, SQL на следующей, фрагменты и ответ на третьей — чтобы изменения набора читались в diff
+    items = ',\n'.join(
+        f'    {{"question": {json.dumps(item["question"], ensure_ascii=False)},\n'
+        f'     "sql": {json.dumps(item["sql"], ensure_ascii=False)},\n'
+        f'     "fragments": {json.dumps(item.get("fragments", []))}, "answer": {json.dumps(item.get("answer"))}}}'
+        for item in golden['items'])
+    path.write_text(f'{{\n  "dataset": {json.dumps(golden["dataset"])},\n  "items": [\n{items}\n  ]\n}}\n',
+                    encoding='utf-8')
+
+
+def answer_value(row) -> Optional[int]:
+    """Число, которое увидел бы пользователь, или None"""
+    if not row or row[0] is None:
+        return None
+    return int(row[0])
+
+
+class CassetteMiss(LookupError):
+    """В кассете нет ответа модели на такие сообщения"""
+
+
+class Cassette:
+    """Записанные ответы модели: ключ — имя модели и сообщения промпта"""
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        if path is not None and path.exists():
+            self.entries = json.loads(path.read_text(encoding='utf-8'))['entries']
+
+    @staticmethod
+    def key(model: str, messages: list) -> str:
+        payload = json.dumps([model, messages], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:20]
+
+    def save(self):
+        self.path.write_text(json.dumps({'entries': self.entries}, ensure_ascii=False, indent=1, sort_keys=True),
+                             encoding='utf-8')
+
+
+class _CassetteModel:
+    def __init__(self, name: str, cassette: Cassette):
+        self.name = name
+        self.cassette = cassette
+        self.last: Optional[dict] = None    # запись последнего вызова
+        self.calls = 0
+        self.misses = 0
+
+
+class RecordingModel(_CassetteModel):
+    """Настоящая модель, ответы которой записываются в кассету"""
+
+    def __init__(self, name: str, model, cassette: Cassette):
+        super().__init__(name, cassette)
+        self.model = model
+
+    async def run(self, messages: list):
+        self.calls += 1
+        started = time.perf_counter()
+        result = await self.model.run(messages)
+        usage = getattr(result, 'usage', None)
+        self.last = self.cassette.entries[Cassette.key(self.name, messages)] = {
+            'model': self.name,
+            'question': messages[-1]['text'],
+            'text': result[0].text if result else '',
+            'latency_s': round(time.perf_counter() - started, 3),
+            'input_tokens': int(getattr(usage, 'input_text_tokens', 0) or 0) or None,
+            'completion_tokens': int(getattr(usage, 'completion_tokens', 0) or 0) or None,
+        }
+        return result
+
+
+class _ReplayResult(list):
+    usage = None
+
+
+class ReplayModel(_CassetteModel):
+    """Ответы из кассеты вместо модели; с latency — с записанной задержкой"""
+
+    def __init__(self, name: str, cassette: Cassette, latency: bool = False):
+        super().__init__(name, cassette)
+        self.latency = latency
+
+    def configure(self, **options) -> 'ReplayModel':
+        return self
+
+    async def run(self, messages: list):
+        self.calls += 1
+        entry = self.cassette.entries.get(Cassette.key(self.name, messages))
+        if entry is None:
+            self.misses += 1
+            raise CassetteMiss(f"нет записи для {self.name}: {messages[-1]['text']}")
+        if self.latency:
+            await asyncio.sleep(entry['latency_s'])
+        self.last = entry
+        result = _ReplayResult([SimpleNamespace(text=entry['text'])])
+        result.usage = SimpleNamespace(input_text_tokens=entry.get('input_tokens'),
+                                       completion_tokens=entry.get('completion_tokens'))
+        return result
+
+
+def make_service(mode: str, cassette: Cassette, model_name: str, prompt_builder: Optional[PromptBuilder] = None,
+                 replay_latency: bool = False, sdk=None) -> Tuple[YandexMLGPTQueryService, _CassetteModel]:
+    """Сервис с одной моделью (без кэшей, памяти и дублирующих запросов) и ее обертка"""
+    config = YandexGPTConfig(model=model_name)
+    if mode == 'replay':
+        model = ReplayModel(model_name, cassette, replay_latency)
+        return YandexMLGPTQueryService(config, prompt_builder=prompt_builder, sdk=StubSDK({model_name: model})), model
+
+    service = YandexMLGPTQueryService(config, prompt_builder=prompt_builder, sdk=sdk)
+    route = service.router.routes[0]
+    route.model = model = RecordingModel(model_name, route.model, cassette)
+    return service, model
+
+
+async def execute_sql(sql: str):
+    from src.db.database import async_engine
+
+    async with async_engine.connect() as conn:
+        return (await conn.execute(text(sql))).first()
+
+
+async def evaluate(items: List[dict], service: YandexMLGPTQueryService, model: _CassetteModel,
+                   execute: Callable[[str], Awaitable] = execute_sql) -> dict:
+    """Прогон вопросов по одному: исход и время каждого, сводка по набору"""
+    results, timings = [], defaultdict(list)
+    for item in items:
+        question, expected = item['question'], item.get('answer')
+        model.last, misses = None, model.misses
+        answer = None
+        started = time.perf_counter()
+        try:
+            sql = await service.text_to_sql(question)
+        except asyncio.TimeoutError:
+            sql = None
+        generated = time.perf_counter()
+        timings['sql'].append(generated - started)
+
+        if sql is None:
+            outcome = 'cassette_miss' if model.misses > misses else 'not_understood'
+        else:
+            try:
+                answer = answer_value(await execute(sql))
+                outcome = 'correct' if answer == expected else 'wrong'
+            except Exception as e:
+                logger.warning(f'Ошибка выполнения SQL для "{question}": {e}')
+                outcome = 'db_error'
+            timings['db'].append(time.perf_counter() - generated)
+        timings['total'].append(time.perf_counter() - started)
+        if model.last is not None:
+            timings['model'].append(model.last['latency_s'])
+
+        results.append({
+            'question': question,
+            'expected': expected,
+            'answer': answer,
+            'correct': outcome == 'correct',
+            'outcome': outcome,
+            'sql': sql,
+            'prompt_tokens': selection_for(question, service.prompt_builder).tokens,
+            'input_tokens': model.last.get('input_tokens') if model.last else None,
+        })
+
+    outcomes = Counter(result['outcome'] for result in results)
+    prompt_tokens = [result['prompt_tokens'] for result in results]
+    input_tokens = [result['input_tokens'] for result in results if result['input_tokens']]
+    return {
+        'questions': len(results),
+        'accuracy': round(outcomes['correct'] / len(results), 4),
+        'outcomes': dict(sorted(outcomes.items())),
+        'stages': {name: summary(values) for name, values in sorted(timings.items())},
+        'prompt_tokens': {'mean': round(mean(prompt_tokens)), 'max': max(prompt_tokens)},
+        'input_tokens': {'mean': round(mean(input_tokens)), 'total': sum(input_tokens)} if input_tokens else None,
+        'model_calls': model.calls,
+        'items': results,
+    }
+
+
+def compare(report: dict, baseline: dict) -> Tuple[List[str], List[str]]:
+    """Строки сравнения с прошлым отчетом и вопросы, которые перестали решаться"""
+    def change(new, old):
+        return f"{(new - old) / old:+.0%}" if old else '—'
+
+    old_items = {item['question']: item for item in baseline['items']}
+    regressions = [f"{item['question']} ({item['outcome']})" for item in report['items']
+                   if old_items.get(item['question'], {}).get('correct') and not item['correct']]
+    fixed = [item['question'] for item in report['items']
+             if item['question'] in old_items and not old_items[item['question']]['correct'] and item['correct']]
+
+    lines = [
+        f"Базовый прогон: {baseline['meta'].get('commit')} от {baseline['meta'].get('started_at')}",
+        f"{'точность':<18}{baseline['accuracy']:>10.1%}{report['accuracy']:>10.1%}",
+        f"{'токенов промпта':<18}{baseline['prompt_tokens']['mean']:>10}{report['prompt_tokens']['mean']:>10}"
+        f"{change(report['prompt_tokens']['mean'], baseline['prompt_tokens']['mean']):>8}",
+    ]
+    for stage, new in report['stages'].items():
+        old = baseline['stages'].get(stage)
+        if old and old['count'] and new['count']:
+            lines.append(f"{stage + ' p95, мс':<18}{old['p95_ms']:>10}{new['p95_ms']:>10}"
+                         f"{change(new['p95_ms'], old['p95_ms']):>8}")
+    lines += [f"  перестал решаться: {question}" for question in regressions]
+    lines += [f"  стал решаться: {question}" for question in fixed]
+    return lines, regressions
+
+
+async def refresh_answers(golden: dict, path: Path):
+    for item in golden['items']:
+        item['answer'] = answer_value(await execute_sql(item['sql']))
+    save_golden(golden, path)
+    print(f"Ожидаемые ответы пересчитаны эталонным SQL: {path}")
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mode', choices=('record', 'replay'))
+    parser.add_argument('--cassette', type=Path, required=True, help="JSON с записанными ответами модели")
+    parser.add_argument('--golden', type=Path, default=GOLDEN_PATH)
+    parser.add_argument('--model', default=YandexGPTConfig().models[0], help="модель из YC_MODELS")
+    parser.add_argument('--prompt', choices=('full', 'retrieval'),
+                        default='retrieval' if settings.PROMPT_RETRIEVAL_ENABLED else 'full')
+    parser.add_argument('--replay-latency', action='store_true', help="выдерживать записанную задержку модели")
+    parser.add_argument('--seed-db', action='store_true', help="очистить таблицы и загрузить синтетику набора")
+    parser.add_argument('--refresh-answers', action='store_true', help="пересчитать ожидаемые ответы в наборе")
+    parser.add_argument('--output', type=Path, help="файл для JSON-отчета")
+    parser.add_argument('--baseline', type=Path, help="JSON-отчет прошлого прогона для сравнения")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    from src.benchmarks.bench_e2e import seed_database
+    from src.db.database import async_engine
+
+    golden = load_golden(args.golden)
+    if args.mode == 'replay' and not args.cassette.exists():
+        print(f"Кассета не найдена: {args.cassette} — все вопросы будут cassette_miss")
+    cassette = Cassette(args.cassette)
+    builder = PromptBuilder(token_budget=settings.PROMPT_TOKEN_BUDGET, max_examples=settings.PROMPT_MAX_EXAMPLES) \
+        if args.prompt == 'retrieval' else None
+    service, model = make_service(args.mode, cassette, args.model, builder, args.replay_latency)
+
+    started_at = datetime.now().isoformat(timespec='seconds')
+    try:
+        if args.seed_db:
+            dataset = golden['dataset']
+            await seed_database(dataset['videos'], dataset['snapshots'])
+        if args.refresh_answers:
+            await refresh_answers(golden, args.golden)
+        report = await evaluate(golden['items'], service, model)
+    finally:
+        await async_engine.dispose()
+    if args.mode == 'record':
+        cassette.save()
+        print(f"Кассета: {args.cassette}, записей {len(cassette.entries)}")
+
+    report['meta'] = {
+        'commit': git_commit(),
+        'started_at': started_at,
+        'args': {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        'settings': {name: getattr(settings, name) for name in (
+            'PROMPT_TOKEN_BUDGET', 'PROMPT_MAX_EXAMPLES', 'RE_YC_TEMPERATURE', 'RE_YC_MAX_TOKENS')},
+    }
+
+    print(f"Вопросов: {report['questions']}, точность {report['accuracy']:.1%}, исходы: {report['outcomes']}")
+    print(f"Токенов промпта: в среднем {report['prompt_tokens']['mean']}, максимум {report['prompt_tokens']['max']}"
+          + (f"; входных по usage: {report['input_tokens']['total']}" if report['input_tokens'] else ''))
+    print(f"{'стадия':<8}{'кол-во':>8}{'p50, мс':>10}{'p95, мс':>10}{'макс., мс':>11}")
+    for name, s in report['stages'].items():
+        if s['count']:
+            print(f"{name:<8}{s['count']:>8}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['max_ms']:>11}")
+    for item in report['items']:
+        if not item['correct']:
+            print(f"  {item['outcome']}: {item['question']} — ожидалось {item['expected']}, "
+                  f"получено {item['answer']}; SQL: {item['sql']}")
+
+    regressions = []
+    if args.baseline:
+        lines, regressions = compare(report, json.loads(args.baseline.read_text(encoding='utf-8')))
+        print()
+        print('\n'.join(lines))
+    if args.output:
+        args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2, default=str), encoding='utf-8')
+        print(f"Отчет: {args.output}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
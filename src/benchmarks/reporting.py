@@ -0,0 +1,31 @@
+"""Общие части отчетов бенчмарков: сводка задержек и версия кода прогона"""
+import subprocess
+from typing import List, Optional
+
+
+def summary(values: List[float]) -> dict:
+    """Количество, среднее и перцентили значений в секундах — в миллисекундах"""
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def percentile(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 3)
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def git_commit() -> Optional[str]:
+    """Короткий хеш HEAD для отчета или None вне git"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,183 @@
+"""Локальные заменители внешних сервисов для нагрузочных тестов
+
+- StubModel — модель YandexGPT с тем же методом run(messages): отвечает
+  заранее заданным SQL по тексту вопроса с настраиваемой задержкой и долей ошибок;
+- StubSDK — замена AsyncYCloudML: sdk.models.completions(name) возвращает
+  StubModel с этим именем;
+- StubSession — сессия aiogram без сети: запросы бота к Telegram API
+  не отправляются, а сохраняются вместе с задержкой ответа, файлы отдаются
+  из заранее заданного словаря;
+- FakeTelegram — локальный HTTP-сервер с методами Bot API, которые нужны боту
+  (getMe, getUpdates, sendMessage, setWebhook/deleteWebhook): обновления для
+  polling берутся из очереди, время каждого ответа бота запоминается.
+"""
+import asyncio
+import json
+import random
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.client.session.base import BaseSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message
+from aiohttp import web
+
+
+class StubLLMError(Exception):
+    """Имитация сбоя вызова модели"""
+
+
+class StubModel:
+    """Заглушка модели: ответ по последнему сообщению пользователя в промпте
+
+    Ответ оборачивается в markdown, как это делает настоящая модель, чтобы
+    очистка и проверка SQL в сервисе работали так же. На вопрос, которого нет
+    в answers, возвращается текст без SQL — он не пройдет проверку.
+    """
+
+    def __init__(self, answers: Dict[str, str], latency: float = 0.5, jitter: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 42, slow_rate: float = 0.0, slow_latency: float = 0.0):
+        self.answers = answers
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        # Доля "зависших" вызовов с задержкой slow_latency — тяжелый хвост
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self._random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+
+    async def run(self, messages: list) -> list:
+        self.calls += 1
+        question = next((m['text'] for m in reversed(messages) if m.get('role') == 'user'), '')
+        if self._random.random() < self.slow_rate:
+            await asyncio.sleep(self.slow_latency)
+        else:
+            await asyncio.sleep(self.latency * self._random.uniform(1 - self.jitter, 1 + self.jitter))
+
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            raise StubLLMError("имитация ошибки модели")
+        sql = self.answers.get(question)
+        return [SimpleNamespace(text=f"```sql\n{sql}\n```" if sql else "Не могу составить запрос")]
+
+    def configure(self, **options) -> 'StubModel':
+        return self
+
+
+class StubSDK:
+    """SDK с заглушками вместо моделей: models.completions(name) → models[name]"""
+
+    def __init__(self, models: Dict[str, StubModel]):
+        self._models = models
+        self.models = SimpleNamespace(completions=self._models.__getitem__)
+
+
+class StubSession(BaseSession):
+    """Сессия бота без сети: sent — отправленные сообщения (chat_id, text)
+
+    files — содержимое файлов по URL для bot.download (stream_content).
+    """
+
+    def __init__(self, latency: float = 0.0, files: Dict[str, bytes] = None):
+        super().__init__()
+        self.latency = latency
+        self.files = files or {}
+        self.sent: List[Tuple[int, str]] = []
+        self.timings: List[float] = []
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout: Optional[int] = None):
+        started = time.perf_counter()
+        await asyncio.sleep(self.latency)
+        result = True
+        if isinstance(method, SendMessage):
+            self._message_id += 1
+            self.sent.append((method.chat_id, method.text))
+            result = Message(message_id=self._message_id, date=datetime.now(),
+                             chat=Chat(id=method.chat_id, type='private'), text=method.text)
+        self.timings.append(time.perf_counter() - started)
+        return result
+
+    async def stream_content(self, url: str, headers: Optional[dict] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True):
+        await asyncio.sleep(self.latency)
+        content = self.files.get(url)
+        if content is None:
+            if raise_for_status:
+                raise FileNotFoundError(f"файл {url} не задан в заглушке")
+            return
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+
+    async def close(self):
+        pass
+
+
+class FakeTelegram:
+    """Локальный Bot API: replies — время (perf_counter) ответа бота по chat_id"""
+
+    def __init__(self):
+        self.replies: Dict[int, float] = {}
+        self.calls: Dict[str, int] = {}
+        self._updates: List[dict] = []
+        self._arrived = asyncio.Condition()
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ''
+
+    def api_server(self) -> TelegramAPIServer:
+        return TelegramAPIServer.from_base(self.base_url)
+
+    async def push(self, update: dict):
+        """Обновление для getUpdates (режим polling)"""
+        async with self._arrived:
+            self._updates.append(update)
+            self._arrived.notify_all()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.base_url = f'http://{host}:{self._runner.addresses[0][1]}'
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        params = dict(await request.post()) if request.can_read_body else {}
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == 'getupdates':
+            result = await self._get_updates(int(params.get('offset', 0)), int(params.get('limit', 100)),
+                                             float(params.get('timeout', 0)))
+        elif method == 'sendmessage':
+            chat_id = int(params['chat_id'])
+            self.replies[chat_id] = time.perf_counter()
+            result = {'message_id': len(self.replies), 'date': int(time.time()),
+                      'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+        elif method == 'getme':
+            result = {'id': 42, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result}, dumps=json.dumps)
+
+    async def _get_updates(self, offset: int, limit: int, timeout: float) -> list:
+        async with self._arrived:
+            # offset подтверждает все обновления с меньшими номерами
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            if not self._updates and timeout:
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return self._updates[:limit]
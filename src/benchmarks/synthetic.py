@@ -0,0 +1,83 @@
+"""Генератор синтетических данных в формате выгрузки videos.json"""
+import json
+import random
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator
+
+BASE_TIME = datetime(2025, 11, 1)
+
+
+def generate_videos(n_videos: int, snapshots_per_video: int = 10, n_creators: int = 50,
+                    seed: int = 42) -> Iterator[dict]:
+    """Детерминированный поток видео со снапшотами (одинаковый seed — одинаковые данные)"""
+    rnd = random.Random(seed)
+    creators = [uuid.UUID(int=rnd.getrandbits(128)).hex for _ in range(n_creators)]
+
+    for _ in range(n_videos):
+        video_id = str(uuid.UUID(int=rnd.getrandbits(128)))
+        published = BASE_TIME - timedelta(days=rnd.randint(0, 180), minutes=rnd.randint(0, 1439))
+
+        snapshots = []
+        views = likes = comments = reports = 0
+        for i in range(snapshots_per_video):
+            created = BASE_TIME + timedelta(days=rnd.randint(0, 29), hours=rnd.randint(0, 23),
+                                            minutes=rnd.randint(0, 59))
+            d_views = rnd.randint(-5, 500)
+            d_likes = rnd.randint(0, 50)
+            d_comments = rnd.randint(0, 10)
+            d_reports = rnd.randint(0, 1)
+            views += d_views
+            likes += d_likes
+            comments += d_comments
+            reports += d_reports
+            snapshots.append({
+                "id": uuid.UUID(int=rnd.getrandbits(128)).hex,
+                "video_id": video_id,
+                "views_count": views,
+                "likes_count": likes,
+                "comments_count": comments,
+                "reports_count": reports,
+                "delta_views_count": d_views,
+                "delta_likes_count": d_likes,
+                "delta_comments_count": d_comments,
+                "delta_reports_count": d_reports,
+                "created_at": created.isoformat() + "+00:00",
+                "updated_at": created.isoformat() + "+00:00",
+            })
+
+        yield {
+            "id": video_id,
+            "creator_id": rnd.choice(creators),
+            "video_created_at": published.isoformat() + "+00:00",
+            "views_count": views,
+            "likes_count": likes,
+            "comments_count": comments,
+            "reports_count": reports,
+            "created_at": published.isoformat() + "+00:00",
+            "updated_at": BASE_TIME.isoformat() + "+00:00",
+            "snapshots": snapshots,
+        }
+
+
+def write_videos_json(path: Path, n_videos: int, snapshots_per_video: int = 10, seed: int = 42) -> Path:
+    """Запись выгрузки {"videos": [...]} без накопления всего списка в памяти"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"videos": [')
+        for i, video in enumerate(generate_videos(n_videos, snapshots_per_video, seed=seed)):
+            if i:
+                f.write(',')
+            f.write(json.dumps(video, ensure_ascii=False))
+        f.write(']}')
+    return path
+
+
+def write_videos_ndjson(path: Path, n_videos: int, snapshots_per_video: int = 10, seed: int = 42) -> Path:
+    """То же в NDJSON: одно видео на строку"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for video in generate_videos(n_videos, snapshots_per_video, seed=seed):
+            f.write(json.dumps(video, ensure_ascii=False) + '\n')
+    return path
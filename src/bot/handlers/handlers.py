@@ -1,12 +1,29 @@
+import asyncio
+import html
 import logging
+import time
+from typing import Dict, Optional, Tuple
 
 from aiogram import Router, F
 from aiogram.filters import CommandStart, Command
-from aiogram.types import Message
+from aiogram.types import BufferedInputFile, Message
 from sqlalchemy import text
 
-from src.db.database import get_async_session
-from src.llm_service.llm_service import YandexMLGPTQueryService, YandexGPTConfig
+from src.analytics.columnar import ColumnarMirror
+from src.db.database import get_async_session, table_read_stats
+from src.db.data_version import get_data_version
+from src.db.query_router import make_sargable, route_to_rollups
+from src.db.result_cache import QueryResultCache, canonicalize_sql
+from src.db.sandbox import QueryRejected, SQLSandbox
+from src.llm_service.fast_path import FastPathParser, PathStats
+from src.llm_service.llm_service import SQL_FROM_LLM, YandexMLGPTQueryService, YandexGPTConfig, llm_tokens
+from src.llm_service.few_shot_memory import FewShotMemory
+from src.llm_service.prompt_builder import PromptBuilder
+from src.llm_service.question_cache import QuestionCache, normalize_question
+from src.llm_service.scheduler import LLMRequestScheduler, SchedulerOverloaded
+from src.services.batch import BatchRunner, read_questions, summarize, write_csv
+from src.services.metrics import metrics, stats_samples
+from src.services.single_flight import SingleFlight
 from src.config.config import settings
 
 router = Router()
@@ -19,7 +36,184 @@ yc_config = YandexGPTConfig(
     temperature=settings.RE_YC_TEMPERATURE,
     max_tokens=settings.RE_YC_MAX_TOKENS
 )
-yc_service = YandexMLGPTQueryService(yc_config)
+question_cache = QuestionCache(
+    max_size=settings.QUESTION_CACHE_SIZE,
+    ttl=settings.QUESTION_CACHE_TTL,
+    path=settings.QUESTION_CACHE_PATH,
+) if settings.QUESTION_CACHE_ENABLED else None
+llm_scheduler = LLMRequestScheduler(
+    max_in_flight=settings.LLM_MAX_IN_FLIGHT,
+    max_queue=settings.LLM_MAX_QUEUE,
+    default_deadline=settings.LLM_REQUEST_DEADLINE,
+)
+prompt_builder = PromptBuilder(
+    token_budget=settings.PROMPT_TOKEN_BUDGET,
+    max_examples=settings.PROMPT_MAX_EXAMPLES,
+) if settings.PROMPT_RETRIEVAL_ENABLED else None
+few_shot_memory = FewShotMemory(
+    path=settings.FEW_SHOT_MEMORY_PATH,
+    reuse_threshold=settings.FEW_SHOT_REUSE_THRESHOLD,
+    examples=settings.FEW_SHOT_EXAMPLES,
+) if settings.FEW_SHOT_MEMORY_ENABLED else None
+yc_service = YandexMLGPTQueryService(yc_config, cache=question_cache, scheduler=llm_scheduler,
+                                     prompt_builder=prompt_builder, memory=few_shot_memory)
+fast_path = FastPathParser() if settings.FAST_PATH_ENABLED else None
+# Задержка получения SQL отдельно по путям: правила и LLM (включая кэш вопросов)
+sql_path_stats = {'fast_path': PathStats(), 'llm': PathStats()}
+
+result_cache = QueryResultCache(
+    version_loader=get_data_version,
+    max_bytes=settings.RESULT_CACHE_MAX_BYTES,
+    version_check_interval=settings.RESULT_CACHE_VERSION_CHECK_INTERVAL,
+) if settings.RESULT_CACHE_ENABLED else None
+
+# Сгенерированный SQL выполняется в отдельном пуле, только на чтение и с лимитами
+sql_sandbox = SQLSandbox() if settings.SANDBOX_ENABLED else None
+
+# Агрегаты по копии данных в памяти; неподдерживаемые запросы уходят в Postgres
+columnar_mirror = ColumnarMirror(
+    version_check_interval=settings.COLUMNAR_VERSION_CHECK_INTERVAL,
+) if settings.COLUMNAR_ENABLED else None
+
+
+# Одинаковые вопросы/SQL, пришедшие одновременно, обслуживаются одним вызовом LLM/БД
+question_flight = SingleFlight('question')
+sql_flight = SingleFlight('sql')
+
+requests_total = metrics.counter('bot_requests_total', 'Обработанные вопросы по исходу', ('outcome',))
+rejected_total = metrics.counter('bot_queries_rejected_total', 'Запросы, отклоненные песочницей', ('reason',))
+batch_questions_total = metrics.counter('bot_batch_questions_total', 'Вопросы из пакетных файлов по исходу',
+                                        ('outcome',))
+
+
+def _component_metrics():
+    """Счетчики кэшей, планировщика и песочницы на момент запроса /metrics"""
+    samples = []
+    if question_cache is not None:
+        samples += stats_samples('question_cache', question_cache.stats(), counters=('hits', 'misses', 'evictions'))
+    if few_shot_memory is not None:
+        samples += stats_samples('few_shot_memory', few_shot_memory.stats(), counters=('lookups', 'reused'))
+    if result_cache is not None:
+        samples += stats_samples('result_cache', result_cache.stats(),
+                                 counters=('hits', 'misses', 'evictions', 'invalidations'))
+    samples += stats_samples('llm_scheduler', llm_scheduler.stats(),
+                             counters=('submitted', 'completed', 'rejected', 'timeouts'))
+    router = yc_service.router.stats()
+    samples += stats_samples('llm_router', router, counters=('hedges', 'hedge_wins', 'fallbacks'))
+    for name, model_stats in router['models'].items():
+        samples += stats_samples('llm_model', model_stats, {'model': name}, counters=('requests', 'errors', 'wins', 'cancelled'))
+    if sql_sandbox is not None:
+        samples += stats_samples('sandbox', sql_sandbox.stats(), counters=(
+            'executed', 'rejected_cost', 'timeouts', 'cancelled', 'parameterized', 'literal_fallbacks',
+            'plan_cache_hits', 'plan_cache_misses'))
+    if columnar_mirror is not None:
+        samples += stats_samples('columnar', columnar_mirror.stats(), counters=(
+            'answered', 'fallbacks', 'full_refreshes', 'incremental_refreshes'))
+    for path, path_stats in sql_path_stats.items():
+        samples += stats_samples('sql_path', path_stats.stats(), {'path': path}, counters=('count',))
+    for flight in (question_flight, sql_flight):
+        samples += stats_samples('single_flight', flight.stats(), {'name': flight.name},
+                                 counters=('executions', 'coalesced'))
+    return samples
+
+
+async def _table_read_metrics():
+    """Прочитанные строки и сканирования таблиц по статистике Postgres"""
+    samples = []
+    for table, counters in (await table_read_stats()).items():
+        for access, prefix in (('seq', 'seq'), ('index', 'idx')):
+            samples.append(('pg_table_rows_read_total', 'counter', 'Строки, прочитанные из таблицы (pg_stat_user_tables)',
+                            {'table': table, 'access': access}, counters[f'{prefix}_rows']))
+            samples.append(('pg_table_scans_total', 'counter', 'Сканирования таблицы (pg_stat_user_tables)',
+                            {'table': table, 'access': access}, counters[f'{prefix}_scan']))
+    return samples
+
+
+metrics.register_collector(_component_metrics)
+metrics.register_collector(_table_read_metrics)
+
+
+async def _fetch_first_row(sql_query: str, resource_class: str = 'interactive'):
+    if sql_sandbox is not None:
+        return await sql_sandbox.fetch_one(sql_query, resource_class)
+    async with get_async_session() as session:
+        with metrics.span('db_connect'):
+            await session.connection()
+        with metrics.span('db_execute'):
+            res = await session.execute(text(sql_query))
+        return res.fetchone()
+
+
+async def _generate_sql(user_query: str, user_id=None) -> Tuple[Optional[str], bool]:
+    """SQL по вопросу и признак того, что его только что сгенерировала модель"""
+    started = time.perf_counter()
+    if fast_path is not None:
+        sql_query = fast_path.parse(user_query)
+        if sql_query:
+            sql_path_stats['fast_path'].observe(time.perf_counter() - started)
+            logger.info(f'SQL получен быстрым путем без LLM: {sql_query}')
+            return sql_query, False
+
+    key = normalize_question(user_query).exact_key
+    sql_query, source = await question_flight.do(key, lambda: yc_service.generate_sql(user_query, user_id))
+    sql_path_stats['llm'].observe(time.perf_counter() - started)
+    return sql_query, source == SQL_FROM_LLM
+
+
+async def _execute_sql(sql_query: str, resource_class: str = 'interactive'):
+    sql_query = make_sargable(sql_query)
+    if columnar_mirror is not None:
+        row = await columnar_mirror.fetch_one(sql_query)
+        if row is not None:
+            return row
+
+    if settings.QUERY_ROLLUPS_ENABLED:
+        sql_query = route_to_rollups(sql_query)
+
+    async def fetch(sql: str):
+        return await _fetch_first_row(sql, resource_class)
+
+    async def run():
+        if result_cache is not None:
+            return await result_cache.fetch_one(sql_query, fetch)
+        return await fetch(sql_query)
+
+    return await sql_flight.do(canonicalize_sql(sql_query), run)
+
+
+def _quick_sql(user_query: str):
+    started = time.perf_counter()
+    sql_query = fast_path.parse(user_query)
+    if sql_query:
+        sql_path_stats['fast_path'].observe(time.perf_counter() - started)
+    return sql_query
+
+
+async def answer_batch(questions, user_id=None) -> list:
+    """Ответы на список вопросов тем же путем, что и в чате, но с классом ресурсов batch"""
+    generated: Dict[str, str] = {}
+
+    async def generate(question: str) -> Optional[str]:
+        sql_query, fresh = await _generate_sql(question, user_id)
+        if fresh:
+            generated[question] = sql_query
+        return sql_query
+
+    runner = BatchRunner(
+        generate=generate,
+        execute=lambda sql_query: _execute_sql(sql_query, 'batch'),
+        quick=_quick_sql if fast_path is not None else None,
+        llm_concurrency=settings.BATCH_LLM_CONCURRENCY,
+        db_concurrency=settings.BATCH_DB_CONCURRENCY,
+    )
+    items = await runner.run(questions)
+    for item in items:
+        batch_questions_total.inc(outcome=item.outcome)
+        # В память примеров — только новые ответы модели, SQL из кэша и быстрого пути там не нужен
+        if few_shot_memory is not None and item.outcome == 'ok' and generated.get(item.question) == item.sql:
+            await few_shot_memory.add_async(item.question, item.sql)
+    return items
+
 
 @router.message(CommandStart())
 async def cmd_start(message: Message):
@@ -29,6 +223,103 @@ async def cmd_start(message: Message):
     )
     await message.answer(welcome_text)
 
+
+def _stats_text() -> str:
+    lines = ['Запросы: ' + (', '.join(f'{key[0]} {int(value)}' for key, value in
+                                      sorted(requests_total.values().items())) or 'еще не было')]
+
+    lines.append('')
+    lines.append(f"{'стадия':<15}{'кол-во':>7}{'ср, мс':>9}{'p50':>8}{'p95':>8}")
+    for stage, count, mean, p50, p95 in metrics.stage_summary():
+        lines.append(f'{stage:<15}{count:>7}{mean * 1000:>9.1f}{p50 * 1000:>8.1f}{p95 * 1000:>8.1f}')
+
+    lines.append('')
+    for path, path_stats in sql_path_stats.items():
+        st = path_stats.stats()
+        lines.append(f"SQL {path}: {st['count']}, в среднем {st['avg_ms']:.1f} мс")
+    if question_cache is not None:
+        lines.append(f"Кэш вопросов: попаданий {question_cache.stats()['hit_rate']:.0%}")
+    if few_shot_memory is not None:
+        memory = few_shot_memory.stats()
+        lines.append(f"Память примеров: {memory['entries']} пар, ответила на {memory['reuse_rate']:.0%}")
+    if result_cache is not None:
+        lines.append(f"Кэш результатов: попаданий {result_cache.stats()['hit_rate']:.0%}")
+    if columnar_mirror is not None:
+        lines.append(f"Колоночная копия: ответила на {columnar_mirror.stats()['answered_rate']:.0%}")
+    scheduler = llm_scheduler.stats()
+    lines.append(f"LLM: в очереди {scheduler['queue_depth']}, выполняется {scheduler['in_flight']}, "
+                 f"отклонено {scheduler['rejected']}, ожидание p95 {scheduler['wait_p95_s']:.2f} с")
+    router = yc_service.router.stats()
+    for name, model_stats in router['models'].items():
+        lines.append(f"Модель {name}: запросов {model_stats['requests']}, ошибок {model_stats['error_rate']:.0%}, "
+                     f"p90 {model_stats['p90_s']:.2f} с")
+    if router['hedges']:
+        lines.append(f"Дублирующих запросов {router['hedges']}, из них быстрее {router['hedge_wins']}")
+    lines.append(f"Токены LLM: входных {int(llm_tokens.value(kind='input'))}, "
+                 f"ответа {int(llm_tokens.value(kind='completion'))}")
+    if sql_sandbox is not None:
+        sandbox = sql_sandbox.stats()
+        lines.append(f"Песочница: выполнено {sandbox['executed']}, отклонено по стоимости "
+                     f"{sandbox['rejected_cost']}, по таймауту {sandbox['timeouts']}")
+    return '\n'.join(lines)
+
+
+@router.message(Command('stats'))
+async def cmd_stats(message: Message):
+    # Команда только для администраторов (ADMIN_IDS); остальным бот не отвечает
+    if not message.from_user or message.from_user.id not in settings.ADMIN_IDS:
+        return
+    await message.answer(f'<pre>{html.escape(_stats_text())}</pre>', parse_mode='HTML')
+
+
+@router.message(F.document)
+async def handle_batch_file(message: Message):
+    """Файл со списком вопросов (TXT или CSV) — в ответ CSV с числами"""
+    if not settings.BATCH_ENABLED:
+        return
+    document = message.document
+    filename = document.file_name or 'questions.txt'
+    if not filename.lower().endswith(('.txt', '.csv')):
+        await _answer(message, 'Пришли файл .txt (вопрос в строке) или .csv с колонкой question')
+        return
+    if document.file_size and document.file_size > settings.BATCH_MAX_FILE_BYTES:
+        await _answer(message, f'Файл слишком большой, максимум {settings.BATCH_MAX_FILE_BYTES // 1024} КБ')
+        return
+
+    try:
+        data = await message.bot.download(document)
+        questions = read_questions(data.read(), filename)
+    except ValueError as e:
+        await _answer(message, str(e))
+        return
+    except Exception as e:
+        logger.error(f'Не удалось прочитать файл {filename}: {e}', exc_info=True)
+        await _answer(message, 'Не удалось прочитать файл. Попробуй отправить его еще раз')
+        return
+    if not questions:
+        await _answer(message, 'В файле не нашлось вопросов')
+        return
+    if len(questions) > settings.BATCH_MAX_QUESTIONS:
+        await _answer(message, f'Слишком много вопросов: {len(questions)}, максимум {settings.BATCH_MAX_QUESTIONS}')
+        return
+
+    logger.info(f'Получен файл {filename}: {len(questions)} вопросов')
+    await _answer(message, f'Принято вопросов: {len(questions)}. Пришлю файл с ответами, когда все будут готовы')
+
+    user_id = message.from_user.id if message.from_user else None
+    started = time.perf_counter()
+    try:
+        with metrics.span('batch'):
+            items = await answer_batch(questions, user_id)
+        caption = (f'Готово за {time.perf_counter() - started:.0f} с: '
+                   + ', '.join(f'{outcome} {count}' for outcome, count in summarize(items).items()))
+        answers = BufferedInputFile(write_csv(items), filename=filename.rsplit('.', 1)[0] + '.answers.csv')
+        await message.answer_document(answers, caption=caption)
+    except Exception as e:
+        logger.error(f'Ошибка обработки файла {filename}: {e}', exc_info=True)
+        await _answer(message, 'Возникла ошибка при обработке файла')
+
+
 @router.message(F.text)
 async def handle_text_query(message: Message):
     user_query = message.text.strip()
@@ -39,30 +330,63 @@ async def handle_text_query(message: Message):
 
     # processing_msg = ''
 
+    with metrics.span('request'):
+        outcome = await _answer_query(message, user_query)
+    requests_total.inc(outcome=outcome)
+
+
+async def _answer(message: Message, text: str):
+    with metrics.span('answer'):
+        await message.answer(text)
+
+
+async def _answer_query(message: Message, user_query: str) -> str:
+    """Ответ на вопрос; возвращает исход для метрик"""
     try:
-        sql_query = await yc_service.text_to_sql(user_query)
+        user_id = message.from_user.id if message.from_user else None
+        with metrics.span('generate_sql'):
+            sql_query, fresh = await _generate_sql(user_query, user_id)
 
         if not sql_query:
-            await message.answer('Не удалось понять запрос. Попробуй сформулировать иначе')
+            await _answer(message, 'Не удалось понять запрос. Попробуй сформулировать иначе')
             # await processing_msg.edit_text('Не удалось понять запрос. Попробуй сформулировать иначе')
-            return
+            return 'not_understood'
 
         logger.info(f'Сгенерирован SQL: {sql_query}')
 
-        async with get_async_session() as session:
-            res = await session.execute(text(sql_query))
-            row = res.fetchone()
+        with metrics.span('execute_sql'):
+            row = await _execute_sql(sql_query)
+
+        if not row or row[0] is None:
+            await _answer(message, 'Возникла ошибка при обработке')
+            # await processing_msg.edit_text('Запросе не вернул результатов')
+            return 'no_result'
+
+        number = row[0]
+        formatted_number = int(number)
+
+        if few_shot_memory is not None and fresh:
+            # Новый ответ модели проверен: SQL выполнился и вернул число
+            await few_shot_memory.add_async(user_query, sql_query)
+
+        response = f'{formatted_number}'     # f"<b>Запрос:</b> <i>{user_query[:100]}...</i>\n\n <b>Результат:</b> <code>{formatted_number}</code>" - красивый ответ
+        await _answer(message, response)
+        return 'ok'
 
-            if not row or row[0] is None:
-                await message.answer('Возникла ошибка при обработке')
-                # await processing_msg.edit_text('Запросе не вернул результатов')
-                return
+    except SchedulerOverloaded:
+        await _answer(message, 'Сейчас слишком много запросов. Попробуй через минуту')
+        return 'overloaded'
 
-            number = row[0]
-            formatted_number = int(number)
+    except QueryRejected as e:
+        logger.warning(f'Запрос отклонен песочницей ({e.reason}): {user_query}')
+        rejected_total.inc(reason=e.reason)
+        await _answer(message, 'Запрос получился слишком тяжелым. Попробуй сузить период или условия')
+        return 'rejected'
 
-            response = f'{formatted_number}'     # f"<b>Запрос:</b> <i>{user_query[:100]}...</i>\n\n <b>Результат:</b> <code>{formatted_number}</code>" - красивый ответ
-            await message.answer(response)
+    except asyncio.TimeoutError:
+        logger.warning(f'Превышено время ожидания ответа на запрос: {user_query}')
+        await _answer(message, 'Не удалось получить ответ вовремя. Попробуй еще раз')
+        return 'timeout'
 
     except Exception as e:
         logger.error(f'Ошибка обработки запросов: {e}', exc_info=True)
@@ -71,4 +395,5 @@ async def handle_text_query(message: Message):
         #     'Произошла ошибка при обработке запроса.\n'
         #     'Попробуйте сформулировать запрос проще или проверьте корректность ID'
         # )
+        return 'error'
 
@@ -0,0 +1,80 @@
+"""Запуск и остановка общих для polling и webhook частей бота
+
+prepare_database выполняется один раз на запуск (создание таблиц, секций,
+агрегатов), start_services/stop_services — в каждом процессе, который
+обрабатывает обновления: у процесса свои пулы соединений, кэши и метрики.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiohttp import web
+
+from src.bot.handlers.handlers import columnar_mirror, router, sql_sandbox
+from src.config.config import settings
+from src.db.database import async_engine, init_db, warm_up_pool
+from src.db.partitions import prepare_partitions
+from src.db.rollups import ensure_rollups
+from src.services.metrics import metrics, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+
+async def prepare_database():
+    await init_db()
+    logger.info('База данных инициализирована')
+
+    if settings.SNAPSHOTS_PARTITIONED:
+        await prepare_partitions()
+
+    if settings.QUERY_ROLLUPS_ENABLED:
+        await ensure_rollups()
+
+
+@dataclass
+class ProcessServices:
+    metrics_runner: Optional[web.AppRunner] = None
+
+
+async def start_services(worker: int = 0) -> ProcessServices:
+    """Прогрев пула, загрузка колоночной копии и сервер метрик (порт METRICS_PORT + номер процесса)"""
+    services = ProcessServices()
+
+    opened = await warm_up_pool()
+    if opened:
+        logger.info(f'Пул соединений прогрет: {opened} соединений')
+
+    if columnar_mirror is not None:
+        # Копия загружается в фоне; до готовности запросы выполняет Postgres
+        columnar_mirror.schedule_refresh()
+
+    if settings.METRICS_ENABLED:
+        services.metrics_runner = await start_metrics_server(
+            metrics, settings.METRICS_HOST, settings.METRICS_PORT + worker)
+    return services
+
+
+async def stop_services(services: ProcessServices):
+    if services.metrics_runner is not None:
+        await services.metrics_runner.cleanup()
+    if sql_sandbox is not None:
+        await sql_sandbox.close()
+    await async_engine.dispose()
+
+
+def create_bot(**kwargs) -> Bot:
+    return Bot(
+        token=settings.RE_TOKEN,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+        **kwargs,
+    )
+
+
+def create_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(router)
+    return dp
@@ -0,0 +1,193 @@
+"""Прием обновлений через webhook (aiohttp) вместо long polling
+
+Telegram присылает каждое обновление POST-запросом, бот отвечает сразу, а
+обработка идет в фоне. Одновременно обрабатывается не больше max_concurrent
+обновлений на процесс: когда все места заняты, HTTP-ответ задерживается, и
+Telegram (не больше max_connections соединений) перестает слать новые —
+очередь копится у него, а не в памяти бота.
+
+Несколько процессов (WEBHOOK_WORKERS) слушают один порт через SO_REUSEPORT,
+соединения между ними распределяет ядро. Вебхук регистрируется один раз
+в родительском процессе. Остановка (SIGTERM/SIGINT): процесс перестает
+принимать соединения, дожидается обработки принятых обновлений (не дольше
+WEBHOOK_SHUTDOWN_TIMEOUT) и только потом закрывает пулы.
+"""
+import asyncio
+import logging
+import multiprocessing
+import signal
+from pathlib import Path
+from typing import Any, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+from src.bot.lifecycle import create_bot, create_dispatcher, start_services, stop_services
+from src.config.config import settings
+from src.config.logs_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Обработка обновлений в фоне с ограничением числа одновременных задач"""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_concurrent: int = 100,
+                 secret_token: Optional[str] = None, shutdown_timeout: float = 30.0, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.max_concurrent = max_concurrent
+        self.shutdown_timeout = shutdown_timeout
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self.accepted = 0
+        self.failed = 0
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        await self._slots.acquire()
+        self.accepted += 1
+        task = asyncio.create_task(self._background_feed_update(bot=bot, update=update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    def _task_done(self, task: asyncio.Task):
+        self._background_feed_update_tasks.discard(task)
+        self._slots.release()
+        if not task.cancelled() and task.exception() is not None:
+            self.failed += 1
+            logger.error(f'Ошибка обработки обновления: {task.exception()}', exc_info=task.exception())
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._background_feed_update_tasks)
+
+    async def drain(self):
+        """Ожидание принятых обновлений; не успевшие за shutdown_timeout отменяются"""
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+        logger.info(f'Ожидание обработки {len(tasks)} обновлений перед остановкой')
+        _, pending = await asyncio.wait(tasks, timeout=self.shutdown_timeout)
+        if pending:
+            logger.warning(f'Не дождались {len(pending)} обновлений за {self.shutdown_timeout} с, отмена')
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def close(self):
+        await self.drain()
+        await super().close()
+
+
+WEBHOOK_HANDLER = web.AppKey('webhook_handler', BoundedRequestHandler)
+
+
+def create_webhook_app(dispatcher: Dispatcher, bot: Bot, path: str = None, max_concurrent: int = None,
+                       secret_token: Optional[str] = None, shutdown_timeout: float = None) -> web.Application:
+    handler = BoundedRequestHandler(
+        dispatcher, bot,
+        max_concurrent=max_concurrent or settings.BOT_MAX_CONCURRENT_UPDATES,
+        secret_token=secret_token,
+        shutdown_timeout=settings.WEBHOOK_SHUTDOWN_TIMEOUT if shutdown_timeout is None else shutdown_timeout,
+    )
+    app = web.Application()
+    handler.register(app, path=path or settings.WEBHOOK_PATH)
+    app[WEBHOOK_HANDLER] = handler
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({'in_flight': handler.in_flight, 'accepted': handler.accepted})
+
+    app.router.add_get('/health', health)
+    return app
+
+
+async def serve_webhook(app: web.Application, host: str, port: int, reuse_port: bool = False,
+                        stop: Optional[asyncio.Event] = None):
+    """Обслуживание до сигнала SIGTERM/SIGINT (или stop), затем корректная остановка"""
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    runner = web.AppRunner(app, access_log=None, handle_signals=False)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port, reuse_port=reuse_port).start()
+        logger.info(f'Webhook-сервер слушает {host}:{port}')
+        await stop.wait()
+        logger.info('Остановка webhook-сервера')
+    finally:
+        # Сначала закрывается прием соединений, затем on_shutdown дожидается фоновых задач
+        await runner.cleanup()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+
+
+def webhook_url() -> str:
+    return settings.WEBHOOK_BASE_URL.rstrip('/') + settings.WEBHOOK_PATH
+
+
+async def register_webhook(bot: Bot, dispatcher: Dispatcher, workers: int):
+    await bot.set_webhook(
+        webhook_url(),
+        secret_token=settings.WEBHOOK_SECRET,
+        max_connections=min(100, workers * settings.BOT_MAX_CONCURRENT_UPDATES),
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+    logger.info(f'Вебхук зарегистрирован: {webhook_url()}')
+
+
+async def _worker_main(worker: int, workers: int):
+    bot = create_bot()
+    services = await start_services(worker)
+    try:
+        app = create_webhook_app(create_dispatcher(), bot, secret_token=settings.WEBHOOK_SECRET)
+        await serve_webhook(app, settings.WEBHOOK_HOST, settings.WEBHOOK_PORT, reuse_port=workers > 1)
+    finally:
+        await bot.session.close()
+        await stop_services(services)
+
+
+def _worker_process(worker: int, workers: int):
+    # Процессы пишут в собственные файлы логов: ротация одного файла из нескольких процессов ломается
+    log_file = Path(settings.LOG_FILE)
+    setup_logging(settings.LOG_LEVEL, str(log_file.with_name(f'{log_file.stem}.{worker}{log_file.suffix}')))
+    asyncio.run(_worker_main(worker, workers))
+
+
+def run_webhook(workers: int = 1):
+    """Запуск workers процессов на одном порту; один процесс работает без дочерних"""
+    if workers <= 1:
+        asyncio.run(_worker_main(0, 1))
+        return
+
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_worker_process, args=(n, workers), name=f'webhook-{n}')
+                 for n in range(workers)]
+    stopping = False
+
+    def forward(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    previous = {sig: signal.signal(sig, forward) for sig in (signal.SIGTERM, signal.SIGINT)}
+    try:
+        for process in processes:
+            process.start()
+        logger.info(f'Запущено webhook-процессов: {workers}')
+
+        # Процесс, завершившийся сам (не по сигналу), останавливает остальные:
+        # перезапуск — забота systemd/Docker
+        while any(process.is_alive() for process in processes):
+            for process in processes:
+                process.join(timeout=1)
+                if not stopping and process.exitcode is not None:
+                    logger.error(f'Процесс {process.name} завершился с кодом {process.exitcode}')
+                    forward(None, None)
+    finally:
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
@@ -1,5 +1,6 @@
 from pydantic_settings import SettingsConfigDict, BaseSettings
 from pathlib import Path
+from typing import List, Optional
 import sys
 
 possible_paths = [
@@ -38,6 +39,106 @@ class Settings(BaseSettings):
     YC_MAX_TOKENS: int
     YC_FOLDER_ID: str
 
+    # Прием обновлений: polling или webhook (aiohttp, см. src/bot/webhook.py)
+    BOT_MODE: str = 'polling'
+    BOT_MAX_CONCURRENT_UPDATES: int = 100
+    WEBHOOK_BASE_URL: Optional[str] = None
+    WEBHOOK_PATH: str = '/webhook'
+    WEBHOOK_SECRET: Optional[str] = None
+    WEBHOOK_HOST: str = '0.0.0.0'
+    WEBHOOK_PORT: int = 8080
+    WEBHOOK_WORKERS: int = 1
+    WEBHOOK_SHUTDOWN_TIMEOUT: float = 30.0
+
+    # Пул соединений с БД
+    DB_ECHO: bool = False
+    DB_POOL_ENABLED: bool = True
+    DB_POOL_SIZE: int = 5
+    DB_POOL_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE: int = 1800
+    DB_STATEMENT_CACHE_SIZE: int = 256
+
+    # Кэш нормализованных вопросов перед YandexGPT
+    QUESTION_CACHE_ENABLED: bool = True
+    QUESTION_CACHE_SIZE: int = 1000
+    QUESTION_CACHE_TTL: int = 7 * 24 * 3600
+    QUESTION_CACHE_PATH: Optional[str] = None
+
+    # Кэш результатов SQL (сбрасывается при изменении версии данных)
+    RESULT_CACHE_ENABLED: bool = True
+    RESULT_CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+    # Версия данных сверяется не чаще раза в N секунд: на столько ответы могут отставать от загрузки
+    RESULT_CACHE_VERSION_CHECK_INTERVAL: float = 1.0
+
+    # Системный промпт из фрагментов, подобранных под вопрос (см. src/llm_service/prompt_builder.py)
+    PROMPT_RETRIEVAL_ENABLED: bool = False
+    PROMPT_TOKEN_BUDGET: int = 1500
+    PROMPT_MAX_EXAMPLES: int = 3
+
+    # Память проверенных пар "вопрос → SQL": ответ на почти такой же вопрос и примеры для промпта
+    FEW_SHOT_MEMORY_ENABLED: bool = False
+    FEW_SHOT_MEMORY_PATH: str = 'data/few_shot_memory.jsonl'
+    FEW_SHOT_REUSE_THRESHOLD: float = 92
+    FEW_SHOT_EXAMPLES: int = 3
+
+    # Планировщик запросов к YandexGPT
+    LLM_MAX_IN_FLIGHT: int = 4
+    LLM_MAX_QUEUE: int = 100
+    LLM_REQUEST_DEADLINE: float = 30.0
+    # Несколько моделей в YC_MODELS (через запятую): дублирующий запрос во вторую модель,
+    # если первая не ответила за свой p90 (до набора статистики — за LLM_HEDGE_DELAY)
+    LLM_HEDGE_QUANTILE: float = 0.9
+    LLM_HEDGE_DELAY: float = 2.0
+    LLM_ATTEMPT_TIMEOUT: float = 15.0
+    LLM_MAX_ERROR_RATE: float = 0.5
+
+    # Песочница для сгенерированного SQL: отдельный пул, READ ONLY, лимиты по классам
+    SANDBOX_ENABLED: bool = True
+    SANDBOX_POOL_SIZE: int = 5
+    SANDBOX_INTERACTIVE_TIMEOUT_MS: int = 5000
+    SANDBOX_INTERACTIVE_WORK_MEM: str = '16MB'
+    SANDBOX_INTERACTIVE_MAX_COST: float = 2_000_000
+    SANDBOX_BATCH_TIMEOUT_MS: int = 60000
+    SANDBOX_BATCH_WORK_MEM: str = '64MB'
+    SANDBOX_BATCH_MAX_COST: float = 100_000_000
+    # Литералы выносятся в параметры, операторы кэшируются на соединении по отпечатку
+    SANDBOX_PREPARED_STATEMENTS: bool = True
+    SANDBOX_STATEMENT_CACHE_SIZE: int = 200
+
+    # Пакетные вопросы файлом (см. src/services/batch.py): лимиты стадий LLM и БД
+    BATCH_ENABLED: bool = True
+    BATCH_MAX_QUESTIONS: int = 500
+    BATCH_MAX_FILE_BYTES: int = 512 * 1024
+    BATCH_LLM_CONCURRENCY: int = 4
+    BATCH_DB_CONCURRENCY: int = 3
+
+    # Помесячное секционирование snapshots по created_at (см. src/db/partitions.py)
+    SNAPSHOTS_PARTITIONED: bool = False
+
+    # Разбор частых вопросов правилами без обращения к LLM
+    FAST_PATH_ENABLED: bool = True
+
+    # Ответы по часовым/суточным агрегатам вместо полного прохода по snapshots
+    QUERY_ROLLUPS_ENABLED: bool = True
+
+    # Колоночная копия videos/snapshots в памяти для агрегатных запросов (см. src/analytics)
+    COLUMNAR_ENABLED: bool = False
+    COLUMNAR_VERSION_CHECK_INTERVAL: float = 1.0
+
+    # Метрики в формате Prometheus на локальном HTTP /metrics; /stats — для ADMIN_IDS (JSON-список)
+    METRICS_ENABLED: bool = False
+    METRICS_HOST: str = '127.0.0.1'
+    METRICS_PORT: int = 9100
+    ADMIN_IDS: List[int] = []
+
+    # Логи пишутся в фоновом потоке (очередь); шумные логгеры — не чаще LOG_SAMPLE_RATE записей в секунду
+    LOG_QUEUE_ENABLED: bool = True
+    LOG_JSON: bool = False
+    LOG_SAMPLED_LOGGERS: List[str] = ['sqlalchemy.engine', 'aiogram.event']
+    LOG_SAMPLE_RATE: float = 10.0
+
     # DB
     @property
     def DATABASE_URL_asyncpg(self):
@@ -1,30 +1,161 @@
+import atexit
+import copy
+import json
 import logging
+import queue
 import sys
+import threading
+import time
+from datetime import datetime, timezone
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Optional, Sequence, TextIO
 from src.config.config import settings
 
-def setup_logging(level: str = settings.logger_level, log_file: str = settings.logger_file):
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Фоновый поток записи логов текущего процесса (см. setup_logging)
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, логгер, сообщение, исключение"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+        }
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+_plain = logging.Formatter()
+
+
+class _QueueHandler(QueueHandler):
+    """В очередь уходит запись с готовым текстом сообщения и трассировки
+
+    В отличие от QueueHandler.prepare трассировка остается отдельно (exc_text),
+    поэтому JsonFormatter в фоновом потоке выносит ее в свое поле.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _plain.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """Не больше rate записей в секунду от каждого из шумных логгеров (и их потомков)
+
+    Ограничение — корзина токенов на логгер с запасом burst. WARNING и выше
+    проходят всегда. Число пропущенных записей добавляется к следующей
+    прошедшей: в текст сообщения и в поле suppressed.
+    """
+
+    def __init__(self, loggers: Sequence[str], rate: float = 10.0, burst: float = None):
+        super().__init__()
+        self.prefixes = tuple(loggers)
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self._buckets: Dict[str, list] = {}     # логгер -> [токены, время пополнения, пропущено]
+        self._lock = threading.Lock()
+
+    def _limited(self, name: str) -> Optional[str]:
+        for prefix in self.prefixes:
+            if name == prefix or name.startswith(prefix + '.'):
+                return prefix
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        prefix = self._limited(record.name)
+        if prefix is None:
+            return True
+        # Без очереди фильтр стоит на нескольких обработчиках: решение одно на запись
+        decided = getattr(record, '_rate_limited', None)
+        if decided is not None:
+            return decided
+        record._rate_limited = self._take(prefix, record)
+        return record._rate_limited
+
+    def _take(self, prefix: str, record: logging.LogRecord) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.setdefault(prefix, [self.burst, now, 0])
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+
+        if suppressed:
+            record.suppressed = suppressed
+            record.msg = f'{record.getMessage()} [пропущено похожих записей: {suppressed}]'
+            record.args = None
+        return True
+
+
+def stop_logging():
+    """Запись оставшихся в очереди сообщений и остановка фонового потока"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def setup_logging(level: str = settings.logger_level, log_file: str = settings.logger_file,
+                  json_format: bool = None, use_queue: bool = None, sampled_loggers: Sequence[str] = None,
+                  sample_rate: float = None, stream: TextIO = None):
+    """Логи в stdout и файл с ротацией
+
+    С use_queue обработчики работают в фоновом потоке (QueueListener), а в
+    цикле событий запись только кладется в очередь. Записи sampled_loggers
+    (например, эхо SQL) прореживаются до sample_rate в секунду.
+    """
+    global _listener
+    json_format = settings.LOG_JSON if json_format is None else json_format
+    use_queue = settings.LOG_QUEUE_ENABLED if use_queue is None else use_queue
+    sampled_loggers = settings.LOG_SAMPLED_LOGGERS if sampled_loggers is None else sampled_loggers
+    sample_rate = settings.LOG_SAMPLE_RATE if sample_rate is None else sample_rate
 
     log_path = Path(log_file)
     log_path.parent.mkdir(parents=True, exist_ok=True)
 
     log_level = getattr(logging, level.upper(), logging.INFO)
 
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
 
     root_logger = logging.getLogger()
     root_logger.setLevel(log_level)
 
-    for handler in root_logger.handlers:
+    stop_logging()
+    for handler in root_logger.handlers[:]:
         root_logger.removeHandler(handler)
+        handler.close()
 
-    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler = logging.StreamHandler(stream or sys.stdout)
     console_handler.setFormatter(formatter)
-    root_logger.addHandler(console_handler)
 
     file_handler = RotatingFileHandler(
         log_file,
@@ -33,10 +164,29 @@ def setup_logging(level: str = settings.logger_level, log_file: str = settings.l
         encoding='utf-8'
     )
     file_handler.setFormatter(formatter)
-    root_logger.addHandler(file_handler)
+    handlers = [console_handler, file_handler]
+
+    if use_queue:
+        log_queue = queue.SimpleQueue()
+        queue_handler = _QueueHandler(log_queue)
+        entry_handlers = [queue_handler]
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+    else:
+        entry_handlers = handlers
+
+    # Фильтр на обработчике видит и записи, пришедшие от дочерних логгеров
+    if sampled_loggers and sample_rate > 0:
+        sampling = RateLimitFilter(sampled_loggers, sample_rate)
+        for handler in entry_handlers:
+            handler.addFilter(sampling)
+    for handler in entry_handlers:
+        root_logger.addHandler(handler)
 
     logging.getLogger('asyncio').setLevel(logging.WARNING)
     logging.getLogger('aiogram').setLevel(logging.INFO)
 
     return root_logger
 
+
+atexit.register(stop_logging)
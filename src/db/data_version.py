@@ -0,0 +1,32 @@
+from sqlalchemy import text
+
+from src.db.database import get_async_session
+
+# Одна строка с id=1; UPSERT, чтобы не требовать отдельной инициализации
+BUMP_VERSION_SQL = (
+    "INSERT INTO data_version (id, version, updated_at) VALUES (1, 1, now()) "
+    "ON CONFLICT (id) DO UPDATE SET version = data_version.version + 1, updated_at = now() "
+    "RETURNING version"
+)
+GET_VERSION_SQL = "SELECT version FROM data_version WHERE id = 1"
+
+
+async def bump_data_version(session) -> int:
+    """Увеличение версии данных в транзакции переданной сессии
+
+    Вызывается в той же транзакции, что и запись данных, поэтому новая
+    версия становится видна ровно вместе с новыми данными.
+    """
+    res = await session.execute(text(BUMP_VERSION_SQL))
+    return res.scalar_one()
+
+
+async def bump_data_version_raw(pg_conn) -> int:
+    """То же для asyncpg соединения (пакетная загрузка через COPY)"""
+    return await pg_conn.fetchval(BUMP_VERSION_SQL)
+
+
+async def get_data_version() -> int:
+    async with get_async_session() as session:
+        res = await session.execute(text(GET_VERSION_SQL))
+        return res.scalar() or 0
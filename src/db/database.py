@@ -1,17 +1,54 @@
-from contextlib import asynccontextmanager
-from typing import AsyncGenerator
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+import asyncio
+import logging
+from contextlib import asynccontextmanager, AsyncExitStack
+from typing import AsyncGenerator, Dict
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.pool import NullPool
 
 from src.config.config import settings
 
-async_engine = create_async_engine(
-    url=settings.DATABASE_URL_asyncpg,
-    echo=True,
-    future=True,
-    poolclass=NullPool,
-)
+
+def create_engine_from_settings(pooled: bool = None, **overrides) -> AsyncEngine:
+    """Создание движка по настройкам DB_* из .env
+
+    pooled=False дает прежнее поведение (NullPool: новое соединение на каждую сессию).
+    Размер кэша подготовленных выражений задается и для SQLAlchemy-адаптера,
+    и для собственного кэша asyncpg, чтобы повторные запросы не парсились заново.
+    """
+    if pooled is None:
+        pooled = settings.DB_POOL_ENABLED
+
+    if settings.DB_ECHO:
+        # Не echo=True: SQLAlchemy добавил бы собственный синхронный вывод в stdout мимо
+        # очереди логов и прореживания (см. setup_logging)
+        logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
+
+    kwargs = dict(
+        url=settings.DATABASE_URL_asyncpg,
+        future=True,
+        connect_args={
+            'statement_cache_size': settings.DB_STATEMENT_CACHE_SIZE,
+            'prepared_statement_cache_size': settings.DB_STATEMENT_CACHE_SIZE,
+        },
+    )
+    if pooled:
+        kwargs.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_POOL_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_pre_ping=settings.DB_POOL_PRE_PING,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+        )
+    else:
+        kwargs['poolclass'] = NullPool
+
+    kwargs.update(overrides)
+    return create_async_engine(**kwargs)
+
+
+async_engine = create_engine_from_settings()
 
 async_session_factory = async_sessionmaker(
     async_engine,
@@ -23,8 +60,9 @@ class Base(DeclarativeBase):
     pass
 
 @asynccontextmanager
-async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
-    async with async_session_factory() as session:
+async def get_async_session(bind: AsyncConnection = None) -> AsyncGenerator[AsyncSession, None]:
+    """Сессия с фиксацией в конце; bind — уже открытое соединение вместо соединения из пула"""
+    async with (async_session_factory(bind=bind) if bind is not None else async_session_factory()) as session:
         try:
             yield session
             await session.commit()
@@ -38,4 +76,53 @@ async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
 async def init_db():
     async with async_engine.begin() as conn:
         # await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+        # create_all не добавляет индексы к уже существующим таблицам
+        await conn.run_sync(_create_missing_indexes)
+
+
+def _create_missing_indexes(sync_conn):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
+async def warm_up_pool(engine: AsyncEngine = async_engine, connections: int = None) -> int:
+    """Заранее открывает соединения пула, чтобы первые запросы не платили за handshake
+
+    Соединения открываются одновременно (иначе пул отдавал бы одно и то же)
+    и возвращаются в пул. Для NullPool ничего не делает. Возвращает число соединений.
+    """
+    if isinstance(engine.pool, NullPool):
+        return 0
+
+    connections = connections or settings.DB_POOL_SIZE
+
+    async with AsyncExitStack() as stack:
+        conns = await asyncio.gather(*(stack.enter_async_context(engine.connect()) for _ in range(connections)))
+        await asyncio.gather(*(conn.execute(text('SELECT 1')) for conn in conns))
+
+    return connections
+
+
+# Секции snapshots (snapshots_yYYYYmMM) суммируются в одну строку таблицы
+TABLE_READS_SQL = r"""
+SELECT regexp_replace(relname, '_y\d{4}m\d{2}$', '') AS table_name,
+       sum(seq_scan), sum(seq_tup_read), sum(COALESCE(idx_scan, 0)), sum(COALESCE(idx_tup_fetch, 0))
+FROM pg_stat_user_tables
+GROUP BY 1
+"""
+
+
+async def table_read_stats(engine: AsyncEngine = async_engine) -> Dict[str, dict]:
+    """Накопленные Postgres счетчики чтения таблиц: сканирования и прочитанные строки
+
+    Счетчики общие для всех клиентов БД (включая загрузчик), а не только для бота.
+    """
+    async with engine.connect() as conn:
+        rows = (await conn.execute(text(TABLE_READS_SQL))).all()
+    return {
+        table: {'seq_scan': int(seq_scan), 'seq_rows': int(seq_rows),
+                'idx_scan': int(idx_scan), 'idx_rows': int(idx_rows)}
+        for table, seq_scan, seq_rows, idx_scan, idx_rows in rows
+    }
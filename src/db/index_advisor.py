@@ -0,0 +1,174 @@
+"""Советник по индексам: прогон сгенерированного SQL из логов через EXPLAIN
+
+Запуск: python -m src.db.index_advisor [logs/bot.log ...] [--top 20]
+
+Из логов бота (текстовых или LOG_JSON) берутся записи 'Сгенерирован SQL: ...',
+одинаковые запросы схлопываются, каждый выполняется через EXPLAIN (ANALYZE, BUFFERS) в транзакции,
+которая затем откатывается. В отчете — запросы, в плане которых остался
+Seq Scan по большим таблицам или полный проход по индексу с отбрасыванием
+строк фильтром, с фильтром, временем и числом прочитанных страниц.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from sqlalchemy import text
+
+from src.config.config import settings
+from src.db.database import async_engine
+from src.db.query_router import make_sargable, route_to_rollups
+from src.db.result_cache import canonicalize_sql
+
+logger = logging.getLogger(__name__)
+
+_GENERATED_SQL = re.compile(r'Сгенерирован SQL: (.+)$', re.S)
+
+
+@dataclass
+class SeqScan:
+    node_type: str
+    relation: str
+    filter: str
+    rows: int
+    shared_blocks: int
+
+
+@dataclass
+class QueryReport:
+    sql: str
+    count: int
+    execution_ms: float = 0.0
+    seq_scans: List[SeqScan] = field(default_factory=list)
+    error: str = ''
+
+
+def _log_message(line: str) -> str:
+    """Текст записи: поле message для строки JSON (LOG_JSON), иначе строка целиком"""
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return line
+        if isinstance(entry, dict):
+            return str(entry.get('message', ''))
+    return line
+
+
+def read_generated_sql(paths: Iterable[Path]) -> Counter:
+    """Частоты сгенерированных запросов (по канонической форме) из файлов логов"""
+    counts: Counter = Counter()
+    for path in paths:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                match = _GENERATED_SQL.search(_log_message(line.rstrip('\n')))
+                if match:
+                    counts[canonicalize_sql(match.group(1))] += 1
+    return counts
+
+
+def find_seq_scans(plan: Dict) -> List[SeqScan]:
+    """Узлы плана, читающие таблицу целиком
+
+    Кроме Seq Scan сюда попадают индексные сканы, у которых фильтр отбросил
+    больше строк, чем вернул: индекс по выражению в фильтре не используется.
+    """
+    scans = []
+    node_type = plan.get('Node Type', '')
+    loops = plan.get('Actual Loops', 1)
+    returned = plan.get('Actual Rows', 0) * loops
+    removed = plan.get('Rows Removed by Filter', 0) * loops
+    if node_type == 'Seq Scan' or (node_type.endswith('Scan') and removed > returned):
+        scans.append(SeqScan(
+            node_type=('Parallel ' if plan.get('Parallel Aware') else '') + node_type,
+            relation=plan.get('Relation Name', '?'),
+            filter=plan.get('Filter', ''),
+            rows=returned + removed,
+            shared_blocks=plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0),
+        ))
+    for child in plan.get('Plans', []):
+        scans.extend(find_seq_scans(child))
+    return scans
+
+
+async def explain(sql: str, count: int) -> QueryReport:
+    report = QueryReport(sql=sql, count=count)
+    if not sql.startswith('select'):
+        report.error = 'не SELECT, пропущен'
+        return report
+
+    async with async_engine.connect() as conn:
+        trans = await conn.begin()
+        try:
+            # EXPLAIN ANALYZE выполняет запрос: только чтение и откат в конце
+            await conn.execute(text("SET TRANSACTION READ ONLY"))
+            res = await conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}"))
+            raw = res.scalar()
+            explained = (json.loads(raw) if isinstance(raw, str) else raw)[0]
+            report.execution_ms = explained.get('Execution Time', 0.0)
+            report.seq_scans = find_seq_scans(explained['Plan'])
+        except Exception as e:
+            report.error = str(e).splitlines()[0]
+        finally:
+            await trans.rollback()
+    return report
+
+
+def format_report(reports: List[QueryReport], min_rows: int) -> str:
+    lines = []
+    flagged = [
+        r for r in reports
+        if r.error or any(s.rows >= min_rows for s in r.seq_scans)
+    ]
+    flagged.sort(key=lambda r: r.execution_ms * r.count, reverse=True)
+
+    for r in flagged:
+        lines.append(f"[x{r.count}] {r.execution_ms:.1f} мс  {r.sql}")
+        if r.error:
+            lines.append(f"    ошибка: {r.error}")
+        for s in r.seq_scans:
+            if s.rows >= min_rows:
+                lines.append(f"    {s.node_type} {s.relation}: {s.rows} строк, {s.shared_blocks} страниц"
+                             + (f", фильтр {s.filter}" if s.filter else ''))
+
+    lines.append(f"Всего уникальных запросов: {len(reports)}, с полным сканированием: "
+                 f"{sum(1 for r in flagged if not r.error)}, с ошибками: {sum(1 for r in reports if r.error)}")
+    return '\n'.join(lines)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('logs', nargs='*', type=Path, default=[Path(settings.logger_file)])
+    parser.add_argument('--top', type=int, default=50, help="сколько самых частых запросов проверять")
+    parser.add_argument('--min-rows', type=int, default=1000,
+                        help="Seq Scan по меньшему числу строк не считается проблемой")
+    parser.add_argument('--no-rollups', action='store_true',
+                        help="не переписывать запросы на агрегаты (по умолчанию как в боте)")
+    args = parser.parse_args()
+
+    counts = read_generated_sql(p for p in args.logs if p.exists())
+    if not counts:
+        print('В логах нет сгенерированного SQL')
+        return
+
+    routed: Counter = Counter()
+    for sql, count in counts.items():
+        sql = make_sargable(sql)
+        if settings.QUERY_ROLLUPS_ENABLED and not args.no_rollups:
+            sql = route_to_rollups(sql)
+        sql = canonicalize_sql(sql)
+        routed[sql] += count
+
+    reports = [await explain(sql, count) for sql, count in routed.most_common(args.top)]
+    print(format_report(reports, args.min_rows))
+    await async_engine.dispose()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main())
@@ -1,8 +1,9 @@
 import datetime
 from typing import Optional, Annotated
+from src.config.config import settings
 from src.db.database import Base
-from sqlalchemy import ForeignKey, Integer, DateTime
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import ForeignKey, Index, Integer, BigInteger, DateTime, LargeBinary, UniqueConstraint, func
+from sqlalchemy.orm import Mapped, mapped_column, relationship, declared_attr
 
 intpk = Annotated[int, mapped_column(primary_key=True)]
 
@@ -11,8 +12,8 @@ class VideosOrm(Base):
 
     id: Mapped[intpk]
     video_id: Mapped[str] = mapped_column(unique=True)
-    creator_id: Mapped[str] = mapped_column()
-    video_created_at: Mapped[Optional[datetime.datetime]]
+    creator_id: Mapped[str] = mapped_column(index=True)
+    video_created_at: Mapped[Optional[datetime.datetime]] = mapped_column(index=True)
     views_count: Mapped[Optional[int]] = mapped_column(Integer)
     likes_count: Mapped[Optional[int]] = mapped_column(Integer)
     comments_count: Mapped[Optional[int]] = mapped_column(Integer)
@@ -41,11 +42,31 @@ class VideosOrm(Base):
             "snapshots": [s.to_dict() for s in self.snapshots]
         }
 
+# При секционировании по месяцам created_at входит в первичный ключ и в
+# уникальный ключ снапшота: PostgreSQL требует ключ секционирования в каждом из них
+SNAPSHOTS_PARTITIONED = settings.SNAPSHOTS_PARTITIONED
+SNAPSHOT_CONFLICT_COLUMNS = ('snapshot_id', 'created_at') if SNAPSHOTS_PARTITIONED else ('snapshot_id',)
+
+_snapshot_indexes = (
+    # Отдельный индекс по video_id не нужен: его покрывает левый столбец составного
+    Index('ix_snapshots_video_id_created_at', 'video_id', 'created_at'),
+    # Снапшоты пишутся по времени, BRIN дает диапазоны по дате почти бесплатно
+    Index('ix_snapshots_created_at_brin', 'created_at', postgresql_using='brin'),
+)
+
+
 class SnapshotsOrm(Base):
     __tablename__ = 'snapshots'
+    if SNAPSHOTS_PARTITIONED:
+        __table_args__ = _snapshot_indexes + (
+            UniqueConstraint('snapshot_id', 'created_at', name='snapshots_snapshot_id_created_at_key'),
+            {'postgresql_partition_by': 'RANGE (created_at)'},
+        )
+    else:
+        __table_args__ = _snapshot_indexes
 
-    id: Mapped[intpk]
-    snapshot_id: Mapped[str] = mapped_column(unique=True)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    snapshot_id: Mapped[str] = mapped_column(unique=not SNAPSHOTS_PARTITIONED)
     video_id: Mapped[str] = mapped_column(ForeignKey('videos.video_id', ondelete="CASCADE"), nullable=False)
     views_count: Mapped[Optional[int]] = mapped_column(Integer)
     likes_count: Mapped[Optional[int]] = mapped_column(Integer)
@@ -55,7 +76,7 @@ class SnapshotsOrm(Base):
     delta_likes_count: Mapped[Optional[int]] = mapped_column(Integer)
     delta_reports_count: Mapped[Optional[int]] = mapped_column(Integer)
     delta_comments_count: Mapped[Optional[int]] = mapped_column(Integer)
-    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, index=True, primary_key=SNAPSHOTS_PARTITIONED)
     updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
 
     videos: Mapped["VideosOrm"] = relationship(
@@ -78,4 +99,99 @@ class SnapshotsOrm(Base):
             "delta_likes_count": self.delta_likes_count or 0,
             "delta_comments_count": self.delta_comments_count or 0,
             "delta_reports_count": self.delta_reports_count or 0
-        }
\ No newline at end of file
+        }
+
+
+class DataVersionOrm(Base):
+    """Счетчик версии данных: увеличивается при каждой записи загрузчиком"""
+    __tablename__ = 'data_version'
+
+    id: Mapped[intpk]
+    version: Mapped[int] = mapped_column(BigInteger, default=0)
+    updated_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime, server_default=func.now())
+
+    def __repr__(self):
+        return f"<DataVersion(version={self.version})>"
+
+
+class LoadCheckpointOrm(Base):
+    """Состояние инкрементальной загрузки файла (см. data_loader.incremental)
+
+    videos_done — сколько видео из файла уже записано (позиция для продолжения
+    после сбоя), *_watermark — самый свежий updated_at загруженных строк,
+    pending_*_watermark — то же для незавершенной загрузки.
+    """
+    __tablename__ = 'load_checkpoints'
+
+    source: Mapped[str] = mapped_column(primary_key=True)
+    file_hash: Mapped[str]
+    status: Mapped[str]
+    videos_done: Mapped[int] = mapped_column(BigInteger, default=0)
+    errors: Mapped[int] = mapped_column(BigInteger, default=0)
+    videos_watermark: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime)
+    snapshots_watermark: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime)
+    pending_videos_watermark: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime)
+    pending_snapshots_watermark: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime)
+    updated_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime, server_default=func.now())
+
+    def __repr__(self):
+        return f"<LoadCheckpoint(source='{self.source}', status='{self.status}', videos_done={self.videos_done})>"
+
+
+class VideoLoadDigestOrm(Base):
+    """Хеш JSON видео вместе со снапшотами на момент последней успешной загрузки"""
+    __tablename__ = 'video_load_digests'
+
+    video_id: Mapped[str] = mapped_column(primary_key=True)
+    digest: Mapped[bytes] = mapped_column(LargeBinary)
+
+
+class _StatsRollupMixin:
+    """Агрегаты снапшотов за период (час или сутки)
+
+    Для каждой метрики хранится сумма прироста целиком, только положительной
+    и только отрицательной части, чтобы фильтры delta_..._count > 0 / < 0
+    тоже можно было ответить из агрегата.
+    """
+    bucket: Mapped[datetime.datetime] = mapped_column(DateTime, primary_key=True, index=True)
+    snapshots_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    delta_views_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    delta_views_count_pos: Mapped[int] = mapped_column(BigInteger, default=0)
+    delta_views_count_neg: Mapped[int] = mapped_column(BigInteger, default=0)
+    delta_likes_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    delta_likes_count_pos: Mapped[int] = mapped_column(BigInteger, default=0)
+    delta_likes_count_neg: Mapped[int] = mapped_column(BigInteger, default=0)
+    delta_comments_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    delta_comments_count_pos: Mapped[int] = mapped_column(BigInteger, default=0)
+    delta_comments_count_neg: Mapped[int] = mapped_column(BigInteger, default=0)
+    delta_reports_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    delta_reports_count_pos: Mapped[int] = mapped_column(BigInteger, default=0)
+    delta_reports_count_neg: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+class _VideoRollupMixin(_StatsRollupMixin):
+    video_id: Mapped[str] = mapped_column(primary_key=True)
+
+    @declared_attr
+    def creator_id(cls) -> Mapped[str]:
+        return mapped_column(index=True)
+
+
+class _CreatorRollupMixin(_StatsRollupMixin):
+    creator_id: Mapped[str] = mapped_column(primary_key=True)
+
+
+class VideoStatsHourlyOrm(_VideoRollupMixin, Base):
+    __tablename__ = 'video_stats_hourly'
+
+
+class VideoStatsDailyOrm(_VideoRollupMixin, Base):
+    __tablename__ = 'video_stats_daily'
+
+
+class CreatorStatsHourlyOrm(_CreatorRollupMixin, Base):
+    __tablename__ = 'creator_stats_hourly'
+
+
+class CreatorStatsDailyOrm(_CreatorRollupMixin, Base):
+    __tablename__ = 'creator_stats_daily'
@@ -0,0 +1,302 @@
+"""Помесячное секционирование таблицы snapshots
+
+Запуск:
+    python -m src.db.partitions list
+    python -m src.db.partitions ensure 2025-11 --months 3
+    python -m src.db.partitions detach 2025-06 --archive-dir data/archive
+    python -m src.db.partitions convert
+
+Секционирование включается настройкой SNAPSHOTS_PARTITIONED (см. models.SnapshotsOrm).
+Секции создаются загрузчиком автоматически, индексы, объявленные на snapshots,
+PostgreSQL создает в каждой секции сам. Старые месяцы можно отсоединить,
+выгрузить в CSV (gzip) и удалить; агрегаты за эти месяцы удаляются вместе с ними.
+
+Секция DEFAULT (snapshots_default) принимает строки, для месяца которых секции
+нет (например, ее удалили, пока другой процесс считал ее существующей), —
+вместо ошибки и отката всего пакета. Когда секция месяца создается, его строки
+переносятся из DEFAULT в нее. Снапшоты без created_at загрузчик отбрасывает
+построчно с ошибкой в логе: created_at входит в первичный ключ.
+"""
+import argparse
+import asyncio
+import gzip
+import logging
+import time
+from datetime import date, datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from src.config.config import settings
+from src.db.database import async_engine, get_async_session
+from src.db.data_version import bump_data_version, bump_data_version_raw
+from src.db.rollups import GRANULARITIES
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = 'snapshots'
+DEFAULT_PARTITION = f'{PARENT_TABLE}_default'
+
+# Секции, существование которых подтверждено в этом процессе: месяц (None — DEFAULT) →
+# время проверки. Через PARTITION_RECHECK_SECONDS проверка повторяется: секцию могли
+# отсоединить или удалить из другого процесса
+_known_partitions: Dict[Optional[date], float] = {}
+PARTITION_RECHECK_SECONDS = 60.0
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def next_month(month: date) -> date:
+    return date(month.year + (month.month == 12), month.month % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f'{PARENT_TABLE}_y{month.year}m{month.month:02d}'
+
+
+def _create_partition_sql(month: date) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {PARENT_TABLE} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+    )
+
+
+CREATE_DEFAULT_PARTITION_SQL = f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT"
+
+
+def _month_range(month: date) -> str:
+    return f"created_at >= '{month.isoformat()}' AND created_at < '{next_month(month).isoformat()}'"
+
+
+def forget_partitions():
+    """Сброс кэша секций: следующая запись заново проверит их в БД (например, после ошибки пакета)"""
+    _known_partitions.clear()
+
+
+async def _create_partition(fetchval: Callable[[str], Awaitable], execute: Callable[[str], Awaitable],
+                            month: date):
+    # Пока в DEFAULT есть строки этого месяца, PostgreSQL не даст создать секцию:
+    # они переносятся в нее в той же транзакции
+    moved = await fetchval(f"SELECT COUNT(*) FROM {DEFAULT_PARTITION} WHERE {_month_range(month)}")
+    if moved:
+        await execute(f"CREATE TEMP TABLE partition_move AS SELECT * FROM {DEFAULT_PARTITION} "
+                      f"WHERE {_month_range(month)}")
+        await execute(f"DELETE FROM {DEFAULT_PARTITION} WHERE {_month_range(month)}")
+    await execute(_create_partition_sql(month))
+    if moved:
+        await execute(f"INSERT INTO {PARENT_TABLE} SELECT * FROM partition_move")
+        await execute("DROP TABLE partition_move")
+        logger.warning(f"Создана секция {partition_name(month)}, из {DEFAULT_PARTITION} перенесено {moved} строк")
+    else:
+        logger.info(f"Создана секция {partition_name(month)}")
+
+
+async def ensure_partitions(fetchval: Callable[[str], Awaitable], execute: Callable[[str], Awaitable],
+                            timestamps: Iterable[Optional[datetime]]):
+    """Создает секцию DEFAULT и недостающие месячные секции для переданных моментов времени
+
+    fetchval/execute выполняют SQL в транзакции вызывающего (сессия или asyncpg).
+    Существование проверяется через to_regclass, чтобы не брать блокировку
+    родительской таблицы на CREATE, когда секция уже есть.
+    """
+    now = time.monotonic()
+
+    def unchecked(month: Optional[date]) -> bool:
+        checked_at = _known_partitions.get(month)
+        return checked_at is None or now - checked_at >= PARTITION_RECHECK_SECONDS
+
+    if unchecked(None):
+        if not await fetchval(f"SELECT to_regclass('{DEFAULT_PARTITION}') IS NOT NULL"):
+            await execute(CREATE_DEFAULT_PARTITION_SQL)
+            logger.info(f"Создана секция {DEFAULT_PARTITION}")
+        _known_partitions[None] = now
+
+    months = {month_start(ts) for ts in timestamps if ts is not None}
+    for month in sorted(filter(unchecked, months)):
+        if not await fetchval(f"SELECT to_regclass('{partition_name(month)}') IS NOT NULL"):
+            await _create_partition(fetchval, execute, month)
+        _known_partitions[month] = now
+
+
+def session_partition_ops(session) -> Tuple[Callable, Callable]:
+    async def fetchval(sql: str):
+        return (await session.execute(text(sql))).scalar()
+
+    async def execute(sql: str):
+        await session.execute(text(sql))
+
+    return fetchval, execute
+
+
+def asyncpg_partition_ops(pg_conn) -> Tuple[Callable, Callable]:
+    return pg_conn.fetchval, pg_conn.execute
+
+
+async def is_partitioned() -> bool:
+    async with get_async_session() as session:
+        res = await session.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = :table AND c.relnamespace = 'public'::regnamespace)"
+        ), {'table': PARENT_TABLE})
+        return bool(res.scalar())
+
+
+async def prepare_partitions():
+    """Проверка при старте: таблица секционирована, секции текущего и следующего месяца есть"""
+    if not await is_partitioned():
+        raise RuntimeError(
+            "SNAPSHOTS_PARTITIONED включен, но таблица snapshots не секционирована: "
+            "выполните python -m src.db.partitions convert"
+        )
+    current = month_start(datetime.now())
+    async with get_async_session() as session:
+        await ensure_partitions(*session_partition_ops(session), [current, next_month(current)])
+
+
+async def list_partitions() -> List[Tuple[str, str, int]]:
+    """Секции snapshots: имя, границы, оценка числа строк"""
+    async with get_async_session() as session:
+        res = await session.execute(text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = CAST(:table AS regclass) ORDER BY c.relname"
+        ), {'table': PARENT_TABLE})
+        return [tuple(row) for row in res.fetchall()]
+
+
+async def detach_partition(month: date, archive_dir: Optional[Path] = None, drop: bool = True) -> Optional[Path]:
+    """Отсоединяет секцию месяца, при необходимости выгружает ее в CSV и удаляет
+
+    Агрегаты за этот месяц удаляются в той же транзакции, что и отсоединение,
+    и версия данных увеличивается, поэтому кэш результатов сбросится.
+    """
+    name = partition_name(month)
+    start, end = month.isoformat(), next_month(month).isoformat()
+
+    async with async_engine.connect() as conn:
+        pg_conn = (await conn.get_raw_connection()).driver_connection
+
+        async with pg_conn.transaction():
+            await pg_conn.execute(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}")
+            for suffix in GRANULARITIES.values():
+                for table in (f'video_stats_{suffix}', f'creator_stats_{suffix}'):
+                    await pg_conn.execute(
+                        f"DELETE FROM {table} WHERE bucket >= '{start}' AND bucket < '{end}'"
+                    )
+            await bump_data_version_raw(pg_conn)
+        _known_partitions.pop(month, None)
+        logger.info(f"Секция {name} отсоединена")
+
+        archive_path = None
+        if archive_dir is not None:
+            archive_dir.mkdir(parents=True, exist_ok=True)
+            archive_path = archive_dir / f'{name}.csv.gz'
+            with gzip.open(archive_path, 'wb') as f:
+                await pg_conn.copy_from_table(name, output=f, format='csv', header=True)
+            logger.info(f"Секция {name} выгружена в {archive_path}")
+
+        if drop:
+            await pg_conn.execute(f"DROP TABLE {name}")
+            logger.info(f"Секция {name} удалена")
+
+    return archive_path
+
+
+async def convert_to_partitioned():
+    """Перенос существующей несекционированной snapshots в секционированную
+
+    Старая таблица переименовывается, новая создается по модели вместе с
+    секцией DEFAULT, данные копируются целиком в одной транзакции. Снапшоты
+    без created_at в секционированную таблицу не попадают (их число выводится в лог).
+    """
+    from src.db.models import SnapshotsOrm
+
+    if not settings.SNAPSHOTS_PARTITIONED:
+        raise RuntimeError("Сначала включите SNAPSHOTS_PARTITIONED: схема новой таблицы берется из модели")
+    if await is_partitioned():
+        logger.info("Таблица snapshots уже секционирована")
+        return
+
+    columns = ', '.join(c.name for c in SnapshotsOrm.__table__.columns)
+    old = f'{PARENT_TABLE}_unpartitioned'
+
+    async with async_engine.begin() as conn:
+        # Имена индексов и последовательности должны освободиться для новой таблицы
+        indexes = (await conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = 'public' AND tablename = :table"
+        ), {'table': PARENT_TABLE})).scalars().all()
+        await conn.execute(text(f"ALTER TABLE {PARENT_TABLE} RENAME TO {old}"))
+        for index in indexes:
+            await conn.execute(text(f"ALTER INDEX {index} RENAME TO {index}_unpartitioned"))
+        await conn.execute(text(f"ALTER SEQUENCE IF EXISTS {PARENT_TABLE}_id_seq RENAME TO {old}_id_seq"))
+
+        await conn.run_sync(lambda sync_conn: SnapshotsOrm.__table__.create(sync_conn))
+
+        months = (await conn.execute(text(
+            f"SELECT DISTINCT date_trunc('month', created_at) FROM {old} WHERE created_at IS NOT NULL"
+        ))).scalars().all()
+        for month in sorted(months):
+            await conn.execute(text(_create_partition_sql(month_start(month))))
+        await conn.execute(text(CREATE_DEFAULT_PARTITION_SQL))
+
+        await conn.execute(text(
+            f"INSERT INTO {PARENT_TABLE} ({columns}) SELECT {columns} FROM {old} WHERE created_at IS NOT NULL"
+        ))
+        skipped = (await conn.execute(text(f"SELECT COUNT(*) FROM {old} WHERE created_at IS NULL"))).scalar()
+        await conn.execute(text(
+            f"SELECT setval('{PARENT_TABLE}_id_seq', COALESCE((SELECT MAX(id) FROM {PARENT_TABLE}), 0) + 1, false)"
+        ))
+        await conn.execute(text(f"DROP TABLE {old}"))
+        await bump_data_version(conn)
+
+    logger.info(f"Таблица snapshots секционирована по месяцам: {len(months)} секций")
+    if skipped:
+        logger.warning(f"Пропущено снапшотов без created_at: {skipped}")
+
+
+def _parse_month(value: str) -> date:
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('list', help="список секций")
+
+    ensure = commands.add_parser('ensure', help="создать секции заранее")
+    ensure.add_argument('month', type=_parse_month, help="первый месяц, ГГГГ-ММ")
+    ensure.add_argument('--months', type=int, default=1)
+
+    detach = commands.add_parser('detach', help="отсоединить (и выгрузить) секцию месяца")
+    detach.add_argument('month', type=_parse_month, help="месяц, ГГГГ-ММ")
+    detach.add_argument('--archive-dir', type=Path, help="каталог для CSV-архива")
+    detach.add_argument('--keep', action='store_true', help="не удалять отсоединенную таблицу")
+
+    commands.add_parser('convert', help="секционировать существующую таблицу snapshots")
+
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for name, bounds, rows in await list_partitions():
+            print(f"{name:<24} {bounds:<70} ~{rows} строк")
+    elif args.command == 'ensure':
+        months = [args.month]
+        while len(months) < args.months:
+            months.append(next_month(months[-1]))
+        async with get_async_session() as session:
+            await ensure_partitions(*session_partition_ops(session), months)
+    elif args.command == 'detach':
+        await detach_partition(args.month, args.archive_dir, drop=not args.keep)
+    elif args.command == 'convert':
+        await convert_to_partitioned()
+
+    await async_engine.dispose()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,249 @@
+import logging
+import re
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+from src.db.result_cache import canonicalize_sql
+
+logger = logging.getLogger(__name__)
+
+_METRIC = r'delta_(views|likes|comments|reports)_count'
+
+_SELECT = re.compile(
+    rf"^select (?:(coalesce)\(sum\({_METRIC}\), 0\)|sum\({_METRIC}\)|(count)\(\*\)|(count)\(distinct video_id\)) "
+    r"from snapshots where (.+)$"
+)
+
+_COND_RANGE = re.compile(r"^created_at (>=|<) '([^']+)'$")
+_COND_DATE = re.compile(r"^date\(created_at\) = '(\d{4}-\d{2}-\d{2})'$")
+_COND_CREATOR = re.compile(r"^video_id in \(select video_id from videos where creator_id = '([^']+)'\)$")
+_COND_VIDEO = re.compile(r"^video_id = '([^']+)'$")
+_COND_SIGN = re.compile(rf"^{_METRIC} (>|<) 0$")
+
+# Функции над столбцом времени мешают индексам и отсечению секций
+_TIME_COLUMN = r'((?:\w+\.)?(?:created_at|video_created_at))'
+_NOT_EXPRESSION = r'(?!\s*(?:::|[-+*/]))'
+_DATE_COMPARE = re.compile(
+    rf"\bdate\(\s*{_TIME_COLUMN}\s*\)\s*(>=|<=|=|<|>)\s*'(\d{{4}}-\d{{2}}-\d{{2}})'{_NOT_EXPRESSION}", re.I)
+_DATE_BETWEEN = re.compile(
+    rf"(?<!not )\bdate\(\s*{_TIME_COLUMN}\s*\)\s+between\s+'(\d{{4}}-\d{{2}}-\d{{2}})'\s+and\s+"
+    rf"'(\d{{4}}-\d{{2}}-\d{{2}})'{_NOT_EXPRESSION}", re.I)
+_YEAR_MONTH = re.compile(
+    rf"(?<!not )\bextract\(\s*year\s+from\s+{_TIME_COLUMN}\s*\)\s*=\s*(\d{{4}})\s+and\s+"
+    rf"extract\(\s*month\s+from\s+\1\s*\)\s*=\s*(\d{{1,2}})\b{_NOT_EXPRESSION}", re.I)
+_YEAR = re.compile(
+    rf"\bextract\(\s*year\s+from\s+{_TIME_COLUMN}\s*\)\s*=\s*(\d{{4}})\b{_NOT_EXPRESSION}", re.I)
+
+
+def _range(column: str, start: date, end: date) -> str:
+    return f"({column} >= '{start.isoformat()}' AND {column} < '{end.isoformat()}')"
+
+
+def _date_compare(m) -> str:
+    column, op, value = m.group(1), m.group(2), date.fromisoformat(m.group(3))
+    following = value + timedelta(days=1)
+    if op == '=':
+        return _range(column, value, following)
+    if op in ('>=', '<'):
+        return f"{column} {op} '{value.isoformat()}'"
+    # DATE(x) > D  ⇔ x >= D+1;  DATE(x) <= D  ⇔ x < D+1
+    return f"{column} {'>=' if op == '>' else '<'} '{following.isoformat()}'"
+
+
+def _date_between(m) -> str:
+    start, end = date.fromisoformat(m.group(2)), date.fromisoformat(m.group(3))
+    return _range(m.group(1), start, end + timedelta(days=1))
+
+
+def _year_month(m) -> str:
+    year, month = int(m.group(2)), int(m.group(3))
+    if not 1 <= month <= 12:
+        return m.group()
+    return _range(m.group(1), date(year, month, 1), date(year + (month == 12), month % 12 + 1, 1))
+
+
+def _year(m) -> str:
+    year = int(m.group(2))
+    return _range(m.group(1), date(year, 1, 1), date(year + 1, 1, 1))
+
+
+def make_sargable(sql: str) -> str:
+    """Замена DATE()/EXTRACT() над временем на эквивалентные диапазоны
+
+    DATE(created_at) = '2025-11-27' → (created_at >= '2025-11-27' AND created_at < '2025-11-28'),
+    EXTRACT(YEAR ...) = 2025 AND EXTRACT(MONTH ...) = 6 → диапазон месяца.
+    Так запрос использует индексы по времени, а для секционированной snapshots
+    затрагивает только секции нужных месяцев. Замена скобочная и меняет только
+    сравнения с константой, поэтому смысл запроса сохраняется.
+    """
+    rewritten = _DATE_BETWEEN.sub(_date_between, sql)
+    rewritten = _DATE_COMPARE.sub(_date_compare, rewritten)
+    rewritten = _YEAR_MONTH.sub(_year_month, rewritten)
+    rewritten = _YEAR.sub(_year, rewritten)
+    if rewritten != sql:
+        logger.info(f"Фильтры по времени переписаны в диапазоны: {rewritten}")
+    return rewritten
+
+
+def _unwrap(condition: str) -> Optional[List[str]]:
+    """Условие в лишних внешних скобках раскрывается в список условий"""
+    if not (condition.startswith('(') and condition.endswith(')')):
+        return [condition]
+    depth, quoted = 0, False
+    for i, ch in enumerate(condition):
+        if ch == "'":
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+            if depth == 0 and i != len(condition) - 1:
+                return [condition]      # (a) and (b): скобки не внешние
+    return _split_conditions(condition[1:-1])
+
+
+def _split_conditions(where: str) -> Optional[List[str]]:
+    """Разбиение WHERE по AND верхнего уровня (вне скобок и кавычек)"""
+    parts, depth, quoted, start = [], 0, False, 0
+    i = 0
+    while i < len(where):
+        ch = where[i]
+        if ch == "'":
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and where.startswith(' and ', i):
+            parts.append(where[start:i].strip())
+            i += len(' and ')
+            start = i
+            continue
+        i += 1
+    parts.append(where[start:].strip())
+    if depth != 0 or quoted or any(' or ' in p or ' between ' in p for p in parts):
+        return None
+
+    conditions = []
+    for part in parts:
+        unwrapped = _unwrap(part)
+        if unwrapped is None:
+            return None
+        conditions.extend(unwrapped)
+    return conditions
+
+
+def _parse_ts(value: str) -> Optional[datetime]:
+    try:
+        ts = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    # Литералы с часовым поясом сравниваются иначе, чем границы агрегатов
+    return ts if ts.tzinfo is None else None
+
+
+def _is_hour_aligned(ts: datetime) -> bool:
+    return ts == ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _is_day_aligned(ts: datetime) -> bool:
+    return _is_hour_aligned(ts) and ts.hour == 0
+
+
+def route_to_rollups(sql: str) -> str:
+    """Переписывает подходящий запрос к snapshots на часовые/суточные агрегаты
+
+    Поддерживаются SUM(delta_*_count), COUNT(*) и COUNT(DISTINCT video_id)
+    с фильтрами: окно created_at >= / < по границам часов, DATE(created_at) = день,
+    автор через подзапрос, конкретное видео, знак прироста той же метрики.
+    Любой другой запрос возвращается без изменений.
+    """
+    canonical = canonicalize_sql(sql)
+    match = _SELECT.match(canonical)
+    if not match:
+        return sql
+
+    coalesce, coalesce_metric, plain_metric, count_all, count_videos, where = match.groups()
+    metric = coalesce_metric or plain_metric
+
+    conditions = _split_conditions(where)
+    if not conditions:
+        return sql
+
+    start = end = None
+    creator_id = video_id = sign = None
+    for cond in conditions:
+        if m := _COND_RANGE.match(cond):
+            ts = _parse_ts(m.group(2))
+            if ts is None:
+                return sql
+            if m.group(1) == '>=' and start is None:
+                start = ts
+            elif m.group(1) == '<' and end is None:
+                end = ts
+            else:
+                return sql
+        elif m := _COND_DATE.match(cond):
+            if start is not None or end is not None:
+                return sql
+            start = datetime.fromisoformat(m.group(1))
+            end = start + timedelta(days=1)
+        elif m := _COND_CREATOR.match(cond):
+            creator_id = m.group(1)
+        elif m := _COND_VIDEO.match(cond):
+            video_id = m.group(1)
+        elif m := _COND_SIGN.match(cond):
+            # Фильтр по знаку допустим только для той же метрики, что суммируется,
+            # или для COUNT(DISTINCT video_id) (видео, у которых был прирост)
+            if sign is not None or (metric and m.group(1) != metric) or count_all:
+                return sql
+            metric = metric or m.group(1)
+            sign = m.group(2)
+        else:
+            return sql
+
+    if start is None or end is None or start >= end:
+        return sql
+    if creator_id and video_id:
+        return sql
+
+    if _is_day_aligned(start) and _is_day_aligned(end):
+        suffix = 'daily'
+    elif _is_hour_aligned(start) and _is_hour_aligned(end):
+        suffix = 'hourly'
+    else:
+        return sql
+
+    # Без фильтра по видео агрегаты авторов меньше и отвечают на тот же вопрос
+    if count_videos or video_id:
+        table = f'video_stats_{suffix}'
+    else:
+        table = f'creator_stats_{suffix}'
+
+    filters = [f"bucket >= '{start.isoformat(sep=' ')}'", f"bucket < '{end.isoformat(sep=' ')}'"]
+    if creator_id:
+        filters.append(f"creator_id = '{creator_id}'")
+    if video_id:
+        filters.append(f"video_id = '{video_id}'")
+
+    column = f'delta_{metric}_count' if metric else None
+    if sign:
+        column += '_pos' if sign == '>' else '_neg'
+
+    if count_videos:
+        if sign:
+            filters.append(f"{column} {sign} 0")
+        select = 'COUNT(DISTINCT video_id)'
+    elif count_all:
+        select = 'COALESCE(SUM(snapshots_count), 0)'
+    elif coalesce:
+        select = f'COALESCE(SUM({column}), 0)'
+    elif sign:
+        # SUM без COALESCE по пустой выборке дает NULL, а агрегат — 0: не переписываем
+        return sql
+    else:
+        select = f'SUM({column})'
+
+    routed = f"SELECT {select} FROM {table} WHERE {' AND '.join(filters)}"
+    logger.info(f"Запрос переписан на агрегаты: {routed}")
+    return routed
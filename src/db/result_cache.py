@@ -0,0 +1,138 @@
+import logging
+import re
+import sys
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+_QUOTED_OR_OTHER = re.compile(r"('(?:[^']|'')*')|([^']+)")
+_SPACES = re.compile(r'\s+')
+_ENTRY_OVERHEAD = 200      # Примерные накладные расходы OrderedDict и кортежа записи, байт
+
+
+def canonicalize_sql(sql: str) -> str:
+    """Каноническая форма SQL для ключа кэша
+
+    Пробелы схлопываются, ';' в конце убирается, регистр приводится к нижнему
+    везде, кроме строковых литералов (ID и даты в кавычках регистрозависимы).
+    """
+    parts = []
+    for quoted, other in _QUOTED_OR_OTHER.findall(sql.strip().rstrip(';').strip()):
+        parts.append(quoted if quoted else _SPACES.sub(' ', other.lower()))
+    return ''.join(parts)
+
+
+def _estimate_size(key: str, row: Optional[tuple]) -> int:
+    size = sys.getsizeof(key) + _ENTRY_OVERHEAD
+    if row is not None:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+    return size
+
+
+class QueryResultCache:
+    """Кэш результатов SQL, инвалидируемый по версии данных
+
+    Ключ — каноническая форма SQL. Перед чтением кэш сверяет версию данных
+    (см. db.data_version): загрузчик увеличивает ее в той же транзакции, что
+    и запись, поэтому ответы сбрасываются ровно тогда, когда меняются данные.
+    version_check_interval > 0 позволяет проверять версию не чаще раза в N секунд.
+    Объем ограничен max_bytes, вытеснение — LRU.
+    """
+
+    def __init__(self, version_loader: Callable[[], Awaitable[int]], max_bytes: int = 16 * 1024 * 1024,
+                 version_check_interval: float = 0.0, clock: Callable[[], float] = time.monotonic):
+        self.version_loader = version_loader
+        self.max_bytes = max_bytes
+        self.version_check_interval = version_check_interval
+        self.clock = clock
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._version: Optional[int] = None
+        self._version_checked_at: Optional[float] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_db_seconds = 0.0
+
+    async def _sync_version(self):
+        now = self.clock()
+        if (self._version_checked_at is not None
+                and now - self._version_checked_at < self.version_check_interval):
+            return
+
+        version = await self.version_loader()
+        self._version_checked_at = now
+        if version != self._version:
+            if self._entries:
+                logger.info(f"Версия данных изменилась ({self._version} → {version}), кэш результатов сброшен")
+                self.invalidations += 1
+            self.clear()
+            self._version = version
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def invalidate(self):
+        """Локальный сброс (например, после записи в этом же процессе)"""
+        self.clear()
+        self._version_checked_at = None
+
+    async def fetch_one(self, sql: str, execute: Callable[[str], Awaitable[Optional[tuple]]]) -> Optional[tuple]:
+        """Первая строка результата sql из кэша или через execute(sql)"""
+        await self._sync_version()
+        key = canonicalize_sql(sql)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            row, elapsed, _ = entry
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_db_seconds += elapsed
+            return row
+
+        self.misses += 1
+        version = self._version
+        started = time.perf_counter()
+        row = await execute(sql)
+        elapsed = time.perf_counter() - started
+        row = tuple(row) if row is not None else None
+
+        # Пока шел запрос, данные могли обновиться: такой результат не кэшируем
+        if version == self._version:
+            self._store(key, row, elapsed)
+        return row
+
+    def _store(self, key: str, row: Optional[tuple], elapsed: float):
+        size = _estimate_size(key, row)
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[2]
+        self._entries[key] = (row, elapsed, size)
+        self._bytes += size
+
+        while self._bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / total if total else 0.0,
+            'saved_db_seconds': round(self.saved_db_seconds, 3),
+            'data_version': self._version,
+        }
@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import text
+
+from src.db.data_version import bump_data_version
+from src.db.database import get_async_session
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = {'hour': 'hourly', 'day': 'daily'}
+METRICS = ('views', 'likes', 'comments', 'reports')
+
+ROLLUP_COLUMNS = ['snapshots_count'] + [
+    f'delta_{m}_count{suffix}' for m in METRICS for suffix in ('', '_pos', '_neg')
+]
+
+# Суммы из снапшотов: общая, положительная и отрицательная часть прироста
+_SNAPSHOT_AGGREGATES = ', '.join(['COUNT(*)'] + [
+    expr
+    for m in METRICS
+    for expr in (
+        f'COALESCE(SUM(s.delta_{m}_count), 0)',
+        f'COALESCE(SUM(GREATEST(s.delta_{m}_count, 0)), 0)',
+        f'COALESCE(SUM(LEAST(s.delta_{m}_count, 0)), 0)',
+    )
+])
+_ROLLUP_SUMS = ', '.join(f'SUM(v.{c})' for c in ROLLUP_COLUMNS)
+_COLUMN_LIST = ', '.join(ROLLUP_COLUMNS)
+
+CREATE_DELTA_SQL = (
+    "CREATE TEMP TABLE IF NOT EXISTS rollup_delta (creator_id varchar, bucket timestamp, "
+    + ', '.join(f'{c} bigint' for c in ROLLUP_COLUMNS) + ")"
+)
+_NEGATED = ', '.join(f'-{c}' for c in ROLLUP_COLUMNS)
+_DELTA_SUMS = ', '.join(f'SUM({c})' for c in ROLLUP_COLUMNS)
+
+
+def _refresh_statements(granularity: str) -> List[tuple]:
+    """SQL пересчета агрегатов для набора видео ($1 — массив video_id)
+
+    Агрегаты видео пересчитываются из snapshots целиком для затронутых видео.
+    Агрегаты авторов обновляются разницей: удаленные строки видео вычитаются,
+    новые прибавляются (суммы и количества аддитивны), поэтому стоимость
+    зависит от числа измененных строк, а не от числа видео у автора. Старые
+    строки вычитаются со старым creator_id, так что смена автора тоже учитывается.
+    Периоды автора, в которых не осталось снапшотов, удаляются.
+    """
+    suffix = GRANULARITIES[granularity]
+    video_table = f'video_stats_{suffix}'
+    creator_table = f'creator_stats_{suffix}'
+    add_list = ', '.join(f'{c} = {creator_table}.{c} + EXCLUDED.{c}' for c in ROLLUP_COLUMNS)
+
+    return [
+        ("DELETE FROM rollup_delta", False),
+        (
+            f"WITH old AS (DELETE FROM {video_table} WHERE video_id = ANY($1) "
+            f"RETURNING creator_id, bucket, {_COLUMN_LIST}) "
+            f"INSERT INTO rollup_delta SELECT creator_id, bucket, {_NEGATED} FROM old",
+            True,
+        ),
+        (
+            f"WITH new AS ("
+            f"INSERT INTO {video_table} (video_id, bucket, creator_id, {_COLUMN_LIST}) "
+            f"SELECT s.video_id, date_trunc('{granularity}', s.created_at), v.creator_id, {_SNAPSHOT_AGGREGATES} "
+            f"FROM snapshots s JOIN videos v ON v.video_id = s.video_id "
+            f"WHERE s.video_id = ANY($1) AND s.created_at IS NOT NULL "
+            f"GROUP BY s.video_id, date_trunc('{granularity}', s.created_at), v.creator_id "
+            f"RETURNING creator_id, bucket, {_COLUMN_LIST}) "
+            f"INSERT INTO rollup_delta SELECT creator_id, bucket, {_COLUMN_LIST} FROM new",
+            True,
+        ),
+        (
+            f"INSERT INTO {creator_table} (creator_id, bucket, {_COLUMN_LIST}) "
+            f"SELECT creator_id, bucket, {_DELTA_SUMS} FROM rollup_delta GROUP BY creator_id, bucket "
+            f"ON CONFLICT (creator_id, bucket) DO UPDATE SET {add_list}",
+            False,
+        ),
+        (
+            f"DELETE FROM {creator_table} c USING (SELECT DISTINCT creator_id, bucket FROM rollup_delta) a "
+            f"WHERE c.creator_id = a.creator_id AND c.bucket = a.bucket AND c.snapshots_count = 0",
+            False,
+        ),
+    ]
+
+
+def _rebuild_statements(granularity: str) -> List[str]:
+    suffix = GRANULARITIES[granularity]
+    video_table = f'video_stats_{suffix}'
+    creator_table = f'creator_stats_{suffix}'
+    return [
+        f"TRUNCATE {video_table}, {creator_table}",
+        f"INSERT INTO {video_table} (video_id, bucket, creator_id, {_COLUMN_LIST}) "
+        f"SELECT s.video_id, date_trunc('{granularity}', s.created_at), v.creator_id, {_SNAPSHOT_AGGREGATES} "
+        f"FROM snapshots s JOIN videos v ON v.video_id = s.video_id "
+        f"WHERE s.created_at IS NOT NULL "
+        f"GROUP BY s.video_id, date_trunc('{granularity}', s.created_at), v.creator_id",
+        f"INSERT INTO {creator_table} (creator_id, bucket, {_COLUMN_LIST}) "
+        f"SELECT v.creator_id, v.bucket, {_ROLLUP_SUMS} FROM {video_table} v GROUP BY v.creator_id, v.bucket",
+    ]
+
+
+Executor = Callable[[str, Optional[list]], Awaitable[None]]
+
+
+def session_executor(session) -> Executor:
+    async def execute(sql: str, video_ids: Optional[list] = None):
+        if video_ids is None:
+            await session.execute(text(sql))
+        else:
+            await session.execute(text(sql.replace('$1', ':video_ids')), {'video_ids': video_ids})
+    return execute
+
+
+def asyncpg_executor(pg_conn) -> Executor:
+    async def execute(sql: str, video_ids: Optional[list] = None):
+        if video_ids is None:
+            await pg_conn.execute(sql)
+        else:
+            await pg_conn.execute(sql, video_ids)
+    return execute
+
+
+async def refresh_rollups(execute: Executor, video_ids: List[str]):
+    """Инкрементальное обновление часовых и суточных агрегатов для видео
+
+    Вызывается загрузчиком в той же транзакции, что и запись снапшотов.
+    """
+    if not video_ids:
+        return
+    await execute(CREATE_DELTA_SQL, None)
+    for granularity in GRANULARITIES:
+        for sql, uses_ids in _refresh_statements(granularity):
+            await execute(sql, video_ids if uses_ids else None)
+
+
+async def clear_rollups(session):
+    for suffix in GRANULARITIES.values():
+        await session.execute(text(f"DELETE FROM video_stats_{suffix}"))
+        await session.execute(text(f"DELETE FROM creator_stats_{suffix}"))
+
+
+async def rebuild_rollups(bump_version: bool = False):
+    """Полный пересчет агрегатов из snapshots (для уже загруженных данных)
+
+    bump_version=True увеличивает версию данных в той же транзакции
+    (параллельная загрузка пересчитывает агрегаты один раз в конце).
+    """
+    async with get_async_session() as session:
+        for granularity in GRANULARITIES:
+            for sql in _rebuild_statements(granularity):
+                await session.execute(text(sql))
+        if bump_version:
+            await bump_data_version(session)
+    logger.info("Агрегаты снапшотов пересчитаны")
+
+
+async def rollups_consistent() -> bool:
+    """Быстрая сверка: число снапшотов в суточных агрегатах авторов совпадает с таблицей"""
+    async with get_async_session() as session:
+        res = await session.execute(text(
+            "SELECT (SELECT COALESCE(SUM(snapshots_count), 0) FROM creator_stats_daily) = "
+            "(SELECT COUNT(*) FROM snapshots WHERE created_at IS NOT NULL)"
+        ))
+        return bool(res.scalar())
+
+
+async def ensure_rollups():
+    """Пересчитывает агрегаты при старте, если они не соответствуют данным"""
+    if not await rollups_consistent():
+        logger.warning("Агрегаты снапшотов не соответствуют данным, выполняется полный пересчет")
+        await rebuild_rollups()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Обслуживание агрегатов снапшотов")
+    parser.add_argument('--rebuild', action='store_true', help="пересчитать агрегаты заново")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        await rebuild_rollups()
+    else:
+        print('Агрегаты согласованы' if await rollups_consistent() else 'Агрегаты НЕ согласованы (--rebuild)')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import logging
+from contextlib import AsyncExitStack
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import asyncpg
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.config.config import settings
+from src.db.database import async_engine, create_engine_from_settings
+from src.db.sql_parser import SQLParameterizer, SQLValidationError, coerce_params
+from src.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRejected(Exception):
+    """Сгенерированный запрос не выполнен: слишком дорогой или не уложился во время"""
+
+    def __init__(self, reason: str, detail: str = ''):
+        super().__init__(f'{reason}: {detail}' if detail else reason)
+        self.reason = reason
+        self.detail = detail
+
+
+@dataclass(frozen=True)
+class ResourceClass:
+    statement_timeout_ms: int
+    work_mem: str
+    max_cost: float         # 0 — без ограничения по оценке планировщика
+
+
+def resource_classes_from_settings() -> Dict[str, ResourceClass]:
+    return {
+        'interactive': ResourceClass(
+            statement_timeout_ms=settings.SANDBOX_INTERACTIVE_TIMEOUT_MS,
+            work_mem=settings.SANDBOX_INTERACTIVE_WORK_MEM,
+            max_cost=settings.SANDBOX_INTERACTIVE_MAX_COST,
+        ),
+        'batch': ResourceClass(
+            statement_timeout_ms=settings.SANDBOX_BATCH_TIMEOUT_MS,
+            work_mem=settings.SANDBOX_BATCH_WORK_MEM,
+            max_cost=settings.SANDBOX_BATCH_MAX_COST,
+        ),
+    }
+
+
+class SQLSandbox:
+    """Выполнение сгенерированного SQL с ограничениями
+
+    - отдельный пул соединений: тяжелые запросы не занимают пул бота и загрузчика;
+    - транзакция READ ONLY, SET LOCAL statement_timeout и work_mem по классу
+      ресурсов (interactive — ответы в чате, batch — пакетная обработка);
+    - перед выполнением EXPLAIN без ANALYZE: запрос с оценкой стоимости выше
+      max_cost отклоняется, не начав выполняться;
+    - если ожидающий запрос отменен (ответ пользователю больше не нужен),
+      запрос на сервере прерывается через pg_cancel_backend;
+    - литералы в сравнениях выносятся в параметры (db.sql_parser), и выполняется
+      отпечаток запроса: запросы одной формы имеют один текст, поэтому кэш
+      подготовленных операторов asyncpg на соединении (statement_cache_size)
+      не разбирает и не планирует их заново. Если параметры не удалось вынести
+      или привести к типам, запрос выполняется как есть.
+    """
+
+    def __init__(self, engine: AsyncEngine = None, classes: Dict[str, ResourceClass] = None,
+                 control_engine: AsyncEngine = async_engine, prepared_statements: bool = None,
+                 statement_cache_size: int = None):
+        self.statement_cache_size = statement_cache_size or settings.SANDBOX_STATEMENT_CACHE_SIZE
+        self.engine = engine or create_engine_from_settings(
+            pool_size=settings.SANDBOX_POOL_SIZE,
+            max_overflow=0,
+            connect_args={
+                'statement_cache_size': self.statement_cache_size,
+                'prepared_statement_cache_size': self.statement_cache_size,
+            },
+        )
+        self.control_engine = control_engine
+        self.classes = classes or resource_classes_from_settings()
+        self.prepared_statements = (settings.SANDBOX_PREPARED_STATEMENTS
+                                    if prepared_statements is None else prepared_statements)
+        self.parameterizer = SQLParameterizer()
+        # Типы параметров по отпечатку (зависят от схемы, а не от соединения)
+        self._param_types: Dict[str, Tuple[str, ...]] = {}
+
+        self.executed = 0
+        self.rejected_cost = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.parameterized = 0
+        self.literal_fallbacks = 0
+        # Попадание — форма запроса уже встречалась, и ее план переиспользуется из кэша asyncpg
+        self.plan_cache_hits = 0
+        self.plan_cache_misses = 0
+
+    async def fetch_one(self, sql: str, resource_class: str = 'interactive') -> Optional[tuple]:
+        try:
+            return await self._fetch_one(sql, self.classes[resource_class], self.prepared_statements)
+        except asyncpg.exceptions.InvalidCachedStatementError as e:
+            # Схема изменилась после подготовки оператора (например, пересоздана таблица)
+            logger.info(f"Подготовленный оператор устарел ({e}), запрос выполняется заново")
+            return await self._fetch_one(sql, self.classes[resource_class], False)
+
+    async def _fetch_one(self, sql: str, limits: ResourceClass, prepared: bool) -> Optional[tuple]:
+        async with AsyncExitStack() as stack:
+            with metrics.span('db_connect'):
+                conn = await stack.enter_async_context(self.engine.connect())
+                pg_conn = (await conn.get_raw_connection()).driver_connection
+            pid = pg_conn.get_server_pid()
+            with metrics.span('db_prepare'):
+                query, args = await self._parameterize(pg_conn, sql) if prepared else (sql, ())
+            try:
+                async with pg_conn.transaction(readonly=True):
+                    await pg_conn.execute(f"SET LOCAL statement_timeout = {int(limits.statement_timeout_ms)}")
+                    await pg_conn.execute(f"SET LOCAL work_mem = '{limits.work_mem}'")
+
+                    if limits.max_cost:
+                        with metrics.span('db_cost_check'):
+                            cost = await self._estimate_cost(pg_conn, query, args)
+                        if cost > limits.max_cost:
+                            self.rejected_cost += 1
+                            logger.warning(f"Запрос отклонен: оценка стоимости {cost:.0f} > {limits.max_cost:.0f}: {sql}")
+                            raise QueryRejected('cost', f'{cost:.0f}')
+
+                    with metrics.span('db_execute'):
+                        row = await pg_conn.fetchrow(query, *args)
+                    self.executed += 1
+                    return tuple(row) if row is not None else None
+
+            except asyncpg.exceptions.InvalidCachedStatementError:
+                # asyncpg уже сбросил свой кэш операторов; типы параметров тоже могли измениться
+                self._param_types.clear()
+                raise
+
+            except asyncpg.exceptions.QueryCanceledError as e:
+                self.timeouts += 1
+                logger.warning(f"Запрос прерван по statement_timeout ({limits.statement_timeout_ms} мс): {sql}")
+                raise QueryRejected('timeout', str(e)) from e
+
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                await asyncio.shield(self._cancel_backend(pid))
+                raise
+
+    async def _parameterize(self, pg_conn, sql: str) -> Tuple[str, tuple]:
+        """Отпечаток запроса и приведенные к типам параметры или (sql, ())"""
+        try:
+            parsed = self.parameterizer.parameterize(sql)
+        except SQLValidationError as e:
+            self.literal_fallbacks += 1
+            logger.debug(f"Запрос выполняется без параметров: {e}")
+            return sql, ()
+
+        type_names = self._param_types.get(parsed.fingerprint)
+        if type_names is not None:
+            self.plan_cache_hits += 1
+        else:
+            try:
+                statement = await pg_conn.prepare(parsed.fingerprint)
+            except asyncpg.PostgresError as e:
+                # Например, сервер не смог вывести тип параметра
+                self.literal_fallbacks += 1
+                logger.debug(f"Не удалось подготовить {parsed.fingerprint}: {e}")
+                return sql, ()
+            if len(self._param_types) >= self.parameterizer.max_shapes:
+                self._param_types.clear()
+            type_names = self._param_types[parsed.fingerprint] = tuple(
+                param.name for param in statement.get_parameters())
+            self.plan_cache_misses += 1
+
+        args = coerce_params(parsed.params, type_names)
+        if args is None:
+            self.literal_fallbacks += 1
+            return sql, ()
+        self.parameterized += 1
+        return parsed.fingerprint, args
+
+    @staticmethod
+    async def _estimate_cost(pg_conn, sql: str, args: tuple = ()) -> float:
+        raw = await pg_conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args)
+        plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]['Plan']
+        return float(plan['Total Cost'])
+
+    async def _cancel_backend(self, pid: int):
+        try:
+            async with self.control_engine.connect() as conn:
+                await conn.execute(text("SELECT pg_cancel_backend(:pid)"), {'pid': pid})
+            logger.info(f"Запрос на сервере (pid {pid}) отменен: ответ больше не ожидается")
+        except Exception as e:
+            logger.error(f"Не удалось отменить запрос pid {pid}: {e}")
+
+    async def close(self):
+        await self.engine.dispose()
+
+    def stats(self) -> dict:
+        pool = self.engine.pool
+        lookups = self.plan_cache_hits + self.plan_cache_misses
+        return {
+            'executed': self.executed,
+            'rejected_cost': self.rejected_cost,
+            'timeouts': self.timeouts,
+            'cancelled': self.cancelled,
+            'parameterized': self.parameterized,
+            'literal_fallbacks': self.literal_fallbacks,
+            'plan_cache_hits': self.plan_cache_hits,
+            'plan_cache_misses': self.plan_cache_misses,
+            'plan_cache_hit_rate': round(self.plan_cache_hits / lookups, 3) if lookups else 0.0,
+            'pool_checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+        }
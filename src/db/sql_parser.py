@@ -0,0 +1,226 @@
+"""Разбор сгенерированного SQL: проверка по AST, отпечаток и параметры
+
+validate_sql проверяет, что запрос — один SELECT только по разрешенным таблицам
+и функциям. parameterize заменяет литералы в сравнениях на $1..$n: одинаковые
+по форме запросы с разными датами, ID и порогами получают один отпечаток, и
+сервер может переиспользовать подготовленный план (см. db.sandbox).
+"""
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+from typing import FrozenSet, List, Optional, Sequence, Tuple
+
+import sqlglot
+from sqlglot import exp
+
+logger = logging.getLogger(__name__)
+
+DIALECT = 'postgres'
+
+ALLOWED_TABLES: FrozenSet[str] = frozenset({'videos', 'snapshots'})
+
+ALLOWED_FUNCTIONS: FrozenSet[str] = frozenset({
+    'COUNT', 'SUM', 'AVG', 'MIN', 'MAX', 'COALESCE', 'NULLIF', 'GREATEST', 'LEAST',
+    'ABS', 'ROUND', 'FLOOR', 'CEIL', 'CAST', 'CASE', 'IF',
+    'DATE', 'EXTRACT', 'DATE_TRUNC', 'TIMESTAMP_TRUNC', 'CURRENT_DATE', 'CURRENT_TIMESTAMP',
+})
+
+_FORBIDDEN_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop, exp.Alter,
+    exp.Command, exp.Into, exp.Lock, exp.Union, exp.Intersect, exp.Except,
+)
+
+# Литерал становится параметром только как операнд сравнения (тип выводит сервер
+# по второму операнду) или приведения типа. В списке SELECT, GROUP BY/ORDER BY
+# и арифметике подстановка поменяла бы смысл запроса.
+_COMPARISONS = (exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Like, exp.ILike)
+
+_LITERAL = re.compile(r"'((?:[^']|'')*)'|(?<![\w.$])(\d+(?:\.\d+)?)(?![\w.])")
+
+
+class SQLValidationError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class ParsedSQL:
+    fingerprint: str            # тот же запрос с $1..$n вместо литералов
+    params: Tuple[str, ...]     # значения литералов в порядке номеров параметров
+
+
+def _parse_one(sql: str) -> exp.Expression:
+    try:
+        statements = [s for s in sqlglot.parse(sql, read=DIALECT) if s is not None]
+    except sqlglot.errors.ParseError as e:
+        raise SQLValidationError(f"не удалось разобрать SQL: {e}") from e
+    if len(statements) != 1:
+        raise SQLValidationError(f"ожидался один запрос, получено {len(statements)}")
+    return statements[0]
+
+
+def _function_name(node: exp.Func) -> str:
+    return node.name.upper() if isinstance(node, exp.Anonymous) else node.sql_name()
+
+
+def check_tree(tree: exp.Expression, allowed_tables: FrozenSet[str] = ALLOWED_TABLES):
+    """Проверка AST; при нарушении — SQLValidationError с причиной"""
+    if not isinstance(tree, exp.Select):
+        raise SQLValidationError(f"разрешен только SELECT, получено {type(tree).__name__}")
+
+    forbidden = tree.find(*_FORBIDDEN_NODES)
+    if forbidden is not None:
+        raise SQLValidationError(f"запрещенная конструкция {type(forbidden).__name__}")
+
+    cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    for table in tree.find_all(exp.Table):
+        if table.db or table.catalog:
+            raise SQLValidationError(f"таблица со схемой: {table.sql(dialect=DIALECT)}")
+        if table.name.lower() not in allowed_tables | cte_names:
+            raise SQLValidationError(f"таблица {table.name} не разрешена")
+
+    for func in tree.find_all(exp.Func):
+        if isinstance(func, exp.Connector):
+            continue
+        name = _function_name(func)
+        if name not in ALLOWED_FUNCTIONS:
+            raise SQLValidationError(f"функция {name} не разрешена")
+
+
+def normalize_sql(sql: str, allowed_tables: FrozenSet[str] = ALLOWED_TABLES) -> str:
+    """Проверенный запрос в канонической записи sqlglot; SQLValidationError, если не прошел"""
+    tree = _parse_one(sql)
+    check_tree(tree, allowed_tables)
+    return tree.sql(dialect=DIALECT)
+
+
+def validate_sql(sql: str, allowed_tables: FrozenSet[str] = ALLOWED_TABLES) -> bool:
+    try:
+        normalize_sql(sql, allowed_tables)
+    except SQLValidationError as e:
+        logger.debug(f"Валидация: {e}")
+        return False
+    return True
+
+
+def _parameterizable(literal: exp.Literal) -> bool:
+    parent = literal.parent
+    if isinstance(parent, exp.Cast):
+        return True
+    if isinstance(parent, _COMPARISONS):
+        other = parent.expression if literal is parent.this else parent.this
+        return not isinstance(other, exp.Literal)
+    if isinstance(parent, exp.Between):
+        return not isinstance(parent.this, exp.Literal)
+    if isinstance(parent, exp.In):
+        return literal is not parent.this and not isinstance(parent.this, exp.Literal)
+    return False
+
+
+def parameterize(sql: str) -> ParsedSQL:
+    """Отпечаток запроса и значения вынесенных литералов
+
+    Проверка разрешенных таблиц здесь не делается: функция применяется к уже
+    проверенному SQL после переписываний (агрегаты, диапазоны дат).
+    """
+    parsed, _ = _parameterize_tree(_parse_one(sql))
+    return parsed
+
+
+def _parameterize_tree(tree: exp.Expression) -> Tuple[ParsedSQL, List[Tuple[str, bool]]]:
+    params = []
+    literals = []       # значения всех литералов в порядке обхода и признак выноса в параметр
+    for literal in list(tree.find_all(exp.Literal, bfs=False)):
+        if isinstance(literal.parent, exp.Parameter):
+            continue
+        replaced = _parameterizable(literal)
+        literals.append((literal.this, replaced))
+        if replaced:
+            params.append(literal.this)
+            literal.replace(exp.Parameter(this=exp.Literal.number(len(params))))
+
+    return ParsedSQL(fingerprint=tree.sql(dialect=DIALECT), params=tuple(params)), literals
+
+
+def _mask_literals(sql: str) -> Tuple[str, List[str]]:
+    values = []
+
+    def mask(match):
+        string, number = match.groups()
+        values.append(string.replace("''", "'") if string is not None else number)
+        return "'?'" if string is not None else '?'
+
+    return _LITERAL.sub(mask, sql), values
+
+
+class SQLParameterizer:
+    """parameterize с кэшем форм запросов
+
+    Разбор sqlglot стоит около миллисекунды, что сопоставимо с самим запросом.
+    Ключ кэша — текст с замаскированными литералами: для запроса знакомой формы
+    значения параметров берутся регулярным выражением, без разбора. Форма
+    кэшируется, только если литералы в тексте и в AST совпали по порядку и
+    значениям, а литералы, оставшиеся в запросе (интервалы, список SELECT),
+    входят в ключ.
+    """
+
+    def __init__(self, max_shapes: int = 1024):
+        self.max_shapes = max_shapes
+        self._shapes: "OrderedDict[str, Tuple[str, Tuple[int, ...], Tuple[str, ...]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def parameterize(self, sql: str) -> ParsedSQL:
+        masked, values = _mask_literals(sql)
+        shape = self._shapes.get(masked)
+        if shape is not None:
+            fingerprint, positions, fixed = shape
+            if fixed == tuple(v for i, v in enumerate(values) if i not in positions):
+                self.hits += 1
+                self._shapes.move_to_end(masked)
+                return ParsedSQL(fingerprint=fingerprint, params=tuple(values[i] for i in positions))
+
+        self.misses += 1
+        parsed, literals = _parameterize_tree(_parse_one(sql))
+
+        if [value for value, _ in literals] == values:
+            positions = tuple(i for i, (_, replaced) in enumerate(literals) if replaced)
+            fixed = tuple(v for i, v in enumerate(values) if i not in positions)
+            self._shapes[masked] = (parsed.fingerprint, positions, fixed)
+            if len(self._shapes) > self.max_shapes:
+                self._shapes.popitem(last=False)
+        return parsed
+
+
+def coerce_param(value: str, type_name: str):
+    """Значение литерала в тип параметра, который вывел сервер при подготовке
+
+    ValueError, если литерал не приводится (тогда запрос выполняется как есть).
+    """
+    if type_name in ('int2', 'int4', 'int8'):
+        return int(value)
+    if type_name == 'numeric':
+        return Decimal(value)
+    if type_name in ('float4', 'float8'):
+        return float(value)
+    if type_name == 'timestamp':
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is not None:
+            # Для timestamp без зоны PostgreSQL смещение в литерале отбрасывает
+            raise ValueError(f"литерал с часовым поясом: {value}")
+        return parsed
+    if type_name == 'date':
+        return date.fromisoformat(value)
+    if type_name in ('text', 'varchar', 'bpchar', 'name'):
+        return value
+    raise ValueError(f"тип параметра {type_name} не поддерживается")
+
+
+def coerce_params(params: Sequence[str], type_names: Sequence[str]) -> Optional[tuple]:
+    try:
+        return tuple(coerce_param(value, type_name) for value, type_name in zip(params, type_names))
+    except (ValueError, ArithmeticError) as e:
+        logger.debug(f"Параметры не приведены к типам {list(type_names)}: {e}")
+        return None
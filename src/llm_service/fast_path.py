@@ -0,0 +1,243 @@
+import logging
+import re
+from collections import deque
+from datetime import date, timedelta
+from typing import Callable, Deque, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_METRICS = [
+    ('views', r'просмотр(?:ов|ы|а)?'),
+    ('likes', r'лайк(?:ов|и|а)?'),
+    ('comments', r'комментари(?:ев|и|я|й)'),
+    ('reports', r'жалоб(?:ы|а)?'),
+]
+_MONTHS = [
+    r'январ[еья]', r'феврал[еья]', r'март[еа]?', r'апрел[еья]', r'ма[еяй]', r'июн[еья]',
+    r'июл[еья]', r'август[еа]?', r'сентябр[еья]', r'октябр[еья]', r'ноябр[еья]', r'декабр[еья]',
+]
+
+_METRIC = '(?:' + '|'.join(pattern for _, pattern in _METRICS) + ')'
+_MONTH = '(?:' + '|'.join(_MONTHS) + ')'
+_YEAR_SUFFIX = r'(?: ?(?:года|год|г))?'
+_MONTH_YEAR = rf'(?P<month>{_MONTH}) (?P<year>\d{{4}}){_YEAR_SUFFIX}'
+_DAY = rf'(?P<day>\d{{1,2}}) {_MONTH_YEAR}'
+_CREATOR = r'(?:креатора|автора|блогера|создателя) (?P<creator>[0-9A-Za-z][0-9A-Za-z_-]{2,})'
+_COMPARE = (r'(?P<cmp>больше чем|больше|более|свыше|выше|не менее|не меньше|как минимум|минимум|от|'
+            r'меньше чем|меньше|менее|ниже|не более|не больше|максимум|до|>=|<=|>|<)')
+_HISTORY = (r'(?P<history>в истории|когда-либо|когда либо|за всю историю|по снапшотам|в снапшотах|'
+            r'по замерам|хотя бы в одном замере)')
+
+_COMPARE_OPS = {
+    'больше чем': '>', 'больше': '>', 'более': '>', 'свыше': '>', 'выше': '>', '>': '>',
+    'не менее': '>=', 'не меньше': '>=', 'как минимум': '>=', 'минимум': '>=', 'от': '>=', '>=': '>=',
+    'меньше чем': '<', 'меньше': '<', 'менее': '<', 'ниже': '<', '<': '<',
+    'не более': '<=', 'не больше': '<=', 'максимум': '<=', 'до': '<=', '<=': '<=',
+}
+
+_THOUSANDS = re.compile(r'\b\d{1,3}(?:[  ]\d{3})+\b')
+_TRAILING = re.compile(r'[\s?!.]+$')
+_SPACES = re.compile(r'\s+')
+
+
+def _metric(word: str) -> str:
+    for name, pattern in _METRICS:
+        if re.fullmatch(pattern, word):
+            return name
+    raise ValueError(word)
+
+
+def _month(word: str) -> int:
+    for number, pattern in enumerate(_MONTHS, start=1):
+        if re.fullmatch(pattern, word):
+            return number
+    raise ValueError(word)
+
+
+def _month_range(month_word: str, year: str) -> Tuple[str, str]:
+    month = _month(month_word)
+    start = date(int(year), month, 1)
+    end = date(int(year) + (month == 12), month % 12 + 1, 1)
+    return start.isoformat(), end.isoformat()
+
+
+def _day(day: str, month_word: str, year: str) -> date:
+    return date(int(year), _month(month_word), int(day))
+
+
+def _count_videos_threshold(m) -> str:
+    creator_id, compare, number, metric = m.group('creator'), m.group('cmp'), m.group('n'), m.group('metric')
+    column = f'{_metric(metric)}_count'
+    op = _COMPARE_OPS[compare]
+    if m.group('history'):
+        creator = (f" AND video_id IN (SELECT video_id FROM videos WHERE creator_id = '{creator_id}')"
+                   if creator_id else '')
+        return f"SELECT COUNT(DISTINCT video_id) FROM snapshots WHERE {column} {op} {int(number)}{creator}"
+    where = f"creator_id = '{creator_id}' AND " if creator_id else ''
+    return f"SELECT COUNT(*) FROM videos WHERE {where}{column} {op} {int(number)}"
+
+
+def _count_published(m) -> str:
+    start, end = _month_range(m.group('month'), m.group('year'))
+    return (f"SELECT COUNT(*) FROM videos "
+            f"WHERE video_created_at >= '{start}' AND video_created_at < '{end}'")
+
+
+def _sum_published(m) -> str:
+    start, end = _month_range(m.group('month'), m.group('year'))
+    column = f"{_metric(m.group('metric'))}_count"
+    return (f"SELECT COALESCE(SUM({column}), 0) FROM videos "
+            f"WHERE video_created_at >= '{start}' AND video_created_at < '{end}'")
+
+
+def _distinct_videos_grew_on_day(m) -> str:
+    day = _day(m.group('day'), m.group('month'), m.group('year'))
+    column = f"delta_{_metric(m.group('metric'))}_count"
+    return (f"SELECT COUNT(DISTINCT video_id) FROM snapshots "
+            f"WHERE created_at >= '{day.isoformat()}' AND created_at < '{(day + timedelta(days=1)).isoformat()}' "
+            f"AND {column} > 0")
+
+
+def _creator_delta_in_window(m) -> str:
+    day = _day(m.group('day'), m.group('month'), m.group('year'))
+    start_hour, end_hour = int(m.group('h1')), int(m.group('h2'))
+    if not 0 <= start_hour < end_hour <= 24:
+        raise ValueError('окно времени')
+    start = f'{day.isoformat()} {start_hour:02d}:00:00'
+    end = (f'{day.isoformat()} {end_hour:02d}:00:00' if end_hour < 24
+           else f'{(day + timedelta(days=1)).isoformat()} 00:00:00')
+
+    column = f"delta_{_metric(m.group('metric'))}_count"
+    verb = m.group('verb')
+    if verb.startswith(('вырос', 'увеличил', 'прибав')):
+        sign = f' AND {column} > 0'
+    elif verb.startswith(('упал', 'уменьшил', 'снизил', 'потерял')):
+        sign = f' AND {column} < 0'
+    else:
+        sign = ''
+    return (f"SELECT COALESCE(SUM({column}), 0) FROM snapshots "
+            f"WHERE created_at >= '{start}' AND created_at < '{end}' "
+            f"AND video_id IN (SELECT video_id FROM videos WHERE creator_id = '{m.group('creator')}'){sign}")
+
+
+def _creator_aggregate(m) -> str:
+    column = f"{_metric(m.group('metric'))}_count"
+    func = 'AVG' if m.group('agg').startswith('средн') else 'SUM'
+    return f"SELECT COALESCE({func}({column}), 0) FROM videos WHERE creator_id = '{m.group('creator')}'"
+
+
+def _count_creator_videos(m) -> str:
+    return f"SELECT COUNT(*) FROM videos WHERE creator_id = '{m.group('creator')}'"
+
+
+# (имя правила, шаблон вопроса целиком, построитель SQL); номера — примеры из промпта
+_RULES: List[Tuple[str, str, Callable]] = [
+    # 33, 34, 39: "Сколько видео [у креатора X] набрали больше 10000 просмотров [в истории]?"
+    ('count_threshold',
+     rf'сколько (?:всего )?(?:разных )?видео(?: (?:у )?{_CREATOR})? '
+     rf'(?:имеют|имели|имеет|набрали|набирали|набрало|получили|получали) '
+     rf'{_COMPARE} (?P<n>\d+) (?P<metric>{_METRIC})(?: {_HISTORY})?(?: по итоговой статистике)?',
+     _count_videos_threshold),
+    # 35: "Сколько видео опубликовано в июне 2025?"
+    ('count_published',
+     rf'сколько (?:всего )?видео (?:было )?(?:опубликовано|опубликовали|вышло|выложено|загружено) в {_MONTH_YEAR}',
+     _count_published),
+    # 36: "Какое суммарное количество просмотров набрали все видео, опубликованные в июне 2025 года?"
+    ('sum_published',
+     rf'(?:какое )?(?:суммарное|общее) количество (?P<metric>{_METRIC}) (?:набрали |у |имеют )?(?:все )?'
+     rf'видео,? (?:опубликованные|вышедшие|выложенные) в {_MONTH_YEAR}',
+     _sum_published),
+    # 37: "Сколько разных видео получали новые просмотры 27 ноября 2025?"
+    ('distinct_grew_on_day',
+     rf'сколько (?:разных )?видео (?:получали|получили|получало) новые (?P<metric>{_METRIC}) {_DAY}',
+     _distinct_videos_grew_on_day),
+    # 38: "На сколько просмотров суммарно выросли все видео креатора X в промежутке с 10:00 до 15:00 28 ноября 2025?"
+    ('creator_delta_window',
+     rf'на сколько (?P<metric>{_METRIC}) (?:суммарно |в сумме )?'
+     rf'(?P<verb>выросли|увеличились|прибавили|изменились|упали|уменьшились|снизились|потеряли) '
+     rf'(?:все )?видео {_CREATOR} (?:в промежутке |в интервале |в период )?'
+     rf'с (?P<h1>\d{{1,2}}):00 до (?P<h2>\d{{1,2}}):00 {_DAY}',
+     _creator_delta_in_window),
+    # 40, 41: "Какое суммарное количество просмотров у автора X?", "Среднее количество просмотров на видео у автора X?"
+    ('creator_aggregate',
+     rf'(?:какое )?(?P<agg>суммарное|общее|среднее) (?:количество|число) (?P<metric>{_METRIC})'
+     rf'(?: на видео)? (?:у|всех видео) {_CREATOR}',
+     _creator_aggregate),
+    ('count_creator_videos',
+     rf'сколько (?:всего )?видео у {_CREATOR}',
+     _count_creator_videos),
+]
+
+
+class PathStats:
+    """Число обращений и задержка одного пути получения SQL (быстрый путь, LLM)"""
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.total_seconds = 0.0
+        self._latencies: Deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total_seconds += seconds
+        self._latencies.append(seconds)
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        return {
+            'count': self.count,
+            'avg_ms': self.total_seconds / self.count * 1000 if self.count else 0.0,
+            'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000 if latencies else 0.0,
+        }
+
+
+class FastPathParser:
+    """Разбор частых формулировок вопросов без обращения к LLM
+
+    Вопрос должен целиком совпасть с одним из шаблонов (примеры 33–41 из
+    промпта и их вариации). Частичное совпадение не считается: при любой
+    неуверенности parse() возвращает None, и вопрос уходит в LLM.
+    Значения в SQL подставляются только из проверенных шаблоном групп
+    (ID — буквы/цифры/дефис, числа, даты), поэтому экранирование не нужно.
+    """
+
+    def __init__(self):
+        self._rules = [(name, re.compile(pattern), build) for name, pattern, build in _RULES]
+        self.hits = 0
+        self.misses = 0
+        self.rule_hits = {name: 0 for name, _, _ in _RULES}
+
+    @staticmethod
+    def _prepare(question: str) -> str:
+        text = _THOUSANDS.sub(lambda m: re.sub(r'\D', '', m.group()), question)
+        text = text.replace('ё', 'е').replace('Ё', 'Е')
+        text = _SPACES.sub(' ', _TRAILING.sub('', text)).strip()
+        # ID регистрозависимы, поэтому в нижний регистр переводятся только русские слова
+        return re.sub(r'[А-ЯЁ]', lambda m: m.group().lower(), text)
+
+    def parse(self, question: str) -> Optional[str]:
+        text = self._prepare(question)
+        for name, pattern, build in self._rules:
+            match = pattern.fullmatch(text)
+            if match is None:
+                continue
+            try:
+                sql = build(match)
+            except (ValueError, KeyError):
+                continue
+            self.hits += 1
+            self.rule_hits[name] += 1
+            logger.debug(f"Быстрый путь, правило {name}: {sql}")
+            return sql
+        self.misses += 1
+        return None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'rules': dict(self.rule_hits),
+        }
+
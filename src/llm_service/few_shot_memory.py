@@ -0,0 +1,257 @@
+"""Память проверенных пар "вопрос → SQL" для повторного использования и few-shot
+
+Пара попадает в память после успешного ответа пользователю. Пары
+группируются по нормализованному шаблону вопроса (normalize_question): для
+группы хранится шаблон SQL, если литералы переносятся однозначно, и последние
+пары с конкретными значениями.
+
+Почти точное совпадение ищется по ключу — шаблону без слов-паразитов, в
+котором незнакомые слова заменены ближайшими словами словаря памяти
+(опечатки; знакомое слово не заменяется, поэтому "больше" не станет
+"меньше"). Если сходство вопроса без слов-паразитов с найденным ключом
+(RapidFuzz ratio) не ниже reuse_threshold и виды слотов совпадают, ответ берется из памяти,
+литералы подставляются в шаблон SQL.
+
+Иначе ближайшие пары уходят в промпт вместо статических примеров. Их ищет
+инвертированный индекс по биграммам слов ключей: для каждого терма
+просматриваются только последние postings_scan шаблонов, лучшие кандидаты
+переоцениваются token_sort_ratio. Хранилище — JSONL, запись дописывается в
+конец файла.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from rapidfuzz import fuzz, process
+
+from src.llm_service.question_cache import (NormalizedQuestion, bind_sql_template, make_sql_template,
+                                            normalize_question)
+
+logger = logging.getLogger(__name__)
+
+# Слова, которые не меняют смысл вопроса
+FILLER_WORDS = frozenset({'а', 'и', 'у', 'с', 'же', 'ну', 'id', 'мне', 'бот', 'вообще', 'пожалуйста',
+                          'скажи', 'подскажи', 'покажи', 'посчитай', 'всего'})
+TYPO_RATIO = 85
+_SLOT_KIND = re.compile(r'<(\w+)>')
+
+
+@dataclass
+class _Group:
+    template: str
+    key: str
+    kinds: Tuple[str, ...]
+    sql_template: Optional[str] = None
+    # slots → (вопрос, SQL), последние max_per_group пар
+    pairs: "OrderedDict[Tuple[str, ...], Tuple[str, str]]" = field(default_factory=OrderedDict)
+
+
+@dataclass
+class MemoryMatch:
+    sql: Optional[str] = None
+    score: float = 0.0
+    examples: List[Tuple[str, str]] = field(default_factory=list)
+
+
+def _terms(tokens: List[str]) -> List[str]:
+    # Отдельные слова встречаются почти во всех вопросах и почти не отличают их: индексируются биграммы
+    if len(tokens) < 2:
+        return tokens
+    return [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]
+
+
+class FewShotMemory:
+    """Хранилище пар с нечетким поиском по шаблонам вопросов"""
+
+    def __init__(self, path: Optional[Path] = None, reuse_threshold: float = 92, examples: int = 3,
+                 example_threshold: float = 60, max_per_group: int = 8, postings_scan: int = 32,
+                 candidates: int = 8, clock: Callable[[], float] = time.time):
+        self.path = Path(path) if path else None
+        self.reuse_threshold = reuse_threshold
+        self.examples = examples
+        self.example_threshold = example_threshold
+        self.max_per_group = max_per_group
+        self.postings_scan = postings_scan
+        self.candidates = candidates
+        self.clock = clock
+        self._groups: List[_Group] = []
+        self._by_key: Dict[str, int] = {}
+        self._postings: Dict[str, List[int]] = {}
+        # Словарь слов шаблонов по первой букве — для исправления опечаток
+        self._words: Dict[str, List[str]] = {}
+        self._vocabulary = set()
+        self.entries = 0
+        self.lookups = 0
+        self.reused = 0
+
+        if self.path and self.path.exists():
+            self._load()
+
+    def __len__(self) -> int:
+        return self.entries
+
+    def add(self, question: str, sql: str, persist: bool = True):
+        """Проверенная пара; повтор того же вопроса обновляет SQL"""
+        if self._insert(question, sql) and persist and self.path:
+            self._append({'question': question, 'sql': sql, 'ts': round(self.clock(), 3)})
+
+    async def add_async(self, question: str, sql: str):
+        """add для обработчиков бота: индекс обновляется сразу, файл дописывается в потоке"""
+        if self._insert(question, sql) and self.path:
+            await asyncio.to_thread(self._append, {'question': question, 'sql': sql, 'ts': round(self.clock(), 3)})
+
+    @staticmethod
+    def _key_tokens(template: str) -> List[str]:
+        return [token for token in template.split() if token not in FILLER_WORDS]
+
+    def _correct(self, tokens: List[str]) -> List[str]:
+        """Незнакомые слова заменяются ближайшими словами словаря"""
+        corrected = []
+        for token in tokens:
+            if token not in self._vocabulary and not token.startswith('<'):
+                match = process.extractOne(token, self._words.get(token[0], ()), scorer=fuzz.ratio,
+                                           score_cutoff=TYPO_RATIO)
+                if match is not None:
+                    token = match[0]
+            corrected.append(token)
+        return corrected
+
+    def _insert(self, question: str, sql: str) -> bool:
+        normalized = normalize_question(question)
+        tokens = self._key_tokens(normalized.template)
+        key = ' '.join(tokens)
+        index = self._by_key.get(key)
+        if index is None:
+            index = len(self._groups)
+            self._groups.append(_Group(normalized.template, key, tuple(_SLOT_KIND.findall(normalized.template))))
+            self._by_key[key] = index
+            for term in set(_terms(tokens)):
+                self._postings.setdefault(term, []).append(index)
+            for token in tokens:
+                if token not in self._vocabulary and not token.startswith('<'):
+                    self._vocabulary.add(token)
+                    self._words.setdefault(token[0], []).append(token)
+
+        group = self._groups[index]
+        slots = tuple(normalized.slots)
+        if group.pairs.get(slots) == (question, sql):
+            return False
+        sql_template = make_sql_template(sql, normalized.slots)
+        if sql_template is not None:
+            group.sql_template = sql_template
+        if slots not in group.pairs:
+            self.entries += 1
+        group.pairs[slots] = (question, sql)
+        group.pairs.move_to_end(slots)
+        while len(group.pairs) > self.max_per_group:
+            group.pairs.popitem(last=False)
+            self.entries -= 1
+        return True
+
+    def _candidates(self, tokens: List[str]) -> List[int]:
+        counts: Counter = Counter()
+        for term in set(_terms(tokens)):
+            ids = self._postings.get(term)
+            if ids:
+                counts.update(ids[-self.postings_scan:])
+        return [index for index, _ in counts.most_common(self.candidates)]
+
+    def search(self, question: str, limit: int = 3) -> List[Tuple[float, _Group]]:
+        """Ближайшие шаблоны с оценкой сходства 0..100"""
+        template = normalize_question(question).template
+        return self._search(template, self._correct(self._key_tokens(template)), limit)
+
+    def _search(self, template: str, tokens: List[str], limit: int) -> List[Tuple[float, _Group]]:
+        near = self._by_key.get(' '.join(tokens))
+        candidates = self._candidates(tokens)
+        if near is not None and near not in candidates:
+            candidates.append(near)
+        scored = [(fuzz.token_sort_ratio(template, self._groups[i].template), i) for i in candidates]
+        scored.sort(key=lambda pair: (-pair[0], pair[1] != near))
+        return [(score, self._groups[i]) for score, i in scored[:limit]]
+
+    @staticmethod
+    def _reuse(normalized: NormalizedQuestion, group: _Group) -> Optional[str]:
+        pair = group.pairs.get(tuple(normalized.slots))
+        if pair is not None:
+            return pair[1]
+        if group.sql_template is None or tuple(_SLOT_KIND.findall(normalized.template)) != group.kinds:
+            return None
+        return bind_sql_template(group.sql_template, normalized.slots)
+
+    def lookup(self, question: str, validator: Callable[[str], bool] = None) -> MemoryMatch:
+        """SQL почти точного совпадения или ближайшие пары для промпта"""
+        self.lookups += 1
+        normalized = normalize_question(question)
+        typed = self._key_tokens(normalized.template)
+        tokens = self._correct(typed)
+
+        index = self._by_key.get(' '.join(tokens))
+        if index is not None:
+            # Сходство с ключом до исправления опечаток: сколько пришлось исправить
+            group = self._groups[index]
+            score = fuzz.ratio(' '.join(typed), group.key)
+            if score >= self.reuse_threshold:
+                sql = self._reuse(normalized, group)
+                if sql and (validator is None or validator(sql)):
+                    self.reused += 1
+                    return MemoryMatch(sql=sql, score=score)
+
+        scored = self._search(normalized.template, tokens, max(self.examples, 1))
+        examples = [next(reversed(group.pairs.values())) for score, group in scored
+                    if score >= self.example_threshold]
+        return MemoryMatch(score=scored[0][0] if scored else 0.0, examples=examples)
+
+    def _append(self, record: dict):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            logger.warning(f"Не удалось записать пару в память примеров {self.path}: {e}")
+
+    def _load(self):
+        lines = 0
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self._insert(record['question'], record['sql'])
+                        lines += 1
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning(f"Пропущена поврежденная строка памяти примеров: {line[:100]!r}")
+        except OSError as e:
+            logger.warning(f"Не удалось прочитать память примеров из {self.path}: {e}")
+            return
+        logger.info(f"Загружено {self.entries} пар ({len(self._groups)} шаблонов) из {self.path}")
+        if lines > 2 * self.entries:
+            self.compact()
+
+    def compact(self):
+        """Перезапись файла без вытесненных и повторных пар (через временный файл)"""
+        tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for group in self._groups:
+                    for question, sql in group.pairs.values():
+                        f.write(json.dumps({'question': question, 'sql': sql}, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Не удалось сжать память примеров {self.path}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            'entries': self.entries,
+            'templates': len(self._groups),
+            'lookups': self.lookups,
+            'reused': self.reused,
+            'reuse_rate': self.reused / self.lookups if self.lookups else 0.0,
+        }
@@ -0,0 +1,182 @@
+"""Выбор модели YandexGPT с учетом задержек и ошибок, дублирующие запросы
+
+Для каждой модели из YC_MODELS хранится скользящее окно задержек и исходов.
+Запрос уходит в первую здоровую модель в порядке настройки (доля ошибок в
+окне меньше max_error_rate). Если она не ответила за свой p90 (hedge_quantile;
+пока замеров мало — hedge_delay), тот же запрос дублируется в самую быструю
+из остальных здоровых моделей. Побеждает первый ответ, прошедший проверку
+(accept); остальные попытки отменяются. Попытка, завершившаяся ошибкой,
+таймаутом (attempt_timeout) или непригодным ответом, сразу передает запрос
+следующей модели. Отмененные попытки в окно задержек не попадают: время до
+отмены — лишь нижняя оценка, и с ним p90 сползал бы вниз с каждым дублированием.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Меньше замеров — квантиль не считается, используется hedge_delay
+MIN_SAMPLES = 20
+
+
+class ModelRoute:
+    """Модель и скользящая статистика ее вызовов"""
+
+    def __init__(self, name: str, model: Any, window: int = 200):
+        self.name = name
+        self.model = model
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._failures: Deque[bool] = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.wins = 0
+        self.cancelled = 0
+
+    def observe(self, latency: float, ok: bool):
+        self._latencies.append(latency)
+        self._failures.append(not ok)
+        self.errors += not ok
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self._latencies) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self._failures) / len(self._failures) if self._failures else 0.0
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'wins': self.wins,
+            'cancelled': self.cancelled,
+            'error_rate': self.error_rate,
+            'p50_s': self.quantile(0.5) or 0.0,
+            'p90_s': self.quantile(0.9) or 0.0,
+        }
+
+
+class ModelRouter:
+    def __init__(self, models: Sequence[Tuple[str, Any]], hedge_quantile: float = 0.9, hedge_delay: float = 2.0,
+                 attempt_timeout: float = 15.0, max_error_rate: float = 0.5, window: int = 200):
+        if not models:
+            raise ValueError("Не задано ни одной модели")
+        self.routes = [ModelRoute(name, model, window) for name, model in models]
+        self.hedge_quantile = hedge_quantile
+        self.hedge_delay = hedge_delay
+        self.attempt_timeout = attempt_timeout
+        self.max_error_rate = max_error_rate
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+
+    def _healthy(self, route: ModelRoute) -> bool:
+        return len(route._failures) < MIN_SAMPLES or route.error_rate < self.max_error_rate
+
+    def _plan(self) -> List[ModelRoute]:
+        """Основная модель, затем запасные: самые быстрые здоровые, потом нездоровые"""
+        healthy = [r for r in self.routes if self._healthy(r)]
+        unhealthy = [r for r in self.routes if not self._healthy(r)]
+        if not healthy:
+            return unhealthy
+        backups = sorted(healthy[1:], key=lambda r: r.quantile(0.5) or float('inf'))
+        return [healthy[0]] + backups + unhealthy
+
+    def _hedge_after(self, route: ModelRoute) -> float:
+        p = route.quantile(self.hedge_quantile)
+        return self.hedge_delay if p is None else p
+
+    async def _attempt(self, route: ModelRoute, call: Callable[[Any], Awaitable[Any]],
+                       accept: Callable[[Any], Optional[T]]) -> Tuple[Optional[T], bool]:
+        """Результат accept (None — не подошел) и признак таймаута"""
+        route.requests += 1
+        started = time.perf_counter()
+        try:
+            raw = await asyncio.wait_for(call(route.model), self.attempt_timeout)
+        except asyncio.TimeoutError:
+            route.observe(time.perf_counter() - started, ok=False)
+            logger.warning(f'Модель {route.name} не ответила за {self.attempt_timeout} с')
+            return None, True
+        except asyncio.CancelledError:
+            # Проигравшая попытка: настоящая задержка неизвестна, замер не записывается
+            route.cancelled += 1
+            raise
+        except Exception as e:
+            route.observe(time.perf_counter() - started, ok=False)
+            logger.error(f'Ошибка при вызове модели {route.name}: {e}')
+            return None, False
+
+        result = accept(raw)
+        route.observe(time.perf_counter() - started, ok=result is not None)
+        return result, False
+
+    async def run(self, call: Callable[[Any], Awaitable[Any]], accept: Callable[[Any], Optional[T]]) -> Optional[T]:
+        """call(model) — вызов модели, accept(ответ) — проверенный результат или None
+
+        Если ни одна модель не дала результата и хотя бы одна не уложилась
+        в attempt_timeout, поднимается asyncio.TimeoutError.
+        """
+        plan = self._plan()
+        pending: Dict[asyncio.Task, ModelRoute] = {}
+        timed_out = False
+        # Дублирующий запрос — не больше одного и только пока основная попытка еще идет
+        can_hedge = True
+        hedge: Optional[ModelRoute] = None
+
+        def launch() -> ModelRoute:
+            route = plan.pop(0)
+            pending[asyncio.create_task(self._attempt(route, call, accept))] = route
+            return route
+
+        primary = launch()
+        try:
+            while pending:
+                wait = self._hedge_after(primary) if plan and can_hedge else None
+                done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    can_hedge = False
+                    self.hedges += 1
+                    logger.info(f'Модель {primary.name} отвечает дольше {wait:.2f} с, дублируем запрос '
+                                f'в {plan[0].name}')
+                    hedge = launch()
+                    continue
+
+                for task in done:
+                    route = pending.pop(task)
+                    result, attempt_timed_out = task.result()
+                    timed_out |= attempt_timed_out
+                    if result is not None:
+                        route.wins += 1
+                        if route is hedge:
+                            self.hedge_wins += 1
+                        return result
+
+                can_hedge = False
+                if not pending and plan:
+                    self.fallbacks += 1
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        if timed_out:
+            raise asyncio.TimeoutError()
+        return None
+
+    def stats(self) -> dict:
+        return {
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'fallbacks': self.fallbacks,
+            'models': {route.name: route.stats() for route in self.routes},
+        }
@@ -0,0 +1,268 @@
+"""Системный промпт из фрагментов, подобранных под вопрос
+
+Полный промпт (схема, 47 правил и примеры) разбит на фрагменты. Вступление,
+схема и основные правила нужны всегда; блоки правил выбираются по ключевым
+словам и шаблонам (RapidFuzz partial_ratio прощает окончания слов), примеры —
+по похожести вопроса на пример (token_set_ratio по нормализованным шаблонам,
+ID и числа замаскированы). Фрагменты добавляются по убыванию оценки, пока
+помещаются в бюджет токенов, и выводятся в исходном порядке. Пары из памяти
+примеров (few_shot_memory), если они есть, заменяют статические примеры.
+
+Токены оцениваются по длине текста (estimate_tokens): точное число для
+YandexGPT известно только из usage ответа.
+"""
+import math
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Pattern, Sequence, Tuple
+
+from rapidfuzz import fuzz
+
+from src.llm_service.question_cache import normalize_question
+
+# Для русского текста в токенизаторе YandexGPT в среднем около 3.5 символов на токен
+CHARS_PER_TOKEN = 3.5
+KEYWORD_SCORE_CUTOFF = 88
+EXAMPLE_SCORE_CUTOFF = 60
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+@dataclass(frozen=True)
+class Fragment:
+    id: str
+    text: str
+    kind: str                                   # 'base' — всегда, 'rules' — по ключевым словам, 'example'
+    keywords: Tuple[str, ...] = ()
+    patterns: Tuple[Pattern, ...] = ()
+    question: str = ''                          # вопрос примера для сравнения с вопросом пользователя
+    tokens: int = field(init=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'tokens', estimate_tokens(self.text))
+
+
+_MONTHS = r'(?:январ|феврал|март|апрел|ма[йея]|июн|июл|август|сентябр|октябр|ноябр|декабр)'
+
+
+def _example(number: int, question: str, sql: str) -> Fragment:
+    return Fragment(f'example_{number}', f'{number}. "{question}" → {sql}', 'example', question=question)
+
+
+def _memory_example(number: int, question: str, sql: str) -> Fragment:
+    return Fragment(f'memory_{number}', f'- "{question}" → {sql}', 'example', question=question)
+
+
+def with_examples(fragments: Sequence[Fragment], examples: Sequence[Tuple[str, str]]) -> List[Fragment]:
+    """Статические примеры заменяются парами из памяти (если они есть)"""
+    if not examples:
+        return list(fragments)
+    result = []
+    for fragment in fragments:
+        if fragment.kind != 'example':
+            result.append(fragment)
+        if fragment.id == 'examples_header':
+            result += [_memory_example(n, q, sql) for n, (q, sql) in enumerate(examples, 1)]
+    return result
+
+
+FRAGMENTS: List[Fragment] = [
+    Fragment('intro', (
+        "Ты — помощник для работы с базой данных статистики видео. Твоя задача: преобразовать запрос "
+        "на русском языке в SQL запрос к PostgreSQL."
+    ), 'base'),
+    Fragment('schema', """СХЕМА БАЗЫ ДАННЫХ:
+
+1. Таблица 'videos' (видео):
+   - id (integer, первичный ключ)
+   - video_id (string, UUID, уникальный идентификатор видео)
+   - creator_id (string, идентификатор автора видео)
+   - video_created_at (datetime, когда было создано видео)
+   - views_count (integer, количество просмотров)
+   - likes_count (integer, количество лайков)
+   - comments_count (integer, количество комментариев)
+   - reports_count (integer, количество жалоб)
+   - created_at (datetime, когда запись создана в БД)
+   - updated_at (datetime, когда запись обновлена в БД)
+
+2. Таблица 'snapshots' (снапшоты — срезы статистики во времени):
+   - id (integer, первичный ключ)
+   - snapshot_id (string, UUID, уникальный идентификатор снапшота)
+   - video_id (string, ссылка на videos.video_id)
+   - views_count (integer, просмотры на момент снапшота)
+   - likes_count (integer, лайки на момент снапшота)
+   - comments_count (integer, комментарии на момент снапшота)
+   - reports_count (integer, жалобы на момент снапшота)
+   - delta_views_count (integer, прирост просмотров с предыдущего снапшота)
+   - delta_likes_count (integer, прирост лайков с предыдущего снапшота)
+   - delta_comments_count (integer, прирост комментариев с предыдущего снапшота)
+   - delta_reports_count (integer, прирост жалоб с предыдущего снапшота)
+   - created_at (datetime, когда создан снапшот)
+   - updated_at (datetime, когда обновлен снапшот)""", 'base'),
+    Fragment('rules_core', """ВАЖНЫЕ ПРАВИЛА:
+1. Запрос должен возвращать ОДНО ЧИСЛО (одно значение, одна строка, один столбец).
+2. Используй только SELECT запросы.
+3. Не используй INSERT, UPDATE, DELETE, DROP.
+4. Если нужно найти видео по video_id — используй точное совпадение.
+5. Если нужно найти по creator_id — используй точное совпадение.
+6. Для подсчета количества ВИДЕО используй COUNT(DISTINCT video_id).
+7. Для подсчета количества СНАПШОТОВ используй COUNT(*).
+8. Для суммирования используй SUM(поле).
+9. Для среднего значения используй AVG(поле).
+10. Для максимального/минимального используй MAX(поле)/MIN(поле).
+11. Всегда возвращай ТОЛЬКО SQL-запрос, без пояснений, без обратных кавычек ```, без markdown.
+12. Если не можешь создать запрос, верни 'NULL'.""", 'base'),
+    Fragment('rules_dates', """ОСОБЫЕ ПРАВИЛА ДЛЯ ДАТ И ВРЕМЕНИ:
+13. Для фильтрации по КОНКРЕТНОЙ ДАТЕ используй функцию DATE(): WHERE DATE(created_at) = '2025-11-27'
+14. Для фильтрации по МЕСЯЦУ используй EXTRACT(): WHERE EXTRACT(YEAR FROM video_created_at) = 2025 AND EXTRACT(MONTH FROM video_created_at) = 6
+15. Для фильтрации по ГОДУ используй EXTRACT(): WHERE EXTRACT(YEAR FROM video_created_at) = 2025
+16. Для фильтрации по ПЕРИОДУ (с/по) используй BETWEEN: WHERE created_at BETWEEN '2025-06-01' AND '2025-06-30'
+17. Для фильтрации по ЧАСУ используй EXTRACT(HOUR FROM created_at): WHERE EXTRACT(HOUR FROM created_at) >= 10""",
+             'rules', keywords=('дата', 'дату', 'день', 'месяц', 'год', 'период', 'неделю', 'вчера', 'сегодня',
+                                'опубликован', 'час'),
+             patterns=(re.compile(_MONTHS), re.compile(r'\b\d{4}\b'), re.compile(r'\d{1,2}:\d{2}'),
+                       re.compile(r'\b\d{4}-\d{2}-\d{2}\b'))),
+    Fragment('rules_stats', """ОСОБЫЕ ПРАВИЛА ДЛЯ СТАТИСТИКИ:
+18. Для вопросов о "новых просмотрах" используй delta_views_count > 0
+19. Для вопросов о "суммарных просмотрах ВСЕХ видео" используй SUM(views_count) из таблицы videos
+20. Для вопросов о "суммарных просмотрах по снапшотам" используй SUM(views_count) из таблицы snapshots с DISTINCT или группировкой
+21. Для вопросов о "выросли/увеличились" используй фильтр delta_views_count > 0
+22. Для вопросов о "потеряли/уменьшились" используй фильтр delta_views_count < 0
+23. Для "абсолютного изменения" используй ABS(delta_views_count)""",
+             'rules', keywords=('новые', 'новых', 'суммарн', 'в сумме', 'вырос', 'увелич', 'прирост', 'потеря',
+                                'уменьш', 'изменени', 'изменил', 'прибав', 'упал', 'снизил')),
+    Fragment('rules_intervals', """ОСОБЫЕ ПРАВИЛА ДЛЯ ВРЕМЕННЫХ ИНТЕРВАЛОВ:
+24. Для интервалов "с X:00 до Y:00" используй полуоткрытый интервал: >= X AND < Y
+25. Пример: "с 10:00 до 15:00" → WHERE EXTRACT(HOUR FROM created_at) >= 10 AND EXTRACT(HOUR FROM created_at) < 15
+26. Для точных временных границ используй: WHERE created_at >= '2025-11-28 10:00:00' AND created_at < '2025-11-28 15:00:00'""",
+             'rules', keywords=('промежут', 'интервал', 'час'),
+             patterns=(re.compile(r'\d{1,2}:\d{2}'), re.compile(r'\bс \d{1,2} до \d{1,2}\b'))),
+    Fragment('rules_interpretation', """ИНТЕРПРЕТАЦИЯ ВОПРОСОВ:
+27. "по итоговой статистике", "текущие показатели", "всего" → используй таблицу videos
+28. "когда-либо имели", "в истории были", "по снапшотам" → используй таблицу snapshots с DISTINCT
+29. "максимальные просмотры" → используй MAX(views_count) в подзапросе или GROUP BY
+30. "опубликованные в [месяц] [год]" → используй EXTRACT(YEAR FROM video_created_at) = год AND EXTRACT(MONTH FROM video_created_at) = месяц
+31. "выросли в промежутке" → суммируй delta_views_count только с фильтром > 0
+32. "изменились в промежутке" → суммируй delta_views_count без фильтра""",
+             'rules', keywords=('итогов', 'текущ', 'всего', 'когда-либо', 'когда либо', 'в истории', 'снапшот',
+                                'максимальн', 'опубликован', 'промежут', 'изменил', 'вырос')),
+    Fragment('examples_header', "ПРИМЕРЫ SQL-ЗАПРОСОВ:", 'base'),
+    _example(33, "Сколько видео имеют > 10000 просмотров?",
+             "SELECT COUNT(*) FROM videos WHERE views_count > 10000"),
+    _example(34, "Сколько видео набрали > 10000 просмотров в истории?",
+             "SELECT COUNT(DISTINCT video_id) FROM snapshots WHERE views_count > 10000"),
+    _example(35, "Сколько видео опубликовано в июне 2025?",
+             "SELECT COUNT(*) FROM videos WHERE EXTRACT(YEAR FROM video_created_at) = 2025 "
+             "AND EXTRACT(MONTH FROM video_created_at) = 6"),
+    _example(36, "Какое суммарное количество просмотров набрали все видео, опубликованные в июне 2025 года?",
+             "SELECT SUM(views_count) FROM videos WHERE EXTRACT(YEAR FROM video_created_at) = 2025 "
+             "AND EXTRACT(MONTH FROM video_created_at) = 6"),
+    _example(37, "Сколько разных видео получали новые просмотры 27 ноября 2025?",
+             "SELECT COUNT(DISTINCT video_id) FROM snapshots WHERE DATE(created_at) = '2025-11-27' "
+             "AND delta_views_count > 0"),
+    _example(38, "На сколько просмотров суммарно выросли все видео креатора X в промежутке с 10:00 до 15:00 "
+                 "28 ноября 2025?",
+             "SELECT COALESCE(SUM(delta_views_count), 0) FROM snapshots WHERE created_at >= '2025-11-28 10:00:00' "
+             "AND created_at < '2025-11-28 15:00:00' AND video_id IN (SELECT video_id FROM videos "
+             "WHERE creator_id = 'X') AND delta_views_count > 0"),
+    _example(39, "Сколько видео у креатора X набрали больше 10000 просмотров по итоговой статистике?",
+             "SELECT COUNT(*) FROM videos WHERE creator_id = 'X' AND views_count > 10000"),
+    _example(40, "Какое суммарное количество просмотров у автора X?",
+             "SELECT SUM(views_count) FROM videos WHERE creator_id = 'X'"),
+    _example(41, "Среднее количество просмотров на видео у автора X?",
+             "SELECT AVG(views_count) FROM videos WHERE creator_id = 'X'"),
+    Fragment('rules_extra', """ДОПОЛНИТЕЛЬНЫЕ ПРАВИЛА:
+42. Если вопрос содержит "итоговый", "текущий", "общий" → обращайся к таблице videos
+43. Если вопрос содержит "в истории", "по замерам", "в снапшотах" → обращайся к таблице snapshots
+44. Если вопрос содержит "выросло", "увеличилось", "прибавилось" → добавляй delta_..._count > 0
+45. Если вопрос содержит "упало", "снизилось", "потеряло" → добавляй delta_..._count < 0
+46. Всегда используй COALESCE(..., 0) для функций агрегации чтобы избежать NULL
+47. Для JOIN используй явное указание таблиц: videos.video_id, snapshots.video_id""",
+             'rules', keywords=('итогов', 'текущ', 'общ', 'в истории', 'замер', 'снапшот', 'вырос', 'увелич',
+                                'прибав', 'упал', 'снизил', 'потер')),
+]
+
+FULL_PROMPT = '\n\n'.join(fragment.text for fragment in FRAGMENTS)
+
+
+@dataclass
+class PromptSelection:
+    text: str
+    fragment_ids: List[str]
+    tokens: int
+
+
+class PromptBuilder:
+    """Сборка системного промпта под вопрос в пределах token_budget"""
+
+    def __init__(self, fragments: Sequence[Fragment] = None, token_budget: int = 1500, max_examples: int = 3):
+        self.fragments = list(fragments or FRAGMENTS)
+        self.token_budget = token_budget
+        self.max_examples = max_examples
+        self._templates = {f.id: normalize_question(f.question).template
+                           for f in self.fragments if f.kind == 'example'}
+
+    @staticmethod
+    def _rule_score(fragment: Fragment, question: str) -> float:
+        if any(pattern.search(question) for pattern in fragment.patterns):
+            return 100.0
+        best = max((fuzz.partial_ratio(keyword, question) for keyword in fragment.keywords), default=0.0)
+        return best if best >= KEYWORD_SCORE_CUTOFF else 0.0
+
+    def _example_template(self, fragment: Fragment) -> str:
+        template = self._templates.get(fragment.id)
+        return template if template is not None else normalize_question(fragment.question).template
+
+    def score(self, question: str, fragments: Sequence[Fragment] = None) -> List[Tuple[float, Fragment]]:
+        """Оценки необязательных фрагментов для вопроса (0 — фрагмент не нужен)"""
+        fragments = self.fragments if fragments is None else fragments
+        lowered = question.lower()
+        template = normalize_question(question).template
+        scored = [(self._rule_score(f, lowered), f) for f in fragments if f.kind == 'rules']
+
+        examples = sorted(((fuzz.token_set_ratio(template, self._example_template(f)), f)
+                           for f in fragments if f.kind == 'example'), key=lambda pair: -pair[0])
+        scored += [(score, f) for score, f in examples[:self.max_examples] if score >= EXAMPLE_SCORE_CUTOFF]
+        return scored
+
+    def select(self, question: str, examples: Sequence[Tuple[str, str]] = ()) -> PromptSelection:
+        """examples — пары из памяти примеров вместо статических"""
+        fragments = with_examples(self.fragments, examples)
+        chosen = {f.id for f in fragments if f.kind == 'base'}
+        used = sum(f.tokens for f in fragments if f.kind == 'base')
+
+        # Правила важнее примеров при равной оценке: они короче и общие
+        candidates = sorted(((score, f) for score, f in self.score(question, fragments) if score > 0),
+                            key=lambda pair: (-pair[0], pair[1].kind != 'rules'))
+        for score, fragment in candidates:
+            if used + fragment.tokens <= self.token_budget:
+                chosen.add(fragment.id)
+                used += fragment.tokens
+
+        if not any(f.kind == 'example' and f.id in chosen for f in fragments):
+            chosen.discard('examples_header')
+
+        selected = [f for f in fragments if f.id in chosen]
+        text = '\n\n'.join(f.text for f in selected)
+        return PromptSelection(text, [f.id for f in selected], estimate_tokens(text))
+
+    def build(self, question: str) -> str:
+        return self.select(question).text
+
+
+def full_prompt_tokens() -> int:
+    return estimate_tokens(FULL_PROMPT)
+
+
+def selection_for(question: str, builder: Optional[PromptBuilder],
+                  examples: Sequence[Tuple[str, str]] = ()) -> PromptSelection:
+    """Выбор фрагментов или полный промпт, если сборка отключена"""
+    if builder is not None:
+        return builder.select(question, examples)
+    if not examples:
+        return PromptSelection(FULL_PROMPT, [f.id for f in FRAGMENTS], full_prompt_tokens())
+    fragments = with_examples(FRAGMENTS, examples)
+    text = '\n\n'.join(f.text for f in fragments)
+    return PromptSelection(text, [f.id for f in fragments], estimate_tokens(text))
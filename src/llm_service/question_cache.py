@@ -0,0 +1,250 @@
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Порядок важен: сначала длинные и специфичные литералы, потом числа
+_SLOT_PATTERNS = [
+    ('id', re.compile(r'\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b')),
+    ('id', re.compile(r'\b(?=[0-9a-fA-F]*[a-fA-F])(?=[0-9a-fA-F]*\d)[0-9a-fA-F]{16,}\b')),
+    ('date', re.compile(r'\b\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2})?)?\b')),
+    ('time', re.compile(r'\b\d{1,2}:\d{2}\b')),
+    ('num', re.compile(r'(?<![\w.])-?\d+(?:[.,]\d+)?\b')),
+]
+_THOUSANDS = re.compile(r'\b\d{1,3}(?:[  ]\d{3})+\b')
+_PUNCT = re.compile(r'[^\w<>\s]+')
+_SPACES = re.compile(r'\s+')
+
+# Строковый литерал или отдельное число в SQL
+_SQL_LITERAL = re.compile(r"'((?:[^']|'')*)'|(?<![\w.])(\d+(?:\.\d+)?)(?![\w.])")
+_SQL_PLACEHOLDER = re.compile(r'\{s(\d+)\}')
+
+
+@dataclass
+class NormalizedQuestion:
+    template: str
+    slots: List[str] = field(default_factory=list)
+
+    @property
+    def exact_key(self) -> str:
+        return self.template + '|' + '|'.join(self.slots)
+
+
+def normalize_question(question: str) -> NormalizedQuestion:
+    """Нормализация вопроса: регистр, пробелы, пунктуация, литералы вынесены в слоты
+
+    "Сколько видео у креатора 9f3c...e1 набрали > 10 000 просмотров?" →
+    template "сколько видео у креатора <id> набрали <num> просмотров", slots ["9f3c...e1", "10000"]
+    """
+    text = _THOUSANDS.sub(lambda m: re.sub(r'\D', '', m.group()), question)
+
+    # Найденные литералы маскируются символами той же длины, чтобы позиции
+    # следующих шаблонов совпадали с исходной строкой
+    found = []
+    masked = text
+    for kind, pattern in _SLOT_PATTERNS:
+        for match in pattern.finditer(masked):
+            value = match.group()
+            if kind == 'num':
+                value = value.replace(',', '.')
+            found.append((match.start(), match.end(), kind, value))
+        masked = pattern.sub(lambda m: '\0' * len(m.group()), masked)
+
+    parts = []
+    slots = []
+    position = 0
+    for start, end, kind, value in sorted(found):
+        parts.append(text[position:start])
+        parts.append(f' <{kind}> ')
+        slots.append(value)
+        position = end
+    parts.append(text[position:])
+
+    template = ''.join(parts).lower().replace('ё', 'е')
+    template = _PUNCT.sub(' ', template)
+    template = _SPACES.sub(' ', template).strip()
+    return NormalizedQuestion(template=template, slots=slots)
+
+
+def make_sql_template(sql: str, slots: List[str]) -> Optional[str]:
+    """Замена литералов SQL, совпадающих со слотами вопроса, на плейсхолдеры {sN}
+
+    Шаблон строится, только если каждый слот однозначно соответствует ровно
+    одному литералу в SQL. Иначе (например, дата "27 ноября" превратилась
+    в '2025-11-27' или 0 встречается и в вопросе, и в COALESCE) возвращается None.
+    """
+    if not slots or len(set(slots)) != len(slots):
+        return None
+
+    matches = {}
+    for match in _SQL_LITERAL.finditer(sql):
+        value = match.group(1).replace("''", "'") if match.group(1) is not None else match.group(2)
+        if value in slots:
+            matches.setdefault(value, []).append(match)
+
+    if set(matches) != set(slots) or any(len(m) != 1 for m in matches.values()):
+        return None
+
+    # Заменяем с конца, чтобы не сбить позиции
+    template = sql
+    for value, match in sorted(((v, m[0]) for v, m in matches.items()), key=lambda item: -item[1].start()):
+        index = slots.index(value)
+        replacement = f"'{{s{index}}}'" if match.group(1) is not None else f'{{s{index}}}'
+        template = template[:match.start()] + replacement + template[match.end():]
+    return template
+
+
+def bind_sql_template(template: str, slots: List[str]) -> str:
+    def replace(match):
+        return slots[int(match.group(1))].replace("'", "''")
+    return _SQL_PLACEHOLDER.sub(replace, template)
+
+
+class QuestionCache:
+    """LRU+TTL кэш "нормализованный вопрос → проверенный SQL"
+
+    Если литералы вопроса однозначно переносятся в SQL, хранится шаблон,
+    и один ответ LLM обслуживает все вопросы той же формы с другими
+    ID/числами/датами. Опционально сохраняется на диск (path), чтобы
+    переживать перезапуски: каждая новая запись дописывается строкой JSONL,
+    файл целиком перезаписывается (compact) только когда устаревших строк
+    в нем стало больше, чем живых.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 86400, path: Optional[Path] = None,
+                 clock: Callable[[], float] = time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = Path(path) if path else None
+        self.clock = clock
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._file_lines = 0        # строк в файле, включая перекрытые и вытесненные
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.path and self.path.exists():
+            self._load()
+
+    def get(self, question: str, validator: Callable[[str], bool] = None) -> Optional[str]:
+        normalized = normalize_question(question)
+
+        for key in (normalized.exact_key, normalized.template):
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            sql, templated, expires_at = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                continue
+
+            if templated:
+                sql = bind_sql_template(sql, normalized.slots)
+            if validator is not None and not validator(sql):
+                continue
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return sql
+
+        self.misses += 1
+        return None
+
+    def put(self, question: str, sql: str):
+        normalized = normalize_question(question)
+        template = make_sql_template(sql, normalized.slots)
+
+        if template is not None:
+            key, value, templated = normalized.template, template, True
+        else:
+            key, value, templated = normalized.exact_key, sql, False
+
+        entry = (value, templated, self.clock() + self.ttl)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        # Вытесненный ключ записывается в файл строкой [ключ], чтобы не вернуться при загрузке
+        records = [[key, *entry]]
+        while len(self._entries) > self.max_size:
+            records.append([self._entries.popitem(last=False)[0]])
+            self.evictions += 1
+
+        if self.path:
+            if self._file_lines >= 2 * max(len(self._entries), self.max_size // 2, 1):
+                self.compact()
+            else:
+                self._append(records)
+
+    def _append(self, records: List[list]):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+            self._file_lines += len(records)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить запись кэша вопросов в {self.path}: {e}")
+
+    def compact(self):
+        """Перезапись файла только живыми записями (атомарно, через временный файл)"""
+        now = self.clock()
+        lines = [json.dumps([k, *v], ensure_ascii=False) + '\n' for k, v in self._entries.items() if v[2] > now]
+        tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_text(''.join(lines), encoding='utf-8')
+            os.replace(tmp_path, self.path)
+            self._file_lines = len(lines)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить кэш вопросов в {self.path}: {e}")
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError as e:
+            logger.warning(f"Не удалось прочитать кэш вопросов из {self.path}: {e}")
+            return
+
+        now = self.clock()
+        legacy = False
+        for line in lines:
+            try:
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    # Прежний формат — один JSON-объект {ключ: [sql, templated, expires_at]}
+                    legacy = True
+                    records = [[k, *v] for k, v in record.items()]
+                else:
+                    records = [record]
+                for key, *entry in records:
+                    if len(entry) == 3 and entry[2] > now:
+                        self._entries[key] = tuple(entry)
+                        self._entries.move_to_end(key)
+                    elif len(entry) in (0, 3):
+                        self._entries.pop(key, None)
+                    else:
+                        raise ValueError(line)
+            except (ValueError, TypeError, AttributeError):
+                logger.warning(f"Пропущена поврежденная строка кэша вопросов: {line[:100]!r}")
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self._file_lines = len(lines)
+        logger.info(f"Загружено {len(self._entries)} записей кэша вопросов из {self.path}")
+        if legacy or self._file_lines > 2 * len(self._entries):
+            self.compact()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import time
+from collections import deque, OrderedDict
+from typing import Awaitable, Callable, Deque, Hashable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class SchedulerOverloaded(Exception):
+    """Очередь запросов к LLM заполнена — запрос отклонен сразу"""
+
+
+class _Request:
+    __slots__ = ('fn', 'future', 'enqueued_at', 'deadline_at', 'task')
+
+    def __init__(self, fn: Callable[[], Awaitable], deadline_at: float):
+        self.fn = fn
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.deadline_at = deadline_at
+        self.task: Optional[asyncio.Task] = None
+
+
+class LLMRequestScheduler:
+    """Планировщик запросов к LLM с ограничением параллелизма
+
+    - не больше max_in_flight одновременных запросов к API;
+    - ограниченная очередь: при переполнении SchedulerOverloaded без ожидания;
+    - справедливость: очереди по пользователям обслуживаются по кругу,
+      поэтому пользователь с десятком вопросов не задерживает остальных;
+    - дедлайн на весь путь (очередь + выполнение): asyncio.TimeoutError.
+    """
+
+    def __init__(self, max_in_flight: int = 4, max_queue: int = 100, default_deadline: float = 30.0,
+                 wait_window: int = 1000):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.default_deadline = default_deadline
+
+        self._queues: "OrderedDict[Hashable, Deque[_Request]]" = OrderedDict()
+        self._queued = 0
+        self._in_flight = 0
+
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._wait_times: Deque[float] = deque(maxlen=wait_window)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def submit(self, user_id: Hashable, fn: Callable[[], Awaitable[T]], deadline: float = None) -> T:
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            logger.warning(f"Очередь LLM переполнена ({self._queued}), запрос пользователя {user_id} отклонен")
+            raise SchedulerOverloaded()
+
+        timeout = deadline if deadline is not None else self.default_deadline
+        request = _Request(fn, time.monotonic() + timeout)
+        self._queues.setdefault(user_id, deque()).append(request)
+        self._queued += 1
+        self.submitted += 1
+        self._dispatch()
+
+        try:
+            return await asyncio.wait_for(request.future, timeout=timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"Запрос к LLM пользователя {user_id} не уложился в {timeout} с")
+            raise
+        finally:
+            # Таймаут или отмена ожидающего: останавливаем саму работу или убираем
+            # запрос из очереди, чтобы он не занимал место и слот
+            if request.task is None:
+                self._discard(user_id, request)
+            elif not request.task.done():
+                request.task.cancel()
+
+    def _discard(self, user_id: Hashable, request: _Request):
+        queue = self._queues.get(user_id)
+        if queue is None or request not in queue:
+            return
+        queue.remove(request)
+        self._queued -= 1
+        if not queue:
+            del self._queues[user_id]
+
+    def _next_request(self) -> Optional[_Request]:
+        """Следующий запрос по кругу пользователей"""
+        while self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            request = queue.popleft()
+            self._queued -= 1
+
+            # Пользователь уходит в конец круга (или из него, если очередь пуста)
+            del self._queues[user_id]
+            if queue:
+                self._queues[user_id] = queue
+
+            if request.future.done() or request.deadline_at <= time.monotonic():
+                continue        # ожидающий уже ушел или вот-вот уйдет по таймауту
+            return request
+        return None
+
+    def _dispatch(self):
+        while self._in_flight < self.max_in_flight:
+            request = self._next_request()
+            if request is None:
+                return
+            self._in_flight += 1
+            self._wait_times.append(time.monotonic() - request.enqueued_at)
+            request.task = asyncio.ensure_future(self._run(request))
+
+    async def _run(self, request: _Request):
+        try:
+            result = await request.fn()
+        except asyncio.CancelledError:
+            if not request.future.done():
+                request.future.cancel()
+            raise
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            if not request.future.done():
+                request.future.set_result(result)
+            self.completed += 1
+        finally:
+            self._in_flight -= 1
+            self._dispatch()
+
+    def stats(self) -> dict:
+        waits = sorted(self._wait_times)
+        return {
+            'queue_depth': self._queued,
+            'in_flight': self._in_flight,
+            'users_waiting': len(self._queues),
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'wait_avg_s': sum(waits) / len(waits) if waits else 0.0,
+            'wait_p95_s': waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+            'wait_max_s': waits[-1] if waits else 0.0,
+        }
@@ -6,20 +6,60 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent / "src"))
 
-from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
-
 from src.config.config import settings
 from src.config.logs_config import setup_logging
-from src.db.database import init_db
-from src.bot.handlers.handlers import router
+from src.db.database import async_engine
+from src.bot.lifecycle import create_bot, create_dispatcher, prepare_database, start_services, stop_services
+from src.bot.webhook import register_webhook, run_webhook
+
+logger = logging.getLogger(__name__)
+
+
+async def prepare():
+    try:
+        await prepare_database()
+    except Exception as e:
+        logger.error(f'Ошибка инициализации {e}')
+        sys.exit(1)
+    finally:
+        # Дальше соединения открываются заново в цикле событий (или процессе) обработчиков
+        await async_engine.dispose()
+
+
+async def run_polling():
+    try:
+        services = await start_services()
+    except Exception as e:
+        logger.error(f'Ошибка инициализации {e}')
+        sys.exit(1)
+
+    bot = create_bot()
+    dp = create_dispatcher()
+
+    logger.info('Бот запущен и готов к работе!')
+
+    try:
+        # Вебхук, оставшийся от запуска в режиме webhook, мешает getUpdates
+        await bot.delete_webhook()
+        await dp.start_polling(bot, tasks_concurrency_limit=settings.BOT_MAX_CONCURRENT_UPDATES)
+    except KeyboardInterrupt:
+        logger.info('Бот остановлен по запросу пользователя!')
+    finally:
+        await bot.session.close()
+        await stop_services(services)
+
 
-async def main():
+async def set_webhook():
+    bot = create_bot()
+    try:
+        await register_webhook(bot, create_dispatcher(), settings.WEBHOOK_WORKERS)
+    finally:
+        await bot.session.close()
+
+
+def main():
     # Logs
     setup_logging(settings.LOG_LEVEL, settings.LOG_FILE)
-    logger = logging.getLogger(__name__)
     logger.info('Запуск приложения...')
 
     if not settings.RE_TOKEN:
@@ -34,32 +74,20 @@ async def main():
         logger.error("Не указан YC_FOLDER_ID в .env файле!")
         sys.exit(1)
 
-    logger.info('Все обязательные настройки проверены успешно')
-
-    try:
-        await init_db()
-        logger.info('База данных инициализирована')
-    except Exception as e:
-        logger.error(f'Ошибка инициализации {e}')
+    if settings.BOT_MODE == 'webhook' and not settings.WEBHOOK_BASE_URL:
+        logger.error('Для BOT_MODE=webhook нужен WEBHOOK_BASE_URL в .env файле!')
         sys.exit(1)
 
-    bot = Bot(
-        token=settings.RE_TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-    )
-
-    dp = Dispatcher(storage=MemoryStorage())
-
-    dp.include_router(router)
+    logger.info('Все обязательные настройки проверены успешно')
 
-    logger.info('Бот запущен и готов к работе!')
+    asyncio.run(prepare())
 
-    try:
-        await dp.start_polling(bot)
-    except KeyboardInterrupt:
-        logger.info('Бот остановлен по запросу пользователя!')
-    finally:
-        await bot.session.close()
+    if settings.BOT_MODE == 'webhook':
+        asyncio.run(set_webhook())
+        logger.info(f'Бот запущен в режиме webhook, процессов: {settings.WEBHOOK_WORKERS}')
+        run_webhook(settings.WEBHOOK_WORKERS)
+    else:
+        asyncio.run(run_polling())
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    main()
@@ -0,0 +1,192 @@
+"""Пакетные ответы на список вопросов: файл в чате или командная строка
+
+Вопросы берутся из TXT (по одному в строке) или CSV (колонка question/вопрос,
+иначе первая). Одинаковые после нормализации вопросы обрабатываются один раз.
+Каждый вопрос идет своей задачей по конвейеру: генерация SQL (не больше
+llm_concurrency одновременно), затем выполнение (не больше db_concurrency).
+Пока одни вопросы ждут LLM, SQL готовых уже выполняется, поэтому пакет
+занимает примерно (число вопросов / llm_concurrency) вызовов LLM, а не их сумму.
+Результат — CSV с ответом и исходом по каждой строке входного файла.
+
+Запуск: python -m src.services.batch questions.csv -o answers.csv
+"""
+import argparse
+import asyncio
+import csv
+import io
+import logging
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from src.db.sandbox import QueryRejected
+from src.llm_service.question_cache import normalize_question
+from src.llm_service.scheduler import SchedulerOverloaded
+
+logger = logging.getLogger(__name__)
+
+QUESTION_COLUMNS = ('question', 'questions', 'вопрос', 'вопросы')
+
+
+@dataclass
+class BatchItem:
+    question: str
+    sql: Optional[str] = None
+    answer: Optional[int] = None
+    outcome: str = 'pending'
+    seconds: float = 0.0
+
+
+def read_questions(data: bytes, filename: str = '') -> List[str]:
+    """Вопросы из содержимого файла; пустые строки пропускаются
+
+    Не UTF-8 читается как cp1251, неизвестные байты заменяются на "?".
+    Двоичный файл (с нулевыми байтами) — ValueError с текстом для пользователя.
+    """
+    if b'\x00' in data:
+        raise ValueError('Файл не похож на текстовый: пришли .txt или .csv в UTF-8 или Windows-1251')
+    try:
+        content = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        content = data.decode('cp1251', errors='replace').replace('\ufffd', '?')
+
+    if not filename.lower().endswith('.csv'):
+        return [line.strip() for line in content.splitlines() if line.strip()]
+
+    try:
+        dialect = csv.Sniffer().sniff(content[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    rows = [row for row in csv.reader(io.StringIO(content), dialect) if any(cell.strip() for cell in row)]
+    column = 0
+    if rows:
+        header = [cell.strip().lower() for cell in rows[0]]
+        found = [i for i, cell in enumerate(header) if cell in QUESTION_COLUMNS]
+        if found:
+            column = found[0]
+            rows = rows[1:]
+    return [row[column].strip() for row in rows if len(row) > column and row[column].strip()]
+
+
+def write_csv(items: List[BatchItem]) -> bytes:
+    """CSV для Excel: BOM, разделитель — запятая"""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['question', 'answer', 'outcome', 'sql'])
+    for item in items:
+        writer.writerow([item.question, '' if item.answer is None else item.answer, item.outcome, item.sql or ''])
+    return out.getvalue().encode('utf-8-sig')
+
+
+def summarize(items: List[BatchItem]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for item in items:
+        counts[item.outcome] = counts.get(item.outcome, 0) + 1
+    return dict(sorted(counts.items(), key=lambda kv: -kv[1]))
+
+
+class BatchRunner:
+    """Конвейер "SQL → БД" для списка вопросов с отдельными лимитами на стадии
+
+    quick(question) — SQL без LLM (быстрый путь) или None; такие вопросы не
+    занимают место в очереди к LLM.
+    """
+
+    def __init__(self, generate: Callable[[str], Awaitable[Optional[str]]],
+                 execute: Callable[[str], Awaitable[Optional[tuple]]],
+                 quick: Callable[[str], Optional[str]] = None,
+                 llm_concurrency: int = 4, db_concurrency: int = 3):
+        self.generate = generate
+        self.execute = execute
+        self.quick = quick
+        self.llm_concurrency = llm_concurrency
+        self.db_concurrency = db_concurrency
+
+    async def run(self, questions: List[str]) -> List[BatchItem]:
+        """Ответы в порядке вопросов; повторы получают ответ первого такого же вопроса"""
+        unique: Dict[str, BatchItem] = {}
+        order = []
+        for question in questions:
+            key = normalize_question(question).exact_key
+            if key not in unique:
+                unique[key] = BatchItem(question)
+            order.append((question, unique[key]))
+
+        llm_slots = asyncio.Semaphore(self.llm_concurrency)
+        db_slots = asyncio.Semaphore(self.db_concurrency)
+        started = time.perf_counter()
+        await asyncio.gather(*(self._process(item, llm_slots, db_slots) for item in unique.values()))
+        logger.info(f'Пакет из {len(questions)} вопросов ({len(unique)} уникальных) обработан за '
+                    f'{time.perf_counter() - started:.1f} с: {summarize(list(unique.values()))}')
+
+        return [item if item.question == question else
+                BatchItem(question, item.sql, item.answer, item.outcome, item.seconds)
+                for question, item in order]
+
+    async def _process(self, item: BatchItem, llm_slots: asyncio.Semaphore, db_slots: asyncio.Semaphore):
+        started = time.perf_counter()
+        try:
+            item.sql = self.quick(item.question) if self.quick is not None else None
+            if not item.sql:
+                async with llm_slots:
+                    item.sql = await self.generate(item.question)
+            if not item.sql:
+                item.outcome = 'not_understood'
+                return
+
+            async with db_slots:
+                row = await self.execute(item.sql)
+            if not row or row[0] is None:
+                item.outcome = 'no_result'
+                return
+            item.answer = int(row[0])
+            item.outcome = 'ok'
+
+        except SchedulerOverloaded:
+            item.outcome = 'overloaded'
+        except QueryRejected as e:
+            logger.warning(f'Запрос из пакета отклонен песочницей ({e.reason}): {item.question}')
+            item.outcome = 'rejected'
+        except asyncio.TimeoutError:
+            item.outcome = 'timeout'
+        except Exception as e:
+            logger.error(f'Ошибка обработки вопроса из пакета "{item.question}": {e}', exc_info=True)
+            item.outcome = 'error'
+        finally:
+            item.seconds = time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('questions', type=Path, help='TXT (вопрос в строке) или CSV (колонка question)')
+    parser.add_argument('-o', '--output', type=Path, default=None,
+                        help='куда записать CSV с ответами (по умолчанию рядом: <имя>.answers.csv)')
+    args = parser.parse_args()
+
+    from src.config.config import settings
+    from src.config.logs_config import setup_logging
+    setup_logging(settings.LOG_LEVEL, settings.LOG_FILE)
+
+    # Тот же путь, что у бота: кэши, быстрый путь, песочница (класс batch), пулы соединений
+    from src.bot.handlers.handlers import answer_batch
+    from src.bot.lifecycle import ProcessServices, stop_services
+
+    questions = read_questions(args.questions.read_bytes(), args.questions.name)
+    output = args.output or args.questions.with_suffix('.answers.csv')
+    print(f'Вопросов: {len(questions)}')
+
+    started = time.perf_counter()
+    try:
+        items = await answer_batch(questions)
+    finally:
+        await stop_services(ProcessServices())
+    output.write_bytes(write_csv(items))
+
+    print(f'Готово за {time.perf_counter() - started:.1f} с: '
+          + ', '.join(f'{outcome} {count}' for outcome, count in summarize(items).items()))
+    print(f'Ответы: {output}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
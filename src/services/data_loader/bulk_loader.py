@@ -0,0 +1,230 @@
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from src.db.database import async_engine
+from src.db.data_version import bump_data_version_raw
+from src.db.models import SNAPSHOTS_PARTITIONED, SNAPSHOT_CONFLICT_COLUMNS
+from src.db.partitions import ensure_partitions, asyncpg_partition_ops, forget_partitions
+from src.db.rollups import refresh_rollups, asyncpg_executor
+from src.services.data_loader.loader_service import _video_values, _snapshot_values, _load_video, refresh_touched
+
+logger = logging.getLogger(__name__)
+
+VIDEO_COLUMNS = (
+    'video_id', 'creator_id', 'video_created_at',
+    'views_count', 'likes_count', 'comments_count', 'reports_count',
+    'created_at', 'updated_at',
+)
+
+SNAPSHOT_COLUMNS = (
+    'snapshot_id', 'video_id',
+    'views_count', 'likes_count', 'comments_count', 'reports_count',
+    'delta_views_count', 'delta_likes_count', 'delta_comments_count', 'delta_reports_count',
+    'created_at', 'updated_at',
+)
+
+# Поля, которые обновляются при конфликте (совпадают с построчным upsert)
+VIDEO_UPDATE_COLUMNS = (
+    'views_count', 'likes_count', 'comments_count', 'reports_count',
+    'creator_id', 'video_created_at', 'updated_at',
+)
+
+SNAPSHOT_UPDATE_COLUMNS = (
+    'views_count', 'likes_count', 'comments_count', 'reports_count',
+    'delta_views_count', 'delta_likes_count', 'delta_comments_count', 'delta_reports_count',
+    'updated_at',
+)
+
+
+def _merge_sql(table: str, stage: str, columns: tuple, conflict: str, update_columns: tuple, source: str = None,
+               only_changed: bool = False) -> str:
+    """INSERT ... SELECT из staging-таблицы с upsert
+
+    only_changed=True не трогает строки, у которых обновляемые поля не изменились
+    (нет новой версии строки и WAL), и возвращает video_id вставленных/измененных строк.
+    """
+    column_list = ', '.join(columns)
+    select_list = ', '.join(f's.{c}' for c in columns)
+    set_list = ', '.join(f'{c} = EXCLUDED.{c}' for c in update_columns)
+    sql = (
+        f"INSERT INTO {table} ({column_list}) "
+        f"SELECT {select_list} FROM {source or stage + ' s'} "
+        f"ON CONFLICT ({conflict}) DO UPDATE SET {set_list}"
+    )
+    if only_changed:
+        current = ', '.join(f'{table}.{c}' for c in update_columns)
+        excluded = ', '.join(f'EXCLUDED.{c}' for c in update_columns)
+        sql += f" WHERE ({current}) IS DISTINCT FROM ({excluded}) RETURNING {table}.video_id"
+    return sql
+
+
+VIDEOS_MERGE_SQL = _merge_sql('videos', 'videos_stage', VIDEO_COLUMNS, 'video_id', VIDEO_UPDATE_COLUMNS)
+VIDEOS_DELTA_MERGE_SQL = _merge_sql('videos', 'videos_stage', VIDEO_COLUMNS, 'video_id', VIDEO_UPDATE_COLUMNS,
+                                    only_changed=True)
+
+# Снапшоты без родительского видео отбрасываются джойном, а не ошибкой FK
+SNAPSHOTS_MERGE_SQL = _merge_sql(
+    'snapshots', 'snapshots_stage', SNAPSHOT_COLUMNS, ', '.join(SNAPSHOT_CONFLICT_COLUMNS), SNAPSHOT_UPDATE_COLUMNS,
+    source='snapshots_stage s JOIN videos v ON v.video_id = s.video_id',
+)
+SNAPSHOTS_DELTA_MERGE_SQL = _merge_sql(
+    'snapshots', 'snapshots_stage', SNAPSHOT_COLUMNS, ', '.join(SNAPSHOT_CONFLICT_COLUMNS), SNAPSHOT_UPDATE_COLUMNS,
+    source='snapshots_stage s JOIN videos v ON v.video_id = s.video_id', only_changed=True,
+)
+
+ORPHAN_SNAPSHOTS_SQL = (
+    "SELECT s.snapshot_id, s.video_id FROM snapshots_stage s "
+    "LEFT JOIN videos v ON v.video_id = s.video_id WHERE v.video_id IS NULL"
+)
+
+
+def build_rows(videos_batch: List[Tuple[int, dict]], stats: Dict[str, int],
+               failed_ids: Optional[Set[str]] = None) -> Tuple[list, list, int, int]:
+    """Преобразование пакета видео из JSON в кортежи для COPY
+
+    Ошибки приведения типов считаются построчно, как и в построчной загрузке.
+    Дубликаты внутри пакета схлопываются (побеждает последняя запись).
+    Возвращает строки видео, строки снапшотов и их количество после схлопывания
+    (столько строк уйдет в COPY); в failed_ids (если передан) добавляются id
+    видео с ошибками.
+    """
+    video_rows = {}
+    snapshot_rows = {}
+
+    for index, video_data in videos_batch:
+        video_id = video_data.get('id', f'unknown_{index}')
+        try:
+            values = _video_values(video_data)
+        except Exception as e:
+            logger.error(f"Ошибка видео {video_id} (№{index}): {e}")
+            stats['errors'] += 1
+            if failed_ids is not None:
+                failed_ids.add(str(video_id))
+            continue
+
+        video_rows[values['video_id']] = tuple(values[c] for c in VIDEO_COLUMNS)
+
+        snapshot_errors = 0
+        for snapshot_data in video_data.get("snapshots", []):
+            try:
+                snapshot = _snapshot_values(snapshot_data)
+            except Exception as e:
+                logger.error(f"Ошибка снапшота (видео {video_id}): {e}")
+                snapshot_errors += 1
+                continue
+            snapshot_rows[snapshot['snapshot_id']] = tuple(snapshot[c] for c in SNAPSHOT_COLUMNS)
+
+        if snapshot_errors > 0:
+            stats['errors'] += snapshot_errors
+            if failed_ids is not None:
+                failed_ids.add(values['video_id'])
+            logger.warning(f"Видео {video_id}: {snapshot_errors} ошибок снапшотов")
+
+    return list(video_rows.values()), list(snapshot_rows.values()), len(video_rows), len(snapshot_rows)
+
+
+async def create_stage_tables(pg_conn):
+    await pg_conn.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS videos_stage ON COMMIT DELETE ROWS AS "
+        f"SELECT {', '.join(VIDEO_COLUMNS)} FROM videos WITH NO DATA"
+    )
+    await pg_conn.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS snapshots_stage ON COMMIT DELETE ROWS AS "
+        f"SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM snapshots WITH NO DATA"
+    )
+
+
+async def stage_snapshots(pg_conn, snapshot_rows: list) -> List[Tuple[str, str]]:
+    """COPY снапшотов в staging (с созданием секций); возвращает снапшоты без видео"""
+    if SNAPSHOTS_PARTITIONED:
+        created_at = SNAPSHOT_COLUMNS.index('created_at')
+        await ensure_partitions(*asyncpg_partition_ops(pg_conn), {row[created_at] for row in snapshot_rows})
+    await pg_conn.copy_records_to_table('snapshots_stage', records=snapshot_rows, columns=SNAPSHOT_COLUMNS)
+    return [(r['snapshot_id'], r['video_id']) for r in await pg_conn.fetch(ORPHAN_SNAPSHOTS_SQL)]
+
+
+async def copy_and_merge(pg_conn, video_rows: list, snapshot_rows: list) -> List[Tuple[str, str]]:
+    """COPY строк во временные таблицы и слияние в videos/snapshots
+
+    pg_conn — asyncpg соединение внутри уже открытой транзакции.
+    Возвращает список снапшотов (snapshot_id, video_id), для которых не нашлось видео.
+    """
+    await create_stage_tables(pg_conn)
+
+    if video_rows:
+        await pg_conn.copy_records_to_table('videos_stage', records=video_rows, columns=VIDEO_COLUMNS)
+        await pg_conn.execute(VIDEOS_MERGE_SQL)
+
+    orphans = []
+    if snapshot_rows:
+        orphans = await stage_snapshots(pg_conn, snapshot_rows)
+        await pg_conn.execute(SNAPSHOTS_MERGE_SQL)
+
+    video_ids = {row[0] for row in video_rows} | {row[1] for row in snapshot_rows}
+    await refresh_rollups(asyncpg_executor(pg_conn), sorted(video_ids))
+
+    await bump_data_version_raw(pg_conn)
+    return orphans
+
+
+@asynccontextmanager
+async def driver_transaction():
+    """asyncpg соединение из движка с открытой транзакцией
+
+    COPY недоступен через SQLAlchemy, поэтому работаем с драйвером напрямую
+    и управляем транзакцией тоже на уровне asyncpg.
+    """
+    async with async_engine.connect() as conn:
+        raw = await conn.get_raw_connection()
+        pg_conn = raw.driver_connection
+        async with pg_conn.transaction():
+            yield pg_conn
+
+
+async def _load_batch(videos_batch: List[Tuple[int, dict]], stats: Dict[str, int]):
+    batch_stats = {'videos': 0, 'snapshots': 0, 'errors': 0}
+    video_rows, snapshot_rows, videos_ok, snapshots_ok = build_rows(videos_batch, batch_stats)
+
+    try:
+        async with driver_transaction() as pg_conn:
+            orphans = await copy_and_merge(pg_conn, video_rows, snapshot_rows)
+    except Exception as e:
+        # Пакет откатился целиком: повторяем его построчно, чтобы
+        # найти и залогировать конкретные проблемные записи
+        logger.warning(f"Ошибка пакетной загрузки ({len(videos_batch)} видео), переход на построчную: {e}")
+        # Секции, созданные в откатившейся транзакции, не существуют: кэш проверяется заново
+        forget_partitions()
+        touched = set()
+        for index, video_data in videos_batch:
+            await _load_video(video_data, index, stats, touched)
+        await refresh_touched(touched)
+        return
+
+    for snapshot_id, video_id in orphans:
+        logger.error(f"Ошибка снапшота {snapshot_id}: видео {video_id} не найдено")
+
+    stats['videos'] += videos_ok
+    stats['snapshots'] += snapshots_ok - len(orphans)
+    stats['errors'] += batch_stats['errors'] + len(orphans)
+
+
+async def bulk_load_videos(videos_data: Iterable[dict], stats: Dict[str, int], batch_size: int = 1000) -> Dict[str, int]:
+    """Пакетная загрузка видео: COPY в staging-таблицы и один upsert на таблицу"""
+    batch: List[Tuple[int, dict]] = []
+    processed = 0
+
+    for index, video_data in enumerate(videos_data, 1):
+        batch.append((index, video_data))
+        if len(batch) >= batch_size:
+            await _load_batch(batch, stats)
+            processed += len(batch)
+            logger.info(f"Прогресс: обработано {processed} видео")
+            batch = []
+
+    if batch:
+        await _load_batch(batch, stats)
+        processed += len(batch)
+        logger.info(f"Прогресс: обработано {processed} видео")
+
+    return stats
@@ -0,0 +1,212 @@
+"""Инкрементальная загрузка выгрузки с контрольными точками
+
+Вместо очистки таблиц и полной перезаливки (режим full) в базу пишутся
+только новые и изменившиеся строки:
+
+- для файла хранится контрольная точка (таблица load_checkpoints): хеш
+  содержимого, статус, число уже записанных видео и водяные знаки updated_at;
+- файл с тем же хешем, уже загруженный до конца, пропускается целиком;
+- после сбоя загрузка того же файла продолжается с первого незаписанного
+  пакета: позиция сохраняется в одной транзакции с данными пакета;
+- видео, JSON которого (вместе со снапшотами) не изменился с прошлой успешной
+  загрузки, пропускается без обращения к videos/snapshots (хеши в
+  video_load_digests); остальные сливаются upsert'ом с IS DISTINCT FROM, поэтому
+  неизменные строки не переписываются, а агрегаты пересчитываются только по
+  измененным видео.
+
+Водяные знаки только фиксируются (насколько свежие данные загружены): отсекать
+по ним строки нельзя, у нового видео бывают снапшоты старше водяного знака.
+Удаленные из выгрузки видео в этом режиме не удаляются из БД.
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.db.data_version import bump_data_version_raw
+from src.db.partitions import forget_partitions
+from src.db.rollups import asyncpg_executor, refresh_rollups
+from src.services.data_loader.bulk_loader import (
+    SNAPSHOT_COLUMNS, SNAPSHOTS_DELTA_MERGE_SQL, VIDEO_COLUMNS, VIDEOS_DELTA_MERGE_SQL,
+    build_rows, create_stage_tables, driver_transaction, stage_snapshots,
+)
+from src.services.data_loader.json_stream import iter_videos
+from src.services.data_loader.loader_service import _load_video, refresh_touched
+
+logger = logging.getLogger(__name__)
+
+DONE = 'done'
+
+START_SQL = (
+    "INSERT INTO load_checkpoints (source, file_hash, status, videos_done, errors, updated_at) "
+    "VALUES ($1, $2, 'in_progress', 0, 0, now()) "
+    "ON CONFLICT (source) DO UPDATE SET file_hash = EXCLUDED.file_hash, status = 'in_progress', "
+    "videos_done = 0, errors = 0, pending_videos_watermark = NULL, pending_snapshots_watermark = NULL, "
+    "updated_at = now()"
+)
+PROGRESS_SQL = (
+    "UPDATE load_checkpoints SET videos_done = $2, errors = errors + $3, "
+    "pending_videos_watermark = GREATEST(pending_videos_watermark, $4), "
+    "pending_snapshots_watermark = GREATEST(pending_snapshots_watermark, $5), updated_at = now() "
+    "WHERE source = $1"
+)
+FINISH_SQL = (
+    "UPDATE load_checkpoints SET status = 'done', updated_at = now(), "
+    "videos_watermark = GREATEST(videos_watermark, pending_videos_watermark), "
+    "snapshots_watermark = GREATEST(snapshots_watermark, pending_snapshots_watermark) "
+    "WHERE source = $1"
+)
+DIGESTS_SQL = "SELECT video_id, digest FROM video_load_digests WHERE video_id = ANY($1::varchar[])"
+SAVE_DIGESTS_SQL = (
+    "INSERT INTO video_load_digests (video_id, digest) SELECT * FROM unnest($1::varchar[], $2::bytea[]) "
+    "ON CONFLICT (video_id) DO UPDATE SET digest = EXCLUDED.digest"
+)
+
+_VIDEO_UPDATED_AT = VIDEO_COLUMNS.index('updated_at')
+_SNAPSHOT_UPDATED_AT = SNAPSHOT_COLUMNS.index('updated_at')
+
+
+def file_hash(path: Path, chunk_size: int = 1 << 20) -> str:
+    """sha256 содержимого файла как есть (сжатый файл хешируется сжатым)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def video_digest(video_data: dict) -> bytes:
+    """Хеш видео вместе со снапшотами
+
+    Ключи не сортируются (это треть времени): другой порядок ключей в выгрузке
+    даст лишь ложное «изменилось», а upsert с IS DISTINCT FROM ничего не перепишет.
+    """
+    payload = json.dumps(video_data, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).digest()
+
+
+def _max_time(rows: list, column: int) -> Optional[datetime]:
+    return max((row[column] for row in rows if row[column] is not None), default=None)
+
+
+async def _load_delta_batch(source: str, videos_batch: List[Tuple[int, dict]], stats: Dict[str, int]):
+    last_index = videos_batch[-1][0]
+    digests = {str(v['id']): video_digest(v) for _, v in videos_batch if v.get('id') is not None}
+
+    async with driver_transaction() as pg_conn:
+        known = {r['video_id']: r['digest'] for r in await pg_conn.fetch(DIGESTS_SQL, list(digests))}
+
+    unchanged = {video_id for video_id, digest in digests.items() if known.get(video_id) == digest}
+    changed_batch = [(i, v) for i, v in videos_batch if str(v.get('id')) not in unchanged]
+    stats['skipped_videos'] += len(videos_batch) - len(changed_batch)
+    stats['skipped_snapshots'] += sum(len(v.get('snapshots', [])) for i, v in videos_batch
+                                      if str(v.get('id')) in unchanged)
+
+    batch_stats = {'videos': 0, 'snapshots': 0, 'errors': 0}
+    failed: Set[str] = set()
+    video_rows, snapshot_rows, videos_ok, snapshots_ok = build_rows(changed_batch, batch_stats, failed)
+    watermarks = (_max_time(video_rows, _VIDEO_UPDATED_AT), _max_time(snapshot_rows, _SNAPSHOT_UPDATED_AT))
+
+    try:
+        async with driver_transaction() as pg_conn:
+            await create_stage_tables(pg_conn)
+            written_videos, written_snapshots, orphans = [], [], []
+
+            if video_rows:
+                await pg_conn.copy_records_to_table('videos_stage', records=video_rows, columns=VIDEO_COLUMNS)
+                written_videos = [r['video_id'] for r in await pg_conn.fetch(VIDEOS_DELTA_MERGE_SQL)]
+            if snapshot_rows:
+                orphans = await stage_snapshots(pg_conn, snapshot_rows)
+                written_snapshots = [r['video_id'] for r in await pg_conn.fetch(SNAPSHOTS_DELTA_MERGE_SQL)]
+
+            changed = set(written_videos) | set(written_snapshots)
+            if changed:
+                await refresh_rollups(asyncpg_executor(pg_conn), sorted(changed))
+                await bump_data_version_raw(pg_conn)
+
+            # Видео с ошибками хеш не получают и будут проверены снова при следующей загрузке.
+            # Снапшот без видео относится к тому видео, в JSON которого он записан
+            if orphans:
+                parents = {str(sd.get('id')): str(v.get('id')) for _, v in changed_batch for sd in v.get('snapshots', [])}
+                failed |= {parents.get(snapshot_id) for snapshot_id, _ in orphans}
+            loaded = [row[0] for row in video_rows if row[0] in digests and row[0] not in failed]
+            if loaded:
+                await pg_conn.execute(SAVE_DIGESTS_SQL, loaded, [digests[video_id] for video_id in loaded])
+
+            errors = batch_stats['errors'] + len(orphans)
+            await pg_conn.execute(PROGRESS_SQL, source, last_index, errors, *watermarks)
+    except Exception as e:
+        # Как и в bulk-режиме: пакет откатился, повторяем построчно, чтобы найти проблемные записи
+        logger.warning(f"Ошибка пакетной загрузки ({len(changed_batch)} видео), переход на построчную: {e}")
+        forget_partitions()
+        errors_before = stats['errors']
+        touched = set()
+        for index, video_data in changed_batch:
+            await _load_video(video_data, index, stats, touched)
+        await refresh_touched(touched)
+        async with driver_transaction() as pg_conn:
+            await pg_conn.execute(PROGRESS_SQL, source, last_index, stats['errors'] - errors_before, *watermarks)
+        return
+
+    for snapshot_id, video_id in orphans:
+        logger.error(f"Ошибка снапшота {snapshot_id}: видео {video_id} не найдено")
+
+    stats['videos'] += len(written_videos)
+    stats['snapshots'] += len(written_snapshots)
+    stats['skipped_videos'] += videos_ok - len(written_videos)
+    stats['skipped_snapshots'] += snapshots_ok - len(orphans) - len(written_snapshots)
+    stats['errors'] += errors
+
+
+async def load_incremental(json_file: Path, batch_size: int = 1000) -> Dict[str, int]:
+    """Загрузка только новых и изменившихся строк с продолжением после сбоя
+
+    Возвращает статистику: videos/snapshots — записано (вставлено или изменено),
+    skipped_* — пропущено как неизменные, unchanged_file — файл уже загружен.
+    """
+    source = str(json_file.resolve())
+    stats = {'videos': 0, 'snapshots': 0, 'errors': 0,
+             'skipped_videos': 0, 'skipped_snapshots': 0, 'unchanged_file': 0}
+
+    digest = file_hash(json_file)
+    async with driver_transaction() as pg_conn:
+        checkpoint = await pg_conn.fetchrow("SELECT * FROM load_checkpoints WHERE source = $1", source)
+
+        same_file = checkpoint is not None and checkpoint['file_hash'] == digest
+        if same_file and checkpoint['status'] == DONE:
+            logger.info(f"Файл {json_file} не изменился с последней загрузки, пропуск")
+            stats['unchanged_file'] = 1
+            return stats
+
+        if same_file:
+            start = checkpoint['videos_done']
+            logger.warning(f"Продолжение прерванной загрузки {json_file} с видео №{start + 1}")
+        else:
+            start = 0
+            await pg_conn.execute(START_SQL, source, digest)
+
+    batch: List[Tuple[int, dict]] = []
+    for index, video_data in enumerate(iter_videos(json_file), 1):
+        if index <= start:
+            continue
+        batch.append((index, video_data))
+        if len(batch) >= batch_size:
+            await _load_delta_batch(source, batch, stats)
+            logger.info(f"Прогресс: обработано {index} видео")
+            batch = []
+
+    if batch:
+        await _load_delta_batch(source, batch, stats)
+        logger.info(f"Прогресс: обработано {batch[-1][0]} видео")
+
+    async with driver_transaction() as pg_conn:
+        await pg_conn.execute(FINISH_SQL, source)
+        checkpoint = await pg_conn.fetchrow("SELECT * FROM load_checkpoints WHERE source = $1", source)
+
+    logger.info(f"Инкрементальная загрузка завершена: записано видео {stats['videos']}, "
+                f"снапшотов {stats['snapshots']}; без изменений видео {stats['skipped_videos']}, "
+                f"снапшотов {stats['skipped_snapshots']}; ошибок {stats['errors']}; данные по "
+                f"{checkpoint['videos_watermark']} (видео) / {checkpoint['snapshots_watermark']} (снапшоты)")
+    return stats
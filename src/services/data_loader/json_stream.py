@@ -0,0 +1,185 @@
+import gzip
+import io
+import json
+import logging
+from pathlib import Path
+from typing import Iterator, TextIO, Union
+
+import zstandard
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+NDJSON_SUFFIXES = {'.ndjson', '.jsonl'}
+WHITESPACE = ' \t\n\r'
+
+
+def open_text(path: Path) -> TextIO:
+    """Открытие файла как текстового потока с прозрачной распаковкой gzip/zstd
+
+    Сжатие определяется по сигнатуре файла, а не по расширению.
+    """
+    raw = open(path, 'rb')
+    magic = raw.read(4)
+    raw.seek(0)
+
+    if magic.startswith(GZIP_MAGIC):
+        binary = gzip.GzipFile(fileobj=raw)
+    elif magic.startswith(ZSTD_MAGIC):
+        binary = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+    else:
+        binary = raw
+
+    return io.TextIOWrapper(binary, encoding='utf-8-sig')
+
+
+def is_ndjson(path: Path) -> bool:
+    """NDJSON определяется по расширению без учета .gz/.zst (videos.jsonl.zst)"""
+    suffixes = [s.lower() for s in path.suffixes]
+    while suffixes and suffixes[-1] in ('.gz', '.zst', '.zstd'):
+        suffixes.pop()
+    return bool(suffixes) and suffixes[-1] in NDJSON_SUFFIXES
+
+
+class _StreamDecoder:
+    """Инкрементальный разбор JSON поверх буфера, который дочитывается по мере надобности"""
+
+    def __init__(self, stream: TextIO, chunk_size: int):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size: int = None) -> bool:
+        if self.eof:
+            return False
+        chunk = self.stream.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Отбрасываем уже разобранную часть, чтобы буфер не рос вместе с файлом
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Следующий непробельный символ ('' в конце потока)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Ожидался символ {char!r}, найден {found!r} (позиция {self.pos})")
+        self.pos += 1
+
+    def value(self):
+        """Разбор одного JSON-значения, начиная с текущей позиции"""
+        self.peek()
+        read_size = self.chunk_size
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Значение обрезано концом буфера: дочитываем, увеличивая порцию,
+                # чтобы большие объекты не разбирались заново квадратично
+                if not self._fill(read_size):
+                    raise
+                read_size *= 2
+                continue
+            # Число на границе буфера могло продолжаться в следующей порции
+            if end == len(self.buf) and not self.eof and self._fill(read_size):
+                continue
+            self.pos = end
+            return obj
+
+    def array_items(self) -> Iterator:
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            sep = self.peek()
+            self.pos += 1
+            if sep == ']':
+                return
+            if sep != ',':
+                raise ValueError(f"Ожидался ',' или ']' в массиве, найден {sep!r}")
+
+
+def _iter_json_videos(stream: TextIO, chunk_size: int) -> Iterator[dict]:
+    reader = _StreamDecoder(stream, chunk_size)
+    first = reader.peek()
+
+    if first == '[':
+        yield from reader.array_items()
+        return
+
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == 'videos':
+            yield from reader.array_items()
+        else:
+            reader.value()
+
+        sep = reader.peek()
+        reader.pos += 1
+        if sep == '}':
+            return
+        if sep != ',':
+            raise ValueError(f"Ожидался ',' или '}}' в объекте, найден {sep!r}")
+
+
+def _iter_ndjson_videos(stream: TextIO) -> Iterator[dict]:
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            logger.error(f"Некорректная строка NDJSON №{line_no}: {e}")
+
+
+def iter_videos(path: Path, chunk_size: int = 1 << 16) -> Iterator[dict]:
+    """Потоковое чтение видео (со снапшотами) по одному из выгрузки
+
+    Поддерживаются {"videos": [...]}, массив видео верхнего уровня и NDJSON
+    (одно видео на строку), в том числе сжатые gzip или zstd. В памяти
+    держится только текущее видео и буфер чтения.
+    """
+    with open_text(path) as stream:
+        if is_ndjson(path):
+            yield from _iter_ndjson_videos(stream)
+        else:
+            yield from _iter_json_videos(stream, chunk_size)
+
+
+def iter_video_records(path: Path, chunk_size: int = 1 << 16) -> Iterator[Union[str, dict]]:
+    """Как iter_videos, но строки NDJSON отдаются без разбора
+
+    Для параллельной загрузки: JSON строки декодирует процесс-обработчик, а не
+    читающий процесс. Вложенный JSON-документ без разбора на видео не делится,
+    поэтому для него, как и в iter_videos, отдаются уже разобранные словари.
+    """
+    with open_text(path) as stream:
+        if is_ndjson(path):
+            for line in stream:
+                line = line.strip()
+                if line:
+                    yield line
+        else:
+            yield from _iter_json_videos(stream, chunk_size)
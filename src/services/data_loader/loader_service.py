@@ -1,29 +1,45 @@
-import json
 import logging
 import asyncio
+import argparse
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, Set
 
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy import text, delete
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection
 
-from src.db.models import VideosOrm, SnapshotsOrm
+from src.db.models import (
+    VideosOrm, SnapshotsOrm, LoadCheckpointOrm, VideoLoadDigestOrm, SNAPSHOTS_PARTITIONED, SNAPSHOT_CONFLICT_COLUMNS,
+)
 from src.db.database import get_async_session
+from src.db.data_version import bump_data_version
+from src.db.partitions import ensure_partitions, session_partition_ops
+from src.db.rollups import clear_rollups, refresh_rollups, session_executor
+from src.services.data_loader.json_stream import iter_videos
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_JSON_PATH = Path(__file__).resolve().parents[3] / 'data' / 'videos.json'
+
 async def clear_existing_data():
     """Очистка таблиц перед загрузкой новых данных"""
     logger.warning("ОЧИСТКА ТАБЛИЦ: Удаление всех существующих данных...")
     async with get_async_session() as session:
         try:
+            await clear_rollups(session)
             await session.execute(delete(SnapshotsOrm))
             logger.info(f"Таблица 'snapshots' очищена")
 
             await session.execute(delete(VideosOrm))
             logger.info(f"Таблица 'videos' очищена")
 
+            # Контрольные точки инкрементальной загрузки описывают удаленные данные
+            await session.execute(delete(LoadCheckpointOrm))
+            await session.execute(delete(VideoLoadDigestOrm))
+
+            await bump_data_version(session)
             await session.commit()
             logger.warning("Очистка таблиц успешно завершена")
         except Exception as e:
@@ -32,57 +48,54 @@ async def clear_existing_data():
             raise
 
 
-async def load_videos_from_json(json_file: Path) -> Dict[str, int]:
-    """Основная функция загрузки данных из JSON"""
+async def load_videos_from_json(json_file: Path, bulk: bool = False, batch_size: int = 1000,
+                                workers: int = 1, writers: int = None) -> Dict[str, int]:
+    """Основная функция загрузки данных из JSON
+
+    Файл читается потоком (json_stream.iter_videos), поэтому память не растет
+    с размером выгрузки; поддерживаются gzip/zstd и NDJSON.
+    bulk=True включает пакетную загрузку через COPY во временные таблицы
+    (см. bulk_loader), иначе каждое видео пишется отдельной сессией.
+    workers > 1 — параллельная пакетная загрузка (см. parallel_loader):
+    разбор в workers процессах, запись через writers соединений.
+    """
     logger.info(f"Начало загрузки данных из {json_file}")
 
     if not json_file.exists():
         logger.error(f"Файл не найден: {json_file}")
         return {'videos': 0, 'snapshots': 0, 'errors': 0}
 
-    with open(json_file, 'r', encoding='utf-8') as f:
-        raw_data = json.load(f)
-
-    videos_data: List[dict] = raw_data.get("videos", [])
-    total_videos = len(videos_data)
-    logger.info(f"Найдено {total_videos} видео для обработки")
-
     stats = {'videos': 0, 'snapshots': 0, 'errors': 0}
+    counters = {'videos': 0, 'snapshots': 0}       # Счетчики прочитанного из файла для отладки
+
+    def counted(videos: Iterator[dict]) -> Iterator[dict]:
+        for video_data in videos:
+            counters['videos'] += 1
+            counters['snapshots'] += len(video_data.get("snapshots", []))
+            yield video_data
+
+    videos_data = counted(iter_videos(json_file))
+
+    if workers > 1:
+        from src.services.data_loader.parallel_loader import parallel_load_videos
+        counters = await parallel_load_videos(json_file, stats, batch_size=batch_size,
+                                              workers=workers, writers=writers)
+    elif bulk:
+        from src.services.data_loader.bulk_loader import bulk_load_videos
+        await bulk_load_videos(videos_data, stats, batch_size=batch_size)
+    else:
+        touched: Set[str] = set()
+        for index, video_data in enumerate(videos_data, 1):
+            if index % 50 == 0:
+                logger.info(f"Прогресс: обработано {index} видео")
 
-    processed_snapshots_count = 0       # Счетчик для отладки
-
-    for index, video_data in enumerate(videos_data, 1):
-        video_id = video_data.get('id', f'unknown_{index}')
-
-        if index % 50 == 0 or index == total_videos:
-            logger.info(f"Прогресс: обработано {index}/{total_videos} видео")
+            await _load_video(video_data, index, stats, touched)
+            if len(touched) >= batch_size:
+                await refresh_touched(touched)
+        await refresh_touched(touched)
 
-        try:
-            async with get_async_session() as session:
-                await _upsert_video(session, video_data)
-                stats['videos'] += 1
-
-                snapshots_data = video_data.get("snapshots", [])
-                snapshots_count = len(snapshots_data)
-                processed_snapshots_count += snapshots_count
-
-                if snapshots_count > 0:
-                    snapshot_errors = 0
-                    for snapshot_data in snapshots_data:
-                        try:
-                            await _upsert_snapshot(session, snapshot_data)
-                            stats['snapshots'] += 1
-                        except Exception as e:
-                            logger.error(f"Ошибка снапшота (видео {video_id}): {e}")
-                            snapshot_errors += 1
-
-                    if snapshot_errors > 0:
-                        stats['errors'] += snapshot_errors
-                        logger.warning(f"Видео {video_id}: {snapshot_errors} ошибок снапшотов")
-
-        except Exception as e:
-            logger.error(f"Ошибка видео {video_id} (№{index}): {e}")
-            stats['errors'] += 1
+    total_videos = counters['videos']
+    processed_snapshots_count = counters['snapshots']
 
     # ФИНАЛЬНАЯ СТАТИСТИКА
     logger.info(f"=" * 50)
@@ -96,9 +109,74 @@ async def load_videos_from_json(json_file: Path) -> Dict[str, int]:
     return stats
 
 
-async def _upsert_video(session, video_data: dict):
-    """Вставка или обновление видео"""
-    video_dict = {
+async def refresh_touched(video_ids: Set[str]):
+    """Пересчет агрегатов по записанным построчно видео и новая версия данных
+
+    Построчная загрузка не пересчитывает агрегаты на каждое видео (несколько
+    запросов по двум гранулярностям и сброс кэшей): id копятся в наборе, и
+    пересчет идет одной транзакцией на пакет. Набор очищается.
+    """
+    if not video_ids:
+        return
+    async with get_async_session() as session:
+        await refresh_rollups(session_executor(session), sorted(video_ids))
+        await bump_data_version(session)
+    video_ids.clear()
+
+
+def _touched_ids(video_data: dict) -> Iterable[str]:
+    """id видео, агрегаты которых меняет запись video_data"""
+    yield str(video_data["id"])
+    for snapshot_data in video_data.get("snapshots", []):
+        if "video_id" in snapshot_data:
+            yield str(snapshot_data["video_id"])
+
+
+async def _load_video(video_data: dict, index: int, stats: Dict[str, int], touched: Set[str],
+                      connection: AsyncConnection = None):
+    """Построчная загрузка одного видео со снапшотами в отдельной сессии
+
+    id затронутых видео добавляются в touched; агрегаты и версию данных по ним
+    обновляет вызывающий (refresh_touched) после пакета. connection — соединение
+    вызывающего (писатель параллельной загрузки), иначе берется из общего пула.
+    """
+    video_id = video_data.get('id', f'unknown_{index}')
+
+    try:
+        async with get_async_session(connection) as session:
+            await _upsert_video(session, video_data)
+            stats['videos'] += 1
+
+            snapshots_data = video_data.get("snapshots", [])
+
+            snapshot_errors = 0
+            transaction_failed = False
+            if snapshots_data:
+                for snapshot_data in snapshots_data:
+                    try:
+                        await _upsert_snapshot(session, snapshot_data)
+                        stats['snapshots'] += 1
+                    except Exception as e:
+                        logger.error(f"Ошибка снапшота (видео {video_id}): {e}")
+                        snapshot_errors += 1
+                        transaction_failed = transaction_failed or isinstance(e, DBAPIError)
+
+                if snapshot_errors > 0:
+                    stats['errors'] += snapshot_errors
+                    logger.warning(f"Видео {video_id}: {snapshot_errors} ошибок снапшотов")
+
+            # После ошибки БД транзакция прервана и данные все равно не запишутся
+            if not transaction_failed:
+                touched.update(_touched_ids(video_data))
+
+    except Exception as e:
+        logger.error(f"Ошибка видео {video_id} (№{index}): {e}")
+        stats['errors'] += 1
+
+
+def _video_values(video_data: dict) -> dict:
+    """Приведение полей видео из JSON к колонкам таблицы videos"""
+    return {
         "video_id": str(video_data["id"]),
         "creator_id": str(video_data["creator_id"]),
         "video_created_at": _parse_datetime(video_data.get("video_created_at")),
@@ -110,28 +188,18 @@ async def _upsert_video(session, video_data: dict):
         "updated_at": _parse_datetime(video_data.get("updated_at"))
     }
 
-    stmt = insert(VideosOrm).values(**video_dict)
-    stmt = stmt.on_conflict_do_update(
-        index_elements=["video_id"],
-        set_={
-            "views_count": stmt.excluded.views_count,
-            "likes_count": stmt.excluded.likes_count,
-            "comments_count": stmt.excluded.comments_count,
-            "reports_count": stmt.excluded.reports_count,
-            "creator_id": stmt.excluded.creator_id,
-            "video_created_at": stmt.excluded.video_created_at,
-            "updated_at": stmt.excluded.updated_at
-        }
-    )
-    await session.execute(stmt)
 
-
-async def _upsert_snapshot(session, snapshot_data: dict):
+def _snapshot_values(snapshot_data: dict) -> dict:
+    """Приведение полей снапшота из JSON к колонкам таблицы snapshots"""
     # ВАЛИДАЦИЯ ОБЯЗАТЕЛЬНЫХ ПОЛЕЙ
     if "video_id" not in snapshot_data:
         raise ValueError("Снапшот не содержит video_id")
 
-    snapshot_dict = {
+    created_at = _parse_datetime(snapshot_data.get("created_at"))
+    if created_at is None and SNAPSHOTS_PARTITIONED:
+        raise ValueError("Снапшот без created_at не может попасть ни в одну секцию")
+
+    return {
         "snapshot_id": str(snapshot_data["id"]),
         "video_id": str(snapshot_data["video_id"]),
         "views_count": int(snapshot_data.get("views_count", 0)),
@@ -142,13 +210,39 @@ async def _upsert_snapshot(session, snapshot_data: dict):
         "delta_likes_count": int(snapshot_data.get("delta_likes_count", 0)),
         "delta_comments_count": int(snapshot_data.get("delta_comments_count", 0)),
         "delta_reports_count": int(snapshot_data.get("delta_reports_count", 0)),
-        "created_at": _parse_datetime(snapshot_data.get("created_at")),
+        "created_at": created_at,
         "updated_at": _parse_datetime(snapshot_data.get("updated_at"))
     }
 
+
+async def _upsert_video(session, video_data: dict):
+    """Вставка или обновление видео"""
+    video_dict = _video_values(video_data)
+
+    stmt = insert(VideosOrm).values(**video_dict)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["video_id"],
+        set_={
+            "views_count": stmt.excluded.views_count,
+            "likes_count": stmt.excluded.likes_count,
+            "comments_count": stmt.excluded.comments_count,
+            "reports_count": stmt.excluded.reports_count,
+            "creator_id": stmt.excluded.creator_id,
+            "video_created_at": stmt.excluded.video_created_at,
+            "updated_at": stmt.excluded.updated_at
+        }
+    )
+    await session.execute(stmt)
+
+
+async def _upsert_snapshot(session, snapshot_data: dict):
+    snapshot_dict = _snapshot_values(snapshot_data)
+    if SNAPSHOTS_PARTITIONED:
+        await ensure_partitions(*session_partition_ops(session), [snapshot_dict['created_at']])
+
     stmt = insert(SnapshotsOrm).values(**snapshot_dict)
     stmt = stmt.on_conflict_do_update(
-        index_elements=['snapshot_id'],
+        index_elements=list(SNAPSHOT_CONFLICT_COLUMNS),
         set_={
             'views_count': stmt.excluded.views_count,
             'likes_count': stmt.excluded.likes_count,
@@ -180,28 +274,64 @@ def _parse_datetime(dt_str: str) -> datetime:
         return None
 
 
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Загрузка видео и снапшотов из JSON в БД")
+    parser.add_argument('json_path', nargs='?', type=Path, default=DEFAULT_JSON_PATH,
+                        help="путь к выгрузке: JSON или NDJSON, можно сжатый gzip/zstd")
+    parser.add_argument('--mode', choices=('full', 'incremental'), default='full',
+                        help="full — очистка таблиц и полная загрузка; incremental — только новые и "
+                             "измененные строки с контрольной точкой (всегда пакетно через COPY)")
+    parser.add_argument('--bulk', action='store_true',
+                        help="пакетная загрузка через COPY и set-based upsert")
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help="количество видео в одном пакете (--bulk и --mode incremental)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="процессов для разбора JSON; больше 1 — параллельная пакетная загрузка "
+                             "(только --mode full)")
+    parser.add_argument('--writers', type=int, default=None,
+                        help="параллельных соединений для записи (по умолчанию равно --workers)")
+    return parser.parse_args()
+
+
 async def main():
     """Основная функция запуска"""
-    json_path = Path(r"D:\WrokingProjects\PythonProject\data\videos.json")
+    args = _parse_args()
+    json_path = args.json_path
 
     print("=" * 60)
     print("ЗАПУСК ЗАГРУЗЧИКА ДАННЫХ")
     print(f"JSON файл: {json_path}")
+    if args.mode == 'incremental':
+        print("Режим: инкрементальный (COPY, только изменения)")
+    else:
+        if args.workers > 1:
+            print(f"Режим: параллельный bulk (COPY), процессов {args.workers}, "
+                  f"соединений {args.writers or args.workers}")
+        else:
+            print(f"Режим: {'bulk (COPY)' if args.bulk else 'построчный'}")
     print("=" * 60)
 
     if not json_path.exists():
         print(f"ОШИБКА: Файл не найден: {json_path}")
         return
 
-    await clear_existing_data()
-
     print("Начало загрузки данных...")
-    stats = await load_videos_from_json(json_path)
+    if args.mode == 'incremental':
+        from src.services.data_loader.incremental import load_incremental
+        stats = await load_incremental(json_path, batch_size=args.batch_size)
+    else:
+        await clear_existing_data()
+        stats = await load_videos_from_json(json_path, bulk=args.bulk, batch_size=args.batch_size,
+                                            workers=args.workers, writers=args.writers)
 
     print("\n" + "=" * 60)
     print("ИТОГИ ЗАГРУЗКИ:")
+    if stats.get('unchanged_file'):
+        print("  Файл не изменился с последней загрузки")
     print(f"  Видео:     {stats['videos']}")
     print(f"  Снапшоты:  {stats['snapshots']}")
+    if args.mode == 'incremental':
+        print(f"  Без изменений: видео {stats['skipped_videos']}, снапшотов {stats['skipped_snapshots']}")
     print(f"  Ошибки:    {stats['errors']}")
 
     if stats['errors'] == 0:
@@ -221,4 +351,4 @@ if __name__ == '__main__':
         ]
     )
 
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
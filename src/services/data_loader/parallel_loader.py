@@ -0,0 +1,215 @@
+"""Параллельная загрузка: пул процессов для разбора и несколько соединений для записи
+
+Конвейер из трех стадий с ограниченными очередями между ними:
+
+- чтение файла (в отдельном потоке, чтобы не блокировать event loop) и нарезка
+  на пакеты по batch_size видео;
+- пул процессов: декодирование строк NDJSON, _parse_datetime и приведение
+  чисел (bulk_loader.build_rows) — то, что в bulk-режиме занимает одно ядро;
+- writers асинхронных задач, у каждой свое соединение из отдельного движка
+  размером writers (общий пул бота не занимается): COPY пакета во временные
+  таблицы и upsert в videos/snapshots.
+
+Очередь разобранных пакетов ограничена, поэтому чтение останавливается, пока
+запись не догонит: в памяти не больше queue_size пакетов. Ожидание места в
+очереди прерывается падением любого писателя, и загрузка останавливается с его
+ошибкой.
+
+Агрегаты снапшотов по пакетам не обновляются: параллельные upsert'ы в общие
+строки creator_stats_* блокировали бы друг друга. Они пересчитываются один раз
+в конце вместе с увеличением версии данных. Поэтому режим предназначен для
+полной загрузки (--mode full) после очистки таблиц.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+import asyncpg
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.db.database import create_engine_from_settings
+from src.db.partitions import forget_partitions
+from src.db.rollups import rebuild_rollups
+from src.services.data_loader.bulk_loader import (
+    SNAPSHOTS_MERGE_SQL, VIDEO_COLUMNS, VIDEOS_MERGE_SQL, build_rows, create_stage_tables, stage_snapshots,
+)
+from src.services.data_loader.json_stream import iter_video_records
+from src.services.data_loader.loader_service import _load_video
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых пакет имеет смысл просто повторить: взаимоблокировка
+# писателей и гонка при создании одной и той же секции snapshots
+RETRYABLE_ERRORS = (
+    asyncpg.exceptions.TransactionRollbackError,
+    asyncpg.exceptions.UniqueViolationError,
+    asyncpg.exceptions.DuplicateTableError,
+)
+MAX_ATTEMPTS = 3
+
+Record = Union[str, dict]
+
+
+class ParsedChunk(NamedTuple):
+    """Результат разбора пакета в процессе-обработчике"""
+    video_rows: list
+    snapshot_rows: list
+    videos_ok: int
+    snapshots_ok: int
+    errors: int
+    videos_read: int
+    snapshots_read: int
+
+
+def _decode(index: int, record: Record) -> Optional[dict]:
+    if isinstance(record, dict):
+        return record
+    try:
+        return json.loads(record)
+    except json.JSONDecodeError as e:
+        logger.error(f"Некорректная строка NDJSON (видео №{index}): {e}")
+        return None
+
+
+def parse_chunk(chunk: List[Tuple[int, Record]]) -> ParsedChunk:
+    """Декодирование и приведение типов пакета (выполняется в пуле процессов)"""
+    videos = [(index, video) for index, video in ((i, _decode(i, r)) for i, r in chunk) if video is not None]
+    stats = {'videos': 0, 'snapshots': 0, 'errors': 0}
+    video_rows, snapshot_rows, videos_ok, snapshots_ok = build_rows(videos, stats)
+    return ParsedChunk(video_rows, snapshot_rows, videos_ok, snapshots_ok, stats['errors'],
+                       len(videos), sum(len(v.get('snapshots', [])) for _, v in videos))
+
+
+def _init_worker(level: int):
+    logging.basicConfig(level=level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+async def _write_chunk(pg_conn, parsed: ParsedChunk) -> List[Tuple[str, str]]:
+    """COPY и upsert пакета без пересчета агрегатов; возвращает снапшоты без видео"""
+    orphans = []
+    async with pg_conn.transaction():
+        await create_stage_tables(pg_conn)
+        if parsed.video_rows:
+            await pg_conn.copy_records_to_table('videos_stage', records=parsed.video_rows, columns=VIDEO_COLUMNS)
+            await pg_conn.execute(VIDEOS_MERGE_SQL)
+        if parsed.snapshot_rows:
+            orphans = await stage_snapshots(pg_conn, parsed.snapshot_rows)
+            await pg_conn.execute(SNAPSHOTS_MERGE_SQL)
+    return orphans
+
+
+async def _write_with_retry(number: int, pg_conn, parsed: ParsedChunk) -> List[Tuple[str, str]]:
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            return await _write_chunk(pg_conn, parsed)
+        except RETRYABLE_ERRORS as e:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            logger.info(f"Писатель {number}: пакет будет повторен ({e})")
+
+
+async def _writer(number: int, engine: AsyncEngine, queue: asyncio.Queue, stats: Dict[str, int],
+                  read: Dict[str, int]):
+    """Запись пакетов из очереди на собственном соединении до получения None
+
+    Ошибка пакета не завершает задачу: пакет повторяется построчно, как
+    в bulk-режиме, на том же соединении.
+    """
+    async with engine.connect() as conn:
+        pg_conn = (await conn.get_raw_connection()).driver_connection
+
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            chunk, future = item
+
+            try:
+                parsed: ParsedChunk = await future
+                orphans = await _write_with_retry(number, pg_conn, parsed)
+            except Exception as e:
+                logger.warning(f"Ошибка пакетной загрузки ({len(chunk)} видео), переход на построчную: {e}")
+                forget_partitions()
+                for index, record in chunk:
+                    video_data = _decode(index, record)
+                    if video_data is None:
+                        continue
+                    read['videos'] += 1
+                    read['snapshots'] += len(video_data.get('snapshots', []))
+                    # Агрегаты пересчитываются целиком в конце загрузки
+                    await _load_video(video_data, index, stats, set(), conn)
+            else:
+                for snapshot_id, video_id in orphans:
+                    logger.error(f"Ошибка снапшота {snapshot_id}: видео {video_id} не найдено")
+                read['videos'] += parsed.videos_read
+                read['snapshots'] += parsed.snapshots_read
+                stats['videos'] += parsed.videos_ok
+                stats['snapshots'] += parsed.snapshots_ok - len(orphans)
+                stats['errors'] += parsed.errors + len(orphans)
+
+            read['written'] += len(chunk)
+            logger.info(f"Прогресс: обработано {read['written']} видео")
+
+
+async def _put(queue: asyncio.Queue, item, writer_tasks: List[asyncio.Task]):
+    """queue.put, прерываемый ошибкой писателя: иначе чтение ждало бы места в очереди вечно"""
+    put = asyncio.ensure_future(queue.put(item))
+    try:
+        while not put.done():
+            running = [task for task in writer_tasks if not task.done()]
+            await asyncio.wait([put, *running], return_when=asyncio.FIRST_COMPLETED)
+            for task in writer_tasks:
+                if task.done() and task.exception() is not None:
+                    raise task.exception()
+    finally:
+        put.cancel()
+
+
+async def parallel_load_videos(json_file: Path, stats: Dict[str, int], batch_size: int = 1000,
+                               workers: int = 2, writers: int = None,
+                               queue_size: int = None) -> Dict[str, int]:
+    """Загрузка выгрузки конвейером: workers процессов разбора и writers соединений записи
+
+    Заполняет stats (videos/snapshots/errors — записано) и возвращает счетчики
+    прочитанного из файла (videos/snapshots).
+    """
+    writers = writers or workers
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size or 2 * writers)
+    read = {'videos': 0, 'snapshots': 0, 'written': 0}
+    loop = asyncio.get_running_loop()
+
+    # forkserver: процессы не наследуют event loop, соединения и потоки родителя
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('forkserver'),
+                               initializer=_init_worker, initargs=(logging.getLogger().getEffectiveLevel(),))
+    records = enumerate(iter_video_records(json_file), 1)
+    # Писатели держат соединение всю загрузку: отдельный пул ровно на writers соединений
+    engine = create_engine_from_settings(pooled=True, pool_size=writers, max_overflow=0)
+    writer_tasks = [asyncio.create_task(_writer(n, engine, queue, stats, read)) for n in range(1, writers + 1)]
+
+    try:
+        while True:
+            chunk = await asyncio.to_thread(lambda: list(islice(records, batch_size)))
+            if not chunk:
+                break
+            # put ждет, пока в очереди не освободится место: чтение не обгоняет запись
+            await _put(queue, (chunk, loop.run_in_executor(pool, parse_chunk, chunk)), writer_tasks)
+        for _ in writer_tasks:
+            await _put(queue, None, writer_tasks)
+        await asyncio.gather(*writer_tasks)
+    except BaseException:
+        for task in writer_tasks:
+            task.cancel()
+        await asyncio.gather(*writer_tasks, return_exceptions=True)
+        raise
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        await engine.dispose()
+
+    logger.info("Пересчет агрегатов снапшотов после параллельной загрузки")
+    await rebuild_rollups(bump_version=True)
+    return {'videos': read['videos'], 'snapshots': read['snapshots']}
@@ -0,0 +1,270 @@
+"""Метрики бота: счетчики, гистограммы задержек стадий и экспорт в формате Prometheus
+
+Стадии обработки сообщения замеряются через metrics.span('стадия') и попадают
+в гистограмму bot_stage_duration_seconds{stage=...}. Состояние компонентов,
+у которых уже есть свои счетчики (кэши, планировщик, песочница), снимается
+в момент запроса /metrics функциями-сборщиками (register_collector), чтобы
+не дублировать учет в горячем пути.
+"""
+import asyncio
+import inspect
+import logging
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# (имя, тип, описание, метки, значение) — результат сборщика
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+LabelKey = Tuple[str, ...]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (k + '="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+               for k, v in labels.items())
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name}: ожидались метки {self.label_names}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _labels(self, key: LabelKey) -> Dict[str, str]:
+        return dict(zip(self.label_names, key))
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    """Монотонный счетчик с метками"""
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def values(self) -> Dict[LabelKey, float]:
+        return dict(self._values)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self._labels(key))} {_format_value(value)}')
+        return lines
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин (как в клиенте Prometheus)"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # по каждой комбинации меток: [счетчики корзин..., сумма, количество]
+        self._series: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return int(series[-1]) if series else 0
+
+    def total(self, **labels) -> float:
+        series = self._series.get(self._key(labels))
+        return series[-2] if series else 0.0
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Оценка квантиля по корзинам с линейной интерполяцией (как histogram_quantile)"""
+        series = self._series.get(self._key(labels))
+        if not series or not series[-1]:
+            return None
+        rank = q * series[-1]
+        cumulative, lower = 0, 0.0
+        for i, bound in enumerate(self.buckets):
+            in_bucket = series[i]
+            if cumulative + in_bucket >= rank and in_bucket:
+                return lower + (bound - lower) * (rank - cumulative) / in_bucket
+            cumulative += in_bucket
+            lower = bound
+        return self.buckets[-1]
+
+    def label_sets(self) -> List[Dict[str, str]]:
+        return [self._labels(key) for key in sorted(self._series)]
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, series in sorted(self._series.items()):
+            labels = self._labels(key)
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += series[i]
+                lines.append(f'{self.name}_bucket{_format_labels({**labels, "le": _format_value(bound)})} '
+                             f'{int(cumulative)}')
+            lines.append(f'{self.name}_bucket{_format_labels({**labels, "le": "+Inf"})} {int(series[-1])}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(series[-2])}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {int(series[-1])}')
+        return lines
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса и сборщиков состояния компонентов"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self.stages = self.histogram('bot_stage_duration_seconds', 'Длительность стадий обработки запроса',
+                                     ('stage',))
+        self.stage_errors = self.counter('bot_stage_errors_total', 'Стадии, завершившиеся исключением',
+                                         ('stage',))
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Метрика {name} уже зарегистрирована с типом {metric.kind}")
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labels)
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labels, buckets)
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]):
+        """Функция (обычная или async), возвращающая метрики на момент запроса"""
+        self._collectors.append(collector)
+
+    @contextmanager
+    def span(self, stage: str):
+        """Замер стадии: длительность в гистограмму, исключение — в счетчик ошибок стадии"""
+        started = time.perf_counter()
+        try:
+            yield
+        except asyncio.CancelledError:
+            raise
+        except BaseException:
+            self.stage_errors.inc(stage=stage)
+            raise
+        finally:
+            self.stages.observe(time.perf_counter() - started, stage=stage)
+
+    async def _collect(self) -> List[Sample]:
+        samples = []
+        for collector in self._collectors:
+            try:
+                result = collector()
+                if inspect.isawaitable(result):
+                    result = await result
+                samples.extend(result)
+            except Exception as e:
+                logger.warning(f"Сборщик метрик {getattr(collector, '__name__', collector)} завершился ошибкой: {e}")
+        return samples
+
+    async def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus 0.0.4"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+
+        # Один сборщик может отдать метрику частями, а несколько сборщиков — одну и ту же
+        # метрику с разными метками: формат требует одного блока на метрику под HELP/TYPE
+        families: Dict[str, List[str]] = {}
+        for name, kind, documentation, labels, value in await self._collect():
+            family = families.get(name)
+            if family is None:
+                family = families[name] = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+            family.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        for family in families.values():
+            lines.extend(family)
+        return '\n'.join(lines) + '\n'
+
+    def stage_summary(self) -> List[Tuple[str, int, float, float, float]]:
+        """(стадия, количество, среднее, p50, p95) в секундах для каждой замеренной стадии"""
+        rows = []
+        for labels in self.stages.label_sets():
+            count = self.stages.count(**labels)
+            rows.append((labels['stage'], count, self.stages.total(**labels) / count,
+                         self.stages.quantile(0.5, **labels), self.stages.quantile(0.95, **labels)))
+        return rows
+
+
+def stats_samples(prefix: str, stats: dict, labels: Dict[str, str] = None,
+                  counters: Iterable[str] = ()) -> List[Sample]:
+    """Числовые поля словаря stats() компонента в виде метрик prefix_<поле>
+
+    Поля из counters экспортируются как счетчики (с суффиксом _total), остальные — как gauge.
+    """
+    counters = set(counters)
+    samples = []
+    for field, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if field in counters:
+            samples.append((f'{prefix}_{field}_total', 'counter', f'{prefix}: {field}', labels or {}, value))
+        else:
+            samples.append((f'{prefix}_{field}', 'gauge', f'{prefix}: {field}', labels or {}, value))
+    return samples
+
+
+async def start_metrics_server(registry: "MetricsRegistry", host: str, port: int) -> web.AppRunner:
+    """HTTP-сервер с /metrics; остановка — await runner.cleanup()"""
+    async def handle_metrics(request: web.Request) -> web.Response:
+        body = await registry.render()
+        return web.Response(body=body.encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class _Call:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Схлопывание одновременных одинаковых вызовов в один
+
+    Пока работа по ключу выполняется, повторные вызовы do() с тем же ключом
+    ждут тот же результат, а не запускают работу заново. Исключение получают
+    все ожидающие. Отмена одного ожидающего не трогает остальных; если ушли
+    все, сама работа отменяется.
+    """
+
+    def __init__(self, name: str = ''):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _, key=key, call=call: self._forget(key, call))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+            logger.debug(f"SingleFlight {self.name}: присоединение к выполняющемуся запросу")
+
+        call.waiters += 1
+        try:
+            # shield: отмена этого ожидающего не должна отменять общую задачу
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Ключ освобождается сразу: вызов, пришедший до колбэка отмененной задачи,
+                # должен запустить работу заново, а не получить чужой CancelledError
+                self._forget(key, call)
+                call.task.cancel()
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        total = self.executions + self.coalesced
+        return {
+            'in_flight': len(self._calls),
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'coalesced_rate': self.coalesced / total if total else 0.0,
+        }
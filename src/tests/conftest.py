@@ -0,0 +1,100 @@
+"""Общие фикстуры тестов
+
+Тесты с БД работают в отдельной базе TEST_DB_NAME (по умолчанию bot_test) на
+сервере из .env: она создается при первом запуске, таблицы очищаются перед
+каждым тестом. Если PostgreSQL недоступен, такие тесты пропускаются.
+"""
+import asyncio
+import os
+
+import pytest
+
+# До импорта src.config: движок создается из настроек при импорте src.db.database
+os.environ['DB_NAME'] = os.environ.get('TEST_DB_NAME', 'bot_test')
+
+
+async def _prepare_database():
+    import asyncpg
+    from sqlalchemy import text
+
+    from src.config.config import settings
+    from src.db import models  # noqa: F401  таблицы регистрируются в Base.metadata при импорте
+    from src.db.database import Base, async_engine, init_db
+
+    try:
+        admin = await asyncpg.connect(host=settings.DB_HOST, port=settings.DB_PORT, user=settings.DB_USER,
+                                      password=settings.DB_PASS, database='postgres', timeout=3)
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+        return f"PostgreSQL недоступен: {e}"
+    try:
+        if not await admin.fetchval("SELECT 1 FROM pg_database WHERE datname = $1", settings.DB_NAME):
+            await admin.execute(f'CREATE DATABASE "{settings.DB_NAME}"')
+    finally:
+        await admin.close()
+
+    # Соединения, оставленные в пуле другими тестами, привязаны к уже закрытым циклам событий
+    await async_engine.dispose(close=False)
+    try:
+        async with async_engine.begin() as conn:
+            # Тест секций оставляет snapshots секционированной, остальным нужна обычная таблица
+            if (await conn.execute(text(
+                    "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('snapshots'))"
+            ))).scalar():
+                await conn.execute(text("DROP TABLE snapshots CASCADE"))
+        await init_db()
+        tables = ', '.join(table.name for table in Base.metadata.sorted_tables)
+        async with async_engine.begin() as conn:
+            await conn.execute(text(f"TRUNCATE {tables}"))
+    finally:
+        await async_engine.dispose()
+    return None
+
+
+def run_db(coro):
+    """Запуск корутины в новом цикле событий с закрытием соединений пула в конце
+
+    Соединения asyncpg привязаны к циклу событий, поэтому между вызовами
+    asyncio.run их нельзя оставлять в пуле.
+    """
+    from src.db.database import async_engine
+
+    async def scenario():
+        try:
+            return await coro
+        finally:
+            await async_engine.dispose()
+
+    return asyncio.run(scenario())
+
+
+ROLLUPS_SQL = (
+    "SELECT (SELECT array_agg(c ORDER BY c) FROM (SELECT ROW(creator_id, bucket, snapshots_count, "
+    "delta_views_count, delta_likes_count_pos)::text c FROM creator_stats_{suffix}) t), "
+    "(SELECT COUNT(*) FROM video_stats_{suffix})"
+)
+
+
+async def read_rollups():
+    """Строки агрегатов авторов и число строк агрегатов видео (часовые и суточные)"""
+    from sqlalchemy import text
+
+    from src.db.database import get_async_session
+
+    async with get_async_session() as session:
+        return [(await session.execute(text(ROLLUPS_SQL.format(suffix=suffix)))).one()
+                for suffix in ('hourly', 'daily')]
+
+
+@pytest.fixture
+def db():
+    """Пустая тестовая БД; возвращает run_db"""
+    skipped = asyncio.run(_prepare_database())
+    if skipped:
+        pytest.skip(skipped)
+    return run_db
+
+
+@pytest.fixture
+def rollups():
+    """Корутина-функция чтения агрегатов для сравнения с полным пересчетом"""
+    return read_rollups
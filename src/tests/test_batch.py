@@ -0,0 +1,73 @@
+import asyncio
+import csv
+import io
+
+import pytest
+
+from src.db.sandbox import QueryRejected
+from src.services.batch import BatchRunner, read_questions, write_csv
+
+
+def test_read_questions():
+    assert read_questions('Сколько всего видео?\n\n  Сколько лайков?  \n'.encode(), 'q.txt') == [
+        'Сколько всего видео?', 'Сколько лайков?']
+
+    data = 'id;вопрос\n1;Сколько видео, больше 100 лайков?\n2;\n3;Сколько всего видео?\n'.encode('cp1251')
+    assert read_questions(data, 'q.csv') == ['Сколько видео, больше 100 лайков?', 'Сколько всего видео?']
+
+
+
+def test_read_questions_survives_bad_encoding():
+    # 0x98 не определен в cp1251: такой файл раньше падал с UnicodeDecodeError
+    data = 'Сколько всего видео?'.encode('cp1251') + b'\x98\n'
+    assert read_questions(data, 'q.txt') == ['Сколько всего видео??']
+
+    with pytest.raises(ValueError):
+        read_questions(b'PK\x03\x04\x00\x00\x98', 'q.csv')
+
+def test_duplicates_share_one_answer_and_stages_overlap():
+    generated, executed = [], []
+    running = {'llm': 0, 'db': 0}
+    peak = {'llm': 0, 'db': 0}
+    overlapped = []
+
+    def enter(stage):
+        running[stage] += 1
+        peak[stage] = max(peak[stage], running[stage])
+        if running['llm'] and running['db']:
+            overlapped.append(stage)
+
+    async def generate(question):
+        generated.append(question)
+        enter('llm')
+        await asyncio.sleep(0.01)
+        running['llm'] -= 1
+        if 'непонятно' in question:
+            return None
+        return f"SELECT {len(generated)}"
+
+    async def execute(sql):
+        executed.append(sql)
+        enter('db')
+        await asyncio.sleep(0.01)
+        running['db'] -= 1
+        if sql == 'SELECT 2':
+            raise QueryRejected('cost')
+        return (int(sql.split()[1]) * 10,)
+
+    questions = ['Сколько всего видео?', 'Сколько лайков?', 'сколько всего видео', 'непонятно что']
+    runner = BatchRunner(generate, execute, llm_concurrency=1, db_concurrency=1)
+    items = asyncio.run(runner.run(questions))
+
+    assert len(generated) == 3
+    assert [item.outcome for item in items] == ['ok', 'rejected', 'ok', 'not_understood']
+    assert items[0].answer == items[2].answer == 10
+    assert items[2].question == 'сколько всего видео'
+    # Каждая стадия не превышает своего лимита, но БД выполняется параллельно с генерацией следующих
+    assert (peak['llm'], peak['db']) == (1, 1)
+    assert overlapped
+
+    rows = list(csv.reader(io.StringIO(write_csv(items).decode('utf-8-sig'))))
+    assert rows[0] == ['question', 'answer', 'outcome', 'sql']
+    assert rows[1] == ['Сколько всего видео?', '10', 'ok', 'SELECT 1']
+    assert rows[4][1:3] == ['', 'not_understood']
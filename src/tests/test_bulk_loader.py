@@ -0,0 +1,24 @@
+from src.benchmarks.synthetic import generate_videos
+from src.services.data_loader.bulk_loader import SNAPSHOT_COLUMNS, VIDEO_COLUMNS, build_rows
+
+
+def test_build_rows_counts_rows_after_deduplication():
+    first, second = generate_videos(2, 3)
+    updated = dict(first, views_count=first['views_count'] + 1, snapshots=first['snapshots'][:2])
+    broken_video = dict(second, id='broken', views_count='много', snapshots=[])
+    broken_snapshot = dict(second['snapshots'][0], id='bad', likes_count=None)
+    second = dict(second, snapshots=second['snapshots'] + [second['snapshots'][0], broken_snapshot])
+    batch = list(enumerate([first, second, updated, broken_video], 1))
+
+    stats = {'videos': 0, 'snapshots': 0, 'errors': 0}
+    failed = set()
+    video_rows, snapshot_rows, videos_ok, snapshots_ok = build_rows(batch, stats, failed)
+
+    # Повторы видео и снапшотов схлопываются: побеждает последняя запись
+    assert (videos_ok, snapshots_ok) == (len(video_rows), len(snapshot_rows)) == (2, 6)
+    views = {row[0]: row[VIDEO_COLUMNS.index('views_count')] for row in video_rows}
+    assert views[first['id']] == first['views_count'] + 1
+    assert len({row[SNAPSHOT_COLUMNS.index('snapshot_id')] for row in snapshot_rows}) == 6
+
+    assert stats['errors'] == 2
+    assert failed == {'broken', second['id']}
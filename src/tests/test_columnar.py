@@ -0,0 +1,131 @@
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import text
+
+from src.analytics.columnar import ColumnarMirror, _Snapshots, _Videos
+from src.analytics.evaluator import Dataset, UnsupportedQuery, compile_plan, numeric_div, to_pg_time
+from src.benchmarks.synthetic import write_videos_json
+from src.db.database import async_engine
+from src.services.data_loader.loader_service import load_videos_from_json
+
+# {creator}, {video}, {day}, {hour}, {n} подставляются значениями из данных
+TEMPLATES = [
+    "SELECT COUNT(*) FROM videos",
+    "SELECT COUNT(*) FROM videos WHERE views_count > {n}",
+    "SELECT COUNT(*) FROM videos WHERE creator_id = '{creator}' AND views_count > {n}",
+    "SELECT SUM(views_count) FROM videos WHERE creator_id = '{creator}'",
+    "SELECT AVG(views_count) FROM videos WHERE creator_id = '{creator}'",
+    "SELECT COALESCE(MAX(likes_count), 0) FROM videos WHERE creator_id = '{creator}'",
+    "SELECT MIN(video_created_at), MAX(video_created_at) FROM videos WHERE views_count BETWEEN {n} AND 100000",
+    "SELECT COUNT(*) FROM videos WHERE video_created_at >= '{day}' AND video_created_at < '{day} 12:00:00'",
+    "SELECT COUNT(DISTINCT creator_id) FROM videos WHERE views_count > {n}",
+    "SELECT COUNT(*) FROM snapshots",
+    "SELECT COUNT(DISTINCT video_id) FROM snapshots WHERE views_count > {n}",
+    "SELECT COUNT(DISTINCT video_id) FROM snapshots WHERE created_at >= '{day}' AND created_at < '{day} 23:59:59' "
+    "AND delta_views_count > 0",
+    "SELECT COALESCE(SUM(delta_views_count), 0) FROM snapshots WHERE created_at >= '{day} {hour}:00:00' "
+    "AND created_at < '{day} 23:00:00' AND video_id IN (SELECT video_id FROM videos WHERE creator_id = '{creator}')",
+    "SELECT SUM(delta_likes_count) FROM snapshots WHERE video_id = '{video}'",
+    "SELECT COUNT(*) FROM snapshots WHERE delta_views_count < 0 OR NOT (delta_likes_count BETWEEN 1 AND {n})",
+    "SELECT COUNT(*) FROM snapshots WHERE created_at > '{day}' AND video_id NOT IN "
+    "(SELECT video_id FROM videos WHERE creator_id = '{creator}')",
+    "SELECT AVG(delta_views_count), MIN(created_at), MAX(created_at) FROM snapshots WHERE created_at <= '{day}'",
+    "SELECT COUNT(*) FROM snapshots WHERE created_at = '{day}' OR delta_comments_count IN (1, 2)",
+    "SELECT COUNT(*) FROM snapshots WHERE video_id = 'no-such-video'",
+]
+
+
+def _queries(creators, videos, days, count=60, seed=3):
+    rnd = random.Random(seed)
+    for i in range(count):
+        yield TEMPLATES[i % len(TEMPLATES)].format(
+            creator=rnd.choice(creators), video=rnd.choice(videos), day=rnd.choice(days),
+            hour=f'{rnd.randrange(24):02d}', n=rnd.choice([0, 10, 500, 5000, 100000]),
+        )
+
+
+def test_results_match_postgres(db, tmp_path):
+    path = write_videos_json(tmp_path / 'videos.json', 120, 8)
+
+    async def scenario():
+        await load_videos_from_json(path, bulk=True)
+        async with async_engine.connect() as conn:
+            creators = [r[0] for r in (await conn.execute(text(
+                "SELECT DISTINCT creator_id FROM videos LIMIT 20"))).all()]
+            videos = [r[0] for r in (await conn.execute(text("SELECT video_id FROM videos LIMIT 20"))).all()]
+            days = [str(r[0]) for r in (await conn.execute(text(
+                "SELECT DISTINCT created_at::date FROM snapshots WHERE created_at IS NOT NULL LIMIT 10"))).all()]
+
+        mirror = ColumnarMirror()
+        await mirror.refresh()
+
+        async with async_engine.connect() as conn:
+            for sql in _queries(creators, videos, days):
+                expected = tuple((await conn.execute(text(sql))).one())
+                assert mirror.execute(sql) == expected, sql
+
+    db(scenario())
+
+
+def _dataset():
+    base = datetime(2025, 11, 1)
+    videos = _Videos()
+    videos.apply([
+        {'id': 1, 'video_id': 'v1', 'creator_id': 'c1', 'video_created_at': base, 'views_count': 10,
+         'likes_count': None, 'comments_count': 0, 'reports_count': 0, 'created_at': base, 'updated_at': None},
+        {'id': 2, 'video_id': 'v2', 'creator_id': 'c2', 'video_created_at': None, 'views_count': 30,
+         'likes_count': 5, 'comments_count': 0, 'reports_count': 0, 'created_at': base, 'updated_at': base},
+    ])
+    times = np.array([to_pg_time(base + timedelta(hours=h)) for h in (5, 1, 3)], dtype=np.int64)
+    snapshots = _Snapshots(
+        ids=np.arange(3, dtype=np.int64), video=np.array([0, 1, 0], dtype=np.int32),
+        ints={c: np.array([1, -2, 4], dtype=np.int32) for c in
+              ('views_count', 'likes_count', 'comments_count', 'reports_count',
+               'delta_views_count', 'delta_likes_count', 'delta_comments_count', 'delta_reports_count')},
+        nulls=np.array([0, 0, 1 << 5], dtype=np.int32),     # delta_likes_count IS NULL в третьей строке
+        created_at=times, updated_at=times,
+    ).sorted()
+    return Dataset(videos.table(), snapshots.table(), videos.codes, videos.creator_codes)
+
+
+def _run(sql, data):
+    mirror = ColumnarMirror()
+    mirror.data = data
+    return mirror.execute(sql)
+
+
+def test_null_semantics_and_time_ranges():
+    data = _dataset()
+    assert _run("SELECT COUNT(*), COUNT(likes_count), SUM(likes_count) FROM videos", data) == (2, 1, 5)
+    # NOT (NULL > 0) — тоже неизвестно: видео без лайков не попадает ни в одну ветку
+    assert _run("SELECT COUNT(*) FROM videos WHERE NOT (likes_count > 0)", data) == (0,)
+    assert _run("SELECT COUNT(*) FROM videos WHERE likes_count > 0 OR views_count = 10", data) == (2,)
+    assert _run("SELECT COUNT(*) FROM videos WHERE video_created_at IS NULL", data) == (1,)
+    assert _run("SELECT COUNT(delta_likes_count) FROM snapshots", data) == (2,)
+    assert _run("SELECT SUM(delta_views_count) FROM snapshots WHERE created_at >= '2025-11-01 01:00:00' "
+                "AND created_at < '2025-11-01 04:00:00'", data) == (2,)
+    assert _run("SELECT COALESCE(SUM(delta_views_count), 0) FROM snapshots WHERE created_at > '2025-12-01'",
+                data) == (0,)
+    assert _run("SELECT COUNT(DISTINCT video_id) FROM snapshots WHERE video_id IN "
+                "(SELECT video_id FROM videos WHERE creator_id = 'c1')", data) == (1,)
+
+
+def test_unsupported_shapes_fall_back():
+    for sql in (
+        "SELECT creator_id, COUNT(*) FROM videos GROUP BY creator_id",
+        "SELECT COUNT(*) FROM snapshots s JOIN videos v ON v.video_id = s.video_id",
+        "SELECT views_count FROM videos",
+        "SELECT COUNT(*) FROM snapshots WHERE created_at >= CURRENT_DATE - INTERVAL '7 days'",
+        "SELECT SUM(views_count + likes_count) FROM videos",
+    ):
+        with pytest.raises(UnsupportedQuery):
+            compile_plan(sql)
+
+
+def test_avg_scale_follows_postgres():
+    assert str(numeric_div(10, 3)) == '3.3333333333333333'
+    assert str(numeric_div(2, 3)) == '0.66666666666666666667'
+    assert str(numeric_div(-5, 2)) == '-2.5000000000000000'
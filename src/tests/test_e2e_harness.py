@@ -0,0 +1,35 @@
+import asyncio
+
+from src.benchmarks import bench_e2e
+from src.benchmarks.stubs import StubModel
+from src.bot.handlers import handlers
+
+
+def test_load_run_reports_stages_and_outcomes(monkeypatch):
+    answers = {
+        "Подскажи, сколько лайков в среднем у видео креатора abc": "SELECT AVG(likes_count) FROM videos",
+        "Подскажи, что-нибудь непонятное": None,
+    }
+    model = StubModel({q: sql for q, sql in answers.items() if sql}, latency=0.01)
+
+    async def stub_execute(sql_query: str):
+        return (7,)
+
+    monkeypatch.setattr(handlers, '_execute_sql', stub_execute)
+    monkeypatch.setattr(handlers, 'question_flight', handlers.SingleFlight('question'))
+
+    original_router = handlers.yc_service.router
+    report = asyncio.run(bench_e2e.run_load(answers, messages=40, rate=2000, model=model, users=5))
+
+    assert report['messages'] == 40
+    assert sum(report['outcomes'].values()) == 40
+    assert set(report['outcomes']) <= {'ok', 'not_understood'}
+    assert report['outcomes']['ok'] > 0
+    assert report['error_rate'] == round(report['outcomes'].get('not_understood', 0) / 40, 4)
+    for stage in ('sql', 'llm', 'model', 'db', 'send', 'total'):
+        assert report['stages'][stage]['count'] > 0
+    assert report['stages']['db']['count'] == report['outcomes']['ok']
+    # после прогона модель и функции обработчика возвращены на место
+    assert handlers._execute_sql is stub_execute
+    assert handlers.yc_service.router is original_router
+    assert 'generate_sql' not in vars(handlers.yc_service)
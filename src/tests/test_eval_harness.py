@@ -0,0 +1,52 @@
+import asyncio
+
+from src.benchmarks import eval_sql
+from src.benchmarks.stubs import StubModel, StubSDK
+from src.llm_service.prompt_builder import PromptBuilder
+
+ITEMS = [
+    {'question': 'Сколько всего видео?', 'sql': 'SELECT COUNT(*) FROM videos', 'answer': 10},
+    {'question': 'Сколько видео набрали больше 100 лайков?', 'sql': 'SELECT COUNT(*) FROM videos WHERE likes_count > 100',
+     'answer': 3},
+]
+ROWS = {'SELECT COUNT(*) FROM videos': (10,), 'SELECT COUNT(*) FROM videos WHERE likes_count > 100': (4,)}
+
+
+async def execute(sql):
+    return ROWS[sql]
+
+
+def test_record_then_replay_without_model(tmp_path):
+    path = tmp_path / 'cassette.json'
+    stub = StubModel({item['question']: item['sql'] for item in ITEMS}, latency=0.01)
+    cassette = eval_sql.Cassette(path)
+    service, model = eval_sql.make_service('record', cassette, 'lite', sdk=StubSDK({'lite': stub}))
+    recorded = asyncio.run(eval_sql.evaluate(ITEMS, service, model, execute))
+    cassette.save()
+
+    service, model = eval_sql.make_service('replay', eval_sql.Cassette(path), 'lite')
+    replayed = asyncio.run(eval_sql.evaluate(ITEMS, service, model, execute))
+    assert stub.calls == 2
+    assert recorded['outcomes'] == replayed['outcomes'] == {'correct': 1, 'wrong': 1}
+    assert replayed['stages']['model']['count'] == 2
+    assert [item['sql'] for item in replayed['items']] == [item['sql'] for item in ITEMS]
+
+    # Другой промпт — другие сообщения: записи нет, модель не вызывается
+    service, model = eval_sql.make_service('replay', eval_sql.Cassette(path), 'lite', PromptBuilder())
+    changed = asyncio.run(eval_sql.evaluate(ITEMS, service, model, execute))
+    assert changed['outcomes'] == {'cassette_miss': 2}
+    assert changed['prompt_tokens']['mean'] < replayed['prompt_tokens']['mean']
+
+
+def test_compare_reports_regressions():
+    def report(correct):
+        return {
+            'accuracy': sum(correct) / len(correct), 'prompt_tokens': {'mean': 1000},
+            'stages': {'total': {'count': 2, 'p95_ms': 10.0}}, 'meta': {},
+            'items': [{'question': item['question'], 'correct': ok, 'outcome': 'correct' if ok else 'wrong'}
+                      for item, ok in zip(ITEMS, correct)],
+        }
+
+    lines, regressions = eval_sql.compare(report([False, True]), report([True, False]))
+    assert regressions == [f"{ITEMS[0]['question']} (wrong)"]
+    assert any('стал решаться' in line and ITEMS[1]['question'] in line for line in lines)
@@ -0,0 +1,45 @@
+import pytest
+
+from src.llm_service.fast_path import FastPathParser
+
+CREATOR = 'aca1061a9d324ecf8c3fa2bb32d7be63'
+
+
+@pytest.mark.parametrize('question, sql', [
+    ("Сколько видео имеют > 10000 просмотров?",
+     "SELECT COUNT(*) FROM videos WHERE views_count > 10000"),
+    ("Сколько видео набрали больше 10 000 просмотров в истории?",
+     "SELECT COUNT(DISTINCT video_id) FROM snapshots WHERE views_count > 10000"),
+    ("Сколько видео опубликовано в декабре 2025 года?",
+     "SELECT COUNT(*) FROM videos WHERE video_created_at >= '2025-12-01' AND video_created_at < '2026-01-01'"),
+    ("Какое суммарное количество просмотров набрали все видео, опубликованные в июне 2025 года?",
+     "SELECT COALESCE(SUM(views_count), 0) FROM videos "
+     "WHERE video_created_at >= '2025-06-01' AND video_created_at < '2025-07-01'"),
+    ("Сколько разных видео получали новые просмотры 27 ноября 2025?",
+     "SELECT COUNT(DISTINCT video_id) FROM snapshots "
+     "WHERE created_at >= '2025-11-27' AND created_at < '2025-11-28' AND delta_views_count > 0"),
+    (f"На сколько просмотров суммарно выросли все видео креатора {CREATOR} "
+     f"в промежутке с 10:00 до 15:00 28 ноября 2025?",
+     "SELECT COALESCE(SUM(delta_views_count), 0) FROM snapshots "
+     "WHERE created_at >= '2025-11-28 10:00:00' AND created_at < '2025-11-28 15:00:00' "
+     f"AND video_id IN (SELECT video_id FROM videos WHERE creator_id = '{CREATOR}') AND delta_views_count > 0"),
+    (f"Сколько видео у креатора {CREATOR} набрали больше 10000 просмотров по итоговой статистике?",
+     f"SELECT COUNT(*) FROM videos WHERE creator_id = '{CREATOR}' AND views_count > 10000"),
+    ("Среднее количество лайков на видео у автора AbC-1?",
+     "SELECT COALESCE(AVG(likes_count), 0) FROM videos WHERE creator_id = 'AbC-1'"),
+])
+def test_known_shapes(question, sql):
+    assert FastPathParser().parse(question) == sql
+
+
+def test_not_confident_falls_back():
+    parser = FastPathParser()
+    for question in [
+        "Сколько видео набрали больше 100 просмотров и 10 лайков?",
+        "Какой автор самый популярный?",
+        "Сколько видео опубликовано в 13 месяце 2025?",
+        "На сколько просмотров выросли все видео креатора abc с 15:00 до 10:00 28 ноября 2025?",
+    ]:
+        assert parser.parse(question) is None
+    assert parser.stats()['misses'] == 4
+    assert parser.stats()['hits'] == 0
@@ -0,0 +1,86 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from src.llm_service.few_shot_memory import FewShotMemory
+from src.llm_service.prompt_builder import PromptBuilder, selection_for
+
+CREATOR_A = '9f3c1a2b4c5d6e7f8a9b0c1d2e3f4a5b'
+CREATOR_B = '0a1b2c3d4e5f60718293a4b5c6d7e8f9'
+
+
+def test_near_match_reuse():
+    memory = FewShotMemory()
+    memory.add(f'Сколько видео у креатора {CREATOR_A} набрали больше 10000 просмотров?',
+               f"SELECT COUNT(*) FROM videos WHERE creator_id = '{CREATOR_A}' AND views_count > 10000")
+
+    # Опечатка и слово-паразит, другие литералы
+    match = memory.lookup(f'подскажи пожалуйста сколько видео у креатора {CREATOR_B} набрали больше 500 просмотов')
+    assert match.sql == f"SELECT COUNT(*) FROM videos WHERE creator_id = '{CREATOR_B}' AND views_count > 500"
+
+    # Другой смысл: ответа из памяти нет, пара уходит в примеры
+    match = memory.lookup(f'Сколько видео у креатора {CREATOR_B} набрали меньше 500 просмотров?')
+    assert match.sql is None
+    assert match.examples and 'views_count > 10000' in match.examples[0][1]
+    assert memory.stats()['reused'] == 1
+
+
+def test_persistence(tmp_path):
+    path = tmp_path / 'memory.jsonl'
+    memory = FewShotMemory(path=path)
+    memory.add('Сколько всего видео?', 'SELECT COUNT(*) FROM videos')
+    memory.add('Сколько всего видео?', 'SELECT COUNT(*) FROM videos')
+    memory.add('Какое суммарное количество лайков?', 'SELECT SUM(likes_count) FROM videos')
+    assert len(path.read_text(encoding='utf-8').splitlines()) == 2
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('не json\n')
+    loaded = FewShotMemory(path=path)
+    assert len(loaded) == 2
+    assert loaded.lookup('сколько всего видео').sql == 'SELECT COUNT(*) FROM videos'
+
+
+def test_examples_replace_static_ones():
+    examples = [('Сколько видео у автора X?', "SELECT COUNT(*) FROM videos WHERE creator_id = 'X'")]
+    question = 'Сколько видео у автора Y набрали больше 100 лайков?'
+
+    full = selection_for(question, None, examples)
+    assert 'memory_1' in full.fragment_ids
+    assert not any(fid.startswith('example_') for fid in full.fragment_ids)
+
+    selected = PromptBuilder().select(question, examples)
+    assert 'memory_1' in selected.fragment_ids and 'examples_header' in selected.fragment_ids
+
+
+def test_only_fresh_llm_sql_is_remembered(tmp_path, monkeypatch):
+    from src.bot.handlers import handlers
+    from src.llm_service.llm_service import SQL_FROM_CACHE, SQL_FROM_LLM
+
+    memory = FewShotMemory(path=tmp_path / 'memory.jsonl')
+    sources = {'Сколько всего видео?': SQL_FROM_CACHE, 'Какое суммарное количество лайков?': SQL_FROM_LLM}
+
+    async def generate_sql(user_query, user_id=None):
+        return 'SELECT COUNT(*) FROM videos', sources[user_query]
+
+    async def execute_sql(sql_query):
+        return (1,)
+
+    class FakeMessage:
+        from_user = SimpleNamespace(id=1)
+
+        async def answer(self, text, **kwargs):
+            pass
+
+    monkeypatch.setattr(handlers, 'few_shot_memory', memory)
+    monkeypatch.setattr(handlers, 'fast_path', None)
+    monkeypatch.setattr(handlers, 'question_flight', handlers.SingleFlight('question'))
+    monkeypatch.setattr(handlers.yc_service, 'generate_sql', generate_sql)
+    monkeypatch.setattr(handlers, '_execute_sql', execute_sql)
+
+    async def scenario():
+        for question in sources:
+            assert await handlers._answer_query(FakeMessage(), question) == 'ok'
+
+    asyncio.run(scenario())
+    records = [json.loads(line) for line in memory.path.read_text(encoding='utf-8').splitlines()]
+    assert [record['question'] for record in records] == ['Какое суммарное количество лайков?']
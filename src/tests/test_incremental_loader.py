@@ -0,0 +1,99 @@
+import copy
+import json
+
+import pytest
+
+from src.benchmarks.synthetic import generate_videos, write_videos_json
+from src.db.rollups import rebuild_rollups
+from src.services.data_loader import incremental
+from src.services.data_loader.bulk_loader import SNAPSHOTS_DELTA_MERGE_SQL, VIDEOS_MERGE_SQL, driver_transaction
+from src.services.data_loader.incremental import file_hash, load_incremental, video_digest
+
+
+def test_video_digest_tracks_snapshot_changes():
+    video = next(generate_videos(1, 3))
+    same = copy.deepcopy(video)
+    assert video_digest(video) == video_digest(same)
+
+    same['snapshots'][1]['delta_views_count'] += 1
+    assert video_digest(video) != video_digest(same)
+
+
+def test_delta_merge_skips_unchanged_rows():
+    assert 'IS DISTINCT FROM' not in VIDEOS_MERGE_SQL
+    assert "WHERE (snapshots.views_count, snapshots.likes_count" in SNAPSHOTS_DELTA_MERGE_SQL
+    assert SNAPSHOTS_DELTA_MERGE_SQL.endswith("RETURNING snapshots.video_id")
+
+
+def test_file_hash_reads_in_chunks(tmp_path):
+    path = tmp_path / 'videos.json'
+    path.write_bytes(b'{"videos": []}' * 1000)
+    assert file_hash(path, chunk_size=7) == file_hash(path)
+
+
+def _write(path, videos):
+    path.write_text(json.dumps({'videos': videos}), encoding='utf-8')
+    return path
+
+
+def test_unchanged_file_is_skipped(db, tmp_path):
+    path = write_videos_json(tmp_path / 'videos.json', 4, 3)
+
+    async def scenario():
+        first = await load_incremental(path, batch_size=2)
+        return first, await load_incremental(path, batch_size=2)
+
+    first, second = db(scenario())
+    assert (first['videos'], first['snapshots'], first['unchanged_file']) == (4, 12, 0)
+    assert second['unchanged_file'] == 1 and second['videos'] == second['skipped_videos'] == 0
+
+
+def test_resumes_from_checkpoint_after_failure(db, tmp_path, monkeypatch):
+    path = write_videos_json(tmp_path / 'videos.json', 5, 2)
+    load_batch = incremental._load_delta_batch
+    calls = []
+
+    async def crash_on_second_batch(source, videos_batch, stats):
+        calls.append([index for index, _ in videos_batch])
+        if len(calls) == 2:
+            raise RuntimeError("сбой посреди файла")
+        await load_batch(source, videos_batch, stats)
+
+    async def scenario():
+        monkeypatch.setattr(incremental, '_load_delta_batch', crash_on_second_batch)
+        with pytest.raises(RuntimeError):
+            await load_incremental(path, batch_size=2)
+        async with driver_transaction() as pg_conn:
+            done = await pg_conn.fetchval("SELECT videos_done FROM load_checkpoints")
+        monkeypatch.setattr(incremental, '_load_delta_batch', load_batch)
+        return done, await load_incremental(path, batch_size=2)
+
+    done, stats = db(scenario())
+    assert done == 2
+    # Первый пакет не читается повторно: продолжение с третьего видео
+    assert (stats['videos'], stats['snapshots'], stats['skipped_videos']) == (3, 6, 0)
+
+
+def test_delta_merge_matches_full_rebuild(db, rollups, tmp_path):
+    videos = list(generate_videos(6, 4, n_creators=3))
+    path = _write(tmp_path / 'videos.json', videos)
+
+    changed = copy.deepcopy(videos)
+    changed[0]['snapshots'][0]['delta_views_count'] += 100      # изменившийся снапшот
+    changed[1]['creator_id'] = changed[2]['creator_id']          # смена автора
+    extra = copy.deepcopy(changed[3]['snapshots'][-1])
+    extra.update(id='new-snapshot', created_at='2025-12-15T10:00:00+00:00', delta_likes_count=-3)
+    changed[3]['snapshots'].append(extra)                        # новый снапшот в новом периоде
+    changed_path = _write(tmp_path / 'videos-changed.json', changed)
+
+    async def scenario():
+        await load_incremental(path, batch_size=4)
+        stats = await load_incremental(changed_path, batch_size=4)
+        merged = await rollups()
+        await rebuild_rollups()
+        return stats, merged, await rollups()
+
+    stats, merged, rebuilt = db(scenario())
+    # Переписаны только строка видео со сменой автора и два снапшота
+    assert (stats['videos'], stats['snapshots'], stats['errors']) == (1, 2, 0)
+    assert merged == rebuilt
@@ -0,0 +1,49 @@
+import logging
+
+from src.config.logs_config import DATE_FORMAT, TEXT_FORMAT, JsonFormatter
+from src.db.index_advisor import find_seq_scans, read_generated_sql
+
+
+def test_read_generated_sql_counts_canonical_queries(tmp_path):
+    log = tmp_path / 'bot.log'
+    log.write_text(
+        "2025-12-01 10:00:00 - src.bot.handlers.handlers - INFO - Сгенерирован SQL: SELECT COUNT(*) FROM videos;\n"
+        "2025-12-01 10:00:01 - src.bot.handlers.handlers - INFO - Получен запрос Сколько видео?\n"
+        "2025-12-01 10:00:02 - src.bot.handlers.handlers - INFO - Сгенерирован SQL: select  count(*) from VIDEOS\n",
+        encoding='utf-8',
+    )
+    assert read_generated_sql([log]) == {'select count(*) from videos': 2}
+
+
+
+def test_read_generated_sql_from_text_and_json_logs(tmp_path):
+    records = [logging.LogRecord('src.bot.handlers.handlers', logging.INFO, __file__, 1, message, None, None)
+               for message in ('Сгенерирован SQL: SELECT SUM(views_count)\nFROM videos',
+                               'Получен запрос Сколько видео?',
+                               'Сгенерирован SQL: select sum(views_count) from videos')]
+    text_log, json_log = tmp_path / 'bot.log', tmp_path / 'bot.json.log'
+    text_formatter = logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+    # Многострочный SQL в текстовом логе обрывается на первой строке, поэтому там только однострочный
+    text_log.write_text(text_formatter.format(records[2]) + '\n', encoding='utf-8')
+    json_log.write_text(''.join(JsonFormatter().format(record) + '\n' for record in records), encoding='utf-8')
+
+    assert read_generated_sql([json_log]) == {'select sum(views_count) from videos': 2}
+    assert read_generated_sql([text_log, json_log]) == {'select sum(views_count) from videos': 3}
+
+
+def test_find_seq_scans_includes_filtered_index_scans():
+    plan = {
+        'Node Type': 'Aggregate',
+        'Plans': [
+            {'Node Type': 'Seq Scan', 'Relation Name': 'videos', 'Actual Rows': 10, 'Actual Loops': 1,
+             'Rows Removed by Filter': 90, 'Filter': '(views_count > 100)', 'Shared Hit Blocks': 3},
+            {'Node Type': 'Index Only Scan', 'Relation Name': 'snapshots', 'Actual Rows': 5, 'Actual Loops': 3,
+             'Rows Removed by Filter': 100},
+            {'Node Type': 'Index Scan', 'Relation Name': 'videos', 'Actual Rows': 1, 'Actual Loops': 1},
+        ],
+    }
+    scans = find_seq_scans(plan)
+    assert [(s.node_type, s.relation, s.rows) for s in scans] == [
+        ('Seq Scan', 'videos', 100),
+        ('Index Only Scan', 'snapshots', 315),
+    ]
@@ -0,0 +1,47 @@
+import gzip
+import json
+
+import zstandard
+
+from src.services.data_loader.json_stream import iter_videos
+
+VIDEOS = [
+    {"id": f"v{i}", "creator_id": "c1", "views_count": i * 1000,
+     "snapshots": [{"id": f"s{i}_{j}", "video_id": f"v{i}", "delta_views_count": j} for j in range(3)]}
+    for i in range(20)
+]
+
+
+def test_wrapped_object_small_chunks(tmp_path):
+    path = tmp_path / 'videos.json'
+    path.write_text(json.dumps({"meta": {"n": 1}, "videos": VIDEOS, "tail": 12345}, indent=2), encoding='utf-8')
+
+    # Маленький буфер проверяет дочитывание значений, разрезанных границей порции
+    assert list(iter_videos(path, chunk_size=7)) == VIDEOS
+
+
+def test_top_level_array_and_empty(tmp_path):
+    path = tmp_path / 'array.json'
+    path.write_text(json.dumps(VIDEOS), encoding='utf-8')
+    assert list(iter_videos(path, chunk_size=16)) == VIDEOS
+
+    empty = tmp_path / 'empty.json'
+    empty.write_text('{"videos": []}', encoding='utf-8')
+    assert list(iter_videos(empty)) == []
+
+
+def test_compressed_and_ndjson(tmp_path):
+    payload = json.dumps({"videos": VIDEOS}).encode('utf-8')
+
+    gz_path = tmp_path / 'videos.json.gz'
+    gz_path.write_bytes(gzip.compress(payload))
+    assert list(iter_videos(gz_path, chunk_size=32)) == VIDEOS
+
+    zst_path = tmp_path / 'videos.json.zst'
+    zst_path.write_bytes(zstandard.ZstdCompressor().compress(payload))
+    assert list(iter_videos(zst_path, chunk_size=32)) == VIDEOS
+
+    ndjson = '\n'.join(json.dumps(v) for v in VIDEOS) + '\n'
+    nd_path = tmp_path / 'videos.jsonl.zst'
+    nd_path.write_bytes(zstandard.ZstdCompressor().compress(ndjson.encode('utf-8')))
+    assert list(iter_videos(nd_path)) == VIDEOS
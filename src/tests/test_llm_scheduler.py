@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from src.llm_service.scheduler import LLMRequestScheduler, SchedulerOverloaded
+
+
+def test_round_robin_between_users_and_in_flight_limit():
+    order = []
+    active = {'now': 0, 'max': 0}
+
+    def job(name):
+        async def run():
+            active['now'] += 1
+            active['max'] = max(active['max'], active['now'])
+            await asyncio.sleep(0.01)
+            order.append(name)
+            active['now'] -= 1
+            return name
+        return run
+
+    async def scenario():
+        scheduler = LLMRequestScheduler(max_in_flight=1, max_queue=10)
+        # Пользователь A прислал пачку вопросов раньше B, но B не ждет их все
+        tasks = [asyncio.ensure_future(scheduler.submit('A', job(f'A{i}'))) for i in range(4)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(scheduler.submit('B', job('B0'))))
+        await asyncio.gather(*tasks)
+
+        assert active['max'] == 1
+        assert order.index('B0') <= 2
+        assert scheduler.stats()['completed'] == 5
+
+    asyncio.run(scenario())
+
+
+def test_rejects_when_queue_full_and_enforces_deadline():
+    async def slow():
+        await asyncio.sleep(1)
+
+    async def scenario():
+        scheduler = LLMRequestScheduler(max_in_flight=1, max_queue=1)
+        running = asyncio.ensure_future(scheduler.submit(1, slow, deadline=0.05))
+        queued = asyncio.ensure_future(scheduler.submit(2, slow, deadline=0.05))
+        await asyncio.sleep(0)
+
+        with pytest.raises(SchedulerOverloaded):
+            await scheduler.submit(3, slow)
+
+        for task in (running, queued):
+            with pytest.raises(asyncio.TimeoutError):
+                await task
+
+        stats = scheduler.stats()
+        assert stats['rejected'] == 1
+        assert stats['timeouts'] == 2
+        await asyncio.sleep(0.01)
+        assert scheduler.queue_depth == 0
+        assert scheduler.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_abandoned_requests_leave_the_queue():
+    release = None
+    started = []
+
+    def job(name):
+        async def run():
+            started.append(name)
+            await release.wait()
+            return name
+        return run
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        scheduler = LLMRequestScheduler(max_in_flight=1, max_queue=2)
+        running = asyncio.ensure_future(scheduler.submit('A', job('A0')))
+        timed_out = asyncio.ensure_future(scheduler.submit('B', job('B0'), deadline=0.01))
+        cancelled = asyncio.ensure_future(scheduler.submit('C', job('C0')))
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth == 2
+
+        cancelled.cancel()
+        with pytest.raises(asyncio.TimeoutError):
+            await timed_out
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        # Ушедшие из очереди не мешают новым запросам и не занимают слот
+        assert scheduler.queue_depth == 0 and scheduler.stats()['users_waiting'] == 0
+        waiting = [asyncio.ensure_future(scheduler.submit(user, job(f'{user}1'))) for user in ('B', 'C')]
+        await asyncio.sleep(0)
+
+        release.set()
+        assert await asyncio.gather(running, *waiting) == ['A0', 'B1', 'C1']
+        assert started == ['A0', 'B1', 'C1']
+
+    asyncio.run(scenario())
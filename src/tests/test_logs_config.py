@@ -0,0 +1,52 @@
+import io
+import json
+import logging
+
+from src.config.logs_config import RateLimitFilter, setup_logging, stop_logging
+
+
+def _record(name: str, level: int = logging.INFO, msg: str = 'SELECT 1') -> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 1, msg, None, None)
+
+
+def test_rate_limit_filter(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('src.config.logs_config.time.monotonic', lambda: now[0])
+    sampling = RateLimitFilter(['sqlalchemy.engine'], rate=2)
+
+    passed = [sampling.filter(_record('sqlalchemy.engine.Engine')) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert sampling.filter(_record('sqlalchemy.engine.Engine', logging.WARNING))
+    assert all(sampling.filter(_record('src.bot')) for _ in range(5))
+
+    now[0] += 0.5
+    record = _record('sqlalchemy.engine.Engine')
+    assert sampling.filter(record)
+    assert record.suppressed == 3 and record.getMessage().endswith('пропущено похожих записей: 3]')
+
+
+def test_queue_pipeline_writes_json(tmp_path):
+    root = logging.getLogger()
+    saved = root.handlers[:], root.level
+    stream = io.StringIO()
+    try:
+        setup_logging('INFO', str(tmp_path / 'bot.log'), json_format=True, use_queue=True,
+                      sampled_loggers=['noisy'], sample_rate=1, stream=stream)
+        log = logging.getLogger('src.test')
+        log.info('Получен запрос %s', 'сколько видео')
+        for i in range(10):
+            logging.getLogger('noisy.child').info('эхо %d', i)
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            log.exception('Ошибка обработки')
+    finally:
+        stop_logging()
+        root.handlers[:], level = saved
+        root.setLevel(level)
+
+    lines = [json.loads(line) for line in (tmp_path / 'bot.log').read_text(encoding='utf-8').splitlines()]
+    assert lines == [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line['message'] for line in lines[:2]] == ['Получен запрос сколько видео', 'эхо 0']
+    assert lines[-1]['level'] == 'ERROR' and 'ZeroDivisionError' in lines[-1]['exc_info']
+    assert len(lines) == 3
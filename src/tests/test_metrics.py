@@ -0,0 +1,116 @@
+import asyncio
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+
+from src.bot.handlers import handlers
+from src.services.metrics import MetricsRegistry, start_metrics_server, stats_samples
+
+
+def test_histogram_and_counter_render_in_prometheus_format():
+    registry = MetricsRegistry()
+    requests = registry.counter('requests_total', 'Запросы', ('outcome',))
+    requests.inc(outcome='ok')
+    requests.inc(2, outcome='ok')
+    requests.inc(outcome='say "hi"')
+    latency = registry.histogram('latency_seconds', 'Задержка', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        latency.observe(value)
+
+    text = asyncio.run(registry.render())
+
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{outcome="ok"} 3' in text
+    assert 'requests_total{outcome="say \\"hi\\""} 1' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 3' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in text
+    assert 'latency_seconds_count 4' in text
+    assert 'latency_seconds_sum 4.25' in text
+    # медиана: 2-я из 4 попадает во вторую корзину (0.1; 1], интерполяция
+    assert latency.quantile(0.5) == pytest.approx(0.1 + 0.9 * (2 - 1) / 2)
+
+
+def test_spans_and_collectors():
+    registry = MetricsRegistry()
+    with registry.span('db'):
+        pass
+    with pytest.raises(ValueError):
+        with registry.span('db'):
+            raise ValueError
+
+    async def async_collector():
+        return [('pg_rows_total', 'counter', 'Строки', {'table': 'videos'}, 10)]
+
+    def broken_collector():
+        raise RuntimeError("нет соединения")
+
+    registry.register_collector(lambda: stats_samples('cache', {'hits': 5, 'hit_rate': 0.5, 'loaded': True},
+                                                      counters=('hits',)))
+    registry.register_collector(async_collector)
+    registry.register_collector(broken_collector)
+    text = asyncio.run(registry.render())
+
+    assert registry.stages.count(stage='db') == 2
+    assert 'bot_stage_errors_total{stage="db"} 1' in text
+    assert 'cache_hits_total 5' in text and 'cache_hit_rate 0.5' in text and 'cache_loaded' not in text
+    assert 'pg_rows_total{table="videos"} 10' in text
+    assert [row[:2] for row in registry.stage_summary()] == [('db', 2)]
+
+
+
+def test_collector_samples_are_grouped_by_metric():
+    registry = MetricsRegistry()
+    registry.register_collector(lambda: [
+        ('queue_depth', 'gauge', 'Очередь', {'user': 'a'}, 1),
+        ('queue_rejected_total', 'counter', 'Отказы', {}, 2),
+        ('queue_depth', 'gauge', 'Очередь', {'user': 'b'}, 3),
+    ])
+    registry.register_collector(lambda: [('queue_depth', 'gauge', 'Очередь', {'user': 'c'}, 4)])
+    lines = asyncio.run(registry.render()).splitlines()
+
+    start = lines.index('# HELP queue_depth Очередь')
+    assert lines[start:start + 5] == [
+        '# HELP queue_depth Очередь', '# TYPE queue_depth gauge',
+        'queue_depth{user="a"} 1', 'queue_depth{user="b"} 3', 'queue_depth{user="c"} 4',
+    ]
+    assert sum(line.startswith('# TYPE queue_depth ') for line in lines) == 1
+    assert lines.index('# HELP queue_rejected_total Отказы') == start + 5
+
+def test_metrics_endpoint():
+    async def scenario():
+        registry = MetricsRegistry()
+        registry.counter('answers_total', 'Ответы').inc()
+        runner = await start_metrics_server(registry, '127.0.0.1', 0)
+        try:
+            port = runner.addresses[0][1]
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f'http://127.0.0.1:{port}/metrics') as response:
+                    assert response.status == 200
+                    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+                    assert 'answers_total 1' in await response.text()
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+
+class _FakeMessage:
+    def __init__(self, user_id: int):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.answers = []
+
+    async def answer(self, text: str, **kwargs):
+        self.answers.append(text)
+
+
+def test_stats_command_only_for_admins(monkeypatch):
+    monkeypatch.setattr(handlers.settings, 'ADMIN_IDS', [1])
+    admin, stranger = _FakeMessage(1), _FakeMessage(2)
+
+    asyncio.run(handlers.cmd_stats(stranger))
+    asyncio.run(handlers.cmd_stats(admin))
+
+    assert stranger.answers == []
+    assert admin.answers[0].startswith('<pre>') and 'LLM: в очереди' in admin.answers[0]
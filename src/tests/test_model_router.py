@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import pytest
+
+from src.benchmarks.stubs import StubModel, StubSDK
+from src.llm_service.llm_service import YandexGPTConfig, YandexMLGPTQueryService
+from src.llm_service.model_router import MIN_SAMPLES, ModelRouter
+
+QUESTION = 'Сколько всего видео?'
+SQL = 'SELECT COUNT(*) FROM videos'
+
+
+def make_service(lite: StubModel, pro: StubModel) -> YandexMLGPTQueryService:
+    config = YandexGPTConfig(api_key='test', folder_id='test', model='lite, pro')
+    return YandexMLGPTQueryService(config, sdk=StubSDK({'lite': lite, 'pro': pro}))
+
+
+def test_hedged_request_wins_and_cancels_primary():
+    lite = StubModel({QUESTION: SQL}, latency=1.0)
+    pro = StubModel({QUESTION: SQL}, latency=0.02)
+    service = make_service(lite, pro)
+    service.router.hedge_delay = 0.05
+
+    started = time.perf_counter()
+    assert asyncio.run(service.text_to_sql(QUESTION)) == SQL
+    assert time.perf_counter() - started < 0.5
+
+    stats = service.router.stats()
+    assert stats['hedges'] == 1 and stats['hedge_wins'] == 1
+    assert stats['models']['pro']['wins'] == 1 and stats['models']['lite']['wins'] == 0
+
+
+def test_hedge_delay_follows_p90():
+    router = ModelRouter([('lite', StubModel({})), ('pro', StubModel({}))], hedge_delay=5.0)
+    lite = router.routes[0]
+    assert router._hedge_after(lite) == 5.0
+    for i in range(MIN_SAMPLES * 5):
+        lite.observe(0.01 if i % 10 else 0.5, ok=True)
+    assert router._hedge_after(lite) == pytest.approx(0.5)
+
+
+
+def test_cancelled_attempts_do_not_shrink_hedge_delay():
+    lite = StubModel({QUESTION: SQL}, latency=0.03)
+    pro = StubModel({QUESTION: SQL}, latency=1.0)
+    router = ModelRouter([('lite', lite), ('pro', pro)], hedge_delay=0.01)
+    pro_route = router.routes[1]
+
+    async def call(model):
+        return (await model.run([{'role': 'user', 'text': QUESTION}]))[0].text
+
+    async def scenario():
+        for _ in range(MIN_SAMPLES):
+            assert await router.run(call, lambda raw: raw)
+
+    asyncio.run(scenario())
+    # Каждый раз дублирующая попытка в pro отменялась через ~20 мс: это не задержка pro
+    assert router.stats()['hedges'] == pro_route.cancelled == MIN_SAMPLES
+    assert pro_route.quantile(0.9) is None
+    assert router._hedge_after(pro_route) == router.hedge_delay
+
+def test_invalid_answer_falls_back_immediately():
+    lite = StubModel({}, latency=0.01)          # отвечает текстом без SQL
+    pro = StubModel({QUESTION: SQL}, latency=0.01)
+    service = make_service(lite, pro)
+
+    assert asyncio.run(service.text_to_sql(QUESTION)) == SQL
+    assert service.router.stats()['fallbacks'] == 1
+    assert service.router.stats()['hedges'] == 0
+
+
+def test_unhealthy_model_is_demoted():
+    router = ModelRouter([('lite', StubModel({})), ('pro', StubModel({}))], max_error_rate=0.5)
+    for _ in range(MIN_SAMPLES):
+        router.routes[0].observe(0.1, ok=False)
+    assert [route.name for route in router._plan()] == ['pro', 'lite']
+
+
+def test_all_models_time_out():
+    lite = StubModel({QUESTION: SQL}, latency=1.0)
+    pro = StubModel({QUESTION: SQL}, latency=1.0)
+    router = ModelRouter([('lite', lite), ('pro', pro)], hedge_delay=0.01, attempt_timeout=0.05)
+
+    async def call(model):
+        return (await model.run([{'role': 'user', 'text': QUESTION}]))[0].text
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(router.run(call, lambda raw: raw))
+    assert router.stats()['models']['lite']['errors'] == 1
+
+
+def test_errors_are_counted_per_model():
+    lite = StubModel({QUESTION: SQL}, latency=0.0, error_rate=1.0)
+    pro = StubModel({QUESTION: SQL}, latency=0.0)
+    router = ModelRouter([('lite', lite), ('pro', pro)])
+
+    async def call(model):
+        return (await model.run([{'role': 'user', 'text': QUESTION}]))[0].text
+
+    assert asyncio.run(router.run(call, lambda raw: raw)).endswith('```')
+    assert lite.errors == 1 and router.stats()['models']['lite']['error_rate'] == 1.0
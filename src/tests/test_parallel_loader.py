@@ -0,0 +1,90 @@
+import asyncio
+import json
+import pickle
+
+import pytest
+from sqlalchemy import text
+
+from src.benchmarks.synthetic import generate_videos, write_videos_json, write_videos_ndjson
+from src.db.database import get_async_session
+from src.db.rollups import rebuild_rollups
+from src.services.data_loader import parallel_loader
+from src.services.data_loader.bulk_loader import build_rows
+from src.services.data_loader.json_stream import iter_video_records
+from src.services.data_loader.parallel_loader import parallel_load_videos, parse_chunk
+
+
+def test_ndjson_records_are_decoded_by_worker(tmp_path):
+    path = write_videos_ndjson(tmp_path / 'videos.ndjson', 3, 2)
+    records = list(iter_video_records(path))
+    assert all(isinstance(r, str) for r in records)
+
+    chunk = list(enumerate(records + ['{broken'], 1))
+    parsed = pickle.loads(pickle.dumps(parse_chunk(chunk)))
+
+    videos = list(enumerate(generate_videos(3, 2), 1))
+    stats = {'videos': 0, 'snapshots': 0, 'errors': 0}
+    video_rows, snapshot_rows, _, _ = build_rows(videos, stats)
+    assert parsed.video_rows == video_rows
+    assert parsed.snapshot_rows == snapshot_rows
+    assert (parsed.videos_read, parsed.snapshots_read, parsed.errors) == (3, 6, 0)
+
+
+def test_json_document_records_are_dicts(tmp_path):
+    path = write_videos_json(tmp_path / 'videos.json', 2, 1)
+    records = list(iter_video_records(path))
+    assert records == [json.loads(json.dumps(v)) for v in generate_videos(2, 1)]
+
+    broken = dict(records[0], views_count='много')
+    parsed = parse_chunk([(1, broken), (2, records[1])])
+    assert (parsed.videos_ok, parsed.errors, len(parsed.video_rows)) == (1, 1, 1)
+
+
+def _counts():
+    async def scenario():
+        async with get_async_session() as session:
+            return tuple((await session.execute(text(
+                "SELECT (SELECT COUNT(*) FROM videos), (SELECT COUNT(*) FROM snapshots)"))).one())
+    return scenario()
+
+
+def test_pipeline_writes_batches_and_falls_back_per_row(db, rollups, tmp_path):
+    videos = list(generate_videos(7, 3))
+    videos[4]['snapshots'][1]['views_count'] = 10 ** 12        # не помещается в integer: пакет откатывается
+    path = tmp_path / 'videos.ndjson'
+    path.write_text(''.join(json.dumps(v) + '\n' for v in videos), encoding='utf-8')
+
+    async def scenario():
+        stats = {'videos': 0, 'snapshots': 0, 'errors': 0}
+        read = await parallel_load_videos(path, stats, batch_size=2, workers=2, writers=2)
+        loaded = await rollups()
+        await rebuild_rollups()
+        return stats, read, await _counts(), loaded, await rollups()
+
+    stats, read, counts, loaded, rebuilt = db(scenario())
+    assert read == {'videos': 7, 'snapshots': 21}
+    assert stats == {'videos': 7, 'snapshots': 20, 'errors': 1}
+    assert counts == (7, 20)
+    assert loaded == rebuilt
+
+
+def test_reader_stops_when_writer_fails(db, tmp_path, monkeypatch):
+    path = write_videos_ndjson(tmp_path / 'videos.ndjson', 20, 1)
+
+    async def broken_write(number, pg_conn, parsed):
+        raise RuntimeError("пакет не записан")
+
+    async def broken_fallback(*args):
+        raise ConnectionError("соединение потеряно")
+
+    monkeypatch.setattr(parallel_loader, '_write_with_retry', broken_write)
+    monkeypatch.setattr(parallel_loader, '_load_video', broken_fallback)
+
+    async def scenario():
+        stats = {'videos': 0, 'snapshots': 0, 'errors': 0}
+        # Очередь на один пакет: без остановки чтение ждало бы места в ней вечно
+        load = parallel_load_videos(path, stats, batch_size=1, workers=1, writers=1, queue_size=1)
+        with pytest.raises(ConnectionError):
+            await asyncio.wait_for(load, timeout=30)
+
+    db(scenario())
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from datetime import date, datetime
+from pathlib import Path
+
+import asyncpg
+
+from src.benchmarks.synthetic import generate_videos, write_videos_json
+from src.config.config import settings
+from src.db import partitions
+from src.services.data_loader.loader_service import load_videos_from_json
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def _run_partitioned(cwd: Path, *args: str) -> str:
+    """Команда в отдельном процессе с SNAPSHOTS_PARTITIONED: схема модели выбирается при импорте
+
+    Процесс запускается в cwd (временном каталоге теста): загрузчик пишет data_loader.log в текущий каталог.
+    """
+    env = dict(os.environ, SNAPSHOTS_PARTITIONED='true', PYTHONPATH=str(ROOT))
+    result = subprocess.run([sys.executable, '-m', *args], cwd=cwd, env=env, capture_output=True, text=True,
+                            timeout=120)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+async def _connect():
+    return await asyncpg.connect(host=settings.DB_HOST, port=settings.DB_PORT, user=settings.DB_USER,
+                                 password=settings.DB_PASS, database=settings.DB_NAME)
+
+
+async def _placement(pg_conn) -> dict:
+    rows = await pg_conn.fetch("SELECT tableoid::regclass::text AS part, COUNT(*) FROM snapshots GROUP BY 1")
+    return {row['part']: row['count'] for row in rows}
+
+
+def test_ensure_partitions_rechecks_after_interval(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(partitions.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(partitions, '_known_partitions', {})
+    checked = []
+
+    async def fetchval(sql):
+        checked.append(sql)
+        return True
+
+    async def execute(sql):
+        raise AssertionError(sql)
+
+    ensure = partitions.ensure_partitions(fetchval, execute, [datetime(2025, 11, 3), datetime(2025, 11, 20), None])
+    asyncio.run(ensure)
+    assert len(checked) == 2        # DEFAULT и ноябрь
+
+    now[0] += partitions.PARTITION_RECHECK_SECONDS / 2
+    asyncio.run(partitions.ensure_partitions(fetchval, execute, [datetime(2025, 11, 5)]))
+    assert len(checked) == 2
+
+    now[0] += partitions.PARTITION_RECHECK_SECONDS
+    asyncio.run(partitions.ensure_partitions(fetchval, execute, [datetime(2025, 11, 5)]))
+    assert len(checked) == 4
+
+    partitions.forget_partitions()
+    asyncio.run(partitions.ensure_partitions(fetchval, execute, [datetime(2025, 11, 5)]))
+    assert len(checked) == 6
+
+
+def test_convert_load_and_default_partition(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(partitions, '_known_partitions', {})
+    db(load_videos_from_json(write_videos_json(tmp_path / 'before.json', 3, 4)))
+
+    _run_partitioned(tmp_path, 'src.db.partitions', 'convert')
+
+    async def converted():
+        pg_conn = await _connect()
+        try:
+            return await _placement(pg_conn)
+        finally:
+            await pg_conn.close()
+
+    placement = asyncio.run(converted())
+    assert sum(placement.values()) == 12 and 'snapshots_default' not in placement
+
+    # Снапшот без created_at отбрасывается построчно, снапшот нового месяца получает секцию
+    videos = list(generate_videos(2, 2))
+    videos[0]['snapshots'][0]['created_at'] = None
+    videos[1]['snapshots'][0]['created_at'] = '2031-02-10T12:00:00+00:00'
+    path = tmp_path / 'after.json'
+    path.write_text(json.dumps({'videos': videos}), encoding='utf-8')
+    output = _run_partitioned(tmp_path, 'src.services.data_loader.loader_service', str(path), '--bulk')
+    assert 'Ошибки:    1' in output
+
+    async def stale_cache():
+        pg_conn = await _connect()
+        try:
+            placement = await _placement(pg_conn)
+            ops = partitions.asyncpg_partition_ops(pg_conn)
+            february = datetime(2031, 2, 1)
+
+            # Секцию удалили из другого процесса, а этот процесс считает ее существующей:
+            # строка уходит в DEFAULT вместо ошибки
+            await partitions.ensure_partitions(*ops, [february])
+            await pg_conn.execute(f"DROP TABLE {partitions.partition_name(date(2031, 2, 1))}")
+            await partitions.ensure_partitions(*ops, [february])
+            await pg_conn.execute(
+                "INSERT INTO snapshots (snapshot_id, video_id, created_at) VALUES ('late', $1, $2)",
+                videos[1]['id'], datetime(2031, 2, 11))
+            in_default = await _placement(pg_conn)
+
+            # После сброса кэша секция создается заново, строки переносятся в нее из DEFAULT
+            partitions.forget_partitions()
+            async with pg_conn.transaction():
+                await partitions.ensure_partitions(*ops, [february])
+            return placement, in_default, await _placement(pg_conn)
+        finally:
+            await pg_conn.close()
+
+    loaded, in_default, moved = asyncio.run(stale_cache())
+    assert sum(loaded.values()) == 3 and loaded['snapshots_y2031m02'] == 1
+    assert in_default['snapshots_default'] == 1
+    assert 'snapshots_default' not in moved and moved['snapshots_y2031m02'] == 1
@@ -0,0 +1,39 @@
+import re
+
+from src.benchmarks.bench_prompt import load_golden, measure_sizes
+from src.llm_service.prompt_builder import FULL_PROMPT, PromptBuilder, estimate_tokens, full_prompt_tokens
+
+
+def test_full_prompt_keeps_all_rules():
+    numbers = {int(n) for n in re.findall(r'^(\d+)\. ', FULL_PROMPT, re.MULTILINE)}
+    assert set(range(1, 48)) <= numbers
+
+
+def test_selection_by_question():
+    builder = PromptBuilder(token_budget=1500)
+
+    dates = builder.select("Сколько видео опубликовано в июне 2025?")
+    assert {'intro', 'schema', 'rules_core', 'rules_dates', 'example_35'} <= set(dates.fragment_ids)
+    assert 'rules_intervals' not in dates.fragment_ids
+
+    plain = builder.select("Сколько всего видео есть в системе?")
+    assert 'rules_dates' not in plain.fragment_ids
+    assert plain.tokens < full_prompt_tokens()
+
+
+def test_budget_keeps_base_fragments():
+    question = "На сколько просмотров суммарно выросли все видео с 10:00 до 15:00 28 ноября 2025 по снапшотам?"
+    small = PromptBuilder(token_budget=800).select(question)
+    assert small.tokens <= 800
+    assert small.fragment_ids[:3] == ['intro', 'schema', 'rules_core']
+
+    # Бюджет меньше обязательных фрагментов: они остаются, необязательные не добавляются
+    tiny = PromptBuilder(token_budget=100).select(question)
+    assert tiny.fragment_ids == ['intro', 'schema', 'rules_core']
+    assert tiny.tokens == estimate_tokens(tiny.text)
+
+
+def test_golden_coverage():
+    report = measure_sizes(load_golden(), PromptBuilder(token_budget=1500))
+    assert report['coverage'] >= 0.9
+    assert report['avg_tokens'] < 0.7 * full_prompt_tokens()
@@ -0,0 +1,64 @@
+from src.db.query_router import make_sargable, route_to_rollups
+
+
+def test_routes_day_and_creator_filters():
+    sql = ("SELECT COALESCE(SUM(delta_views_count), 0) FROM snapshots WHERE DATE(created_at) = '2025-11-28' "
+           "AND video_id IN (SELECT video_id FROM videos WHERE creator_id = 'AbC');")
+    assert route_to_rollups(sql) == (
+        "SELECT COALESCE(SUM(delta_views_count), 0) FROM creator_stats_daily "
+        "WHERE bucket >= '2025-11-28 00:00:00' AND bucket < '2025-11-29 00:00:00' AND creator_id = 'AbC'"
+    )
+
+
+def test_routes_hour_window_and_sign_filter():
+    sql = ("SELECT COUNT(DISTINCT video_id) FROM snapshots WHERE created_at >= '2025-11-28 10:00:00' "
+           "AND created_at < '2025-11-28 15:00:00' AND delta_views_count < 0")
+    assert route_to_rollups(sql) == (
+        "SELECT COUNT(DISTINCT video_id) FROM video_stats_hourly "
+        "WHERE bucket >= '2025-11-28 10:00:00' AND bucket < '2025-11-28 15:00:00' "
+        "AND delta_views_count_neg < 0"
+    )
+
+
+def test_unsupported_queries_are_unchanged():
+    unchanged = [
+        # окно не по границе часа
+        "SELECT SUM(delta_views_count) FROM snapshots WHERE created_at >= '2025-11-28 10:30:00' "
+        "AND created_at < '2025-11-28 15:00:00'",
+        # фильтр по другой метрике
+        "SELECT SUM(delta_views_count) FROM snapshots WHERE DATE(created_at) = '2025-11-28' "
+        "AND delta_likes_count > 0",
+        # SUM без COALESCE с фильтром по знаку может вернуть NULL
+        "SELECT SUM(delta_views_count) FROM snapshots WHERE DATE(created_at) = '2025-11-28' "
+        "AND delta_views_count > 0",
+        "SELECT COUNT(*) FROM snapshots WHERE DATE(created_at) = '2025-11-28' OR video_id = 'x'",
+        "SELECT COUNT(*) FROM videos WHERE creator_id = 'x'",
+    ]
+    for sql in unchanged:
+        assert route_to_rollups(sql) == sql
+
+
+def test_make_sargable_rewrites_time_functions_to_ranges():
+    assert make_sargable(
+        "SELECT COUNT(*) FROM videos WHERE EXTRACT(YEAR FROM video_created_at) = 2025 "
+        "AND EXTRACT(MONTH FROM video_created_at) = 12"
+    ) == "SELECT COUNT(*) FROM videos WHERE (video_created_at >= '2025-12-01' AND video_created_at < '2026-01-01')"
+    assert make_sargable(
+        "SELECT COUNT(*) FROM snapshots s WHERE DATE(s.created_at) <= '2025-11-27' AND DATE(s.created_at) > '2025-11-01'"
+    ) == "SELECT COUNT(*) FROM snapshots s WHERE s.created_at < '2025-11-28' AND s.created_at >= '2025-11-02'"
+    # Выражение с приведением типа не трогается, NOT относится только к году
+    cast = "SELECT COUNT(*) FROM snapshots WHERE DATE(created_at) = '2025-11-27'::date"
+    assert make_sargable(cast) == cast
+    assert make_sargable(
+        "SELECT COUNT(*) FROM videos WHERE NOT EXTRACT(YEAR FROM video_created_at) = 2025 "
+        "AND EXTRACT(MONTH FROM video_created_at) = 6"
+    ) == ("SELECT COUNT(*) FROM videos WHERE NOT (video_created_at >= '2025-01-01' AND video_created_at < '2026-01-01') "
+          "AND EXTRACT(MONTH FROM video_created_at) = 6")
+
+
+def test_sargable_ranges_are_routed_to_rollups():
+    sql = make_sargable("SELECT COUNT(*) FROM snapshots WHERE DATE(created_at) = '2025-11-27'")
+    assert route_to_rollups(sql) == (
+        "SELECT COALESCE(SUM(snapshots_count), 0) FROM creator_stats_daily "
+        "WHERE bucket >= '2025-11-27 00:00:00' AND bucket < '2025-11-28 00:00:00'"
+    )
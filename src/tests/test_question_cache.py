@@ -0,0 +1,97 @@
+import json
+
+from src.llm_service.question_cache import QuestionCache, normalize_question, make_sql_template
+
+CREATOR_A = '9f3c1a2b4c5d6e7f8a9b0c1d2e3f4a5b'
+CREATOR_B = '0a1b2c3d4e5f60718293a4b5c6d7e8f9'
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_normalize_question():
+    a = normalize_question(f'Сколько видео у креатора {CREATOR_A} набрали больше 10 000 просмотров?')
+    b = normalize_question(f'  сколько ВИДЕО у креатора {CREATOR_B}   набрали больше 500 просмотров ')
+
+    assert a.template == b.template == 'сколько видео у креатора <id> набрали больше <num> просмотров'
+    assert a.slots == [CREATOR_A, '10000']
+    assert b.slots == [CREATOR_B, '500']
+
+
+def test_template_rebinding():
+    cache = QuestionCache()
+    cache.put(f'Сколько видео у креатора {CREATOR_A} набрали больше 10000 просмотров?',
+              f"SELECT COUNT(*) FROM videos WHERE creator_id = '{CREATOR_A}' AND views_count > 10000")
+
+    sql = cache.get(f'сколько видео у креатора {CREATOR_B} набрали больше 500 просмотров')
+    assert sql == f"SELECT COUNT(*) FROM videos WHERE creator_id = '{CREATOR_B}' AND views_count > 500"
+    assert cache.stats()['hits'] == 1
+
+
+def test_ambiguous_literals_are_not_templated():
+    # 0 есть и в вопросе, и в COALESCE: переносить такой SQL на другие числа нельзя
+    sql = "SELECT COALESCE(SUM(delta_views_count), 0) FROM snapshots WHERE delta_views_count > 0"
+    assert make_sql_template(sql, ['0']) is None
+
+    cache = QuestionCache()
+    cache.put('Сумма приростов больше 0', sql)
+    assert cache.get('Сумма приростов больше 0') == sql
+    assert cache.get('Сумма приростов больше 5') is None
+
+
+def test_ttl_lru_and_persistence(tmp_path):
+    clock = FakeClock()
+    path = tmp_path / 'cache.json'
+    cache = QuestionCache(max_size=2, ttl=60, path=path, clock=clock)
+
+    cache.put('сколько всего видео', 'SELECT COUNT(*) FROM videos')
+    cache.put('сколько всего снапшотов', 'SELECT COUNT(*) FROM snapshots')
+    cache.get('сколько всего видео')
+    cache.put('сумма просмотров', 'SELECT SUM(views_count) FROM videos')
+
+    assert cache.get('сколько всего снапшотов') is None
+    assert cache.stats()['evictions'] == 1
+
+    restored = QuestionCache(max_size=2, ttl=60, path=path, clock=clock)
+    assert restored.get('Сколько всего видео?') == 'SELECT COUNT(*) FROM videos'
+
+    clock.now += 61
+    assert restored.get('Сколько всего видео?') is None
+
+
+def test_put_appends_a_line_and_compacts_rarely(tmp_path):
+    clock = FakeClock()
+    path = tmp_path / 'cache.jsonl'
+    cache = QuestionCache(max_size=4, ttl=60, path=path, clock=clock)
+
+    tables = ['videos', 'snapshots', 'videos_hourly']
+    for n, table in enumerate(tables, 1):
+        cache.put(f'сколько строк в {table}', f'SELECT COUNT(*) FROM {table}')
+        assert len(path.read_text(encoding='utf-8').splitlines()) == n
+
+    # Повторы ключа только дописываются, пока устаревших строк не станет больше живых
+    for n in range(3):
+        cache.put('сколько строк в videos', f'SELECT COUNT(*) + {n} FROM videos')
+    assert len(path.read_text(encoding='utf-8').splitlines()) == 6
+    cache.put('сколько строк в videos', 'SELECT COUNT(*) FROM videos')
+    assert len(path.read_text(encoding='utf-8').splitlines()) == 3
+
+    restored = QuestionCache(max_size=4, ttl=60, path=path, clock=clock)
+    assert [restored.get(f'сколько строк в {table}') for table in tables] == [
+        f'SELECT COUNT(*) FROM {table}' for table in tables]
+
+
+def test_loads_previous_single_object_format(tmp_path):
+    clock = FakeClock()
+    path = tmp_path / 'cache.json'
+    key = normalize_question('сколько всего видео').exact_key
+    path.write_text(json.dumps({key: ['SELECT COUNT(*) FROM videos', False, clock.now + 60]}), encoding='utf-8')
+
+    cache = QuestionCache(path=path, clock=clock)
+    assert cache.get('Сколько всего видео?') == 'SELECT COUNT(*) FROM videos'
+    assert json.loads(path.read_text(encoding='utf-8')) == [key, 'SELECT COUNT(*) FROM videos', False, clock.now + 60]
@@ -0,0 +1,64 @@
+import asyncio
+
+from src.db.result_cache import QueryResultCache, canonicalize_sql
+
+
+def test_canonicalize_sql_keeps_literals():
+    assert canonicalize_sql("SELECT  COUNT(*)\n FROM Videos WHERE creator_id = 'AbC';") == \
+        "select count(*) from videos where creator_id = 'AbC'"
+
+
+def test_invalidation_by_data_version_and_byte_cap():
+    version = {'value': 1}
+    executed = []
+
+    async def load_version():
+        return version['value']
+
+    async def execute(sql):
+        executed.append(sql)
+        return (len(executed),)
+
+    async def scenario():
+        cache = QueryResultCache(load_version)
+        assert await cache.fetch_one('SELECT 1', execute) == (1,)
+        assert await cache.fetch_one('select 1;', execute) == (1,)
+        assert len(executed) == 1
+
+        version['value'] = 2
+        assert await cache.fetch_one('SELECT 1', execute) == (2,)
+        assert cache.stats()['invalidations'] == 1
+
+        small = QueryResultCache(load_version, max_bytes=700)
+        for i in range(5):
+            await small.fetch_one(f'SELECT {i}', execute)
+        assert small.stats()['bytes'] <= 700
+        assert small.stats()['evictions'] > 0
+
+    asyncio.run(scenario())
+
+
+def test_version_is_checked_once_per_interval():
+    now = [100.0]
+    version_queries = []
+
+    async def load_version():
+        version_queries.append(now[0])
+        return 1
+
+    async def execute(sql):
+        return (1,)
+
+    async def scenario():
+        cache = QueryResultCache(load_version, version_check_interval=1.0, clock=lambda: now[0])
+        for _ in range(5):
+            assert await cache.fetch_one('SELECT 1', execute) == (1,)
+            now[0] += 0.1
+        assert version_queries == [100.0]
+        assert cache.stats()['hits'] == 4
+
+        now[0] += 0.6
+        await cache.fetch_one('SELECT 1', execute)
+        assert len(version_queries) == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,21 @@
+from src.benchmarks.synthetic import write_videos_json
+from src.db.data_version import get_data_version
+from src.db.rollups import rebuild_rollups
+from src.services.data_loader.loader_service import load_videos_from_json
+
+
+def test_row_by_row_load_refreshes_rollups_once_per_batch(db, rollups, tmp_path):
+    path = write_videos_json(tmp_path / 'videos.json', 5, 4)
+
+    async def scenario():
+        stats = await load_videos_from_json(path, batch_size=2)
+        loaded = await rollups()
+        version = await get_data_version()
+        await rebuild_rollups()
+        return stats, loaded, version, await rollups()
+
+    stats, loaded, version, rebuilt = db(scenario())
+    assert stats == {'videos': 5, 'snapshots': 20, 'errors': 0}
+    assert loaded == rebuilt and loaded[1][1] > 0
+    # Агрегаты и версия обновляются после каждых двух видео и в конце, а не на каждое видео
+    assert version == 3
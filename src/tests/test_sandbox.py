@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from src.db.sandbox import QueryRejected, ResourceClass, SQLSandbox
+
+
+def _sandbox(max_cost=0, timeout_ms=1000):
+    return SQLSandbox(classes={'interactive': ResourceClass(timeout_ms, '4MB', max_cost)})
+
+
+def test_rejects_expensive_and_slow_queries():
+    async def scenario():
+        sandbox = _sandbox(max_cost=1)
+        try:
+            with pytest.raises(QueryRejected) as rejected:
+                await sandbox.fetch_one("SELECT COUNT(*) FROM snapshots a, snapshots b")
+            assert rejected.value.reason == 'cost'
+        finally:
+            await sandbox.close()
+
+        sandbox = _sandbox(timeout_ms=200)
+        try:
+            with pytest.raises(QueryRejected) as rejected:
+                await sandbox.fetch_one("SELECT pg_sleep(2)")
+            assert rejected.value.reason == 'timeout'
+            # Соединение после таймаута снова пригодно
+            assert await sandbox.fetch_one("SELECT 1") == (1,)
+        finally:
+            await sandbox.close()
+
+    asyncio.run(scenario())
+
+
+def test_writes_are_refused():
+    async def scenario():
+        sandbox = _sandbox()
+        try:
+            with pytest.raises(Exception, match='read-only'):
+                await sandbox.fetch_one("DELETE FROM videos")
+        finally:
+            await sandbox.close()
+
+    asyncio.run(scenario())
+
+
+def test_abandoned_query_is_cancelled_on_server():
+    async def scenario():
+        sandbox = _sandbox(timeout_ms=30000)
+        try:
+            task = asyncio.ensure_future(sandbox.fetch_one("SELECT pg_sleep(20)"))
+            await asyncio.sleep(0.3)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert sandbox.stats()['cancelled'] == 1
+            assert await sandbox.fetch_one("SELECT 1") == (1,)
+        finally:
+            await sandbox.close()
+
+    asyncio.run(scenario())
+
+
+def test_same_shape_reuses_one_server_statement(db):
+    async def scenario():
+        sandbox = _sandbox()
+        try:
+            for threshold in range(5):
+                assert await sandbox.fetch_one(f"SELECT COUNT(*) FROM videos WHERE views_count > {threshold}") == (0,)
+            prepared = await sandbox.fetch_one(
+                "SELECT COUNT(*) FROM pg_prepared_statements WHERE statement LIKE '%views_count > $1%'")
+            return prepared[0], sandbox.stats()
+        finally:
+            await sandbox.close()
+
+    prepared, stats = asyncio.run(scenario())
+    # Кэш asyncpg держит один оператор на форму (второй — от первого определения типов, пока не собран)
+    assert 1 <= prepared <= 2
+    assert (stats['parameterized'], stats['literal_fallbacks']) == (6, 0)
+    # Две формы: пороги — одна форма с четырьмя повторами, запрос к pg_prepared_statements — вторая
+    assert (stats['plan_cache_hits'], stats['plan_cache_misses'], stats['plan_cache_hit_rate']) == (4, 2, 0.667)
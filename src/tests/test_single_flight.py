@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from src.services.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 42
+
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do('q', work) for _ in range(20)))
+        assert results == [42] * 20
+        assert len(calls) == 1
+        assert flight.stats()['coalesced'] == 19
+
+        # После завершения ключ освобождается и работа выполняется заново
+        await flight.do('q', work)
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_errors_reach_every_waiter():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError('boom')
+
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do('q', fail) for _ in range(5)), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+
+    asyncio.run(scenario())
+
+
+def test_cancellation_of_one_waiter_and_of_all():
+    started = []
+
+    async def slow():
+        started.append(1)
+        await asyncio.sleep(0.05)
+        return 'ok'
+
+    async def scenario():
+        flight = SingleFlight()
+        first = asyncio.ensure_future(flight.do('q', slow))
+        second = asyncio.ensure_future(flight.do('q', slow))
+        await asyncio.sleep(0.01)
+
+        first.cancel()
+        assert await second == 'ok'
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        # Если ушли все ожидающие, общая задача отменяется
+        lonely = asyncio.ensure_future(flight.do('k', slow))
+        await asyncio.sleep(0.01)
+        inner = flight._calls['k'].task
+        lonely.cancel()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert inner.cancelled()
+
+    asyncio.run(scenario())
+
+
+def test_caller_joining_after_last_waiter_left_gets_fresh_execution():
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return len(calls)
+
+    async def scenario():
+        flight = SingleFlight()
+        leaving = asyncio.ensure_future(flight.do('q', slow))
+        await asyncio.sleep(0.005)
+        leaving.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+
+        # Отмененная задача еще не успела завершиться, но новый вызов к ней не присоединяется
+        assert await flight.do('q', slow) == 2
+        assert flight.stats()['coalesced'] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,62 @@
+from datetime import datetime
+from decimal import Decimal
+
+from src.db.sql_parser import SQLParameterizer, coerce_params, normalize_sql, parameterize, validate_sql
+
+
+def test_validation_by_ast():
+    assert validate_sql("SELECT COUNT(DISTINCT video_id) FROM snapshots WHERE DATE(created_at) = '2025-11-27';")
+    assert validate_sql("select coalesce(sum(views_count), 0) from videos v where v.creator_id = 'x'")
+    rejected = [
+        "NULL",
+        "SELECT 1; DROP TABLE videos",
+        "SELECT COUNT(*) FROM pg_catalog.pg_class",
+        "SELECT COUNT(*) FROM users",
+        "SELECT pg_sleep(10)",
+        "SELECT video_id FROM videos UNION SELECT video_id FROM snapshots",
+        "WITH d AS (DELETE FROM videos RETURNING 1) SELECT COUNT(*) FROM d",
+        "SELECT * FROM videos FOR UPDATE",
+    ]
+    for sql in rejected:
+        assert not validate_sql(sql), sql
+    assert normalize_sql("select   count(*)\nfrom videos ;") == "SELECT COUNT(*) FROM videos"
+
+
+def test_same_shape_gets_same_fingerprint():
+    first = parameterize("SELECT COUNT(*) FROM snapshots WHERE created_at >= '2025-11-27' "
+                         "AND created_at < '2025-11-28' AND delta_views_count > 0")
+    second = parameterize("select count(*) from snapshots where created_at >= '2025-12-01' "
+                          "and created_at < '2025-12-02' and delta_views_count > 100")
+    assert first.fingerprint == second.fingerprint == (
+        "SELECT COUNT(*) FROM snapshots WHERE created_at >= $1 AND created_at < $2 AND delta_views_count > $3"
+    )
+    assert second.params == ('2025-12-01', '2025-12-02', '100')
+
+
+def test_literals_outside_comparisons_stay_inline():
+    parsed = parameterize("SELECT COALESCE(SUM(views_count), 0) FROM videos "
+                          "WHERE video_created_at > NOW() - INTERVAL '7 days' AND video_id IN ('a', 'b')")
+    assert parsed.params == ('a', 'b')
+    assert "COALESCE(SUM(views_count), 0)" in parsed.fingerprint
+    assert "IN ($1, $2)" in parsed.fingerprint
+
+
+def test_parameterizer_cache_matches_full_parse():
+    parameterizer = SQLParameterizer()
+    queries = [
+        "SELECT COUNT(*) FROM videos WHERE creator_id = 'a' AND views_count > 10",
+        "SELECT COUNT(*) FROM videos WHERE creator_id = 'it''s' AND views_count > 20",
+        "SELECT 1 FROM videos WHERE views_count > 5",
+        "SELECT 2 FROM videos WHERE views_count > 5",
+    ]
+    for sql in queries:
+        assert parameterizer.parameterize(sql) == parameterize(sql)
+    assert parameterizer.hits == 1
+
+
+def test_coerce_params_by_server_types():
+    assert coerce_params(('2025-11-28 10:00:00', '10', '2025', 'x'), ('timestamp', 'int4', 'numeric', 'text')) == (
+        datetime(2025, 11, 28, 10), 10, Decimal(2025), 'x'
+    )
+    assert coerce_params(('10.5',), ('int4',)) is None
+    assert coerce_params(('2025-11-28T10:00:00+03:00',), ('timestamp',)) is None
@@ -0,0 +1,78 @@
+import asyncio
+import socket
+
+import aiohttp
+import pytest
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+
+from src.benchmarks.stubs import StubSession
+from src.bot.webhook import WEBHOOK_HANDLER, create_webhook_app, serve_webhook
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _update(number: int) -> dict:
+    return {'update_id': number, 'message': {
+        'message_id': number, 'date': 0, 'chat': {'id': number, 'type': 'private'},
+        'from': {'id': number, 'is_bot': False, 'first_name': 'test'}, 'text': 'вопрос',
+    }}
+
+
+def test_bounded_concurrency_and_graceful_shutdown():
+    async def scenario():
+        state = {'running': 0, 'peak': 0, 'done': 0}
+        router = Router()
+
+        @router.message()
+        async def slow_handler(message: Message):
+            state['running'] += 1
+            state['peak'] = max(state['peak'], state['running'])
+            await asyncio.sleep(0.2)
+            state['running'] -= 1
+            state['done'] += 1
+
+        dispatcher = Dispatcher()
+        dispatcher.include_router(router)
+        bot = Bot(token='42:TEST', session=StubSession())
+        app = create_webhook_app(dispatcher, bot, path='/hook', max_concurrent=3, secret_token='s3cret',
+                                 shutdown_timeout=5)
+        port, stop = _free_port(), asyncio.Event()
+        server = asyncio.create_task(serve_webhook(app, '127.0.0.1', port, stop=stop))
+        await asyncio.sleep(0.2)
+
+        url = f'http://127.0.0.1:{port}/hook'
+        headers = {'X-Telegram-Bot-Api-Secret-Token': 's3cret'}
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json=_update(0), headers={}) as response:
+                assert response.status == 401
+            responses = await asyncio.gather(*(session.post(url, json=_update(n), headers=headers)
+                                               for n in range(1, 11)))
+            assert all(r.status == 200 for r in responses)
+
+        # Остановка, пока часть обновлений еще обрабатывается: они должны завершиться
+        assert state['done'] < 10
+        stop.set()
+        await server
+
+        assert state['done'] == 10
+        assert state['peak'] == 3
+        assert app[WEBHOOK_HANDLER].accepted == 10
+
+    asyncio.run(scenario())
+
+
+def test_stub_session_streams_canned_files():
+    async def scenario():
+        session = StubSession(files={'https://files/doc.txt': b'abcdefg'})
+        chunks = [c async for c in session.stream_content('https://files/doc.txt', chunk_size=3)]
+        assert chunks == [b'abc', b'def', b'g']
+        assert [c async for c in session.stream_content('https://files/none', raise_for_status=False)] == []
+        with pytest.raises(FileNotFoundError):
+            [c async for c in session.stream_content('https://files/none')]
+
+    asyncio.run(scenario())